@@ -18,8 +18,7 @@ import argparse
 
 from requests import ConnectionError, RequestException
 
-from wlauto import File, ExtensionLoader, Command, settings
-from wlauto.core.extension import Extension
+from wlauto import ExtensionLoader, Command, settings
 
 
 REMOTE_ASSETS_URL = 'https://github.com/ARM-software/workload-automation-assets/raw/master/dependencies'
@@ -44,6 +43,8 @@ class GetAssetsCommand(Command):
                                  help='''The location from which to download the files. If not provided,
                                  config setting ``remote_assets_url`` will be used if available, else
                                  uses the default REMOTE_ASSETS_URL parameter in the script.''')
+        self.parser.add_argument('-j', '--jobs', metavar='N', type=int, default=4,
+                                 help='The maximum number of assets to download concurrently.')
         group = self.parser.add_mutually_exclusive_group(required=True)
         group.add_argument('-a', '--all', action='store_true',
                            help='Download assets for all extensions found in the index. Cannot be used with -e.')
@@ -89,34 +90,18 @@ class GetAssetsCommand(Command):
         if missing:
             self.logger.warning('Not getting assets for missing extensions: {}'.format(', '.join(missing)))
 
-        # Ideally the extension loader would be used to instantiate, but it does full
-        # validation of the extension, like checking connected devices or supported
-        # platform(s). This info might be unavailable and is not required to download
-        # assets, since they are classified by extension name alone. So instead we use
-        # a simple subclass of ``Extension`` providing a valid ``name`` attribute.
-        for ext_name in assets_to_get:
-            owner = _instantiate(NamedExtension, ext_name)
-            self.logger.info('Getting assets for: {}'.format(ext_name))
-            for asset in all_assets[ext_name]:
-                getter.get(File(owner, asset))  # Download the files
+        results = getter.prefetch(assets_to_get, jobs=args.jobs)
+        if not all(results.itervalues()):
+            self.exit_with_error('Some assets could not be downloaded.')
 
     def exit_with_error(self, message, code=1):
         self.logger.error(message)
         sys.exit(code)
 
 
-class NamedExtension(Extension):
-    def __init__(self, name, **kwargs):
-        super(NamedExtension, self).__init__(**kwargs)
-        self.name = name
-
-
 def not_empty(val):
     if val:
         return val
     else:
         raise argparse.ArgumentTypeError('Extension name cannot be blank')
 
-
-def _instantiate(cls, *args, **kwargs):
-    return cls(*args, **kwargs)
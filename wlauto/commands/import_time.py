@@ -0,0 +1,70 @@
+#    Copyright 2017 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from wlauto import ExtensionLoader, Command, settings
+from wlauto.utils.lazyimport import profile_imports
+
+
+class ImportTimeCommand(Command):
+
+    name = 'import-time'
+    description = """
+    Report the time taken to import WA and the modules defining its extensions
+    (similar to Python 3's ``-X importtime`` option). The imports are performed in a
+    fresh Python interpreter, and the slowest ones, by cumulative time, are listed.
+
+    This can be used to make sure that extensions do not import large packages
+    (e.g. pandas or matplotlib) when they are loaded; such imports should be deferred
+    using ``wlauto.utils.lazyimport.lazy_import``.
+    """
+
+    def initialize(self, context):
+        self.parser.add_argument('-e', '--extensions', metavar='EXT', nargs='+',
+                                 help='Only import the modules defining the specified extensions.')
+        self.parser.add_argument('-n', '--limit', type=int, default=20,
+                                 help='The number of imports to list (0 lists all of them).')
+        self.parser.add_argument('--max-time', type=float, metavar='SECONDS',
+                                 help='''
+                                 Exit with an error if the total import time exceeds the
+                                 specified number of seconds.
+                                 ''')
+
+    def execute(self, args):
+        ext_loader = ExtensionLoader(packages=settings.extension_packages, paths=settings.extension_paths)
+        if args.extensions:
+            infos = [ext_loader.get_extension_info(name) for name in args.extensions]
+        else:
+            infos = ext_loader.list_extensions()
+        modules = ['wlauto']
+        for info in sorted(infos, key=lambda x: x.module):
+            module = (info.module, info.filepath) if info.filepath else info.module
+            if module not in modules:
+                modules.append(module)
+
+        times = profile_imports(modules)
+        total = sum(t.self_time for t in times)
+        slowest = sorted(times, key=lambda x: x.cumulative_time, reverse=True)
+        if args.limit:
+            slowest = slowest[:args.limit]
+
+        print 'Imported {} modules in {:.3f}s\n'.format(len(times), total)
+        print '{:>12} {:>12}  {}'.format('self [ms]', 'cumulative', 'module')
+        for t in slowest:
+            print '{:>12.1f} {:>12.1f}  {}'.format(t.self_time * 1000, t.cumulative_time * 1000, t.name)
+
+        if args.max_time is not None and total > args.max_time:
+            self.logger.error('Total import time of {:.3f}s exceeds {}s'.format(total, args.max_time))
+            return 1
@@ -21,6 +21,7 @@ import time
 import tempfile
 import shutil
 import threading
+import subprocess
 import json
 import xml.dom.minidom
 from subprocess import CalledProcessError
@@ -30,14 +31,21 @@ from wlauto.common.resources import Executable
 from wlauto.core.resource import NO_ONE
 from wlauto.common.linux.device import BaseLinuxDevice, PsEntry
 from wlauto.exceptions import DeviceError, WorkerThreadError, TimeoutError, DeviceNotRespondingError
-from wlauto.utils.misc import convert_new_lines, ABI_MAP, commonprefix
+from wlauto.utils.misc import convert_new_lines, ABI_MAP, commonprefix, escape_single_quotes
 from wlauto.utils.types import boolean, regex
 from wlauto.utils.android import (adb_shell, adb_background_shell, adb_list_devices,
-                                  adb_command, AndroidProperties, ANDROID_VERSION_MAP)
+                                  adb_command, AndroidProperties, ANDROID_VERSION_MAP, AdbShell)
 
 
 SCREEN_STATE_REGEX = re.compile('(?:mPowerState|mScreenOn|Display Power: state)=([0-9]+|true|false|ON|OFF)', re.I)
 SCREEN_SIZE_REGEX = re.compile(r'mUnrestrictedScreen=\(\d+,\d+\)\s+(?P<width>\d+)x(?P<height>\d+)')
+PACKAGE_INFO_REGEXES = {
+    'version_name': re.compile(r'versionName=(.*)$'),
+    'version_code': re.compile(r'versionCode=(\d+)'),
+    'abi': re.compile(r'primaryCpuAbi=(\S+)'),
+    'last_update_time': re.compile(r'lastUpdateTime=(.*)$'),
+}
+APK_FINGERPRINT_MARKER = 'WA_APK_FINGERPRINT'
 
 
 class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
@@ -64,11 +72,21 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
                   description='Specified the nature of adb connection.'),
         Parameter('logcat_poll_period', kind=int,
                   description="""
-                  If specified and is not ``0``, logcat will be polled every
-                  ``logcat_poll_period`` seconds, and buffered on the host. This
-                  can be used if a lot of output is expected in logcat and the fixed
-                  logcat buffer on the device is not big enough. The trade off is that
-                  this introduces some minor runtime overhead. Not set by default.
+                  If specified and is not ``0``, logcat will be continuously streamed
+                  from the device and buffered on the host. This can be used if a lot of
+                  output is expected in logcat and the fixed logcat buffer on the device
+                  is not big enough. The trade off is that this introduces some minor
+                  runtime overhead. Not set by default.
+
+                  .. note:: logcat is no longer polled, so the value of this parameter
+                            (other than it being non-zero) does not matter; it has been
+                            kept for compatibility with existing configurations.
+                  """),
+        Parameter('logcat_buffer_size', kind=int, default=64 * 1024 * 1024,
+                  description="""
+                  The maximum size, in bytes, of logcat output buffered on the host
+                  when ``logcat_poll_period`` is set. Once this is exceeded, the oldest
+                  output is discarded.
                   """),
         Parameter('enable_screen_check', kind=boolean, default=False,
                   description="""
@@ -81,6 +99,13 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
                   If set a swipe of the specified direction will be performed.
                   This should unlock the screen.
                   """),
+        Parameter('persistent_shell', kind=boolean, default=False,
+                  description="""
+                  If set, commands will be executed over a single, long-lived ``adb shell``
+                  session, rather than by starting a new ``adb`` process for each command.
+                  This substantially reduces the overhead of executing commands on the device.
+                  The session will be restarted if it is lost (e.g. when the device reboots).
+                  """),
     ]
 
     default_timeout = 30
@@ -139,17 +164,21 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
 
     def __init__(self, **kwargs):
         super(AndroidDevice, self).__init__(**kwargs)
-        self._logcat_poller = None
+        self._logcat_streamer = None
+        self._shell = None
+        self._apk_fingerprints = {}
 
     def reset(self):
         self._is_ready = False
         self._just_rebooted = True
+        self._close_shell()
         adb_command(self.adb_name, 'reboot', timeout=self.default_timeout)
 
     def hard_reset(self):
         super(AndroidDevice, self).hard_reset()
         self._is_ready = False
         self._just_rebooted = True
+        self._close_shell()
 
     def boot(self, hard=False, **kwargs):
         if hard:
@@ -208,6 +237,8 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
 
             self.logger.debug('Boot completed.')
             self._just_rebooted = False
+        if self.persistent_shell and not self._shell:
+            self._shell = AdbShell(self.adb_name, timeout=self.default_timeout)
         self._is_ready = True
 
     def initialize(self, context):
@@ -219,8 +250,11 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
             self.ensure_screen_is_on()
 
     def disconnect(self):
-        if self._logcat_poller:
-            self._logcat_poller.close()
+        if self._logcat_streamer:
+            self._logcat_streamer.stop()
+            self._logcat_streamer.close()
+            self._logcat_streamer = None
+        self._close_shell()
 
     def ping(self):
         try:
@@ -230,15 +264,15 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
             raise DeviceNotRespondingError(self.adb_name or self.name)
 
     def start(self):
-        if self.logcat_poll_period:
-            if self._logcat_poller:
-                self._logcat_poller.close()
-            self._logcat_poller = _LogcatPoller(self, self.logcat_poll_period, timeout=self.default_timeout)
-            self._logcat_poller.start()
+        # logcat keeps being streamed between iterations, so that nothing is
+        # lost; it is only stopped when disconnecting from the device.
+        if self.logcat_poll_period and not self._logcat_streamer:
+            self._logcat_streamer = _LogcatStreamer(self, self.logcat_buffer_size, timeout=self.default_timeout)
+            self._logcat_streamer.start()
 
     def stop(self):
-        if self._logcat_poller:
-            self._logcat_poller.stop()
+        if self._logcat_streamer:
+            self._logcat_streamer.check()
 
     def get_android_version(self):
         return ANDROID_VERSION_MAP.get(self.get_sdk_version(), None)
@@ -295,6 +329,63 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
                 return abi
         return val
 
+    def get_installed_package_info(self, package):
+        """
+        Returns a dict with the ``version_name``, ``version_code``, (primary) ``abi``
+        and ``last_update_time`` of the specified package if it is installed on the
+        device, or ``None`` otherwise. This only queries the device once.
+
+        """
+        return _parse_package_info(self.execute('dumpsys package {}'.format(package)))
+
+    def get_apk_fingerprint(self, package):
+        """
+        Returns the fingerprint recorded with :meth:`set_apk_fingerprint` for the specified
+        package, provided the package has not been re-installed (or uninstalled)
+        since, or ``None`` otherwise. The fingerprint is a dict with the ``sha256``
+        of the APK it was installed from and the items returned by
+        :meth:`get_installed_package_info`.
+
+        Fingerprints are stored under the device's ``resource_cache``, so they persist
+        across runs; they are only validated against the device on first use after
+        connecting, as WA invalidates them itself when it (un)installs APKs.
+
+        """
+        if package not in self._apk_fingerprints:
+            path = self._get_apk_fingerprint_path(package)
+            command = 'cat {} 2>/dev/null; echo; echo {}; dumpsys package {}'
+            output = self.execute(command.format(path, APK_FINGERPRINT_MARKER, package), check_exit_code=False)
+            stored, dumpsys_output = convert_new_lines(output).split(APK_FINGERPRINT_MARKER, 1)
+            try:
+                fingerprint = json.loads(stored.strip())
+            except ValueError:
+                fingerprint = None
+            info = _parse_package_info(dumpsys_output)
+            if not info or not isinstance(fingerprint, dict) or \
+                    fingerprint.get('last_update_time') != info['last_update_time']:
+                fingerprint = None
+            self._apk_fingerprints[package] = fingerprint
+        return self._apk_fingerprints[package]
+
+    def set_apk_fingerprint(self, package, sha256):
+        """
+        Records that the specified package has been installed from an APK with the
+        specified SHA256 hexdigest. See :meth:`get_apk_fingerprint`.
+
+        """
+        info = self.get_installed_package_info(package)
+        if not info:
+            raise DeviceError('Cannot fingerprint {}: it is not installed.'.format(package))
+        fingerprint = dict(info, sha256=sha256)
+        path = self._get_apk_fingerprint_path(package)
+        command = "mkdir -p {} && echo '{}' > {}"
+        self.execute(command.format(self.path.dirname(path), escape_single_quotes(json.dumps(fingerprint)), path))
+        self._apk_fingerprints[package] = fingerprint
+        return fingerprint
+
+    def _get_apk_fingerprint_path(self, package):
+        return self.path.join(self.resource_cache, 'apk_fingerprints', package)
+
     def list_packages(self):
         """
         List packages installed on the device.
@@ -375,12 +466,12 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
 
     def delete_file(self, filepath, as_root=False):  # pylint: disable=W0221
         self._check_ready()
-        adb_shell(self.adb_name, "rm -rf '{}'".format(filepath), as_root=as_root, timeout=self.default_timeout)
+        self._adb_shell("rm -rf '{}'".format(filepath), as_root=as_root, timeout=self.default_timeout)
 
     def file_exists(self, filepath):
         self._check_ready()
-        output = adb_shell(self.adb_name, 'if [ -e \'{}\' ]; then echo 1; else echo 0; fi'.format(filepath),
-                           timeout=self.default_timeout)
+        output = self._adb_shell('if [ -e \'{}\' ]; then echo 1; else echo 0; fi'.format(filepath),
+                                 timeout=self.default_timeout)
         return bool(int(output))
 
     def install(self, filepath, timeout=default_timeout, with_name=None, replace=False):  # pylint: disable=W0221
@@ -402,6 +493,9 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
             if self.get_sdk_version() >= 23:
                 flags.append('-g')  # Grant all runtime permissions
             self.logger.debug("Replace APK = {}, ADB flags = '{}'".format(replace, ' '.join(flags)))
+            # The package being installed is not known here, so all fingerprints
+            # must be re-validated.
+            self._apk_fingerprints.clear()
             return adb_command(self.adb_name, "install {} '{}'".format(' '.join(flags), filepath), timeout=timeout)
         else:
             raise DeviceError('Can\'t install {}: unsupported format.'.format(filepath))
@@ -428,6 +522,7 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
 
     def uninstall(self, package):
         self._check_ready()
+        self._apk_fingerprints.pop(package, None)
         adb_command(self.adb_name, "uninstall {}".format(package), timeout=self.default_timeout)
 
     def uninstall_executable(self, executable_name):
@@ -485,7 +580,7 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
         if background:
             return adb_background_shell(self.adb_name, command, as_root=as_root)
         else:
-            return adb_shell(self.adb_name, command, timeout, check_exit_code, as_root)
+            return self._adb_shell(command, timeout, check_exit_code, as_root)
 
     def kick_off(self, command, as_root=None):
         """
@@ -592,7 +687,7 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
         """
         adb_command(self.adb_name, 'forward {} {}'.format(from_port, to_port), timeout=self.default_timeout)
 
-    def dump_logcat(self, outfile, filter_spec=None):
+    def dump_logcat(self, outfile, filter_spec=None, since=None, until=None):
         """
         Dump the contents of logcat, for the specified filter spec to the
         specified output file.
@@ -602,10 +697,16 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
                         log will be written.
         :param filter_spec: Logcat filter specification.
                             see http://developer.android.com/tools/debugging/debugging-log.html#filteringOutput
+        :param since: If logcat is being streamed (see ``logcat_poll_period``), an offset,
+                      as returned by ``mark_logcat()``, from which the log should be
+                      written. Defaults to the point at which it was last cleared.
+        :param until: If logcat is being streamed, an offset, as returned by
+                      ``mark_logcat()``, up to which the log should be written.
+                      Defaults to the current end of the log.
 
         """
-        if self._logcat_poller:
-            return self._logcat_poller.write_log(outfile)
+        if self._logcat_streamer:
+            return self._logcat_streamer.write_log(outfile, since=since, until=until)
         else:
             if filter_spec:
                 command = 'logcat -d -s {} > {}'.format(filter_spec, outfile)
@@ -615,11 +716,22 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
 
     def clear_logcat(self):
         """Clear (flush) logcat log."""
-        if self._logcat_poller:
-            return self._logcat_poller.clear_buffer()
+        if self._logcat_streamer:
+            return self._logcat_streamer.clear_buffer()
         else:
             return adb_shell(self.adb_name, 'logcat -c', timeout=self.default_timeout)
 
+    def mark_logcat(self):
+        """
+        Returns the current offset into the logcat log streamed from the device
+        (see ``logcat_poll_period``), which may be passed to ``dump_logcat()`` to
+        only dump a part of the log.
+
+        """
+        if not self._logcat_streamer:
+            raise DeviceError('logcat is not being streamed from the device.')
+        return self._logcat_streamer.mark()
+
     def get_screen_size(self):
         output = self.execute('dumpsys window')
         match = SCREEN_SIZE_REGEX.search(output)
@@ -766,6 +878,16 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
             else:
                 self.logger.warning('Could not parse version string.')
 
+    def _adb_shell(self, command, timeout=None, check_exit_code=False, as_root=False):
+        if self._shell:
+            return self._shell.execute(command, timeout, check_exit_code, as_root)
+        return adb_shell(self.adb_name, command, timeout, check_exit_code, as_root)
+
+    def _close_shell(self):
+        if self._shell:
+            self._shell.close()
+            self._shell = None
+
     def _ensure_binaries_directory_is_writable(self):
         matched = []
         for entry in self.list_file_systems():
@@ -779,74 +901,178 @@ class AndroidDevice(BaseLinuxDevice):  # pylint: disable=W0223
             raise DeviceError('Could not find mount point for binaries directory {}'.format(self.binaries_directory))
 
 
-class _LogcatPoller(threading.Thread):
+class _LogcatStreamer(threading.Thread):
+    """
+    Continuously streams logcat from the device into a size-bounded buffer on the
+    host. The buffer consists of a number of segment files; once the total size
+    exceeds ``buffer_size``, the oldest segment is discarded. Positions within the
+    log are identified by offsets from the start of the stream, so that a part of
+    the log can be written out without copying the whole buffer.
+
+    """
 
     join_timeout = 5
+    sync_timeout = 10
+    segments_per_buffer = 4
+    copy_chunk_size = 1024 * 1024
+    sync_tag = 'WA_LOGCAT_SYNC'
 
-    def __init__(self, device, period, timeout=None):
-        super(_LogcatPoller, self).__init__()
+    def __init__(self, device, buffer_size, timeout=None):
+        super(_LogcatStreamer, self).__init__()
         self.adb_device = device.adb_name
         self.logger = device.logger
-        self.period = period
+        self.buffer_size = buffer_size
+        self.segment_size = max(buffer_size // self.segments_per_buffer, 1)
         self.timeout = timeout
         self.stop_signal = threading.Event()
-        self.lock = threading.RLock()
-        self.buffer_file = tempfile.mktemp()
-        self.last_poll = 0
+        self.lock = threading.Condition()
+        self.buffer_directory = tempfile.mkdtemp()
+        self.segments = []  # (start offset, path), oldest first
+        self.position = 0
+        self.cleared_position = 0
+        self.process = None
         self.daemon = True
         self.exc = None
+        self._wfh = None
+        self._segment_length = 0
+        self._sync_count = 0
+        self._sync_token = None
 
     def run(self):
-        self.logger.debug('Starting logcat polling.')
+        self.logger.debug('Starting logcat streaming.')
         try:
-            while True:
-                if self.stop_signal.is_set():
-                    break
-                with self.lock:
-                    current_time = time.time()
-                    if (current_time - self.last_poll) >= self.period:
-                        self._poll()
-                time.sleep(0.5)
+            while not self.stop_signal.is_set():
+                device_part = ['-s', self.adb_device] if self.adb_device else []
+                # wait-for-device allows the stream to be resumed after a reboot.
+                self.process = subprocess.Popen(['adb'] + device_part + ['wait-for-device', 'logcat'],
+                                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                for line in iter(self.process.stdout.readline, ''):
+                    self._append(line)
+                self.process.wait()
+                if not self.stop_signal.is_set():
+                    self.logger.debug('logcat exited with {}; restarting.'.format(self.process.returncode))
+                    time.sleep(1)
         except Exception:  # pylint: disable=W0703
             self.exc = WorkerThreadError(self.name, sys.exc_info())
-        self.logger.debug('Logcat polling stopped.')
+        self.logger.debug('Logcat streaming stopped.')
+
+    def check(self):
+        """Raise the error that stopped the streaming thread, if there was one."""
+        if self.exc:
+            raise self.exc  # pylint: disable=E0702
 
     def stop(self):
-        self.logger.debug('Stopping logcat polling.')
+        self.logger.debug('Stopping logcat streaming.')
+        if self.is_alive():
+            self.sync()
         self.stop_signal.set()
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
         self.join(self.join_timeout)
         if self.is_alive():
-            self.logger.error('Could not join logcat poller thread.')
-        if self.exc:
-            raise self.exc  # pylint: disable=E0702
+            self.logger.error('Could not join logcat streaming thread.')
+        with self.lock:
+            if self._wfh:
+                self._wfh.close()
+        self.check()
+
+    def sync(self):
+        """
+        Writes a marker into the log on the device and waits for it to arrive in the
+        stream, so that everything logged before this was called has been buffered.
+
+        """
+        if not self.is_alive():
+            return
+        with self.lock:
+            self._sync_count += 1
+            token = '{}_{}'.format(self.sync_tag, self._sync_count)
+            self._sync_token = token
+        try:
+            adb_shell(self.adb_device, 'log -t {0} {0}'.format(token), timeout=self.timeout)
+        except (DeviceError, TimeoutError) as e:
+            self.logger.warning('Could not sync logcat; the log may be incomplete: {}'.format(e))
+            return
+        timeout_time = time.time() + self.sync_timeout
+        with self.lock:
+            while self._sync_token == token and self.is_alive():
+                remaining = timeout_time - time.time()
+                if remaining <= 0:
+                    self.logger.warning('Timed out waiting for logcat; the log may be incomplete.')
+                    break
+                self.lock.wait(min(remaining, 0.5))
+
+    def mark(self):
+        """Returns the offset of the current end of the log."""
+        self.sync()
+        with self.lock:
+            return self.position
 
     def clear_buffer(self):
         self.logger.debug('Clearing logcat buffer.')
-        with self.lock:
-            adb_shell(self.adb_device, 'logcat -c', timeout=self.timeout)
-            with open(self.buffer_file, 'w') as _:  # NOQA
-                pass
+        self.cleared_position = self.mark()
+
+    def write_log(self, outfile, since=None, until=None):
+        """
+        Writes the log between the specified offsets to ``outfile``. ``since``
+        defaults to the point at which the buffer was last cleared, and ``until``
+        to the current end of the log.
 
-    def write_log(self, outfile):
+        """
         self.logger.debug('Writing logbuffer to {}.'.format(outfile))
+        if until is None:
+            until = self.mark()
+        if since is None:
+            since = self.cleared_position
         with self.lock:
-            self._poll()
-            if os.path.isfile(self.buffer_file):
-                shutil.copy(self.buffer_file, outfile)
-            else:  # there was no logcat trace at this time
-                with open(outfile, 'w') as _:  # NOQA
-                    pass
+            if self._wfh:
+                self._wfh.flush()
+            segments = self.segments + [(self.position, None)]
+            if segments[0][0] > since:
+                self.logger.warning('logcat buffer overflowed; the start of the log has been lost.')
+            with open(outfile, 'w') as wfh:
+                for (start, path), (end, _) in zip(segments, segments[1:]):
+                    if end <= since or start >= until:
+                        continue
+                    with open(path) as fh:
+                        fh.seek(max(since - start, 0))
+                        remaining = min(end, until) - max(since, start)
+                        while remaining > 0:
+                            data = fh.read(min(remaining, self.copy_chunk_size))
+                            if not data:
+                                break
+                            wfh.write(data)
+                            remaining -= len(data)
 
     def close(self):
-        self.logger.debug('Closing logcat poller.')
-        if os.path.isfile(self.buffer_file):
-            os.remove(self.buffer_file)
+        self.logger.debug('Closing logcat streamer.')
+        if os.path.isdir(self.buffer_directory):
+            shutil.rmtree(self.buffer_directory)
 
-    def _poll(self):
+    def _append(self, line):
         with self.lock:
-            self.last_poll = time.time()
-            adb_command(self.adb_device, 'logcat -d >> {}'.format(self.buffer_file), timeout=self.timeout)
-            adb_command(self.adb_device, 'logcat -c', timeout=self.timeout)
+            if self.sync_tag in line:
+                # Sync markers only exist to flush the stream, so they are not
+                # buffered (this includes those of syncs that timed out).
+                if self._sync_token and self._sync_token in line:
+                    self._sync_token = None
+                    self.lock.notify_all()
+                return
+            if self._wfh is None or self._segment_length >= self.segment_size:
+                self._new_segment()
+            self._wfh.write(line)
+            self._segment_length += len(line)
+            self.position += len(line)
+
+    def _new_segment(self):
+        if self._wfh:
+            self._wfh.close()
+        path = os.path.join(self.buffer_directory, 'logcat.{}'.format(self.position))
+        self.segments.append((self.position, path))
+        self._wfh = open(path, 'w')
+        self._segment_length = 0
+        while len(self.segments) > 1 and self.position - self.segments[1][0] >= self.buffer_size:
+            os.remove(self.segments.pop(0)[1])
 
 
 class BigLittleDevice(AndroidDevice):  # pylint: disable=W0223
@@ -854,3 +1080,27 @@ class BigLittleDevice(AndroidDevice):  # pylint: disable=W0223
     parameters = [
         Parameter('scheduler', default='hmp', override=True),
     ]
+
+
+def _parse_package_info(dumpsys_output):
+    info = {}
+    for line in convert_new_lines(dumpsys_output).split('\n'):
+        line = line.strip()
+        for key, regex in PACKAGE_INFO_REGEXES.iteritems():
+            if key not in info:
+                match = regex.search(line)
+                if match:
+                    info[key] = match.group(1).strip()
+    if 'version_name' not in info and 'version_code' not in info:
+        return None  # not installed
+    abi = info.get('abi')
+    if abi == 'null':
+        abi = None
+    for wa_abi, architectures in ABI_MAP.iteritems():
+        if abi in architectures:
+            abi = wa_abi
+            break
+    return {'version_name': info.get('version_name'),
+            'version_code': info.get('version_code'),
+            'abi': abi,
+            'last_update_time': info.get('last_update_time')}
@@ -15,23 +15,29 @@
 
 import os
 import sys
+import json
 import time
-
+import tarfile
+import threading
+from collections import namedtuple
 from distutils.version import LooseVersion
 
+from wlauto.core.bootstrap import settings
 from wlauto.core.extension import Parameter, ExtensionMeta, ListCollection
 from wlauto.core.workload import Workload
 from wlauto.common.android.resources import ApkFile
 from wlauto.common.resources import ExtensionAsset, File
 from wlauto.exceptions import WorkloadError, ResourceError, DeviceError
-from wlauto.utils.android import (ApkInfo, ANDROID_NORMAL_PERMISSIONS,
+from wlauto.utils.android import (get_apk_info, ANDROID_NORMAL_PERMISSIONS,
                                   ANDROID_UNCHANGEABLE_PERMISSIONS, UNSUPPORTED_PACKAGES)
+from wlauto.utils.misc import FileHashIndex, escape_single_quotes, ensure_file_directory_exists
 from wlauto.utils.types import boolean, ParameterDict
 import wlauto.utils.statedetect as state_detector
 from wlauto.common.linux.workload import ReventWorkload
 
 
 DELAY = 5
+ASSET_LISTING_MARKER = 'WA_ASSET_LISTING'
 
 
 # Due to the way `super` works you have to call it at every level but WA executes some
@@ -210,36 +216,33 @@ class ApkWorkload(Workload):
         self.kill_background()
         self.device.clear_logcat()
 
-    def setup_workload_apk(self, context):
-        # Get target version
-        target_version = self.device.get_installed_package_version(self.package)
-        if target_version:
-            target_version = LooseVersion(target_version)
-            self.logger.debug("Found version '{}' on target device".format(target_version))
-
-        # Get host version
-        self.apk_file = context.resolver.get(ApkFile(self, self.device.abi),
-                                             version=getattr(self, 'version', None),
-                                             variant_name=getattr(self, 'variant_name', None),
-                                             strict=False)
-
-        # Get target abi
-        target_abi = self.device.get_installed_package_abi(self.package)
-        if target_abi:
-            self.logger.debug("Found apk with primary abi '{}' on target device".format(target_abi))
+    def prepare(self, context):
+        # Resolving the APK queries the device's ABIs, which does not affect the
+        # state of the device and is safe to do alongside another job.
+        apk_file = self.find_host_apk(context)
+        if apk_file:
+            get_apk_info(apk_file)
 
-        # Get host version, primary abi is first, and then try to find supported.
-        for abi in self.device.supported_abi:
-            self.apk_file = context.resolver.get(ApkFile(self, abi),
-                                                 version=getattr(self, 'version', None),
-                                                 variant_name=getattr(self, 'variant_name', None),
-                                                 strict=False)
+    def setup_workload_apk(self, context):
+        self.apk_file = self.find_host_apk(context)
+        host_version = self.check_host_version()
 
-            # Stop if apk found, or if exact_abi is set only look for primary abi.
-            if self.apk_file or self.exact_abi:
-                break
+        # If the host APK is already installed (as recorded by its fingerprint),
+        # the target does not need to be probed, and nothing needs installing.
+        fingerprint = self.get_installed_fingerprint()
+        if fingerprint:
+            self.logger.debug('Host APK is already installed on target device')
+            target_version = host_version
+            target_abi = fingerprint['abi']
+        else:
+            target_version = self.device.get_installed_package_version(self.package)
+            if target_version:
+                target_version = LooseVersion(target_version)
+                self.logger.debug("Found version '{}' on target device".format(target_version))
+            target_abi = self.device.get_installed_package_abi(self.package)
+            if target_abi:
+                self.logger.debug("Found apk with primary abi '{}' on target device".format(target_abi))
 
-        host_version = self.check_host_version()
         self.verify_apk_version(target_version, target_abi, host_version)
 
         if self.force_install:
@@ -250,13 +253,43 @@ class ApkWorkload(Workload):
             self.prefer_target_apk(context, host_version, target_version)
 
         self.reset(context)
-        self.apk_version = self.device.get_installed_package_version(self.package)
+        fingerprint = self.get_installed_fingerprint()
+        if fingerprint:
+            self.apk_version = fingerprint['version_name']
+        else:
+            self.apk_version = self.device.get_installed_package_version(self.package)
         context.add_classifiers(apk_version=self.apk_version)
 
+    def find_host_apk(self, context):
+        # Get host version, primary abi is first, and then try to find supported.
+        for abi in self.device.supported_abi:
+            apk_file = context.resolver.get(ApkFile(self, abi),
+                                            version=getattr(self, 'version', None),
+                                            variant_name=getattr(self, 'variant_name', None),
+                                            strict=False)
+
+            # Stop if apk found, or if exact_abi is set only look for primary abi.
+            if apk_file or self.exact_abi:
+                return apk_file
+        return None
+
+    def get_installed_fingerprint(self):
+        """
+        Returns the device's fingerprint for the workload's package if it was installed
+        from the host APK, or ``None`` otherwise.
+
+        """
+        if self.apk_file is None or self.force_install:
+            return None
+        fingerprint = self.device.get_apk_fingerprint(self.package)
+        if fingerprint and fingerprint['sha256'] == get_apk_info(self.apk_file).sha256:
+            return fingerprint
+        return None
+
     def check_host_version(self):
         host_version = None
         if self.apk_file is not None:
-            host_version = ApkInfo(self.apk_file).version_name
+            host_version = get_apk_info(self.apk_file).version_name
             if host_version:
                 host_version = LooseVersion(host_version)
             self.logger.debug("Found version '{}' on host".format(host_version))
@@ -423,6 +456,7 @@ class ApkWorkload(Workload):
         else:
             self.logger.debug(output)
             success = True
+            self.device.set_apk_fingerprint(self.package, get_apk_info(self.apk_file).sha256)
         self.do_post_install(context)
         return success
 
@@ -632,6 +666,9 @@ class GameWorkload(ApkWorkload, ReventWorkload):
     asset_file = None
     saved_state_file = None
     view = 'SurfaceView'
+    # If more than this many previously extracted files have changed, the asset
+    # tarball is extracted in full.
+    MAX_DELTA_FILES = 100
     loading_time = 10
     supported_platforms = ['android']
     setup_required = True
@@ -648,6 +685,15 @@ class GameWorkload(ApkWorkload, ReventWorkload):
                   If set to ``False``, this will prevent WA from clearing package
                   data for this workload prior to running it.
                   """),
+        Parameter('skip_deployed_assets', kind=bool, default=True,
+                  description="""
+                  If set to ``True``, the asset tarball will only be extracted on the
+                  device if the files previously extracted from it are missing or have
+                  changed size (in which case only those files are re-extracted, unless
+                  there are more than ``MAX_DELTA_FILES`` of them). Otherwise, the tarball
+                  is fully extracted every time the assets are deployed. This does not
+                  apply to the saved state tarball, which is always fully extracted.
+                  """),
     ]
 
     def __init__(self, device, **kwargs):  # pylint: disable=W0613
@@ -665,6 +711,17 @@ class GameWorkload(ApkWorkload, ReventWorkload):
         if self.check_states:
             self._check_statedetection_files(context)
 
+    def prepare(self, context):
+        ApkWorkload.prepare(self, context)
+        ReventWorkload.prepare(self, context)
+        if self.asset_file and self.skip_deployed_assets:
+            resource_file = self.asset_file.split(':', 1)[-1]
+            asset_tarball = context.resolver.get(ExtensionAsset(self, resource_file), strict=False)
+            if asset_tarball:
+                get_tarball_manifest(asset_tarball)
+        if self.check_states:
+            state_detector.get_state_detector(self.statedefs_dir)
+
     def setup(self, context):
         ApkWorkload.setup(self, context)
         self.logger.debug('Waiting for the game to load...')
@@ -706,30 +763,90 @@ class GameWorkload(ApkWorkload, ReventWorkload):
 
     def _deploy_assets(self, context, timeout=300):
         if self.asset_file:
-            self._deploy_resource_tarball(context, self.asset_file, timeout)
+            self._deploy_resource_tarball(context, self.asset_file, timeout,
+                                          skip_deployed=self.skip_deployed_assets)
         if self.saved_state_file:  # must be deployed *after* asset tarball!
             self._deploy_resource_tarball(context, self.saved_state_file, timeout)
 
-    def _deploy_resource_tarball(self, context, resource_file, timeout=300):
+    def _deploy_resource_tarball(self, context, resource_file, timeout=300, skip_deployed=False):
         kind = 'data'
         if ':' in resource_file:
             kind, resource_file = resource_file.split(':', 1)
         ondevice_cache = self.device.path.join(self.device.resource_cache, self.name, resource_file)
-        if not self.device.file_exists(ondevice_cache):
-            asset_tarball = context.resolver.get(ExtensionAsset(self, resource_file))
+        device_asset_directory = self.device.path.join(self.device.external_storage_directory, 'Android', kind)
+        # Records the SHA256 of the tarball that was last extracted.
+        marker = ondevice_cache + '.extracted'
+
+        asset_tarball = None
+        manifest = None
+        if skip_deployed:
+            asset_tarball = context.resolver.get(ExtensionAsset(self, resource_file), strict=False)
+            if asset_tarball:
+                manifest = get_tarball_manifest(asset_tarball)
+
+        if manifest:
+            is_cached, extracted_sha256, sizes = self._get_deployed_assets(ondevice_cache, marker,
+                                                                           device_asset_directory, manifest)
+            is_deployed = is_cached and extracted_sha256 == manifest.sha256
+        else:
+            is_cached, is_deployed, sizes = self.device.file_exists(ondevice_cache), False, {}
+        # If the tarball was not the one last extracted, the cached copy may be out
+        # of date with the host's, so it is pushed again.
+        if not is_cached or (manifest and not is_deployed):
             if not asset_tarball:
-                message = 'Could not find resource {} for workload {}.'
-                raise WorkloadError(message.format(resource_file, self.name))
+                asset_tarball = context.resolver.get(ExtensionAsset(self, resource_file))
             # adb push will create intermediate directories if they don't
             # exist.
             self.device.push_file(asset_tarball, ondevice_cache, timeout=timeout)
 
-        device_asset_directory = self.device.path.join(self.device.external_storage_directory, 'Android', kind)
+        members = None  # i.e. all of them
+        if is_deployed:
+            members = [name for path, (name, size) in manifest.files.iteritems() if sizes.get(path) != size]
+            if not members:
+                self.logger.debug('{} is already deployed; not extracting'.format(resource_file))
+                return
+            if len(members) > self.MAX_DELTA_FILES:
+                members = None
+            else:
+                self.logger.debug('Re-extracting {} changed file(s) from {}'.format(len(members), resource_file))
+
         deploy_command = 'cd {} && {} tar -xzf {}'.format(device_asset_directory,
                                                           self.device.busybox,
                                                           ondevice_cache)
+        if members:
+            deploy_command += ' ' + ' '.join("'{}'".format(escape_single_quotes(m)) for m in members)
+        if manifest:
+            deploy_command += ' && echo {} > {}'.format(manifest.sha256, marker)
+        else:
+            deploy_command += ' && rm -f {}'.format(marker)
         self.device.execute(deploy_command, timeout=timeout, as_root=True)
 
+    def _get_deployed_assets(self, ondevice_cache, marker, device_asset_directory, manifest):
+        """
+        Checks, with a single command, whether the tarball is present in the on-device
+        cache, the SHA256 of the tarball last extracted from it, and the sizes of
+        the files that would be extracted from it (relative to the asset directory).
+
+        """
+        top_level = sorted(set(path.split('/')[0] for path in manifest.files))
+        command = ('if [ -f {cache} ]; then echo cached; fi; cat {marker} 2>/dev/null; echo; echo {sep}; '
+                   'cd {directory} && {bb} find {top_level} -type f -print0 2>/dev/null | '
+                   '{bb} xargs -0 {bb} stat -c "%s %n"')
+        command = command.format(cache=ondevice_cache, marker=marker, sep=ASSET_LISTING_MARKER,
+                                 directory=device_asset_directory, bb=self.device.busybox,
+                                 top_level=' '.join("'{}'".format(escape_single_quotes(t)) for t in top_level))
+        output = self.device.execute(command, as_root=True, check_exit_code=False)
+        header, listing = output.replace('\r\n', '\n').split(ASSET_LISTING_MARKER, 1)
+        header_lines = header.split()
+        is_cached = 'cached' in header_lines
+        extracted_sha256 = header_lines[-1] if header_lines and header_lines[-1] != 'cached' else None
+        sizes = {}
+        for line in listing.split('\n'):
+            parts = line.split(' ', 1)
+            if len(parts) == 2 and parts[0].isdigit():
+                sizes[os.path.normpath(parts[1])] = int(parts[0])
+        return is_cached, extracted_sha256, sizes
+
     def _check_statedetection_files(self, context):
         try:
             self.statedefs_dir = context.resolver.get(File(self, 'state_definitions'))
@@ -748,3 +865,48 @@ class GameWorkload(ApkWorkload, ReventWorkload):
         except state_detector.StateDefinitionError as e:
             msg = "State definitions or template files missing or invalid ({}). Skipping state detection."
             self.logger.warning(msg.format(e.message))
+
+
+TarballManifest = namedtuple('TarballManifest', 'sha256 files')
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+_tarball_hash_index = None
+
+
+def get_tarball_manifest(path):
+    """
+    Returns a :class:`TarballManifest` for the gzipped tarball at the specified
+    path, with its SHA256 and a dict mapping the normalized path of each regular
+    file it contains to a ``(member name, size)`` tuple. Manifests are cached under
+    WA's environment root, so each tarball only needs to be read once.
+
+    """
+    global _tarball_hash_index  # pylint: disable=global-statement
+    cache_directory = os.path.join(settings.environment_root, 'asset_manifests')
+    with _manifests_lock:
+        if _tarball_hash_index is None:
+            _tarball_hash_index = FileHashIndex(os.path.join(cache_directory, 'sha256.json'))
+        digest = _tarball_hash_index.sha256(path)
+        if digest not in _manifests:
+            manifest_path = os.path.join(cache_directory, digest + '.json')
+            files = None
+            if os.path.isfile(manifest_path):
+                try:
+                    with open(manifest_path) as fh:
+                        files = {str(k): (str(name), size) for k, (name, size) in json.load(fh).iteritems()}
+                except (IOError, ValueError):
+                    files = None
+            if files is None:
+                files = {}
+                with tarfile.open(path, 'r|gz') as tar:
+                    for member in tar:
+                        if member.isfile():
+                            files[os.path.normpath(member.name)] = (member.name, member.size)
+                try:
+                    with open(ensure_file_directory_exists(manifest_path), 'w') as wfh:
+                        json.dump(files, wfh)
+                except (IOError, OSError):
+                    pass  # will be re-generated next time
+            _manifests[digest] = TarballManifest(digest, files)
+        return _manifests[digest]
@@ -356,8 +356,10 @@ class BaseGem5Device(object):
         self.sckt.PROMPT = prompt
 
     def close(self):
-        if self._logcat_poller:
-            self._logcat_poller.stop()
+        if self._logcat_streamer:
+            self._logcat_streamer.stop()
+            self._logcat_streamer.close()
+            self._logcat_streamer = None
 
     def reset(self):
         self.logger.warn("Attempt to restart the gem5 device. This is not "
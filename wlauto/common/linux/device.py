@@ -19,7 +19,7 @@ import re
 import time
 import base64
 import socket
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from subprocess import CalledProcessError
 
 from wlauto.core.extension import Parameter
@@ -42,11 +42,126 @@ LsmodEntry = namedtuple('LsmodEntry', ['name', 'size', 'use_count', 'used_by'])
 
 GOOGLE_DNS_SERVER_ADDRESS = '8.8.8.8'
 
+# Delimit the output of each command in a batch.
+BATCH_BEGIN_MARKER = 'WA_BATCH_BEGIN'
+BATCH_END_MARKER = 'WA_BATCH_END'
+
+
+class BatchedCommand(object):
+    """
+    A command queued in a :class:`CommandBatch`. Its ``output`` and ``exit_code``
+    become available once the batch has been executed.
+
+    """
+
+    @property
+    def output(self):
+        self._check_executed()
+        return self._output
+
+    @property
+    def exit_code(self):
+        self._check_executed()
+        return self._exit_code
+
+    @property
+    def executed(self):
+        return self._exit_code is not None
+
+    def __init__(self, command, check_exit_code=True):
+        self.command = command.strip().rstrip(';')
+        self.check_exit_code = check_exit_code
+        self._output = None
+        self._exit_code = None
+
+    def _check_executed(self):
+        if not self.executed:
+            raise RuntimeError('"{}" has not been executed yet'.format(self.command))
+
+    def __str__(self):
+        return self.command
+
+    __repr__ = __str__
+
+
+class CommandBatch(object):
+    """
+    Queues up commands and executes them on the device as a single shell script,
+    saving a round trip to the device for each command. This is normally used via
+    :meth:`BaseLinuxDevice.batch`::
+
+        with device.batch() as batch:
+            governor = batch.execute('cat /sys/devices/system/cpu/cpu0/cpufreq/scaling_governor')
+            batch.execute('echo 1 > /sys/devices/system/cpu/cpu1/online')
+        print governor.output
+
+    The queued commands are executed when the ``with`` block exits (or when
+    ``flush()`` is called), in the order they were queued. If a command whose exit
+    code is checked fails, the remaining commands are still executed, after which
+    ``DeviceError`` is raised. Commands are split over multiple scripts if
+    necessary to keep each one within the device's ``max_batch_command_length``.
+
+    """
+
+    def __init__(self, device, as_root=False, timeout=None):
+        self.device = device
+        self.as_root = as_root
+        self.timeout = timeout
+        self.commands = []
+
+    def execute(self, command, check_exit_code=True):
+        """Queue the specified command and return the :class:`BatchedCommand` for it."""
+        batched = BatchedCommand(command, check_exit_code)
+        self.commands.append(batched)
+        return batched
+
+    def flush(self):
+        """Execute all commands queued so far."""
+        commands, self.commands = self.commands, []
+        script = []
+        for index, batched in enumerate(commands):
+            line = 'echo {0} {1}; {{ {2}; }} 2>&1; ret=$?; echo; echo {3} {1} $ret'.format(BATCH_BEGIN_MARKER, index,
+                                                                                          batched.command,
+                                                                                          BATCH_END_MARKER)
+            if script and len('; '.join(script + [line])) > self.device.max_batch_command_length:
+                self._run(script, commands)
+                script = []
+            script.append(line)
+        if script:
+            self._run(script, commands)
+
+        for batched in commands:
+            if not batched.executed:
+                raise DeviceError('Did not get the result of "{}" from the device.'.format(batched.command))
+            if batched.check_exit_code and batched.exit_code:
+                message = 'Got exit code {} from "{}":\n{}'
+                raise DeviceError(message.format(batched.exit_code, batched.command, batched.output))
+
+    def _run(self, script, commands):
+        output = self.device.execute('; '.join(script), timeout=self.timeout,
+                                     check_exit_code=False, as_root=self.as_root)
+        for index, (exit_code, command_output) in _parse_batch_output(output).iteritems():
+            if index < len(commands):
+                commands[index]._output = command_output  # pylint: disable=protected-access
+                commands[index]._exit_code = exit_code  # pylint: disable=protected-access
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.commands = []
+
 
 class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
 
     path_module = 'posixpath'
     has_gpu = True
+    # Maximum length of the command used to execute a batch of commands;
+    # larger batches are split over multiple commands.
+    max_batch_command_length = 2048
 
     parameters = [
         Parameter('scheduler', kind=str, default='unknown',
@@ -256,11 +371,10 @@ class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
                        to deal with binary format.
 
         """
+        output = self.execute(self._get_sysfile_read_command(sysfile, binary),
+                              as_root=self.is_rooted).strip()  # pylint: disable=E1103
         if binary:
-            output = self.execute('{} base64 {}'.format(self.busybox, sysfile), as_root=self.is_rooted).strip()
             output = output.decode('base64')
-        else:
-            output = self.execute('cat \'{}\''.format(sysfile), as_root=self.is_rooted).strip()  # pylint: disable=E1103
         if kind:
             return kind(output)
         else:
@@ -274,20 +388,9 @@ class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
         ``True``.
 
         """
-        value = str(value)
-        if binary:
-            # Value is already string encoded, so need to decode before encoding in base64
-            try:
-                value = str(value.decode('string_escape'))
-            except ValueError as e:
-                msg = 'Can not interpret value "{}" for "{}": {}'
-                raise ValueError(msg.format(value, sysfile, e.message))
-
-            encoded_value = base64.b64encode(value)
-            cmd = 'echo {} | {} base64 -d > \'{}\''.format(encoded_value, self.busybox, sysfile)
-        else:
-            cmd = 'echo {} > \'{}\''.format(value, sysfile)
+        cmd, value = self._get_sysfile_write_command(sysfile, value, binary)
         self.execute(cmd, check_exit_code=False, as_root=True)
+        self._on_sysfiles_written([sysfile])
 
         if verify:
             output = self.get_sysfile_value(sysfile, binary=binary)
@@ -296,16 +399,23 @@ class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
                 raise DeviceError(message)
         self._written_sysfiles.append((sysfile, binary))
 
-    def get_sysfile_values(self):
+    def get_sysfile_values(self, sysfiles=None):
         """
-        Returns a dict mapping paths of sysfiles that were previously set to their
-        current values.
+        Returns a dict mapping paths of sysfiles to their current values. The
+        sysfiles are read using a single command (see ``max_batch_command_length``).
+
+        :param sysfiles: The paths of the sysfiles to be read. As with
+                         ``set_sysfile_values``, a path may be prefixed with
+                         ``'^'`` to read the file as binary data. If not
+                         specified, the sysfiles that were previously set will
+                         be read.
 
         """
-        values = {}
-        for sysfile, binary in self._written_sysfiles:
-            values[sysfile] = self.get_sysfile_value(sysfile, binary=binary)
-        return values
+        if sysfiles is None:
+            reads = self._written_sysfiles
+        else:
+            reads = [(sysfile.lstrip('^'), sysfile.startswith('^')) for sysfile in sysfiles]
+        return self._execute_sysfile_batch([], reads)
 
     def set_sysfile_values(self, params):
         """
@@ -314,13 +424,120 @@ class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
         be disabled for individual paths by appending ``'!'`` to them. To enable values being
         written as binary data, a ``'^'`` can be prefixed to the path.
 
+        All of the values are written, and then verified, using a single command (see
+        ``max_batch_command_length``), so, unlike with ``set_sysfile_value``, all
+        values will have been written by the time an error is raised for one of them.
+
         """
+        writes = []
         for sysfile, value in params.iteritems():
             verify = not sysfile.endswith('!')
             sysfile = sysfile.rstrip('!')
             binary = sysfile.startswith('^')
             sysfile = sysfile.lstrip('^')
-            self.set_sysfile_value(sysfile, value, verify=verify, binary=binary)
+            writes.append((sysfile, value, verify, binary))
+        self._execute_sysfile_batch(writes, [])
+
+    def _get_sysfile_read_command(self, sysfile, binary=False):
+        if binary:
+            return '{} base64 {}'.format(self.busybox, sysfile)
+        else:
+            return 'cat \'{}\''.format(sysfile)
+
+    def _get_sysfile_write_command(self, sysfile, value, binary=False):
+        """Returns the command that writes ``value`` to ``sysfile``, along with the value expected to be read back."""
+        value = str(value)
+        if binary:
+            # Value is already string encoded, so need to decode before encoding in base64
+            try:
+                value = str(value.decode('string_escape'))
+            except ValueError as e:
+                msg = 'Can not interpret value "{}" for "{}": {}'
+                raise ValueError(msg.format(value, sysfile, e.message))
+
+            encoded_value = base64.b64encode(value)
+            cmd = 'echo {} | {} base64 -d > \'{}\''.format(encoded_value, self.busybox, sysfile)
+        else:
+            cmd = 'echo {} > \'{}\''.format(value, sysfile)
+        return cmd, value
+
+    def _execute_sysfile_batch(self, writes, reads):
+        """
+        Performs the specified writes, followed by the specified reads, as a single
+        batch of commands (see ``batch()``).
+
+        :param writes: A list of ``(sysfile, value, verify, binary)`` tuples. Each value
+                       is written and then, if ``verify`` is ``True``, read back and
+                       checked, as with ``set_sysfile_value``.
+        :param reads: A list of ``(sysfile, binary)`` tuples.
+
+        :returns: A dict mapping the paths of the sysfiles in ``reads`` to their values.
+
+        """
+        checks = []  # (sysfile, binary, batched read, expected value)
+        # As with set_sysfile_value, writes are always attempted as root.
+        with self.batch(as_root=True if writes else self.is_rooted) as batch:
+            for sysfile, value, verify, binary in writes:
+                command, value = self._get_sysfile_write_command(sysfile, value, binary)
+                batch.execute(command, check_exit_code=False)
+                if verify:
+                    read = batch.execute(self._get_sysfile_read_command(sysfile, binary), check_exit_code=False)
+                    checks.append((sysfile, binary, read, value))
+                else:
+                    checks.append((sysfile, binary, None, None))
+            for sysfile, binary in reads:
+                read = batch.execute(self._get_sysfile_read_command(sysfile, binary), check_exit_code=False)
+                checks.append((sysfile, binary, read, None))
+        self._on_sysfiles_written([sysfile for sysfile, _, _, _ in writes])
+
+        values = {}
+        errors = []
+        for i, (sysfile, binary, read, expected) in enumerate(checks):
+            is_write = i < len(writes)
+            if read is None:  # unverified write
+                self._written_sysfiles.append((sysfile, binary))
+                continue
+            if read.exit_code:
+                errors.append('Could not read {}: {}'.format(sysfile, read.output.strip()))
+                continue
+            output = read.output.strip()
+            if binary:
+                output = output.decode('base64')
+            if is_write:
+                if output.strip() != expected:
+                    errors.append('Could not set the value of {} to {}'.format(sysfile, expected))
+                    continue
+                # As with set_sysfile_value, only successfully written
+                # sysfiles are recorded.
+                self._written_sysfiles.append((sysfile, binary))
+            else:
+                values[sysfile] = output
+        if errors:
+            raise DeviceError(errors[0])
+        return values
+
+    def _on_sysfiles_written(self, sysfiles):
+        # The cpufreq module caches the governor set for each CPU, which may
+        # have been changed behind its back.
+        if self.has('cpufreq') and any(s.endswith('/cpufreq/scaling_governor') for s in sysfiles):
+            self.invalidate_cpufreq_cache()
+
+    def batch(self, as_root=False, timeout=None):
+        """
+        Returns a :class:`CommandBatch` context manager that queues up the commands
+        executed through it, and executes them on the device using a single command
+        when the ``with`` block exits::
+
+            with device.batch(as_root=True) as batch:
+                batch.execute('mkdir -p /sys/fs/cgroup/wa')
+                result = batch.execute('cat /proc/mounts')
+            mounts = result.output
+
+        :param as_root: Execute the batch as root.
+        :param timeout: Timeout for each command used to execute (part of) the batch.
+
+        """
+        return CommandBatch(self, as_root=as_root, timeout=timeout)
 
     def deploy_busybox(self, context, force=False):
         """
@@ -514,6 +731,8 @@ class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
         status = 1 if online else 0
         sysfile = '/sys/devices/system/cpu/{}/online'.format(cpu)
         self.set_sysfile_value(sysfile, status)
+        if self.has('cpufreq'):
+            self.invalidate_cpufreq_cache()
 
     def get_number_of_online_cores(self, core):
         if core not in self.core_names:
@@ -543,10 +762,13 @@ class BaseLinuxDevice(Device):  # pylint: disable=abstract-method
             else:  # did not find one
                 raise ValueError('Cannot hotplug all cpus on the device!')
 
-        for i in xrange(0, number):
-            self.enable_cpu(core_ids[i])
-        for i in xrange(number, max_cores):
-            self.disable_cpu(core_ids[i])
+        # Bring the cores online before taking any offline, all in one batch.
+        params = OrderedDict()
+        for i, cpu in enumerate(core_ids):
+            params['/sys/devices/system/cpu/cpu{}/online'.format(cpu)] = 1 if i < number else 0
+        self.set_sysfile_values(params)
+        if self.has('cpufreq'):
+            self.invalidate_cpufreq_cache()
 
     def invoke(self, binary, args=None, in_directory=None, on_cpus=None,
                background=False, as_root=False, timeout=30):
@@ -922,3 +1144,23 @@ class LinuxDevice(BaseLinuxDevice):
 
     def ensure_screen_is_on(self):
         pass  # TODO
+
+
+def _parse_batch_output(output):
+    """
+    Returns a dict mapping the indexes of the commands in a batch to
+    ``(exit_code, output)`` tuples.
+
+    """
+    results = {}
+    current, lines = None, []
+    for line in convert_new_lines(output or '').split('\n'):
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == BATCH_BEGIN_MARKER:
+            current, lines = parts[1], []
+        elif len(parts) == 3 and parts[0] == BATCH_END_MARKER and parts[1] == current:
+            results[int(current)] = (int(parts[2]), '\n'.join(lines))
+            current = None
+        elif current is not None:
+            lines.append(line)
+    return results
@@ -80,6 +80,14 @@ class ReventWorkload(Workload):
         devpath = self.device.path
         self.on_device_revent_binary = devpath.join(self.device.binaries_directory, 'revent')
 
+    def prepare(self, context):
+        if self.setup_required:
+            context.resolver.get(ReventFile(self, 'setup'), strict=False)
+        if not self.idle_time:
+            context.resolver.get(ReventFile(self, 'run'), strict=False)
+        if self.teardown_required:
+            context.resolver.get(ReventFile(self, 'teardown'), strict=False)
+
     def setup(self, context):
         devpath = self.device.path
         if self.setup_required:
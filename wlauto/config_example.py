@@ -57,6 +57,16 @@ max_retries = 3
 # If WA should delete its files from the device after the run is completed
 clean_up = False
 
+# If set, iteration results will be processed by result processors that support
+# it in the background, while subsequent iterations are executing.
+parallel_result_processing = False
+
+# If set, all assets (e.g. APKs, for every version and ABI) listed in the remote assets
+# index for the extensions used in the run will be fetched before the run starts, using up
+# to prefetch_jobs concurrent downloads.
+prefetch_assets = False
+prefetch_jobs = 4
+
 ####################################################################################################
 ######################################### Device Settings ##########################################
 ####################################################################################################
@@ -86,6 +96,14 @@ device_config = dict(
     # core_clusters = [0, 0, 0, 1, 1]
 )
 
+# A list of devices to spread the run across. Each entry is merged on top of device_config         #
+# above, and iterations are distributed between the devices as they become free.                   #
+#                                                                                                  #
+#device_pool = [
+#    dict(adb_name='10.109.173.2:5555'),
+#    dict(adb_name='10.109.173.3:5555'),
+#]
+
 
 ####################################################################################################
 ################################### Instrumentation Configuration ####################################
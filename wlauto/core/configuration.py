@@ -482,6 +482,10 @@ class RunConfiguration(object):
         RunConfigurationItem('retry_on_status', 'list', 'replace'),
         RunConfigurationItem('max_retries', 'scalar', 'replace'),
         RunConfigurationItem('clean_up', 'scalar', 'replace'),
+        RunConfigurationItem('parallel_result_processing', 'scalar', 'replace'),
+        RunConfigurationItem('prefetch_assets', 'scalar', 'replace'),
+        RunConfigurationItem('prefetch_jobs', 'scalar', 'replace'),
+        RunConfigurationItem('device_pool', 'list', 'replace'),
     ]
 
     # Configuration specified for each workload spec. "workload_parameters"
@@ -538,6 +542,10 @@ class RunConfiguration(object):
         self.other_config = {}  # keeps track of used config for extensions other than of the four main kinds.
         self.retry_on_status = status_list(['FAILED', 'PARTIAL'])
         self.max_retries = 3
+        self.parallel_result_processing = False
+        self.prefetch_assets = False
+        self.prefetch_jobs = 4
+        self.device_pool = []
         self._used_config_items = []
         self._global_instrumentation = []
         self._reboot_policy = None
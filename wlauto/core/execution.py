@@ -35,17 +35,24 @@ following actors:
             stages of execution, emitting an appropriate signal at each step to
             allow instrumentation to do its stuff.
 
+    PoolJobQueue: When a run is spread across a pool of devices, this is the job
+                  queue of each device's Runner. Jobs are claimed from a queue
+                  shared by all the devices as they are needed.
+
 """
 import os
 import uuid
 import logging
 import subprocess
 import random
+import threading
+import multiprocessing
 from copy import copy
 from datetime import datetime
 from contextlib import contextmanager
 from collections import Counter, defaultdict, OrderedDict
 from itertools import izip_longest
+from Queue import Empty
 
 import wlauto.core.signal as signal
 from wlauto.core import instrumentation
@@ -58,6 +65,7 @@ from wlauto.core.result import ResultManager, IterationResult, RunResult
 from wlauto.exceptions import (WAError, ConfigError, TimeoutError, InstrumentError,
                                DeviceError, DeviceNotRespondingError, ResourceError,
                                HostError)
+from wlauto.utils.log import add_log_prefix
 from wlauto.utils.misc import ensure_directory_exists as _d, get_traceback, merge_dicts, format_duration
 
 
@@ -70,6 +78,10 @@ MAX_REBOOT_ATTEMPTS = 3
 # to reboot.
 REBOOT_DELAY = 3
 
+# How often (in seconds) to check whether the workers of a device pool are
+# still alive while waiting for their results.
+POOL_POLL_INTERVAL = 1
+
 
 class RunInfo(object):
     """
@@ -120,8 +132,7 @@ class ExecutionContext(object):
     @property
     def current_iteration(self):
         if self.current_job:
-            spec_id = self.current_job.spec.id
-            return self.job_iteration_counts[spec_id]
+            return self.current_job.iteration
         else:
             return None
 
@@ -188,7 +199,11 @@ class ExecutionContext(object):
     def next_job(self, job):
         """Invoked by the runner when starting a new iteration of workload execution."""
         self.current_job = job
-        self.job_iteration_counts[self.spec.id] += 1
+        if isinstance(self.job_iteration_counts, SharedIterationCounts):
+            self.current_job.iteration = self.job_iteration_counts.increment(self.spec.id)
+        else:
+            self.job_iteration_counts[self.spec.id] += 1
+            self.current_job.iteration = self.job_iteration_counts[self.spec.id]
         if not self.aborted:
             outdir_name = '_'.join(map(str, [self.spec.label, self.spec.id, self.current_iteration]))
             self.output_directory = _d(os.path.join(self.run_output_directory, outdir_name))
@@ -305,7 +320,14 @@ class Executor(object):
         self.logger.debug('Initialising device configuration.')
         if not self.config.device:
             raise ConfigError('Make sure a device is specified in the config.')
-        self.device = self.ext_loader.get_device(self.config.device, **self.config.device_config)
+        if self.config.device_pool:
+            # Workloads are loaded and results are processed for the first
+            # device in the pool; the devices themselves are set up by the
+            # worker processes.
+            device_config = self._get_pool_device_config(0)
+        else:
+            device_config = self.config.device_config
+        self.device = self.ext_loader.get_device(self.config.device, **device_config)
         self.device.validate()
 
         self.context = ExecutionContext(self.device, self.config)
@@ -315,42 +337,196 @@ class Executor(object):
         self.context.resolver.load()
         self.context.add_artifact('run_config', config_outfile, 'meta')
 
-        self.logger.debug('Installing instrumentation')
-        for name, params in self.config.instrumentation.iteritems():
-            instrument = self.ext_loader.get_instrument(name, self.device, **params)
-            instrumentation.install(instrument)
-        instrumentation.validate()
+        if not self.config.device_pool:
+            self._install_instrumentation(self.device)
 
         self.logger.debug('Installing result processors')
-        result_manager = ResultManager()
+        result_manager = ResultManager(parallel=self.config.parallel_result_processing)
         for name, params in self.config.result_processors.iteritems():
             processor = self.ext_loader.get_result_processor(name, **params)
             result_manager.install(processor)
+        if self.config.device_pool:
+            self._validate_pool_result_processors(result_manager)
         result_manager.validate()
 
         self.logger.debug('Loading workload specs')
         for workload_spec in self.config.workload_specs:
             workload_spec.load(self.device, self.ext_loader)
-            workload_spec.workload.init_resources(self.context)
+
+        if self.config.prefetch_assets:
+            self.prefetch_resources()
+
+        if self.config.device_pool:
+            self.execute_on_device_pool(result_manager)
+        else:
+            self._prepare_device(self.device, self.context)
+            self.logger.info('Running workloads')
+            runner = self._get_runner(result_manager)
+            runner.init_queue(self.config.workload_specs)
+            runner.run()
+            self._clean_up_device(self.device)
+        self.execute_postamble()
+
+    def execute_on_device_pool(self, result_manager):
+        """
+        Spread the jobs for the run across the devices in the ``device_pool``. Each
+        device is driven by its own ``Runner`` in a separate worker process. Jobs are
+        claimed by the workers from a shared queue (in the order determined by the
+        run's ``execution_order``) as they become free, so faster devices end up
+        running more of them. Iteration results are sent back to this process,
+        where they are passed to the result processors and combined into a single
+        run result.
+
+        """
+        specs = self.config.workload_specs
+        runnercls = self._get_runner_class()
+        queue_order = runnercls(None, None, None)
+        queue_order.init_queue(specs)
+        job_order = [specs.index(job.spec) for job in queue_order.job_queue]
+        next_job_index = multiprocessing.Value('i', 0)
+        iteration_counts = SharedIterationCounts([spec.id for spec in specs])
+        messages = multiprocessing.Queue()
+
+        self.logger.info('Running workloads on {} devices'.format(len(self.config.device_pool)))
+        run_info = self.context.run_info
+        run_info.start_time = datetime.utcnow()
+        result_manager.initialize(self.context)
+        workers = []
+        for index in xrange(len(self.config.device_pool)):
+            worker = multiprocessing.Process(target=self._run_pool_worker,
+                                             name=self._get_pool_device_label(index),
+                                             args=(index, runnercls, job_order, next_job_index,
+                                                   iteration_counts, messages))
+            worker.start()
+            workers.append(worker)
+
+        merger = PoolResultMerger(self.context, result_manager)
+        interrupted = False
+        while True:
+            try:
+                if not any(w.is_alive() for w in workers):
+                    break
+                try:
+                    merger.merge(messages.get(timeout=POOL_POLL_INTERVAL))
+                except Empty:
+                    pass
+            except KeyboardInterrupt:
+                # The workers get the CTRL-C as well, and will finalize their part of the run.
+                if interrupted:
+                    raise
+                interrupted = True
+                self.logger.info('Got CTRL-C. Waiting for devices to finalize... (CTRL-C again to abort).')
+        # Everything the workers sent will have been flushed by the time they exit.
+        while True:
+            try:
+                merger.merge(messages.get(timeout=POOL_POLL_INTERVAL))
+            except Empty:
+                break
+
+        if merger.errors_logged:
+            self.error_logged = True
+        if merger.warnings_logged:
+            self.warning_logged = True
+        unclaimed = len(job_order) - next_job_index.value
+        if unclaimed:
+            self.logger.error('{} job(s) were not run, as no devices were available.'.format(unclaimed))
+            self.context.run_result.non_iteration_errors = True
+
+        run_info.end_time = datetime.utcnow()
+        run_info.duration = run_info.end_time - run_info.start_time
+        self.logger.info('Processing overall results')
+        result_manager.process_run_result(self.context.run_result, self.context)
+        result_manager.finalize(self.context)
+
+    def _run_pool_worker(self, index, runnercls, job_order, next_job_index, iteration_counts, messages):  # pylint: disable=too-many-arguments
+        label = self._get_pool_device_label(index)
+        add_log_prefix(label)
+        forwarder = PoolResultForwarder(label, messages)
+        try:
+            device = self.ext_loader.get_device(self.config.device, **self._get_pool_device_config(index))
+            device.validate()
+
+            context = ExecutionContext(device, self.config)
+            context.initialize()
+            # All workers contribute to the same run; resources have already
+            # been discovered (and prefetched) by the parent.
+            context.run_info = copy(self.context.run_info)
+            context.run_result = RunResult(context.run_info, context.run_output_directory)
+            context.resolver = self.context.resolver
+            context.job_iteration_counts = iteration_counts
+
+            self._install_instrumentation(device)
+            for workload_spec in self.config.workload_specs:
+                workload_spec.load(device, self.ext_loader)
+            self._prepare_device(device, context)
+
+            runner = runnercls(device, context, forwarder)
+            runner.job_queue = PoolJobQueue([self.config.workload_specs[i] for i in job_order],
+                                            next_job_index, context)
+            runner.run()
+            self._clean_up_device(device)
+        except Exception, e:  # pylint: disable=broad-except
+            self.logger.error('{}("{}")'.format(e.__class__.__name__, e))
+            self.logger.debug(get_traceback())
+            forwarder.failed = True
+        finally:
+            forwarder.done(self.error_logged, self.warning_logged)
+
+    def _validate_pool_result_processors(self, result_manager):
+        # Result processors only run in this process, which never connects to
+        # the devices in the pool.
+        unsupported = [p.name for p in result_manager.processors if p.queries_device]
+        if unsupported:
+            message = 'Result processor(s) {} query the device, so cannot be used with device_pool.'
+            raise ConfigError(message.format(', '.join(unsupported)))
+
+    def _get_pool_device_config(self, index):
+        pool_config = self.config.device_pool[index]
+        if not isinstance(pool_config, dict):
+            raise ConfigError('device_pool entries must be dicts; got {}'.format(pool_config))
+        return merge_dicts(self.config.device_config, pool_config, should_merge_lists=False,
+                           should_normalize=False, dict_type=OrderedDict)
+
+    def _get_pool_device_label(self, index):
+        return '{}{}'.format(self.config.device, index)
+
+    def _install_instrumentation(self, device):
+        self.logger.debug('Installing instrumentation')
+        for name, params in self.config.instrumentation.iteritems():
+            instrument = self.ext_loader.get_instrument(name, device, **params)
+            instrumentation.install(instrument)
+        instrumentation.validate()
+
+    def _prepare_device(self, device, context):
+        for workload_spec in self.config.workload_specs:
+            workload_spec.workload.init_resources(context)
             workload_spec.workload.validate()
 
         if self.config.flashing_config:
-            if not self.device.flasher:
+            if not device.flasher:
                 msg = 'flashing_config specified for {} device that does not support flashing.'
-                raise ConfigError(msg.format(self.device.name))
+                raise ConfigError(msg.format(device.name))
             self.logger.debug('Flashing the device')
-            self.device.flasher.flash(self.device)
-
-        self.logger.info('Running workloads')
-        runner = self._get_runner(result_manager)
-        runner.init_queue(self.config.workload_specs)
-        runner.run()
+            device.flasher.flash(device)
 
+    def _clean_up_device(self, device):
         if getattr(self.config, "clean_up", False):
             self.logger.info('Clearing WA files from device')
-            self.device.delete_file(self.device.binaries_directory)
-            self.device.delete_file(self.device.working_directory)
-        self.execute_postamble()
+            device.delete_file(device.binaries_directory)
+            device.delete_file(device.working_directory)
+
+    def prefetch_resources(self):
+        """
+        Fetch resources that may be needed by the workloads (and other extensions)
+        used in this run up front, so that slow (e.g. remote) sources do not hold
+        up the run once the device is connected.
+
+        """
+        owner_names = set([self.device.name])
+        owner_names.update(spec.workload.name for spec in self.config.workload_specs)
+        owner_names.update(self.config.instrumentation)
+        self.logger.info('Prefetching resources')
+        self.context.resolver.prefetch(owner_names, jobs=self.config.prefetch_jobs)
 
     def execute_postamble(self):
         """
@@ -380,6 +556,10 @@ class Executor(object):
             self.logger.warn('Please see {}'.format(settings.log_file))
 
     def _get_runner(self, result_manager):
+        runnercls = self._get_runner_class()
+        return runnercls(self.device, self.context, result_manager)
+
+    def _get_runner_class(self):
         if not self.config.execution_order or self.config.execution_order == 'by_iteration':
             if self.config.reboot_policy == 'each_spec':
                 self.logger.info('each_spec reboot policy with the default by_iteration execution order is '
@@ -393,7 +573,7 @@ class Executor(object):
             runnercls = RandomRunner
         else:
             raise ConfigError('Unexpected execution order: {}'.format(self.config.execution_order))
-        return runnercls(self.device, self.context, result_manager)
+        return runnercls
 
     def _error_signalled_callback(self):
         self.error_logged = True
@@ -481,6 +661,7 @@ class Runner(object):
         self.job_queue = []
         self.completed_jobs = []
         self._initial_reset = True
+        self._preparation = None
 
     def init_queue(self, specs):
         raise NotImplementedError()
@@ -580,6 +761,7 @@ class Runner(object):
         self.context.next_job(self.current_job)
 
     def _run_job(self):   # pylint: disable=too-many-branches
+        self._wait_for_preparation()
         spec = self.current_job.spec
         if not spec.enabled:
             self.logger.info('Skipping workload %s (iteration %s)', spec, self.context.current_iteration)
@@ -651,6 +833,7 @@ class Runner(object):
         self.context.end_job()
 
     def _finalize_run(self):
+        self._wait_for_preparation()
         self.logger.info('Finalizing workloads')
         for workload_spec in self.context.config.workload_specs:
             workload_spec.workload.finalize(self.context)
@@ -687,6 +870,7 @@ class Runner(object):
             with self._handle_errors('Running workload'):
                 with self._signal_wrap('WORKLOAD_EXECUTION'):
                     workload.run(self.context)
+            self._prepare_next_job()
 
             self.logger.info('\tProcessing result')
             self._send(signal.BEFORE_WORKLOAD_RESULT_UPDATE)
@@ -710,6 +894,35 @@ class Runner(object):
                     workload.teardown(self.context)
             self.result_manager.add_result(self.current_job.result, self.context)
 
+    def _prepare_next_job(self):
+        """
+        If the next job is for a different spec, start the host-side preparation for
+        its workload (see ``Workload.prepare()``) on a background thread, so that it
+        overlaps with the result processing and teardown of the current job.
+
+        """
+        if not self.spec_will_change or self.next_job is None:
+            return
+        spec = self.next_job.spec
+        if not spec.enabled:
+            return
+        self._preparation = threading.Thread(target=self._prepare_workload, args=(spec.workload,),
+                                             name='job-preparation')
+        self._preparation.daemon = True
+        self._preparation.start()
+
+    def _prepare_workload(self, workload):
+        try:
+            workload.prepare(self.context)
+        except Exception, e:  # pylint: disable=broad-except
+            # Whatever went wrong will be reported when the workload is set up.
+            self.logger.debug('Could not prepare {} in advance: {}'.format(workload.name, e))
+
+    def _wait_for_preparation(self):
+        if self._preparation:
+            self._preparation.join()
+            self._preparation = None
+
     def _flash_device(self, flashing_params):
         with self._signal_wrap('FLASHING'):
             self.device.flash(**flashing_params)
@@ -867,3 +1080,213 @@ class RandomRunner(Runner):
         all_jobs = [j for spec_jobs in jobs for j in spec_jobs]
         random.shuffle(all_jobs)
         self.job_queue = all_jobs
+
+
+class PoolJobQueue(object):
+    """
+    The job queue of a ``Runner`` driving one of the devices in a device pool. This
+    behaves like the list the ``Runner`` normally uses, but jobs are only claimed from
+    ``specs`` (the specs for the jobs of the entire run, in execution order), which is
+    shared between all the devices, when the ``Runner`` needs them. ``next_index`` is
+    the (shared) index of the next job to be claimed.
+
+    At most the current job and the one after it are claimed at any one time (the
+    ``Runner`` looks one job ahead to see whether the spec is about to change), so
+    jobs are not held up by a device that is busy with something else. Jobs
+    inserted by the ``Runner`` (i.e. retries) are run by the same device. No more
+    jobs are claimed once the run has been aborted on this device, leaving the
+    remaining jobs for the other devices.
+
+    """
+
+    def __init__(self, specs, next_index, context=None):
+        self.specs = specs
+        self.next_index = next_index
+        self.context = context
+        self._claimed = []
+
+    def pop(self, index=0):
+        self._claim_up_to(index + 1)
+        return self._claimed.pop(index)
+
+    def insert(self, index, job):
+        self._claimed.insert(index, job)
+
+    def _claim_up_to(self, size):
+        while len(self._claimed) < size:
+            if self.context is not None and self.context.aborted:
+                break
+            with self.next_index.get_lock():
+                index = self.next_index.value
+                if index >= len(self.specs):
+                    break
+                self.next_index.value += 1
+            self._claimed.append(RunnerJob(self.specs[index]))
+
+    def __getitem__(self, index):
+        self._claim_up_to(index + 1)
+        return self._claimed[index]
+
+    def __len__(self):
+        # The Runner only ever needs to know whether there are jobs after the
+        # current one, so there is no need to claim further ahead than that.
+        self._claim_up_to(2)
+        return len(self._claimed)
+
+    def __nonzero__(self):
+        self._claim_up_to(1)
+        return bool(self._claimed)
+
+
+class SharedIterationCounts(object):
+    """
+    The number of iterations that have been started for each spec, shared between the
+    workers of a device pool so that iteration numbers (and therefore output directories)
+    are unique across the run.
+
+    """
+
+    def __init__(self, spec_ids):
+        self._counts = {spec_id: multiprocessing.Value('i', 0) for spec_id in spec_ids}
+
+    def increment(self, spec_id):
+        count = self._counts[spec_id]
+        with count.get_lock():
+            count.value += 1
+            return count.value
+
+    def values(self):
+        return [count.value for count in self._counts.itervalues()]
+
+    def __getitem__(self, spec_id):
+        return self._counts[spec_id].value
+
+
+class PoolResultForwarder(object):
+    """
+    Takes the place of the ``ResultManager`` for the ``Runner`` of a device pool worker,
+    sending the results back to the parent process over ``messages``, where they are
+    handled by a ``PoolResultMerger``.
+
+    """
+
+    def __init__(self, label, messages):
+        self.label = label
+        self.messages = messages
+        self.failed = False
+
+    def initialize(self, context):
+        pass
+
+    def add_result(self, result, context):
+        self._send('iteration', _iteration_result_to_pod(result, context.iteration_artifacts))
+
+    def process_run_result(self, result, context):
+        self._send('run', {
+            'device_properties': result.info.device_properties,
+            'run_artifacts': context.run_artifacts,
+            'events': result.events,
+            'non_iteration_errors': result.non_iteration_errors,
+            # Includes the iterations that did not get as far as being processed
+            # (e.g. ones that were skipped or aborted).
+            'iteration_results': [_iteration_result_to_pod(r) for r in result.iteration_results],
+        })
+
+    def finalize(self, context):
+        pass
+
+    def done(self, error_logged, warning_logged):
+        self._send('done', {
+            'failed': self.failed,
+            'error_logged': error_logged,
+            'warning_logged': warning_logged,
+        })
+
+    def _send(self, kind, pod):
+        self.messages.put((kind, self.label, pod))
+
+
+class PoolResultMerger(object):
+    """
+    Combines the results sent by the workers of a device pool into the run result of
+    ``context``, passing iteration results onto ``result_manager`` as they arrive. Each
+    iteration result gets a ``device`` classifier with the label of the device that
+    produced it.
+
+    """
+
+    def __init__(self, context, result_manager):
+        self.context = context
+        self.result_manager = result_manager
+        self.specs = {spec.id: spec for spec in context.config.workload_specs}
+        self.results = {}
+        self.failed_devices = []
+        self.errors_logged = False
+        self.warnings_logged = False
+
+    def merge(self, message):
+        kind, label, pod = message
+        getattr(self, '_merge_{}'.format(kind))(label, pod)
+
+    def _merge_iteration(self, label, pod):
+        job = RunnerJob(self.specs[pod['id']])
+        job.result = self._update_result(label, pod)
+        job.iteration = job.result.iteration
+        self.context.current_job = job
+        self.context.output_directory = job.result.output_directory
+        self.context.iteration_artifacts = pod['iteration_artifacts']
+        try:
+            self.result_manager.add_result(job.result, self.context)
+        finally:
+            self.context.current_job = None
+            self.context.output_directory = self.context.run_output_directory
+            self.context.iteration_artifacts = None
+
+    def _merge_run(self, label, pod):
+        run_result = self.context.run_result
+        if not run_result.info.device_properties:
+            run_result.info.device_properties = pod['device_properties']
+        for artifact in pod['run_artifacts']:
+            if not any(a.name == artifact.name and a.path == artifact.path
+                       for a in self.context.run_artifacts):
+                self.context.run_artifacts.append(artifact)
+        run_result.events.extend(pod['events'])
+        if pod['non_iteration_errors']:
+            run_result.non_iteration_errors = True
+        for result_pod in pod['iteration_results']:
+            self._update_result(label, result_pod)
+
+    def _merge_done(self, label, pod):
+        if pod['failed']:
+            self.failed_devices.append(label)
+            self.context.run_result.non_iteration_errors = True
+        self.errors_logged = self.errors_logged or pod['error_logged']
+        self.warnings_logged = self.warnings_logged or pod['warning_logged']
+
+    def _update_result(self, label, pod):
+        key = (pod['id'], pod['iteration'])
+        result = self.results.get(key)
+        if result is None:
+            result = IterationResult(self.specs[pod['id']])
+            self.results[key] = result
+            self.context.run_result.iteration_results.append(result)
+            counts = self.context.job_iteration_counts
+            counts[pod['id']] = max(counts[pod['id']], pod['iteration'])
+        for attr in ITERATION_RESULT_POD_ATTRIBUTES:
+            setattr(result, attr, pod[attr])
+        result.classifiers.setdefault('device', label)
+        return result
+
+
+# The IterationResult attributes sent back by device pool workers. The rest
+# (the spec and workload) are per-device objects that are re-created by the
+# parent from the spec ID.
+ITERATION_RESULT_POD_ATTRIBUTES = ['iteration', 'status', 'output_directory', 'events',
+                                   'metrics', 'artifacts', 'classifiers']
+
+
+def _iteration_result_to_pod(result, iteration_artifacts=None):
+    pod = {attr: getattr(result, attr) for attr in ITERATION_RESULT_POD_ATTRIBUTES}
+    pod['id'] = result.id
+    pod['iteration_artifacts'] = iteration_artifacts
+    return pod
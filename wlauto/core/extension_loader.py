@@ -16,22 +16,27 @@
 
 import os
 import sys
+import json
 import inspect
 import imp
 import string
+import pkgutil
 import logging
 from functools import partial
 from collections import OrderedDict
 
 from wlauto.core.bootstrap import settings
-from wlauto.core.extension import Extension
+from wlauto.core.extension import Extension, Alias
 from wlauto.exceptions import NotFoundError, LoaderError
-from wlauto.utils.misc import walk_modules, load_class, merge_lists, merge_dicts, get_article
+from wlauto.utils.misc import load_class, merge_lists, merge_dicts, get_article
 from wlauto.utils.types import identifier
 
 
 MODNAME_TRANS = string.maketrans(':/\\.', '____')
 
+# Bump this when the format of the manifest entries changes.
+MANIFEST_VERSION = 2
+
 
 class ExtensionLoaderItem(object):
 
@@ -42,6 +47,119 @@ class ExtensionLoaderItem(object):
         self.cls = load_class(ext_tuple.cls)
 
 
+class ParameterInfo(object):
+    """The subset of an extension parameter's attributes recorded in the manifest."""
+
+    def __init__(self, name, kind, global_alias=None):
+        self.name = name
+        self.kind = kind
+        self.global_alias = global_alias
+
+    def to_pod(self):
+        return {'name': self.name, 'kind': self.kind, 'global_alias': self.global_alias}
+
+    @staticmethod
+    def from_pod(pod):
+        return ParameterInfo(**pod)
+
+
+class ExtensionInfo(object):
+    """
+    Describes a discovered extension without necessarily having imported the module
+    that defines it. The name, kind, description, aliases and global parameter aliases
+    of the extension are recorded in the extension manifest, so that extensions can be
+    listed without importing them. Any other attribute is looked up on the extension
+    class, which gets imported the first time it is needed.
+
+    """
+
+    @property
+    def qualified_name(self):
+        return self.mro[0]
+
+    def __init__(self, name, kind, module, class_name, filepath=None, description=None,
+                 doc=None, aliases=None, parameters=None, supported_platforms=None, mro=None, cls=None):
+        self.name = name
+        self.kind = kind
+        self.module = module
+        self.class_name = class_name
+        self.filepath = filepath  # only set for extensions loaded from paths.
+        self.description = description
+        self.__doc__ = doc
+        self.__name__ = class_name
+        self.aliases = aliases or []
+        self.parameters_info = parameters or []
+        self.supported_platforms = supported_platforms or []
+        self.mro = mro or ['{}.{}'.format(module, class_name)]
+        self.cls = cls
+        for alias in self.aliases:
+            alias.extension_name = name
+
+    def load(self):
+        """Returns the extension class, importing its module if necessary."""
+        if self.cls is None:
+            try:
+                module = sys.modules.get(self.module)
+                if module is None:
+                    if self.filepath:
+                        module = imp.load_source(self.module, self.filepath)
+                    else:
+                        module = __import__(self.module, {}, {}, [''])
+                cls = getattr(module, self.class_name)
+            except Exception:  # pylint: disable=broad-except
+                raise LoaderError('Could not load {} {}'.format(self.kind, self.name), sys.exc_info())
+            cls.kind = self.kind
+            self.cls = cls
+        return self.cls
+
+    def is_subclass(self, other):
+        return other.qualified_name in self.mro
+
+    def to_pod(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'module': self.module,
+            'class_name': self.class_name,
+            'description': self.description,
+            'doc': self.__doc__,
+            'aliases': [{'name': a.name, 'params': a.params} for a in self.aliases],
+            'parameters': [p.to_pod() for p in self.parameters_info],
+            'supported_platforms': self.supported_platforms,
+            'mro': self.mro,
+        }
+
+    @staticmethod
+    def from_pod(pod, filepath=None):
+        pod = dict(pod)
+        pod['aliases'] = [Alias(a['name'], **a['params']) for a in pod['aliases']]
+        pod['parameters'] = [ParameterInfo.from_pod(p) for p in pod['parameters']]
+        return ExtensionInfo(filepath=filepath, **pod)
+
+    @staticmethod
+    def from_class(cls, kind, module, filepath=None):
+        parameters = [ParameterInfo(p.name, _get_kind_name(p.kind), p.global_alias)
+                      for p in cls.parameters if p.global_alias]
+        return ExtensionInfo(cls.name, kind, module, cls.__name__, filepath,
+                             description=getattr(cls, 'description', None),
+                             doc=cls.__doc__,
+                             aliases=list(cls.aliases),
+                             parameters=parameters,
+                             supported_platforms=list(getattr(cls, 'supported_platforms', None) or []),
+                             mro=['{}.{}'.format(c.__module__, c.__name__) for c in inspect.getmro(cls)],
+                             cls=cls)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __str__(self):
+        return 'ExtensionInfo({})'.format(self.name)
+
+    __repr__ = __str__
+
+
 class GlobalParameterAlias(object):
     """
     Represents a "global alias" for an extension parameter. A global alias
@@ -63,7 +181,7 @@ class GlobalParameterAlias(object):
             yield (self.get_param(ext), ext)
 
     def get_param(self, ext):
-        for param in ext.parameters:
+        for param in ext.parameters_info:
             if param.global_alias == self.name:
                 return param
         message = 'Extension {} does not have a parameter with global alias {}'
@@ -76,7 +194,7 @@ class GlobalParameterAlias(object):
     def _validate_ext(self, other_ext):
         other_param = self.get_param(other_ext)
         for param, ext in self.iteritems():
-            if ((not (issubclass(ext, other_ext) or issubclass(other_ext, ext))) and
+            if ((not (ext.is_subclass(other_ext) or other_ext.is_subclass(ext))) and
                     other_param.kind != param.kind):
                 message = 'Duplicate global alias {} declared in {} and {} extensions with different types'
                 raise LoaderError(message.format(self.name, ext.name, other_ext.name))
@@ -99,10 +217,19 @@ class ExtensionLoader(object):
     additional locations may specified through paths parameter that must
     be a list of additional Python module paths (i.e. dot-delimited).
 
+    What was discovered in each module is recorded in a manifest file (keyed
+    on the module file's path, modification time and size), so that on
+    subsequent runs modules only need to be imported once an extension they
+    define is actually used.
+
     """
 
     _instance = None
 
+    # Location of the extension manifest. If this is not set, the manifest will
+    # be kept in WA's environment root.
+    manifest_path = None
+
     # Singleton
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -159,8 +286,11 @@ class ExtensionLoader(object):
         # extensions.
         for ext in self.extension_kinds.values():
             setattr(self, '_' + ext.name, {})
+        self._manifest = None
+        self._manifest_changed = False
         self._load_from_packages(self.packages)
         self._load_from_paths(self.paths, self.ignore_paths)
+        self._save_manifest()
 
     def update(self, packages=None, paths=None, ignore_paths=None):
         """ Load extensions from the specified paths/packages
@@ -172,6 +302,7 @@ class ExtensionLoader(object):
             self.paths.extend(paths)
             self.ignore_paths.extend(ignore_paths or [])
             self._load_from_paths(paths, ignore_paths or [])
+        self._save_manifest()
 
     def clear(self):
         """ Clear all discovered items. """
@@ -184,10 +315,21 @@ class ExtensionLoader(object):
         self.clear()
         self._load_from_packages(self.packages)
         self._load_from_paths(self.paths, self.ignore_paths)
+        self._save_manifest()
 
     def get_extension_class(self, name, kind=None):
         """
         Return the class for the specified extension if found or raises ``ValueError``.
+        The module defining the extension is imported if it hasn't been already.
+
+        """
+        return self.get_extension_info(name, kind).load()
+
+    def get_extension_info(self, name, kind=None):
+        """
+        Return the :class:`ExtensionInfo` for the specified extension if found or raises
+        ``ValueError``. Unlike ``get_extension_class``, this will not import the module
+        defining the extension.
 
         """
         name, _ = self.resolve_alias(name)
@@ -227,8 +369,11 @@ class ExtensionLoader(object):
 
     def list_extensions(self, kind=None):
         """
-        List discovered extension classes. Optionally, only list extensions of a
-        particular type.
+        List discovered extensions. Optionally, only list extensions of a
+        particular type. Extensions are listed as :class:`ExtensionInfo`\ s,
+        which provide access to the attributes of the extension classes, but
+        only import them when an attribute not recorded in the manifest is
+        accessed.
 
         """
         if kind is None:
@@ -245,7 +390,7 @@ class ExtensionLoader(object):
 
         """
         try:
-            self.get_extension_class(name, kind)
+            self.get_extension_info(name, kind)
             return True
         except NotFoundError:
             return False
@@ -301,8 +446,8 @@ class ExtensionLoader(object):
     def _load_from_packages(self, packages):
         try:
             for package in packages:
-                for module in walk_modules(package):
-                    self._load_module(module)
+                for modname, filepath in _walk_package_files(package):
+                    self._load_file(filepath, modname)
         except ImportError as e:
             message = 'Problem loading extensions from package {}: {}'
             raise LoaderError(message.format(package, e.message))
@@ -325,20 +470,65 @@ class ExtensionLoader(object):
                     filepath = os.path.join(root, fname)
                     try:
                         modname = os.path.splitext(filepath[1:])[0].translate(MODNAME_TRANS)
-                        module = imp.load_source(modname, filepath)
-                        self._load_module(module)
+                        self._load_file(filepath, modname, from_path=True)
                     except (SystemExit, ImportError), e:
                         if self.keep_going:
                             self.logger.warn('Failed to load {}'.format(filepath))
                             self.logger.warn('Got: {}'.format(e))
                         else:
                             raise LoaderError('Failed to load {}'.format(filepath), sys.exc_info())
+                    except LoaderError:
+                        raise
                     except Exception as e:
                         message = 'Problem loading extensions from {}: {}'
                         raise LoaderError(message.format(filepath, e))
 
-    def _load_module(self, module):  # NOQA pylint: disable=too-many-branches
+    def _load_file(self, filepath, modname, from_path=False):
+        """
+        Adds the extensions defined in the specified module file, using the manifest
+        entry for it if it is up to date, and importing it otherwise.
+
+        """
+        stat = os.stat(filepath)
+        manifest = self._get_manifest()
+        entry = manifest.get(filepath)
+        if (entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size and
+                _files_unchanged(entry['dependencies'])):
+            self.logger.debug('Using manifest entry for module %s', modname)
+            infos = [ExtensionInfo.from_pod(pod, filepath if from_path else None)
+                     for pod in entry['extensions']]
+        else:
+            if from_path:
+                module = imp.load_source(modname, filepath)
+            else:
+                module = __import__(modname, {}, {}, [''])
+            infos = self._load_module(module, filepath if from_path else None)
+            try:
+                extensions = [info.to_pod() for info in infos]
+                json.dumps(extensions)
+                # Inherited attributes (e.g. parameters with global aliases) are
+                # also recorded, so the entry is only valid for as long as the
+                # files defining the base classes are not modified either.
+                manifest[filepath] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                                      'dependencies': _get_dependencies(infos, filepath),
+                                      'extensions': extensions}
+            except (TypeError, ValueError):
+                # e.g. alias parameters that cannot be serialized; the module
+                # will be imported every time.
+                manifest.pop(filepath, None)
+            self._manifest_changed = True
+        for info in infos:
+            try:
+                self._add_found_extension(info)
+            except LoaderError as e:
+                if self.keep_going:
+                    self.logger.warning(e)
+                else:
+                    raise e
+
+    def _load_module(self, module, filepath=None):  # NOQA pylint: disable=too-many-branches
         self.logger.debug('Checking module %s', module.__name__)
+        infos = []
         for obj in vars(module).itervalues():
             if inspect.isclass(obj):
                 if not issubclass(obj, Extension) or not hasattr(obj, 'name') or not obj.name:
@@ -346,7 +536,8 @@ class ExtensionLoader(object):
                 try:
                     for ext in self.extension_kinds.values():
                         if issubclass(obj, ext.cls):
-                            self._add_found_extension(obj, ext)
+                            obj.kind = ext.name
+                            infos.append(ExtensionInfo.from_class(obj, ext.name, module.__name__, filepath))
                             break
                     else:  # did not find a matching Extension type
                         message = 'Unknown extension type for {} (type: {})'
@@ -356,44 +547,106 @@ class ExtensionLoader(object):
                         self.logger.warning(e)
                     else:
                         raise e
+        return infos
 
-    def _add_found_extension(self, obj, ext):
+    def _add_found_extension(self, info):
         """
-            :obj: Found extension class
-            :ext: matching extension item.
+            :info: ``ExtensionInfo`` for the found extension.
         """
-        self.logger.debug('\tAdding %s %s', ext.name, obj.name)
-        key = identifier(obj.name.lower())
-        obj.kind = ext.name
+        self.logger.debug('\tAdding %s %s', info.kind, info.name)
+        key = identifier(info.name.lower())
         if key in self.extensions or key in self.aliases:
-            raise LoaderError('{} {} already exists.'.format(ext.name, obj.name))
+            raise LoaderError('{} {} already exists.'.format(info.kind, info.name))
         # Extensions are tracked both, in a common extensions
         # dict, and in per-extension kind dict (as retrieving
         # extensions by kind is a common use case.
-        self.extensions[key] = obj
-        store = self._get_store(ext)
-        store[key] = obj
-        for alias in obj.aliases:
+        self.extensions[key] = info
+        store = self._get_store(info.kind)
+        store[key] = info
+        for alias in info.aliases:
             alias_id = identifier(alias.name)
             if alias_id in self.extensions or alias_id in self.aliases:
-                raise LoaderError('{} {} already exists.'.format(ext.name, obj.name))
+                raise LoaderError('{} {} already exists.'.format(info.kind, info.name))
             self.aliases[alias_id] = alias
 
         # Update global aliases list. If a global alias is already in the list,
         # then make sure this extension is in the same parent/child hierarchy
         # as the one already found.
-        for param in obj.parameters:
+        for param in info.parameters_info:
             if param.global_alias:
                 if param.global_alias not in self.global_param_aliases:
                     ga = GlobalParameterAlias(param.global_alias)
-                    ga.update(obj)
+                    ga.update(info)
                     self.global_param_aliases[ga.name] = ga
                 else:  # global alias already exists.
-                    self.global_param_aliases[param.global_alias].update(obj)
+                    self.global_param_aliases[param.global_alias].update(info)
+
+    def _get_manifest_path(self):
+        return self.manifest_path or os.path.join(settings.environment_root, 'extension_manifest.json')
+
+    def _get_manifest(self):
+        if self._manifest is None:
+            self._manifest = {}
+            path = self._get_manifest_path()
+            if os.path.isfile(path):
+                try:
+                    with open(path) as fh:
+                        pod = _to_str(json.load(fh))
+                    if pod.get('version') == MANIFEST_VERSION:
+                        self._manifest = pod['files']
+                except (IOError, ValueError, KeyError) as e:
+                    self.logger.debug('Ignoring extension manifest {}: {}'.format(path, e))
+        return self._manifest
+
+    def _save_manifest(self):
+        if not self._manifest_changed:
+            return
+        path = self._get_manifest_path()
+        try:
+            # Write to a temporary file first so that concurrent WA processes
+            # never see a partially written manifest.
+            temp_path = '{}.{}'.format(path, os.getpid())
+            with open(temp_path, 'w') as wfh:
+                json.dump({'version': MANIFEST_VERSION, 'files': self._manifest}, wfh)
+            os.rename(temp_path, path)
+            self._manifest_changed = False
+        except (IOError, OSError) as e:
+            self.logger.debug('Could not write extension manifest {}: {}'.format(path, e))
 
 
 # Utility functions.
 
+def _get_dependencies(infos, filepath):
+    """
+    Returns a dict mapping the source files of the base classes of the specified
+    extensions (other than ``filepath`` itself) to their ``[mtime, size]``.
+
+    """
+    dependencies = {}
+    for info in infos:
+        for cls in inspect.getmro(info.cls)[1:]:
+            try:
+                source = inspect.getsourcefile(cls)
+            except TypeError:  # built-in
+                continue
+            if not source or source in dependencies or os.path.samefile(source, filepath):
+                continue
+            stat = os.stat(source)
+            dependencies[source] = [stat.st_mtime, stat.st_size]
+    return dependencies
+
+
+def _files_unchanged(dependencies):
+    for path, (mtime, size) in dependencies.iteritems():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_mtime != mtime or stat.st_size != size:
+            return False
+    return True
+
+
 def _instantiate(cls, args=None, kwargs=None):
     args = [] if args is None else args
     kwargs = {} if kwargs is None else kwargs
@@ -401,3 +654,46 @@ def _instantiate(cls, args=None, kwargs=None):
         return cls(*args, **kwargs)
     except Exception:
         raise LoaderError('Could not load {}'.format(cls), sys.exc_info())
+
+
+def _get_kind_name(kind):
+    if kind is None:
+        return None
+    return '{}.{}'.format(getattr(kind, '__module__', None), getattr(kind, '__name__', kind))
+
+
+def _to_str(obj):
+    """Converts the unicode strings in the (JSON-derived) ``obj`` to ``str``."""
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    elif isinstance(obj, list):
+        return [_to_str(v) for v in obj]
+    elif isinstance(obj, dict):
+        return {_to_str(k): _to_str(v) for k, v in obj.iteritems()}
+    return obj
+
+
+def _walk_package_files(package, path=None):
+    """
+    Yields ``(module name, file path)`` for each module (including submodules, etc) in
+    the specified package. Only the top-level package itself is imported.
+
+    """
+    if path is None:
+        path = __import__(package, {}, {}, ['']).__path__
+    yield package, _get_module_file(path[0], '__init__')
+    for importer, name, ispkg in pkgutil.iter_modules(path):
+        modname = '.'.join([package, name])
+        if ispkg:
+            for item in _walk_package_files(modname, [os.path.join(importer.path, name)]):
+                yield item
+        else:
+            yield modname, _get_module_file(importer.path, name)
+
+
+def _get_module_file(directory, name):
+    for ext in ['.py', '.pyc', '.pyo']:
+        filepath = os.path.join(directory, name + ext)
+        if os.path.isfile(filepath):
+            return filepath
+    raise ImportError('Could not find module {} in {}'.format(name, directory))
@@ -19,6 +19,7 @@ Defines infrastructure for resource resolution. This is used to find
 various dependencies/assets/etc that WA objects rely on in a flexible way.
 
 """
+import os
 import logging
 from collections import defaultdict
 
@@ -34,12 +35,19 @@ class ResourceResolver(object):
     Discovers and registers getters, and then handles requests for
     resources using registered getters.
 
+    The result of resolving a resource is remembered for the lifetime of the
+    resolver (i.e. for the run), so that subsequent requests for the same resource
+    (e.g. on every iteration of a workload) do not need to go through the getters
+    again. Requests are considered to be the same if the resources are of the same
+    type, have the same owner and attributes, and the same criteria are specified.
+
     """
 
     def __init__(self, config):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.getters = defaultdict(PriorityList)
         self.config = config
+        self.cache = {}
 
     def load(self):
         """
@@ -61,13 +69,15 @@ class ResourceResolver(object):
 
         """
         self.logger.debug('Resolving {}'.format(resource))
-        for getter in self.getters[resource.name]:
-            self.logger.debug('Trying {}'.format(getter))
-            result = getter.get(resource, *args, **kwargs)
-            if result is not None:
-                self.logger.debug('Resource {} found using {}:'.format(resource, getter))
-                self.logger.debug('\t{}'.format(result))
-                return result
+        key = _get_cache_key(resource, args, kwargs)
+        if key in self.cache and _is_still_valid(self.cache[key]):
+            result = self.cache[key]
+            self.logger.debug('Using previously resolved {}: {}'.format(resource, result))
+        else:
+            result = self._resolve(resource, *args, **kwargs)
+            self.cache[key] = result
+        if result is not None:
+            return result
         if strict:
             if kwargs:
                 criteria = ', '.join(['{}:{}'.format(k, v) for k, v in kwargs.iteritems()])
@@ -77,6 +87,37 @@ class ResourceResolver(object):
         self.logger.debug('Resource {} not found.'.format(resource))
         return None
 
+    def prefetch(self, owner_names, jobs=1):
+        """
+        Gives each registered getter the opportunity to fetch, in advance, any resources
+        the specified owners (extension names) may require. See
+        :meth:`wlauto.core.resource.ResourceGetter.prefetch`.
+
+        """
+        seen = set()
+        for kind in sorted(self.getters):
+            for getter in self.getters[kind]:
+                if id(getter) in seen:
+                    continue
+                seen.add(id(getter))
+                getter.prefetch(owner_names, jobs=jobs)
+        # Resources that previously could not be found may now be available.
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Forget the results of previous resolutions."""
+        self.cache.clear()
+
+    def _resolve(self, resource, *args, **kwargs):
+        for getter in self.getters[resource.name]:
+            self.logger.debug('Trying {}'.format(getter))
+            result = getter.get(resource, *args, **kwargs)
+            if result is not None:
+                self.logger.debug('Resource {} found using {}:'.format(resource, getter))
+                self.logger.debug('\t{}'.format(result))
+                return result
+        return None
+
     def register(self, getter, kind, priority=0):
         """
         Register the specified resource getter as being able to discover a resource
@@ -101,6 +142,7 @@ class ResourceResolver(object):
         """
         self.logger.debug('Registering {}'.format(getter.name))
         self.getters[kind].add(getter, priority)
+        self.clear_cache()
 
     def unregister(self, getter, kind):
         """
@@ -112,3 +154,28 @@ class ResourceResolver(object):
             self.getters[kind].remove(getter)
         except ValueError:
             raise ValueError('Resource getter {} is not installed.'.format(getter.name))
+        self.clear_cache()
+
+
+def _get_cache_key(resource, args, kwargs):
+    attributes = sorted((k, v) for k, v in vars(resource).iteritems() if k != 'owner')
+    return (resource.__class__, _hashable(resource.owner), _hashable(attributes),
+            _hashable(args), _hashable(sorted(kwargs.iteritems())))
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def _is_still_valid(result):
+    # Files may have been removed (e.g. by a getter's delete()) since they were
+    # resolved.
+    if isinstance(result, basestring) and os.path.isabs(result):
+        return os.path.exists(result)
+    return True
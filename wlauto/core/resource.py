@@ -146,6 +146,21 @@ class ResourceGetter(Extension):
         """
         raise NotImplementedError()
 
+    def prefetch(self, owner_names, jobs=1):
+        """
+        This will get invoked by the resolver before a run starts (and before the device
+        is connected), allowing getters that obtain resources from slow sources (e.g.
+        over the network) to fetch everything that may be needed by the specified
+        owners up front, rather than one resource at a time as they get requested.
+
+        This is optional; the default implementation does nothing.
+
+        :param owner_names: The names of the extensions whose resources should be fetched.
+        :param jobs: The maximum number of resources to fetch concurrently.
+
+        """
+        pass
+
     def delete(self, resource, *args, **kwargs):
         """
         Delete the resource if it is discovered. All arguments are passed to a call
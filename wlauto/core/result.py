@@ -34,9 +34,18 @@ who's names appear in this list will be used.
 
 A :class:`ResultsManager`  keeps track of active results processors.
 
+If parallel result processing is enabled, iteration results will be passed
+to processors that declare themselves ``thread_safe`` on a background thread,
+so that their processing overlaps with the execution of subsequent
+iterations. All such processing will have completed before run results are
+processed.
+
 """
 import logging
+import threading
 import traceback
+from array import array
+from Queue import Queue
 from copy import copy
 from contextlib import contextmanager
 from datetime import datetime
@@ -53,10 +62,14 @@ class ResultManager(object):
 
     """
 
-    def __init__(self):
+    def __init__(self, parallel=False):
         self.logger = logging.getLogger('ResultsManager')
         self.processors = []
+        self.parallel = parallel
         self._bad = []
+        self._pending = None
+        self._worker = None
+        self._worker_bad = []
 
     def install(self, processor):
         self.logger.debug('Installing results processor %s', processor.name)
@@ -78,15 +91,36 @@ class ResultManager(object):
             processor.initialize(context)
 
     def add_result(self, result, context):
+        if self.parallel:
+            processors = [p for p in self.processors if not p.thread_safe]
+            deferred = [p for p in self.processors if p.thread_safe]
+        else:
+            processors = self.processors
+            deferred = []
+        if deferred:
+            self._defer_result(deferred, result, context)
         with self._manage_processors(context):
-            for processor in self.processors:
+            for processor in processors:
                 with self._handle_errors(processor):
                     processor.process_iteration_result(result, context)
-            for processor in self.processors:
+            for processor in processors:
                 with self._handle_errors(processor):
                     processor.export_iteration_result(result, context)
 
+    def wait_for_pending_results(self, context):
+        """Block until all iteration results passed to the background thread have been processed."""
+        if not self._worker:
+            return
+        with self._manage_processors(context):
+            self._pending.put(None)
+            self._worker.join()
+            self._worker = None
+            self._pending = None
+            self._bad.extend(self._worker_bad)
+            self._worker_bad = []
+
     def process_run_result(self, result, context):
+        self.wait_for_pending_results(context)
         with self._manage_processors(context):
             for processor in self.processors:
                 with self._handle_errors(processor):
@@ -96,6 +130,7 @@ class ResultManager(object):
                     processor.export_run_result(result, context)
 
     def finalize(self, context):
+        self.wait_for_pending_results(context)
         with self._manage_processors(context):
             for processor in self.processors:
                 with self._handle_errors(processor):
@@ -114,8 +149,39 @@ class ResultManager(object):
             self.uninstall(processor)
         self._bad = []
 
+    def _defer_result(self, processors, result, context):
+        if not self._worker:
+            self._pending = Queue()
+            self._worker = threading.Thread(target=self._process_pending_results,
+                                            name='result-processing')
+            self._worker.daemon = True
+            self._worker.start()
+        # The context will have moved on to the next iteration by the time the
+        # result is processed, so processors get a snapshot of its current state.
+        self._pending.put((processors, result, _snapshot_context(context)))
+
+    def _process_pending_results(self):
+        # Results are processed one at a time in the order they were added, so
+        # processors see iterations in the same order as they would if run serially.
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            processors, result, context = item
+            processors = [p for p in processors if p not in self._worker_bad]
+            for processor in processors:
+                with self._handle_errors(processor, self._worker_bad):
+                    processor.process_iteration_result(result, context)
+            for processor in processors:
+                if processor in self._worker_bad:
+                    continue
+                with self._handle_errors(processor, self._worker_bad):
+                    processor.export_iteration_result(result, context)
+
     @contextmanager
-    def _handle_errors(self, processor):
+    def _handle_errors(self, processor, bad=None):
+        if bad is None:
+            bad = self._bad
         try:
             yield
         except KeyboardInterrupt, e:
@@ -123,12 +189,12 @@ class ResultManager(object):
         except WAError, we:
             self.logger.error('"{}" result processor has encountered an error'.format(processor.name))
             self.logger.error('{}("{}")'.format(we.__class__.__name__, we.message))
-            self._bad.append(processor)
+            bad.append(processor)
         except Exception, e:  # pylint: disable=W0703
             self.logger.error('"{}" result processor has encountered an error'.format(processor.name))
             self.logger.error('{}("{}")'.format(e.__class__.__name__, e))
             self.logger.error(traceback.format_exc())
-            self._bad.append(processor)
+            bad.append(processor)
 
 
 class ResultProcessor(Extension):
@@ -138,8 +204,23 @@ class ResultProcessor(Extension):
     of the results, from writing them out to a file, to uploading them to a database,
     performing calculations, generating plots, etc.
 
+    Processors that set ``thread_safe`` to ``True`` may have their
+    ``process_iteration_result`` and ``export_iteration_result`` invoked on a
+    background thread (if parallel result processing is enabled for the run),
+    while subsequent iterations are executing. Such processors must not modify
+    the result (e.g. add metrics or artifacts) in a way that other processors
+    rely on, and must not interact with the device.
+
+    Processors that set ``queries_device`` to ``True`` interact with the device
+    outside of the workload execution (e.g. to discover its idle states when they
+    are initialized). As results are processed away from the devices when a run
+    is spread across a ``device_pool``, such processors cannot be used with one.
+
     """
 
+    thread_safe = False
+    queries_device = False
+
     def initialize(self, context):
         pass
 
@@ -259,19 +340,19 @@ class IterationResult(object):
         self.status = self.NOT_STARTED
         self.output_directory = None
         self.events = []
-        self.metrics = []
+        self.metrics = MetricStore()
         self.artifacts = []
 
     def add_metric(self, name, value, units=None, lower_is_better=False, classifiers=None):
-        classifiers = merge_dicts(self.classifiers, classifiers or {},
-                                  list_duplicates='last', should_normalize=False)
-        self.metrics.append(Metric(name, value, units, lower_is_better, classifiers))
+        if classifiers:
+            classifiers = merge_dicts(self.classifiers, classifiers,
+                                      list_duplicates='last', should_normalize=False)
+        else:
+            classifiers = self.classifiers
+        self.metrics.add(name, value, units, lower_is_better, classifiers)
 
     def has_metric(self, name):
-        for metric in self.metrics:
-            if metric.name == name:
-                return True
-        return False
+        return self.metrics.find(name) is not None
 
     def add_event(self, message):
         self.events.append(RunEvent(message))
@@ -279,16 +360,17 @@ class IterationResult(object):
     def to_dict(self):
         d = copy(self.__dict__)
         d['events'] = [e.to_dict() for e in self.events]
+        d['metrics'] = list(self.metrics)
         return d
 
     def __iter__(self):
         return iter(self.metrics)
 
     def __getitem__(self, name):
-        for metric in self.metrics:
-            if metric.name == name:
-                return metric
-        raise KeyError('Metric {} not found.'.format(name))
+        metric = self.metrics.find(name)
+        if metric is None:
+            raise KeyError('Metric {} not found.'.format(name))
+        return metric
 
 
 class Metric(object):
@@ -316,6 +398,14 @@ class Metric(object):
         self.lower_is_better = lower_is_better
         self.classifiers = classifiers or {}
 
+    @classmethod
+    def from_store(cls, name, value, units, lower_is_better, classifiers):
+        """Creates a metric from already validated attributes (see :class:`MetricStore`)."""
+        metric = cls.__new__(cls)
+        metric.__dict__.update(name=name, value=value, units=units,
+                               lower_is_better=lower_is_better, classifiers=classifiers)
+        return metric
+
     def to_dict(self):
         return self.__dict__
 
@@ -327,3 +417,132 @@ class Metric(object):
         return '<{}>'.format(result)
 
     __repr__ = __str__
+
+
+class MetricStore(object):
+    """
+    A compact store for the metrics of an iteration, which may run into thousands.
+    Rather than keeping a :class:`Metric` object for each, values are kept in an
+    array, and names, units and classifiers are shared between the metrics that have
+    the same ones. Metrics are also indexed by name.
+
+    This behaves like the list of :class:`Metric`\ s it replaces: iterating over it,
+    or indexing it, yields :class:`Metric`\ s in the order they were added. These are
+    created as they are requested, so changing them does not affect the store.
+    Classifier dicts are shared between metrics, and must not be modified.
+
+    """
+
+    # Metric values are stored as doubles. Ints are flagged as such, and
+    # those too large to be represented exactly are stored separately.
+    FLOAT = 0
+    INT = 1
+    OTHER = 2
+
+    MAX_EXACT_INT = 2 ** 53
+
+    def __init__(self, metrics=None):
+        self._names = []
+        self._values = array('d')
+        self._kinds = bytearray()
+        self._other_values = {}
+        self._units = []
+        self._lower_is_better = bytearray()
+        self._classifier_ids = array('i')
+        self._classifier_sets = []
+        self._classifier_index = {}
+        self._strings = {}
+        self._name_index = {}
+        for metric in metrics or []:
+            self.append(metric)
+
+    def add(self, name, value, units=None, lower_is_better=False, classifiers=None):
+        value = numeric(value)
+        position = len(self._names)
+        name = self._intern(name)
+        self._names.append(name)
+        if isinstance(value, float):
+            self._values.append(value)
+            self._kinds.append(self.FLOAT)
+        elif not isinstance(value, bool) and -self.MAX_EXACT_INT <= value <= self.MAX_EXACT_INT:
+            self._values.append(value)
+            self._kinds.append(self.INT)
+        else:
+            self._values.append(0)
+            self._kinds.append(self.OTHER)
+            self._other_values[position] = value
+        self._units.append(self._intern(units))
+        self._lower_is_better.append(bool(lower_is_better))
+        self._classifier_ids.append(self._intern_classifiers(classifiers or {}))
+        self._name_index.setdefault(name, position)
+
+    def append(self, metric):
+        self.add(metric.name, metric.value, metric.units, metric.lower_is_better, metric.classifiers)
+
+    def find(self, name):
+        """Returns the first metric with the specified name, or ``None`` if there isn't one."""
+        position = self._name_index.get(name)
+        if position is None:
+            return None
+        return self._get_metric(position)
+
+    def _get_metric(self, position):
+        kind = self._kinds[position]
+        if kind == self.FLOAT:
+            value = self._values[position]
+        elif kind == self.INT:
+            value = int(self._values[position])
+        else:
+            value = self._other_values[position]
+        return Metric.from_store(self._names[position], value, self._units[position],
+                                 bool(self._lower_is_better[position]),
+                                 self._classifier_sets[self._classifier_ids[position]])
+
+    def _intern(self, value):
+        if value is None:
+            return value
+        return self._strings.setdefault(value, value)
+
+    def _intern_classifiers(self, classifiers):
+        try:
+            key = frozenset(classifiers.iteritems())
+        except TypeError:  # unhashable classifier values, so cannot be shared
+            key = None
+        if key is not None and key in self._classifier_index:
+            return self._classifier_index[key]
+        self._classifier_sets.append(dict(classifiers))
+        classifier_id = len(self._classifier_sets) - 1
+        if key is not None:
+            self._classifier_index[key] = classifier_id
+        return classifier_id
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_metric(i) for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Metric index out of range: {}'.format(index))
+        return self._get_metric(index)
+
+    def __iter__(self):
+        for position in xrange(len(self._names)):
+            yield self._get_metric(position)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __nonzero__(self):
+        return bool(self._names)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def _snapshot_context(context):
+    snapshot = copy(context)
+    # Attributes that are updated in place as execution progresses (rather
+    # than being re-assigned for each new job) must be copied explicitly.
+    if hasattr(context, 'job_iteration_counts'):
+        snapshot.job_iteration_counts = copy(context.job_iteration_counts)
+    return snapshot
@@ -70,6 +70,18 @@ class Workload(Extension):
         """
         pass
 
+    def prepare(self, context):
+        """
+        This method may be used to perform host-side preparation for ``setup()`` in advance, such
+        as resolving resources and computing their hashes, so that it is already done when the
+        workload is set up. It is invoked on a background thread while the previous job is
+        being torn down and its results processed, so it must not change the state of the device
+        and should only use ``context`` for its ``resolver``. It may be invoked more than
+        once, and any errors it raises are ignored (they will be raised again by ``setup()``).
+
+        """
+        pass
+
     def setup(self, context):  # pylint: disable=unused-argument
         """
         Perform the setup necessary to run the workload, such as copying the necessary files
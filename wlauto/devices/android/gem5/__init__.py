@@ -177,8 +177,8 @@ class Gem5AndroidDevice(BaseGem5Device, AndroidDevice):
 
     def clear_logcat(self):
         """Clear (flush) logcat log."""
-        if self._logcat_poller:
-            return self._logcat_poller.clear_buffer()
+        if self._logcat_streamer:
+            return self._logcat_streamer.clear_buffer()
         else:
             return self.gem5_shell('logcat -c')
 
@@ -28,6 +28,7 @@ if __name__ == '__main__':  # for debugging
 from daqpower import log
 from daqpower.common import DaqServerRequest, DaqServerResponse, Status
 from daqpower.config import get_config_parser
+from daqpower.portfile import is_binary_port_file
 
 
 __all__ = ['execute_command', 'run_send_command', 'Status']
@@ -142,7 +143,8 @@ class CommandExecutorProtocol(Protocol):
         if 'port_number' not in response.data:
             self.errorOut('Response does not contain port number: {} ({}).'.format(response, response.data))
         port_number = response.data.pop('port_number')
-        filename = self.sent_request.params['port_id'] + '.csv'
+        # Older servers only send CSV files and do not report the file name.
+        filename = response.data.pop('filename', self.sent_request.params['port_id'] + '.csv')
         self.factory.initiateFileTransfer(filename, port_number)
         if self.ports_to_pull:
             self.sendPullRequest(self.ports_to_pull.pop())
@@ -253,6 +255,27 @@ class FileReceiver(LineReceiver):  # pylint: disable=W0223
         self.fh.write(line)
 
 
+class BinaryFileReceiver(Protocol):  # pylint: disable=W0223
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+        self.factory = None
+
+    def connectionMade(self):
+        if os.path.isfile(self.path):
+            log.warning('overriding existing file.')
+            os.remove(self.path)
+        self.fh = open(self.path, 'wb')
+
+    def connectionLost(self, reason=ConnectionDone):
+        if self.fh:
+            self.fh.close()
+
+    def dataReceived(self, data):
+        self.fh.write(data)
+
+
 class FileReceiverFactory(ReconnectingClientFactory):
 
     def __init__(self, path, owner):
@@ -260,7 +283,10 @@ class FileReceiverFactory(ReconnectingClientFactory):
         self.owner = owner
 
     def buildProtocol(self, addr):
-        protocol = FileReceiver(self.path)
+        if is_binary_port_file(self.path):
+            protocol = BinaryFileReceiver(self.path)
+        else:
+            protocol = FileReceiver(self.path)
         protocol.factory = self
         self.resetDelay()
         return protocol
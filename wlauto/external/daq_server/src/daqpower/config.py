@@ -17,6 +17,7 @@
 import argparse
 
 from daqpower.common import Serializable
+from daqpower.portfile import FILE_FORMATS
 
 
 class ConfigurationError(Exception):
@@ -28,12 +29,14 @@ class DeviceConfiguration(Serializable):
     """Encapulates configuration for the DAQ, typically, passed from
     the client."""
 
-    valid_settings = ['device_id', 'v_range', 'dv_range', 'sampling_rate', 'resistor_values', 'labels']
+    valid_settings = ['device_id', 'v_range', 'dv_range', 'sampling_rate', 'resistor_values', 'labels',
+                      'file_format']
 
     default_device_id = 'Dev1'
     default_v_range = 2.5
     default_dv_range = 0.2
     default_sampling_rate = 10000
+    default_file_format = 'csv'
     # Channel map used in DAQ 6363 and similar.
     default_channel_map = (0, 1, 2, 3, 4, 5, 6, 7, 16, 17, 18, 19, 20, 21, 22, 23)
 
@@ -51,6 +54,8 @@ class DeviceConfiguration(Serializable):
             self.channel_map = kwargs.pop('channel_map') or self.default_channel_map
             self.labels = (kwargs.pop('labels') or
                            ['PORT_{}.csv'.format(i) for i in xrange(len(self.resistor_values))])
+            # Not sent by older clients.
+            self.file_format = kwargs.pop('file_format', None) or self.default_file_format
         except KeyError, e:
             raise ConfigurationError('Missing config: {}'.format(e.message))
         if kwargs:
@@ -62,6 +67,18 @@ class DeviceConfiguration(Serializable):
         if len(self.resistor_values) != len(self.labels):
             message = 'The number  of resistors ({}) does not match the number of labels ({})'
             raise ConfigurationError(message.format(len(self.resistor_values), len(self.labels)))
+        if self.file_format not in FILE_FORMATS:
+            message = 'Invalid port file format: {} (must be one of {})'
+            raise ConfigurationError(message.format(self.file_format, ', '.join(FILE_FORMATS)))
+
+    def serialize(self, d=None):
+        if d is None:
+            d = dict(self.__dict__)
+            # Older servers do not understand file_format, so only send it if
+            # it is needed.
+            if d['file_format'] == self.default_file_format:
+                del d['file_format']
+        return super(DeviceConfiguration, self).serialize(d)
 
     def __str__(self):
         return self.serialize()
@@ -121,6 +138,7 @@ class ConfigNamespace(object):
             self.resistor_values = None
             self.labels = None
             self.channel_map = None
+            self.file_format = None
 
     @property
     def device_config(self):
@@ -147,6 +165,7 @@ def get_config_parser(server=True, device=True):
         parser.add_argument('--sampling-rate', action=UpdateDeviceConfig, type=int)
         parser.add_argument('--resistor-values', action=UpdateDeviceConfig, type=float, nargs='*')
         parser.add_argument('--labels', action=UpdateDeviceConfig, nargs='*')
+        parser.add_argument('--file-format', action=UpdateDeviceConfig, choices=FILE_FORMATS)
     if server:
         parser.add_argument('--host', action=UpdateServerConfig)
         parser.add_argument('--port', action=UpdateServerConfig, type=int)
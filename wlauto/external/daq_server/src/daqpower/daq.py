@@ -73,6 +73,7 @@ except ImportError:  # earlier driver version
 
 
 from daqpower import log
+from daqpower.portfile import BinaryPortWriter, get_port_file_name
 
 
 def list_available_devices():
@@ -234,6 +235,9 @@ class PortWriter(object):
     def write(self, row):
         self.writer.writerow(row)
 
+    def write_rows(self, rows):
+        self.writer.writerows(rows.tolist())
+
     def close(self):
         self.fh.close()
 
@@ -247,11 +251,13 @@ class SamplePorcessorError(Exception):
 
 class SampleProcessor(AsyncWriter):
 
-    def __init__(self, resistor_values, output_directory, labels):
+    def __init__(self, resistor_values, output_directory, labels, file_format='csv', sampling_rate=None):
         super(SampleProcessor, self).__init__()
-        self.resistor_values = resistor_values
+        self.resistor_values = numpy.array(resistor_values, dtype=numpy.float64)
         self.output_directory = output_directory
         self.labels = labels
+        self.file_format = file_format
+        self.sampling_rate = sampling_rate
         self.number_of_ports = len(resistor_values)
         if len(self.labels) != self.number_of_ports:
             message = 'Number of labels ({}) does not match number of ports ({}).'
@@ -260,17 +266,21 @@ class SampleProcessor(AsyncWriter):
 
     def do_write(self, sample_tuple):
         samples, number_of_samples = sample_tuple
-        for i in xrange(0, number_of_samples * self.number_of_ports * 2, self.number_of_ports * 2):
-            for j in xrange(self.number_of_ports):
-                V = float(samples[i + 2 * j])
-                DV = float(samples[i + 2 * j + 1])
-                P = V * (DV / self.resistor_values[j])
-                self.port_writers[j].write([P, V])
+        samples = samples[:number_of_samples * self.number_of_ports * 2].reshape(number_of_samples,
+                                                                                 self.number_of_ports, 2)
+        V = samples[:, :, 0]
+        DV = samples[:, :, 1]
+        P = V * (DV / self.resistor_values)
+        for j, writer in enumerate(self.port_writers):
+            writer.write_rows(numpy.column_stack((P[:, j], V[:, j])))
 
     def start(self):
         for label in self.labels:
             port_file = self.get_port_file_path(label)
-            writer = PortWriter(port_file)
+            if self.file_format == 'binary':
+                writer = BinaryPortWriter(port_file, label, self.sampling_rate)
+            else:
+                writer = PortWriter(port_file)
             self.port_writers.append(writer)
         super(SampleProcessor, self).start()
 
@@ -282,7 +292,7 @@ class SampleProcessor(AsyncWriter):
 
     def get_port_file_path(self, port_id):
         if port_id in self.labels:
-            return os.path.join(self.output_directory, port_id + '.csv')
+            return os.path.join(self.output_directory, get_port_file_name(port_id, self.file_format))
         else:
             raise SamplePorcessorError('Invalid port ID: {}'.format(port_id))
 
@@ -298,7 +308,8 @@ class DaqRunner(object):
 
     def __init__(self, config, output_directory):
         self.config = config
-        self.processor = SampleProcessor(config.resistor_values, output_directory, config.labels)
+        self.processor = SampleProcessor(config.resistor_values, output_directory, config.labels,
+                                         config.file_format, config.sampling_rate)
         if callbacks_supported:
             self.task = ReadSamplesCallbackTask(config, self.processor)
         else:
@@ -329,11 +340,12 @@ if __name__ == '__main__':
     from collections import namedtuple
     DeviceConfig = namedtuple('DeviceConfig', ['device_id', 'channel_map', 'resistor_values',
                                                'v_range', 'dv_range', 'sampling_rate',
-                                               'number_of_ports', 'labels'])
+                                               'number_of_ports', 'labels', 'file_format'])
     channel_map = (0, 1, 2, 3, 4, 5, 6, 7, 16, 17, 18, 19, 20, 21, 22, 23)
     resistor_values = [0.005]
     labels = ['PORT_0']
-    dev_config = DeviceConfig('Dev1', channel_map, resistor_values, 2.5, 0.2, 10000, len(resistor_values), labels)
+    dev_config = DeviceConfig('Dev1', channel_map, resistor_values, 2.5, 0.2, 10000, len(resistor_values), labels,
+                              'csv')
     if len(sys.argv) != 3:
         print 'Usage: {} OUTDIR DURATION'.format(os.path.basename(__file__))
         sys.exit(1)
@@ -0,0 +1,139 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Binary port file format. This is a more compact alternative to the CSV port
+files that is also much faster to parse. A binary port file consists of a
+header, followed by fixed-width records, one per sample::
+
+    magic          8 bytes   'DAQPOWER'
+    version        uint16
+    sampling_rate  uint32
+    info_size      uint16
+    info           info_size bytes of JSON containing the port label and the
+                   names of the columns, padded with spaces so that the records
+                   are 4-byte aligned.
+    records        float32 value for each column, for each sample.
+
+All values are little-endian.
+
+"""
+import os
+import json
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+FILE_FORMATS = ['csv', 'binary']
+FILE_EXTENSIONS = {
+    'csv': '.csv',
+    'binary': '.bin',
+}
+
+BINARY_MAGIC = 'DAQPOWER'
+BINARY_VERSION = 1
+BINARY_DTYPE = '<f4'
+HEADER_STRUCT = struct.Struct('<8sHIH')
+
+
+class PortFileError(Exception):
+    pass
+
+
+class BinaryPortFileHeader(object):
+
+    @property
+    def record_size(self):
+        return len(self.columns) * 4
+
+    def __init__(self, label, sampling_rate, columns, data_offset=None):
+        self.label = label
+        self.sampling_rate = sampling_rate
+        self.columns = list(columns)
+        self.data_offset = data_offset
+
+    def pack(self):
+        info = json.dumps({'label': self.label, 'columns': self.columns})
+        padding = -(HEADER_STRUCT.size + len(info)) % 4
+        info += ' ' * padding
+        self.data_offset = HEADER_STRUCT.size + len(info)
+        return HEADER_STRUCT.pack(BINARY_MAGIC, BINARY_VERSION, self.sampling_rate, len(info)) + info
+
+    @staticmethod
+    def read(fh):
+        data = fh.read(HEADER_STRUCT.size)
+        if len(data) != HEADER_STRUCT.size:
+            raise PortFileError('Truncated binary port file header.')
+        magic, version, sampling_rate, info_size = HEADER_STRUCT.unpack(data)
+        if magic != BINARY_MAGIC:
+            raise PortFileError('Not a binary port file.')
+        if version != BINARY_VERSION:
+            raise PortFileError('Unsupported binary port file version: {}'.format(version))
+        info = json.loads(fh.read(info_size))
+        return BinaryPortFileHeader(info['label'], sampling_rate, info['columns'],
+                                    HEADER_STRUCT.size + info_size)
+
+
+class BinaryPortWriter(object):
+
+    def __init__(self, path, label, sampling_rate, columns=('power', 'voltage')):
+        self.path = path
+        self.header = BinaryPortFileHeader(label, sampling_rate, columns)
+        self.fh = open(path, 'wb')
+        self.fh.write(self.header.pack())
+
+    def write(self, row):
+        self.fh.write(struct.pack('<{}f'.format(len(row)), *row))
+
+    def write_rows(self, rows):
+        """Write a 2D numpy array of samples (one row per sample)."""
+        self.fh.write(np.asarray(rows, dtype=BINARY_DTYPE).tostring())
+
+    def close(self):
+        if not self.fh.closed:
+            self.fh.close()
+
+    def __del__(self):
+        self.close()
+
+
+def get_port_file_name(label, file_format='csv'):
+    return label + FILE_EXTENSIONS[file_format]
+
+
+def is_binary_port_file(path):
+    return os.path.splitext(path)[1] == FILE_EXTENSIONS['binary']
+
+
+def read_binary_port_file(path):
+    """
+    Returns the header of the binary port file at the specified path, along
+    with a read-only memory map of its records as an array with a row for each
+    sample. An incomplete final record (e.g. from an interrupted transfer) is
+    ignored.
+
+    """
+    with open(path, 'rb') as fh:
+        header = BinaryPortFileHeader.read(fh)
+    num_samples = (os.path.getsize(path) - header.data_offset) // header.record_size
+    if not num_samples:
+        return header, np.zeros((0, len(header.columns)), dtype=BINARY_DTYPE)
+    samples = np.memmap(path, dtype=BINARY_DTYPE, mode='r', offset=header.data_offset,
+                        shape=(num_samples, len(header.columns)))
+    return header, samples
@@ -35,6 +35,7 @@ if __name__ == "__main__":  # for debugging
 from daqpower import log
 from daqpower.config import DeviceConfiguration
 from daqpower.common import DaqServerRequest, DaqServerResponse, Status
+from daqpower.portfile import BinaryPortWriter, get_port_file_name, is_binary_port_file
 
 try:
     from daqpower.daq import DaqRunner, list_available_devices, CAN_ENUMERATE_DEVICES
@@ -69,11 +70,18 @@ class DummyDaqRunner(object):
         import csv, random  # pylint: disable=multiple-imports
         log.info('runner started')
         for i in xrange(self.config.number_of_ports):
-            rows = [['power', 'voltage']] + [[random.gauss(1.0, 1.0), random.gauss(1.0, 0.1)]
-                                             for _ in xrange(self.num_rows)]
-            with open(self.get_port_file_path(self.config.labels[i]), 'wb') as wfh:
-                writer = csv.writer(wfh)
-                writer.writerows(rows)
+            label = self.config.labels[i]
+            rows = [[random.gauss(1.0, 1.0), random.gauss(1.0, 0.1)] for _ in xrange(self.num_rows)]
+            if self.config.file_format == 'binary':
+                writer = BinaryPortWriter(self.get_port_file_path(label), label, self.config.sampling_rate)
+                for row in rows:
+                    writer.write(row)
+                writer.close()
+            else:
+                with open(self.get_port_file_path(label), 'wb') as wfh:
+                    writer = csv.writer(wfh)
+                    writer.writerow(['power', 'voltage'])
+                    writer.writerows(rows)
 
         self.is_running = True
 
@@ -83,7 +91,7 @@ class DummyDaqRunner(object):
 
     def get_port_file_path(self, port_id):
         if port_id in self.config.labels:
-            return os.path.join(self.output_directory, '{}.csv'.format(port_id))
+            return os.path.join(self.output_directory, get_port_file_name(port_id, self.config.file_format))
         else:
             raise Exception('Invalid port id: {}'.format(port_id))
 
@@ -268,7 +276,8 @@ class DaqControlProtocol(LineReceiver):  # pylint: disable=W0223
             port_file = self.daq_server.get_port_file_path(port_id)
             if os.path.isfile(port_file):
                 port = self._initiate_file_transfer(port_file)
-                self.sendResponse(Status.OK, data={'port_number': port})
+                self.sendResponse(Status.OK, data={'port_number': port,
+                                                   'filename': os.path.basename(port_file)})
             else:
                 self.sendError('File for port {} does not exist.'.format(port_id))
         else:
@@ -397,8 +406,11 @@ class FileReader(object):
 
     implements(interfaces.IPushProducer)
 
+    chunk_size = 64 * 1024
+
     def __init__(self, filepath):
-        self.fh = open(filepath)
+        self.binary = is_binary_port_file(filepath)
+        self.fh = open(filepath, 'rb' if self.binary else 'r')
         self.proto = None
         self.done = False
         self._paused = True
@@ -412,8 +424,13 @@ class FileReader(object):
         self._paused = False
         try:
             while not self._paused:
-                line = self.fh.next().rstrip('\n') + '\r\n'
-                self.proto.transport.write(line)
+                if self.binary:
+                    data = self.fh.read(self.chunk_size)
+                    if not data:
+                        raise StopIteration()
+                else:
+                    data = self.fh.next().rstrip('\n') + '\r\n'
+                self.proto.transport.write(data)
         except StopIteration:
             log.debug('Sent everything.')
             self.stopProducing()
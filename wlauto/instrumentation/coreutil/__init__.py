@@ -15,20 +15,21 @@
 
 
 import os
-import sys
 import re
-import time
-import shutil
-import logging
-import threading
-import subprocess
-import tempfile
 import csv
 
 from wlauto import Instrument, Parameter
-from wlauto.core.execution import ExecutionContext
-from wlauto.exceptions import InstrumentError, WorkerThreadError
-from wlauto.core import signal
+from wlauto.exceptions import InstrumentError
+from wlauto.utils.lazyimport import lazy_import
+
+
+np = lazy_import('numpy')
+
+
+THIS_DIR = os.path.dirname(__file__)
+
+# Number of sample intervals to wait for the sampler to finish after it has been stopped.
+DONE_WAIT_INTERVALS = 10
 
 
 class CoreUtilization(Instrument):
@@ -52,6 +53,9 @@ class CoreUtilization(Instrument):
      - 28.8314% of total time four cores are running simultaneously above or equal to threshold value
      - 18.098% of time all core are running below threshold value.
 
+    ``/proc/stat`` is sampled by a script running on the device for the duration of the
+    workload, and the collected samples are pulled once at the end of the iteration.
+
     ..note : This instrument doesn't work on ARM big.LITTLE IKS implementation
 
     """
@@ -63,35 +67,66 @@ class CoreUtilization(Instrument):
                               'as "utilized". This value may need to be adjusted based on the background '
                               'activity and the intensity of the workload being instrumented (e.g. it may '
                               'need to be lowered for low-intensity workloads such as video playback).'
-                  )
+                  ),
+        Parameter('sample_interval', kind=int, default=500,
+                  constraint=lambda x: x > 0,
+                  description='The interval between ``/proc/stat`` samples, in milliseconds. Note that '
+                              'the kernel accounts CPU time in units of ``USER_HZ`` (typically 10ms), '
+                              'so intervals shorter than a few of those will produce noisy results.'),
     ]
 
     def __init__(self, device, **kwargs):
         super(CoreUtilization, self).__init__(device, **kwargs)
-        self.collector = None
         self.output_dir = None
         self.cores = None
         self.output_artifact_registered = False
+        self.sampler = None
+        self.command = None
+        self.on_device_output = None
+        self.on_device_run_file = None
+        self.on_device_done_file = None
+
+    def initialize(self, context):
+        self.sampler = self.device.install(os.path.join(THIS_DIR, 'procstat.sh'))
+        self.on_device_output = self.device.path.join(self.device.working_directory, 'procstat.txt')
+        self.on_device_run_file = self.device.path.join(self.device.working_directory, 'procstat.run')
+        self.on_device_done_file = self.device.path.join(self.device.working_directory, 'procstat.done')
+        self.command = 'sh {} {} {} {} {} {}'.format(self.sampler, self.device.busybox,
+                                                     self.sample_interval * 1000,
+                                                     self.on_device_output,
+                                                     self.on_device_run_file,
+                                                     self.on_device_done_file)
 
     def setup(self, context):
-        ''' Calls ProcCollect class '''
         self.output_dir = context.output_directory
-        self.collector = ProcCollect(self.device, self.logger, self.output_dir)
         self.cores = self.device.number_of_cores
+        # The sampler runs for as long as the "run" file exists.
+        self.device.execute('rm -f {} {} && echo > {}'.format(self.on_device_output,
+                                                              self.on_device_done_file,
+                                                              self.on_device_run_file))
 
     def start(self, context):  # pylint: disable=W0613
         ''' Starts collecting data once the workload starts '''
         self.logger.debug('Starting to collect /proc/stat data')
-        self.collector.start()
+        self.device.kick_off(self.command)
 
     def stop(self, context):  # pylint: disable=W0613
         ''' Stops collecting data once the workload stops '''
         self.logger.debug('Stopping /proc/stat data collection')
-        self.collector.stop()
+        self.device.execute('rm -f {}'.format(self.on_device_run_file))
 
     def update_result(self, context):
         ''' updates result into coreutil.csv '''
-        self.collector.join()    # wait for "proc.txt" to generate.
+        # wait for the sampler to write out its last record.
+        attempts = ' '.join(str(i) for i in xrange(DONE_WAIT_INTERVALS))
+        self.device.execute('for i in {}; do [ -e {} ] && break; {} usleep {}; done'.format(attempts,
+                                                                                          self.on_device_done_file,
+                                                                                          self.device.busybox,
+                                                                                          self.sample_interval * 1000))
+        if not self.device.file_exists(self.on_device_done_file):
+            message = '/proc/stat sampler did not finish within {} ms of being stopped; is {} still running?'
+            raise InstrumentError(message.format(DONE_WAIT_INTERVALS * self.sample_interval, self.sampler))
+        self.device.pull_file(self.on_device_output, os.path.join(self.output_dir, 'proc.txt'))
         context.add_artifact('proctxt', 'proc.txt', 'raw')
         calc = Calculator(self.cores, self.threshold, context)  # pylint: disable=E1101
         calc.calculate()
@@ -99,41 +134,9 @@ class CoreUtilization(Instrument):
             context.add_run_artifact('cpuutil', 'coreutil.csv', 'data')
             self.output_artifact_registered = True
 
-
-class ProcCollect(threading.Thread):
-    ''' Dumps data into proc.txt '''
-
-    def __init__(self, device, logger, out_dir):
-        super(ProcCollect, self).__init__()
-        self.device = device
-        self.logger = logger
-        self.dire = out_dir
-        self.stop_signal = threading.Event()
-        self.command = 'cat /proc/stat'
-        self.exc = None
-
-    def run(self):
-        try:
-            self.stop_signal.clear()
-            _, temp_file = tempfile.mkstemp()
-            self.logger.debug('temp file : {}'.format(temp_file))
-            with open(temp_file, 'wb') as tempfp:
-                while not self.stop_signal.is_set():
-                    tempfp.write(self.device.execute(self.command))
-                    tempfp.write('\n')
-                    time.sleep(0.5)
-            raw_file = os.path.join(self.dire, 'proc.txt')
-            shutil.copy(temp_file, raw_file)
-            os.unlink(temp_file)
-        except Exception, error:  # pylint: disable=W0703
-            self.logger.warning('Exception on collector thread : {}({})'.format(error.__class__.__name__, error))
-            self.exc = WorkerThreadError(self.name, sys.exc_info())
-
-    def stop(self):
-        '''Executed once the workload stops'''
-        self.stop_signal.set()
-        if self.exc is not None:
-            raise self.exc  # pylint: disable=E0702
+    def teardown(self, context):
+        self.device.delete_file(self.on_device_output)
+        self.device.delete_file(self.on_device_done_file)
 
 
 class Calculator(object):
@@ -209,11 +212,13 @@ class Calculator(object):
             #   keeping  track of seen cores until no more lines match 'cpu\d+'
             #   pattern.
             # - For every core not seen in this record, pad zeros.
-            # - Loop
+            # - Loop, starting with the line that ended the record, as it
+            #   may be the summary line of the next one.
             try:
+                line = fh.next()
                 while True:
-                    line = fh.next()
                     if not line.startswith('cpu '):
+                        line = fh.next()
                         continue
 
                     seen_cores = set([])
@@ -233,9 +238,21 @@ class Calculator(object):
                         self.active[unseen_core].append(0)
             except StopIteration:  # EOF
                 pass
+        # The last record may have been cut short.
+        num_samples = min(len(t) for t in self.total) if self.total else 0
+        self.total = [t[:num_samples] for t in self.total]
+        self.active = [a[:num_samples] for a in self.active]
 
     def calculate_core_utilization(self):
         """Calculates CPU utilization"""
+        if np is not None:
+            # Deltas between consecutive samples are computed for all cores at once.
+            diff_active = np.diff(np.array(self.active, dtype=float), axis=1)
+            diff_total = np.diff(np.array(self.total, dtype=float), axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cpu_util = np.where(diff_total == 0, 0, diff_active / diff_total)
+            self.cpu_util = np.round(cpu_util * 100, 2).tolist()
+            return
         diff_active = [[] for _ in xrange(self.cores)]
         diff_total = [[] for _ in xrange(self.cores)]
         self.cpu_util = [[] for _ in xrange(self.cores)]
@@ -252,13 +269,19 @@ class Calculator(object):
 
     def generate_csv(self, context):
         """ generates ``coreutil.csv``"""
-        self.output = [0 for _ in xrange(self.cores + 1)]
-        for i in range(len(self.cpu_util[0])):
-            count = 0
-            for j in xrange(len(self.cpu_util)):
-                if self.cpu_util[j][i] > round(float(self.threshold), 2):
-                    count = count + 1
-            self.output[count] += 1
+        threshold = round(float(self.threshold), 2)
+        if np is not None:
+            # number of utilized cores in each sample, binned by count.
+            utilized = (np.array(self.cpu_util) > threshold).sum(axis=0)
+            self.output = np.bincount(utilized, minlength=self.cores + 1).tolist()
+        else:
+            self.output = [0 for _ in xrange(self.cores + 1)]
+            for i in range(len(self.cpu_util[0])):
+                count = 0
+                for j in xrange(len(self.cpu_util)):
+                    if self.cpu_util[j][i] > threshold:
+                        count = count + 1
+                self.output[count] += 1
         if self.cpu_util[0]:
             scale_factor = round((float(1) / len(self.cpu_util[0])) * 100, 6)
         else:
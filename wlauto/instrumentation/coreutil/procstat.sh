@@ -0,0 +1,26 @@
+#!/system/bin/sh
+#
+# usage: procstat.sh BUSYBOX INTERVAL OUTPUT_FILE RUN_FILE DONE_FILE
+#
+# Records the cpu lines of /proc/stat into OUTPUT_FILE every INTERVAL
+# microseconds for as long as RUN_FILE exists. DONE_FILE is created once the last record
+# has been written. Only shell builtins are used to take a sample, so that
+# sampling does not perturb the system being measured.
+
+BUSYBOX=$1
+INTERVAL=$2
+OUTPUT_FILE=$3
+RUN_FILE=$4
+DONE_FILE=$5
+
+while [ -e $RUN_FILE ]; do
+    while read name values; do
+        case $name in
+            cpu*) echo "$name $values" ;;
+            *) break ;;
+        esac
+    done < /proc/stat
+    $BUSYBOX usleep $INTERVAL
+done > $OUTPUT_FILE
+
+: > $DONE_FILE
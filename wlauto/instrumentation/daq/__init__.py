@@ -21,6 +21,7 @@ import csv
 import shutil
 import tempfile
 from collections import OrderedDict, defaultdict
+from itertools import islice
 from string import ascii_lowercase
 
 from multiprocessing import Process, Queue
@@ -29,7 +30,8 @@ from wlauto import Instrument, Parameter
 from wlauto.core import signal
 from wlauto.exceptions import ConfigError, InstrumentError, DeviceError
 from wlauto.utils.misc import ensure_directory_exists as _d
-from wlauto.utils.types import list_of_ints, list_of_strs, boolean
+from wlauto.utils.types import list_of_ints, list_of_strs, list_of_numbers, boolean
+from wlauto.utils.lazyimport import lazy_import
 
 # pylint: disable=wrong-import-position,wrong-import-order
 daqpower_path = os.path.join(os.path.dirname(__file__), '..', '..', 'external', 'daq_server', 'src')
@@ -40,8 +42,12 @@ try:
 except ImportError, e:
     daq, DeviceConfiguration, ServerConfiguration, ConfigurationError = None, None, None, None
     import_error_mesg = e.message
+from daqpower.portfile import (BinaryPortWriter, get_port_file_name,  # pylint: disable=F0401
+                               is_binary_port_file, read_binary_port_file)
 sys.path.pop(0)
 
+np = lazy_import('numpy')
+
 
 UNITS = {
     'energy': 'Joules',
@@ -53,6 +59,12 @@ UNITS = {
 GPIO_ROOT = '/sys/class/gpio'
 TRACE_MARKER_PATH = '/sys/kernel/debug/tracing/trace_marker'
 
+# Number of samples read from a port file at a time.
+CHUNK_SIZE = 65536
+# Number of points used to summarise the distribution of power samples for
+# percentile calculation.
+QUANTILE_SUMMARY_SIZE = 1024
+
 
 def dict_or_bool(value):
     """
@@ -105,6 +117,8 @@ class Daq(Instrument):
                           connector on the DAQ (varies between DAQ models). The default
                           assumes DAQ 6363 and similar with AI channels on connectors
                           0-7 and 16-23.
+        :daq_port_file_format: The format of the port files written by the server.
+                               Defaults to ``'csv'``.
 
     """
 
@@ -183,7 +197,28 @@ class Daq(Instrument):
 
                   In the above exaples the DAQ channels labeled A15a and A15b will be summed together
                   with the results being saved as 'channel' ''a''. A7, GPU and RoS will be summed to 'c'
-                  """)
+                  """),
+        Parameter('percentiles', kind=list_of_numbers, default=[],
+                  global_alias='daq_percentiles',
+                  description="""
+                  Percentiles of power samples to be reported for each port (e.g. ``[50, 90, 99]``),
+                  in addition to the mean. If specified, the minimum and maximum power for each
+                  port will also be reported. Percentiles are estimated from a fixed-size summary
+                  of the samples, so that memory use does not grow with the length of the capture.
+                  This requires ``numpy`` to be installed on the host.
+                  """),
+        Parameter('port_file_format', default='csv', allowed_values=['csv', 'binary'],
+                  global_alias='daq_port_file_format',
+                  description="""
+                  The format in which the server records samples for each port. ``'csv'`` port
+                  files are text files with a row for each sample. ``'binary'`` port files store
+                  each sample as fixed-width ``float32`` values after a small header with the
+                  port label and the sampling rate; they are several times smaller than CSV
+                  files, so are quicker to transfer from the server, and are memory-mapped
+                  rather than parsed when the results are processed. This is recommended for
+                  captures at high sampling rates. ``'binary'`` requires a server that supports
+                  it, as well as ``numpy`` to be installed on the host.
+                  """),
     ]
 
     def initialize(self, context):
@@ -239,35 +274,33 @@ class Daq(Instrument):
             if key not in self._results:
                 self._results[key] = {}
 
-            temp_file = os.path.join(tempfile.gettempdir(), entry)
-            writer, wfh = None, None
-
-            with open(path) as fh:
-                if self.negative_samples != 'keep':
-                    wfh = open(temp_file, 'wb')
-                    writer = csv.writer(wfh)
-
-                reader = csv.reader(fh)
-                metrics = reader.next()
-                if writer:
-                    writer.writerow(metrics)
-                self._metrics |= set(metrics)
-
-                rows = _get_rows(reader, writer, self.negative_samples)
-                data = zip(*rows)
-
-                if writer:
-                    wfh.close()
-                    shutil.move(temp_file, os.path.join(output_directory, entry))
-
-                n = len(data[0])
-                means = [s / n for s in map(sum, data)]
-                for metric, value in zip(metrics, means):
-                    metric_name = '{}_{}'.format(port, metric)
-                    context.result.add_metric(metric_name, round(value, 3), UNITS[metric])
-                    self._results[key][metric_name] = round(value, 3)
-                energy = sum(data[metrics.index('power')]) / self.sampling_rate
-                context.result.add_metric('{}_energy'.format(port), round(energy, 3), UNITS['energy'])
+            if is_binary_port_file(path):
+                metrics, stats, sampling_rate = self._process_binary_port_file(path)
+                means = stats.means
+                energy = stats.sums[metrics.index('power')] / sampling_rate
+            elif np is not None:
+                metrics, stats = self._process_port_file(path)
+                means = stats.means
+                energy = stats.sums[metrics.index('power')] / self.sampling_rate
+            else:
+                metrics, means, energy = self._process_port_file_in_memory(path)
+            self._metrics |= set(metrics)
+
+            for metric, value in zip(metrics, means):
+                metric_name = '{}_{}'.format(port, metric)
+                context.result.add_metric(metric_name, round(value, 3), UNITS[metric])
+                self._results[key][metric_name] = round(value, 3)
+            context.result.add_metric('{}_energy'.format(port), round(energy, 3), UNITS['energy'])
+
+            if self.percentiles and stats.count:
+                power_index = metrics.index('power')
+                context.result.add_metric('{}_power_min'.format(port),
+                                          round(stats.mins[power_index], 3), UNITS['power'])
+                context.result.add_metric('{}_power_max'.format(port),
+                                          round(stats.maxs[power_index], 3), UNITS['power'])
+                for percentile in self.percentiles:
+                    context.result.add_metric('{}_power_p{:g}'.format(port, percentile),
+                                              round(stats.percentile(percentile), 3), UNITS['power'])
 
     def teardown(self, context):
         self.logger.debug('Terminating session.')
@@ -281,6 +314,13 @@ class Daq(Instrument):
     def validate(self):  # pylint: disable=too-many-branches
         if not daq:
             raise ImportError(import_error_mesg)
+        if self.percentiles:
+            if np is None:
+                raise ConfigError('DAQ percentiles require numpy Python package to be installed.')
+            if any(not 0 <= p <= 100 for p in self.percentiles):
+                raise ConfigError('DAQ percentiles must be between 0 and 100.')
+        if self.port_file_format == 'binary' and np is None:
+            raise ConfigError('DAQ binary port files require numpy Python package to be installed.')
         self._results = None
         self._metrics = set()
         if self.labels:
@@ -300,7 +340,8 @@ class Daq(Instrument):
                                                  sampling_rate=self.sampling_rate,
                                                  resistor_values=self.resistor_values,
                                                  channel_map=self.channel_map,
-                                                 labels=self.labels)
+                                                 labels=self.labels,
+                                                 file_format=self.port_file_format)
         try:
             self.server_config.validate()
             self.device_config.validate()
@@ -374,9 +415,97 @@ class Daq(Instrument):
             raise InstrumentError('DAQ: Unexpected result: {} - {}'.format(result.status, result.message))
         return (result.status, result.data)
 
+    def _process_port_file(self, path):
+        """
+        Computes the stats for the port file at the specified path in a single
+        pass over it, rewriting it with the negative samples policy applied
+        (unless negative samples are kept).
+
+        """
+        temp_file = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+        writer, wfh = None, None
+        with open(path) as fh:
+            reader = csv.reader(fh)
+            metrics = reader.next()
+            if self.negative_samples != 'keep':
+                wfh = open(temp_file, 'wb')
+                writer = csv.writer(wfh)
+                writer.writerow(metrics)
+            percentile_column = metrics.index('power') if self.percentiles else None
+            stats = SampleStats(len(metrics), percentile_column)
+            for chunk in _read_chunks(fh, len(metrics)):
+                chunk = _apply_negative_samples_policy(chunk, self.negative_samples)
+                stats.update(chunk)
+                if writer:
+                    writer.writerows(chunk.tolist())
+        if writer:
+            wfh.close()
+            shutil.move(temp_file, path)
+        return metrics, stats
+
+    def _process_binary_port_file(self, path):
+        """
+        Computes the stats for the binary port file at the specified path from a
+        memory map of it, rewriting it with the negative samples policy applied
+        (unless negative samples are kept).
+
+        """
+        header, samples = read_binary_port_file(path)
+        percentile_column = header.columns.index('power') if self.percentiles else None
+        stats = SampleStats(len(header.columns), percentile_column)
+        writer = None
+        temp_file = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+        if self.negative_samples != 'keep':
+            writer = BinaryPortWriter(temp_file, header.label, header.sampling_rate, header.columns)
+        for chunk in _iter_array_chunks(samples):
+            chunk = _apply_negative_samples_policy(chunk.astype(np.float64), self.negative_samples)
+            stats.update(chunk)
+            if writer:
+                writer.write_rows(chunk)
+        del samples  # release the memory map before the file is replaced
+        if writer:
+            writer.close()
+            shutil.move(temp_file, path)
+        return header.columns, stats, header.sampling_rate
+
+    def _process_port_file_in_memory(self, path):
+        temp_file = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+        writer, wfh = None, None
+
+        with open(path) as fh:
+            if self.negative_samples != 'keep':
+                wfh = open(temp_file, 'wb')
+                writer = csv.writer(wfh)
+
+            reader = csv.reader(fh)
+            metrics = reader.next()
+            if writer:
+                writer.writerow(metrics)
+
+            rows = _get_rows(reader, writer, self.negative_samples)
+            data = zip(*rows)
+
+            if writer:
+                wfh.close()
+                shutil.move(temp_file, path)
+
+        n = len(data[0])
+        means = [s / n for s in map(sum, data)]
+        energy = sum(data[metrics.index('power')]) / self.sampling_rate
+        return metrics, means, energy
+
     def _merge_channels(self, context):  # pylint: disable=r0914
         output_directory = _d(os.path.join(context.output_directory, 'daq'))
         for name, labels in self.label_map.iteritems():
+            output_path = os.path.join(output_directory, get_port_file_name(name, self.port_file_format))
+            paths = [os.path.join(output_directory, get_port_file_name(label, self.port_file_format))
+                     for label in labels]
+            if self.port_file_format == 'binary':
+                _merge_binary_port_files(name, paths, output_path, self.negative_samples)
+                continue
+            if np is not None:
+                _merge_port_files(paths, output_path, self.negative_samples)
+                continue
             summed = None
             for label in labels:
                 path = os.path.join(output_directory, "{}.csv".format(label))
@@ -388,7 +517,6 @@ class Daq(Instrument):
                         summed = [[x + y for x, y in zip(a, b)] for a, b in zip(rows, summed)]
                     else:
                         summed = rows
-            output_path = os.path.join(output_directory, "{}.csv".format(name))
             with open(output_path, 'wb') as wfh:
                 writer = csv.writer(wfh)
                 writer.writerow(metrics)
@@ -396,6 +524,77 @@ class Daq(Instrument):
                     writer.writerow(row)
 
 
+class SampleStats(object):
+    """
+    Accumulates the count, sum, minimum and maximum of each column of samples
+    that are passed to it chunk by chunk. If ``percentile_column`` is
+    specified, a fixed-size summary of the distribution of values in that
+    column is also maintained, from which percentiles may be estimated.
+
+    """
+
+    @property
+    def means(self):
+        if not self.count:
+            return [float('nan')] * len(self.sums)
+        return (self.sums / self.count).tolist()
+
+    def __init__(self, num_columns, percentile_column=None, summary_size=QUANTILE_SUMMARY_SIZE):
+        self.count = 0
+        self.sums = np.zeros(num_columns)
+        self.mins = np.full(num_columns, np.inf)
+        self.maxs = np.full(num_columns, -np.inf)
+        self.percentile_column = percentile_column
+        self.summary_size = summary_size
+        self._values = []
+        self._weights = []
+        self._summary_length = 0
+
+    def update(self, chunk):
+        if not len(chunk):
+            return
+        self.count += len(chunk)
+        self.sums += chunk.sum(axis=0)
+        self.mins = np.minimum(self.mins, chunk.min(axis=0))
+        self.maxs = np.maximum(self.maxs, chunk.max(axis=0))
+        if self.percentile_column is not None:
+            values = np.sort(chunk[:, self.percentile_column])
+            if len(values) > self.summary_size:
+                indexes = np.linspace(0, len(values) - 1, self.summary_size).round().astype(int)
+                values = values[indexes]
+            self._add_to_summary(values, np.full(len(values), len(chunk) / len(values)))
+
+    def percentile(self, q):
+        """Returns an estimate of the ``q``th percentile of the values in ``percentile_column``."""
+        if self.percentile_column is None:
+            raise ValueError('Percentiles are not being tracked.')
+        values, weights = self._get_summary()
+        cumulative = np.cumsum(weights) - weights / 2
+        return float(np.interp(q / 100 * weights.sum(), cumulative, values))
+
+    def _add_to_summary(self, values, weights):
+        self._values.append(values)
+        self._weights.append(weights)
+        self._summary_length += len(values)
+        if self._summary_length > 4 * self.summary_size:
+            # Compress the summary back down to summary_size points, each
+            # representing an equal share of the samples seen so far.
+            values, weights = self._get_summary()
+            total = weights.sum()
+            cumulative = np.cumsum(weights) - weights / 2
+            targets = (np.arange(self.summary_size) + 0.5) * total / self.summary_size
+            values = np.interp(targets, cumulative, values)
+            self._values = [values]
+            self._weights = [np.full(self.summary_size, total / self.summary_size)]
+            self._summary_length = self.summary_size
+
+    def _get_summary(self):
+        values = np.concatenate(self._values)
+        weights = np.concatenate(self._weights)
+        order = np.argsort(values, kind='mergesort')
+        return values[order], weights[order]
+
+
 def _send_daq_command(q, *args, **kwargs):
     result = daq.execute_command(*args, **kwargs)
     q.put(result)
@@ -406,18 +605,111 @@ def _get_rows(reader, writer, negative_samples):
     for row in reader:
         row = map(float, row)
         if negative_samples == 'keep':
-            rows.append(row)
+            pass
         elif negative_samples == 'zero':
-            def nonneg(v):
-                return v if v >= 0 else 0
-            rows.append([nonneg(v) for v in row])
+            row = [v if v >= 0 else 0 for v in row]
         elif negative_samples == 'drop':
-            if all(v >= 0 for v in row):
-                rows.append(row)
+            if not all(v >= 0 for v in row):
+                continue
         elif negative_samples == 'abs':
-            rows.append([abs(v) for v in row])
+            row = [abs(v) for v in row]
         else:
             raise AssertionError(negative_samples)  # should never get here
+        rows.append(row)
         if writer:
             writer.writerow(row)
     return rows
+
+
+def _read_chunks(fh, num_columns, chunk_size=CHUNK_SIZE):
+    """Yields the rows of samples in a port file as arrays of up to ``chunk_size`` rows."""
+    while True:
+        lines = list(islice(fh, chunk_size))
+        if not lines:
+            break
+        text = ','.join(l.strip() for l in lines if l.strip())
+        if not text:
+            continue
+        yield np.fromstring(text, dtype=np.float64, sep=',').reshape(-1, num_columns)
+
+
+def _iter_array_chunks(samples, chunk_size=CHUNK_SIZE):
+    """Yields the rows of an array of samples in chunks of up to ``chunk_size`` rows."""
+    for i in xrange(0, len(samples), chunk_size):
+        yield samples[i:i + chunk_size]
+
+
+def _apply_negative_samples_policy(chunk, negative_samples):
+    if negative_samples == 'keep':
+        return chunk
+    elif negative_samples == 'zero':
+        return np.where(chunk >= 0, chunk, 0)
+    elif negative_samples == 'drop':
+        return chunk[(chunk >= 0).all(axis=1)]
+    elif negative_samples == 'abs':
+        return np.abs(chunk)
+    else:
+        raise AssertionError(negative_samples)  # should never get here
+
+
+def _merge_port_files(paths, output_path, negative_samples):
+    """
+    Sums the samples in the specified port files, a chunk at a time, and writes
+    the result to ``output_path``. With the ``'drop'`` negative samples policy,
+    a row is dropped from all files if it contains a negative value in any of
+    them, so that the summed rows stay aligned.
+
+    """
+    fhs = [open(path) for path in paths]
+    try:
+        metrics = None
+        for fh in fhs:
+            metrics = csv.reader(fh).next()
+        readers = [_read_chunks(fh, len(metrics)) for fh in fhs]
+        with open(output_path, 'wb') as wfh:
+            writer = csv.writer(wfh)
+            writer.writerow(metrics)
+            for chunk in _sum_chunks(readers, negative_samples):
+                writer.writerows(chunk.tolist())
+    finally:
+        for fh in fhs:
+            fh.close()
+
+
+def _merge_binary_port_files(label, paths, output_path, negative_samples):
+    """
+    Binary port file equivalent of ``_merge_port_files``; the merged port file
+    is labelled with ``label``.
+
+    """
+    port_files = [read_binary_port_file(path) for path in paths]
+    header = port_files[0][0]
+    readers = [_iter_array_chunks(samples) for _, samples in port_files]
+    writer = BinaryPortWriter(output_path, label, header.sampling_rate, header.columns)
+    try:
+        for chunk in _sum_chunks(readers, negative_samples):
+            writer.write_rows(chunk)
+    finally:
+        writer.close()
+
+
+def _sum_chunks(readers, negative_samples):
+    """
+    Yields the sums of the corresponding chunks of samples produced by each of
+    the readers, stopping when any of them is exhausted.
+
+    """
+    while True:
+        chunks = [next(r, None) for r in readers]
+        if any(c is None for c in chunks):
+            break
+        num_rows = min(len(c) for c in chunks)
+        chunks = [np.asarray(c[:num_rows], dtype=np.float64) for c in chunks]
+        if negative_samples == 'drop':
+            mask = np.ones(num_rows, dtype=bool)
+            for chunk in chunks:
+                mask &= (chunk >= 0).all(axis=1)
+            chunks = [c[mask] for c in chunks]
+        else:
+            chunks = [_apply_negative_samples_policy(c, negative_samples) for c in chunks]
+        yield sum(chunks)
@@ -23,29 +23,31 @@ from tempfile import mktemp
 from base64 import b64encode
 from collections import Counter, namedtuple
 
-try:
-    import jinja2
-    import pandas as pd
-    import matplotlib
-    matplotlib.use('AGG')
-    import matplotlib.pyplot as plt
-    import numpy as np
-    low_filter = np.vectorize(lambda x: x > 0 and x or 0)  # pylint: disable=no-member
-    import_error = None
-except ImportError as e:
-    import_error = e
-    jinja2 = None
-    pd = None
-    plt = None
-    np = None
-    low_filter = None
-
 from wlauto import Instrument, Parameter, File
 from wlauto.exceptions import ConfigError, InstrumentError, DeviceError
 from wlauto.instrumentation import instrument_is_installed
+from wlauto.utils.lazyimport import lazy_import
 from wlauto.utils.types import caseless_string, list_or_caseless_string, list_of_ints
 from wlauto.utils.misc import list_to_mask
 
+
+def _use_agg_backend():
+    import matplotlib
+    matplotlib.use('AGG')
+
+
+jinja2 = lazy_import('jinja2')
+pd = lazy_import('pandas')
+plt = lazy_import('matplotlib.pyplot', pre_import=_use_agg_backend)
+np = lazy_import('numpy')
+_missing = [name for name, module in [('jinja2', jinja2), ('pandas', pd), ('matplotlib', plt), ('numpy', np)]
+            if module is None]
+import_error = ImportError('No module named {}'.format(', '.join(_missing))) if _missing else None
+
+
+def low_filter(values):
+    return np.vectorize(lambda x: x > 0 and x or 0)(values)  # pylint: disable=no-member
+
 FREQ_TABLE_FILE = 'frequency_power_perf_data.csv'
 CPUS_TABLE_FILE = 'projected_cap_power.csv'
 MEASURED_CPUS_TABLE_FILE = 'measured_cap_power.csv'
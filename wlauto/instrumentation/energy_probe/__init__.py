@@ -20,15 +20,13 @@ import subprocess
 import signal
 import struct
 import csv
-try:
-    import pandas
-except ImportError:
-    pandas = None
-
 from wlauto import Instrument, Parameter, Executable
 from wlauto.exceptions import InstrumentError, ConfigError
+from wlauto.utils.lazyimport import lazy_import
 from wlauto.utils.types import list_of_numbers
 
+pandas = lazy_import('pandas')
+
 
 class EnergyProbe(Instrument):
 
@@ -25,6 +25,8 @@ from wlauto import Instrument, Parameter, Executable
 from wlauto.exceptions import InstrumentError, ConfigError, DeviceError
 from wlauto.core import signal
 from wlauto.utils.types import boolean
+from wlauto.utils.trace_bus import trace_event_bus
+from wlauto.utils.trace_cmd import text_trace_has_dropped_events
 
 OUTPUT_TRACE_FILE = 'trace.dat'
 OUTPUT_TEXT_FILE = '{}.txt'.format(os.path.splitext(OUTPUT_TRACE_FILE)[0])
@@ -135,6 +137,9 @@ class TraceCmdInstrument(Instrument):
         Parameter('report', kind=boolean, default=True,
                   description="""
                   Specifies whether reporting should be performed once the binary trace has been generated.
+                  Trace processors in WA (e.g. ``cpustates``) are able to decode the binary trace directly,
+                  so this may be disabled if the text version of the trace is not otherwise needed; this
+                  considerably reduces post-processing time for large traces.
                   """),
         Parameter('no_install', kind=boolean, default=False,
                   description="""
@@ -160,6 +165,7 @@ class TraceCmdInstrument(Instrument):
         self.event_string = _build_trace_events(self.events)
         self.output_file = os.path.join(self.device.working_directory, OUTPUT_TRACE_FILE)
         self.temp_trace_file = self.device.path.join(self.device.working_directory, OUTPUT_TRACE_FILE)
+        self.dropped_events = False
 
     def on_run_init(self, context):
         if not self.device.is_rooted:
@@ -177,6 +183,12 @@ class TraceCmdInstrument(Instrument):
         signal.connect(self.insert_start_mark, signal.BEFORE_WORKLOAD_EXECUTION, priority=11)
         signal.connect(self.insert_end_mark, signal.AFTER_WORKLOAD_EXECUTION, priority=11)
 
+        # Dropped events are detected as part of the single pass over the trace
+        # that also feeds any trace result processors.
+        trace_event_bus.subscribe(self.record_dropped_events, names=['DROPPED EVENTS DETECTED'],
+                                  on_start=self.reset_dropped_events,
+                                  on_end=self.report_dropped_events)
+
     def setup(self, context):
         if self.mode == 'start':
             if self.buffer_size:
@@ -255,22 +267,37 @@ class TraceCmdInstrument(Instrument):
             if os.path.isfile(local_txt_trace_file):
                 context.add_iteration_artifact('txttrace', OUTPUT_TEXT_FILE, kind='export',
                                                description='trace-cmd generated ftrace dump.')
-                self.logger.debug('Verifying traces.')
-                with open(local_txt_trace_file) as fh:
-                    for line in fh:
-                        if 'EVENTS DROPPED' in line:
-                            self.logger.warning('Dropped events detected.')
-                            break
-                    else:
-                        self.logger.debug('Trace verified.')
             else:
                 self.logger.warning('Could not generate trace.txt.')
 
+        # If there are other consumers of the trace, it will be verified when
+        # one of them dispatches it (which may happen on a background thread).
+        # Otherwise, parsing the whole trace just to look for dropped events
+        # is not worth it; the text trace (if there is one) is scanned instead.
+        if len(trace_event_bus.subscribers) == 1 and os.path.isfile(local_txt_trace_file):
+            self.logger.debug('Verifying traces.')
+            if text_trace_has_dropped_events(local_txt_trace_file):
+                self.logger.warning('Dropped events detected in {}.'.format(local_txt_trace_file))
+            else:
+                self.logger.debug('Trace verified.')
+
     def teardown(self, context):
         self.device.delete_file(os.path.join(self.device.working_directory, OUTPUT_TRACE_FILE))
 
     def on_run_end(self, context):
-        pass
+        trace_event_bus.unsubscribe(self.record_dropped_events)
+
+    def reset_dropped_events(self, trace_file):
+        self.dropped_events = False
+
+    def record_dropped_events(self, event):
+        self.dropped_events = True
+
+    def report_dropped_events(self, trace_file):
+        if self.dropped_events:
+            self.logger.warning('Dropped events detected in {}.'.format(trace_file))
+        else:
+            self.logger.debug('Trace verified.')
 
     def validate(self):
         if self.report and not self.report_on_target and os.system('which trace-cmd > /dev/null'):
@@ -14,6 +14,7 @@
 #
 # pylint: disable=attribute-defined-outside-init
 import logging
+from collections import OrderedDict
 
 import wlauto.core.signal as signal
 from wlauto import Module, Parameter
@@ -42,12 +43,11 @@ class CgroupController(object):
         if self.mount_point in [e.mount_point for e in mounted]:
             self.logger.debug('controller is already mounted.')
         else:
-            self.device.execute('mkdir -p {} 2>/dev/null'.format(self.mount_point),
-                                as_root=True)
-            self.device.execute('mount -t cgroup -o {} {} {}'.format(self.kind,
-                                                                     self.mount_name,
-                                                                     self.mount_point),
-                                as_root=True)
+            with self.device.batch(as_root=True) as batch:
+                batch.execute('mkdir -p {} 2>/dev/null'.format(self.mount_point))
+                batch.execute('mount -t cgroup -o {} {} {}'.format(self.kind,
+                                                                   self.mount_name,
+                                                                   self.mount_point))
 
 
 class CpusetGroup(object):
@@ -71,21 +71,20 @@ class CpusetGroup(object):
             cpus = list_to_ranges(cpus)
         if isiterable(mems):
             mems = list_to_ranges(mems)
-        self.device.set_sysfile_value(self.cpus_file, cpus)
-        self.device.set_sysfile_value(self.mems_file, mems)
+        self.device.set_sysfile_values(OrderedDict([(self.cpus_file, cpus), (self.mems_file, mems)]))
 
     def get(self):
-        cpus = self.device.get_sysfile_value(self.cpus_file)
-        mems = self.device.get_sysfile_value(self.mems_file)
-        return (cpus, mems)
+        values = self.device.get_sysfile_values([self.cpus_file, self.mems_file])
+        return (values[self.cpus_file], values[self.mems_file])
 
     def get_tasks(self):
         task_ids = self.device.get_sysfile_value(self.tasks_file).split()
         return map(int, task_ids)
 
     def add_tasks(self, tasks):
-        for tid in tasks:
-            self.add_task(tid)
+        with self.device.batch(as_root=True) as batch:
+            for tid in tasks:
+                batch.execute('echo {} > \'{}\''.format(tid, self.tasks_file))
 
     def add_task(self, tid):
         self.device.set_sysfile_value(self.tasks_file, tid, verify=False)
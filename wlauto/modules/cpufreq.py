@@ -1,3 +1,4 @@
+import wlauto.core.signal as signal
 from wlauto import Module
 from wlauto.exceptions import ConfigError, DeviceError
 
@@ -25,6 +26,14 @@ class CpufreqModule(Module):
 
     "core" APIs expect a core name, as defined by ``device.core_names`` list.
 
+    Available frequencies and governors, the governor currently set for each CPU,
+    and the online CPUs are read from the device once at the start of the run and
+    are cached afterwards. The cached governors and online CPUs are invalidated
+    when a CPU is hotplugged (via the device's ``hotplug_cpu``), a ``scaling_governor``
+    file is written via the device's ``set_sysfile_value(s)`` (including through the
+    ``sysfile_values`` runtime parameter), or the device is rebooted; the cached
+    governor is updated when it is set via this module.
+
     """
     capabilities = ['cpufreq']
 
@@ -36,7 +45,22 @@ class CpufreqModule(Module):
         # pylint: disable=W0201
         CpufreqModule._available_governors = {}
         CpufreqModule._available_governor_tunables = {}
+        CpufreqModule._available_frequencies = {}
+        CpufreqModule._current_governors = {}
+        CpufreqModule._online_cpus = None
         CpufreqModule.device = self.root_owner
+        signal.connect(self._on_device_init, signal.RUN_INIT, priority=1)
+        signal.connect(self._on_device_boot, signal.SUCCESSFUL_BOOT)
+
+    def invalidate_cpufreq_cache(self):
+        """
+        Discard the cached state that may change when CPUs are hotplugged, i.e. the
+        online CPUs and the governors set for them. Tables of available frequencies
+        and governors are fixed, so remain cached.
+
+        """
+        self._current_governors.clear()
+        CpufreqModule._online_cpus = None
 
     def list_available_cpu_governors(self, cpu):
         """Returns a list of governors supported by the cpu."""
@@ -52,8 +76,10 @@ class CpufreqModule(Module):
         """Returns the governor currently set for the specified CPU."""
         if isinstance(cpu, int):
             cpu = 'cpu{}'.format(cpu)
-        sysfile = '/sys/devices/system/cpu/{}/cpufreq/scaling_governor'.format(cpu)
-        return self.device.get_sysfile_value(sysfile)
+        if cpu not in self._current_governors:
+            sysfile = '/sys/devices/system/cpu/{}/cpufreq/scaling_governor'.format(cpu)
+            self._current_governors[cpu] = self.device.get_sysfile_value(sysfile)
+        return self._current_governors[cpu]
 
     def set_cpu_governor(self, cpu, governor, **kwargs):
         """
@@ -82,7 +108,10 @@ class CpufreqModule(Module):
         if governor not in supported:
             raise ConfigError('Governor {} not supported for cpu {}'.format(governor, cpu))
         sysfile = '/sys/devices/system/cpu/{}/cpufreq/scaling_governor'.format(cpu)
+        # The governor of the other CPUs in the cluster changes as well.
+        self._current_governors.clear()
         self.device.set_sysfile_value(sysfile, governor)
+        self._current_governors[cpu] = governor
         self.set_cpu_governor_tunables(cpu, governor, **kwargs)
 
     def list_available_cpu_governor_tunables(self, cpu):
@@ -161,16 +190,11 @@ class CpufreqModule(Module):
         if not could be found."""
         if isinstance(cpu, int):
             cpu = 'cpu{}'.format(cpu)
+        if cpu in self._available_frequencies:
+            return self._available_frequencies[cpu]
         try:
             cmd = 'cat /sys/devices/system/cpu/{}/cpufreq/scaling_available_frequencies'.format(cpu)
-            output = self.device.execute(cmd)
-            #available_frequencies = map(int, output.strip().split())  # pylint: disable=E1103
-            available_frequencies = []
-            for f in output.strip().split():
-                try:
-                    available_frequencies.append(int(f))
-                except ValueError:
-                    pass
+            available_frequencies = _parse_frequencies(self.device.execute(cmd))
         except DeviceError:
             # On some devices scaling_available_frequencies  is not generated.
             # http://adrynalyne-teachtofish.blogspot.co.uk/2011/11/how-to-enable-scalingavailablefrequenci.html
@@ -178,6 +202,7 @@ class CpufreqModule(Module):
             cmd = 'cat /sys/devices/system/cpu/{}/cpufreq/stats/time_in_state'.format(cpu)
             out_iter = iter(self.device.execute(cmd).strip().split())
             available_frequencies = map(int, reversed([f for f, _ in zip(out_iter, out_iter)]))
+        self._available_frequencies[cpu] = available_frequencies
         return available_frequencies
 
     def get_cpu_min_frequency(self, cpu):
@@ -344,7 +369,7 @@ class CpufreqModule(Module):
         """Returns the first *active* cpu for the cluster. If the entire cluster
         has been hotplugged, this will raise a ``ValueError``."""
         cpu_indexes = set([i for i, c in enumerate(self.device.core_clusters) if c == cluster])
-        active_cpus = sorted(list(cpu_indexes.intersection(self.device.online_cpus)))
+        active_cpus = sorted(list(cpu_indexes.intersection(self.get_cpufreq_online_cpus())))
         if not active_cpus:
             raise ValueError('All cpus for cluster {} are offline'.format(cluster))
         return active_cpus[0]
@@ -409,6 +434,12 @@ class CpufreqModule(Module):
         cpu = self.get_cluster_active_cpu(cluster)
         return self.set_cpu_max_frequency(cpu, freq)
 
+    def get_cpufreq_online_cpus(self):
+        """Returns the (cached) list of indexes of online CPUs."""
+        if self._online_cpus is None:
+            CpufreqModule._online_cpus = self.device.online_cpus
+        return self._online_cpus
+
     def get_core_online_cpu(self, core):
         for cluster in self.get_core_clusters(core):
             try:
@@ -448,3 +479,48 @@ class CpufreqModule(Module):
     def set_core_max_frequency(self, core, freq):
         for cluster in self.get_core_clusters(core):
             self.set_cluster_max_frequency(cluster, freq)
+
+    def _on_device_init(self, context):  # pylint: disable=unused-argument
+        self.invalidate_cpufreq_cache()
+        cpus = ['cpu{}'.format(c) for c in self.get_cpufreq_online_cpus()]
+        # Read the state of all online CPUs in as few commands as possible. If
+        # some of the files do not exist, leave them to be read (and any errors
+        # to be reported) when they are needed.
+        governor_files = self._read_cpufreq_files(cpus, ['scaling_available_governors', 'scaling_governor'])
+        for cpu, (available_governors, governor) in governor_files.iteritems():
+            self._available_governors[cpu] = available_governors.split()
+            self._current_governors[cpu] = governor
+        frequency_files = self._read_cpufreq_files(cpus, ['scaling_available_frequencies'])
+        for cpu, (available_frequencies,) in frequency_files.iteritems():
+            self._available_frequencies[cpu] = _parse_frequencies(available_frequencies)
+
+    def _on_device_boot(self, context):  # pylint: disable=unused-argument
+        self.invalidate_cpufreq_cache()
+
+    def _read_cpufreq_files(self, cpus, names):
+        """
+        Returns a dict mapping each of the CPUs onto the values of the named cpufreq
+        files for it, or an empty dict if not all of the files could be read.
+
+        """
+        paths = {}
+        for cpu in cpus:
+            for name in names:
+                paths[(cpu, name)] = '/sys/devices/system/cpu/{}/cpufreq/{}'.format(cpu, name)
+        try:
+            values = self.device.get_sysfile_values(paths.values())
+        except DeviceError as e:
+            self.logger.info('Could not read {} in one batch ({}); '
+                             'falling back to reading them per CPU as needed.'.format(', '.join(names), e))
+            return {}
+        return {cpu: tuple(values[paths[(cpu, name)]] for name in names) for cpu in cpus}
+
+
+def _parse_frequencies(output):
+    available_frequencies = []
+    for f in output.strip().split():
+        try:
+            available_frequencies.append(int(f))
+        except ValueError:
+            pass
+    return available_frequencies
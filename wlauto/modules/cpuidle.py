@@ -20,6 +20,9 @@ from wlauto.exceptions import DeviceError
 
 class CpuidleState(object):
 
+    # Properties that do not change, and so are read when the state is created.
+    static_properties = ['desc', 'name', 'latency', 'power']
+
     @property
     def usage(self):
         return self.get('usage')
@@ -45,16 +48,18 @@ class CpuidleState(object):
                 raise ValueError('invalid idle state name: "{}"'.format(self.id))
         return int(self.id[i:])
 
-    def __init__(self, device, index, path):
+    def __init__(self, device, index, path, values=None):
         self.device = device
         self.index = index
         self.path = path
         self.id = self.device.path.basename(self.path)
         self.cpu = self.device.path.basename(self.device.path.dirname(path))
-        self.desc = self.get('desc')
-        self.name = self.get('name')
-        self.latency = self.get('latency')
-        self.power = self.get('power')
+        if values is None:
+            values = dict((prop, self.get(prop)) for prop in self.static_properties)
+        self.desc = values['desc']
+        self.name = values['name']
+        self.latency = values['latency']
+        self.power = values['power']
 
     def get(self, prop):
         property_path = self.device.path.join(self.path, prop)
@@ -104,11 +109,19 @@ class Cpuidle(Module):
         if isinstance(cpu, int):
             cpu = 'cpu{}'.format(cpu)
         states_dir = self.device.path.join(self.device.path.dirname(self.root_path), cpu, 'cpuidle')
-        idle_states = []
+        state_paths = {}
         for state in self.device.listdir(states_dir):
             if state.startswith('state'):
-                index = int(state[5:])
-                idle_states.append(CpuidleState(self.device, index, self.device.path.join(states_dir, state)))
+                state_paths[int(state[5:])] = self.device.path.join(states_dir, state)
+        # Read the properties of all states in one go, rather than a state at a time.
+        values = self.device.get_sysfile_values([self.device.path.join(path, prop)
+                                                 for path in state_paths.itervalues()
+                                                 for prop in CpuidleState.static_properties])
+        idle_states = []
+        for index, path in sorted(state_paths.iteritems()):
+            state_values = dict((prop, values[self.device.path.join(path, prop)])
+                                for prop in CpuidleState.static_properties)
+            idle_states.append(CpuidleState(self.device, index, path, state_values))
         return idle_states
 
     def _on_device_init(self, context):  # pylint: disable=unused-argument
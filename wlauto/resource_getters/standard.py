@@ -23,15 +23,19 @@ import sys
 import shutil
 import inspect
 import httplib
+import hashlib
 import logging
 import json
+import threading
+from multiprocessing.pool import ThreadPool
 
 import requests
 
 from wlauto import ResourceGetter, GetterPriority, Parameter, NO_ONE, settings, __file__ as __base_filepath
 from wlauto.exceptions import ResourceError
-from wlauto.utils.android import ApkInfo
-from wlauto.utils.misc import ensure_directory_exists as _d, ensure_file_directory_exists as _f, sha256, urljoin
+from wlauto.utils.android import ApkInfo, get_apk_info
+from wlauto.utils.misc import ensure_directory_exists as _d, ensure_file_directory_exists as _f, urljoin
+from wlauto.utils.misc import FileHashIndex
 from wlauto.utils.types import boolean
 from wlauto.utils.revent import ReventRecording
 
@@ -348,13 +352,16 @@ class HttpGetter(ResourceGetter):
         Parameter('always_fetch', kind=boolean, default=False, global_alias='always_fetch_remote_assets',
                   description="""If ``True``, will always attempt to fetch assets from the remote, even if
                                  a local cached copy is available."""),
-        Parameter('chunk_size', kind=int, default=1024,
-                  description="""Chunk size for streaming large assets."""),
+        Parameter('chunk_size', kind=int, default=1024 * 1024,
+                  description="""Chunk size (in bytes) for streaming large assets."""),
     ]
 
     def __init__(self, resolver, **kwargs):
         super(HttpGetter, self).__init__(resolver, **kwargs)
         self.index = None
+        # Hashes of downloaded assets are kept across runs, so that they only need
+        # to be re-hashed if they have changed.
+        self.hash_index = FileHashIndex(os.path.join(settings.dependencies_directory, '__remote', 'sha256.json'))
 
     def get(self, resource, **kwargs):
         if not resource.owner:
@@ -366,6 +373,59 @@ class HttpGetter(ResourceGetter):
             return
         return self.download_asset(asset, resource.owner.name)
 
+    def prefetch(self, owner_names, jobs=1):
+        """
+        Downloads (or verifies local copies of) all assets in the index for the
+        specified owners, fetching up to ``jobs`` assets concurrently. Returns a dict
+        mapping ``(owner_name, asset_path)`` to the local path of each asset, or to
+        ``None`` if it could not be fetched.
+
+        """
+        if not self.index:
+            try:
+                self.index = self.fetch_index()
+            except requests.RequestException as e:
+                # Not fatal, as the assets may well be available locally;
+                # the index will be fetched again if they are not.
+                self.logger.warning('Could not fetch asset index; not prefetching assets: {}'.format(e))
+                return {}
+        to_fetch = []
+        for owner_name in sorted(set(owner_names)):
+            for asset in self.index.get(owner_name, []):
+                to_fetch.append((asset, owner_name))
+        if not to_fetch:
+            return {}
+
+        owners = sorted(set(owner_name for _, owner_name in to_fetch))
+        self.logger.info('Fetching {} asset(s) for {}'.format(len(to_fetch), ', '.join(owners)))
+        results = {}
+        pool = ThreadPool(max(1, min(jobs, len(to_fetch))))
+        try:
+            fetched = pool.imap_unordered(self._prefetch_asset, to_fetch)
+            total_size = 0
+            for i, (owner_name, path, local_path) in enumerate(fetched, 1):
+                results[(owner_name, path)] = local_path
+                if local_path:
+                    total_size += os.path.getsize(local_path)
+                self.logger.info('[{}/{}] {}/{} ({:.1f} MB total)'.format(i, len(to_fetch), owner_name,
+                                                                         path, total_size / 1024.0 / 1024))
+        finally:
+            pool.terminate()
+        failed = [k for k, v in results.iteritems() if v is None]
+        if failed:
+            failed_names = ', '.join('/'.join(f) for f in sorted(failed))
+            self.logger.warning('Could not fetch {} asset(s): {}'.format(len(failed), failed_names))
+        return results
+
+    def _prefetch_asset(self, asset_and_owner):
+        asset, owner_name = asset_and_owner
+        try:
+            local_path = self.download_asset(asset, owner_name)
+        except (requests.RequestException, IOError, OSError) as e:
+            self.logger.warning('Could not fetch {}/{}: {}'.format(owner_name, asset['path'], e))
+            local_path = None
+        return owner_name, asset['path'], local_path
+
     def fetch_index(self):
         if not self.url:
             return {}
@@ -382,7 +442,7 @@ class HttpGetter(ResourceGetter):
         local_path = _f(os.path.join(settings.dependencies_directory, '__remote',
                                      owner_name, asset['path'].replace('/', os.sep)))
         if os.path.exists(local_path) and not self.always_fetch:
-            local_sha = sha256(local_path)
+            local_sha = self.hash_index.sha256(local_path)
             if local_sha == asset['sha256']:
                 self.logger.debug('Local SHA256 matches; not re-downloading')
                 return local_path
@@ -392,9 +452,22 @@ class HttpGetter(ResourceGetter):
             message = 'Could not download asset "{}"; recieved "{} {}"'
             self.logger.warning(message.format(url, response.status_code, response.reason))
             return
-        with open(local_path, 'wb') as wfh:
-            for chunk in response.iter_content(chunk_size=self.chunk_size):
-                wfh.write(chunk)
+        sha = hashlib.sha256()
+        # Download to a temporary file, so that an interrupted download does not
+        # leave a truncated asset in the cache.
+        temp_path = '{}.part{}'.format(local_path, threading.current_thread().ident)
+        try:
+            with open(temp_path, 'wb') as wfh:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    wfh.write(chunk)
+                    sha.update(chunk)
+            os.rename(temp_path, local_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.hash_index.update(local_path, sha.hexdigest())
+        if sha.hexdigest() != asset['sha256']:
+            self.logger.warning('SHA256 of downloaded asset "{}" does not match the index.'.format(url))
         return local_path
 
     def geturl(self, url, stream=False):
@@ -558,14 +631,16 @@ def get_from_list_by_extension(resource, filelist, extension, version=None, vari
     filelist = [ff for ff in filelist if os.path.splitext(ff)[1].lower().endswith('.' + extension)]
     if variant:
         filelist = [ff for ff in filelist if variant.lower() in os.path.basename(ff).lower()]
+    if extension == 'apk':
+        infos = {ff: _get_apk_info(ff) for ff in filelist}
     if version:
         if extension == 'apk':
-            filelist = [ff for ff in filelist if version.lower() in ApkInfo(ff).version_name.lower()]
+            filelist = [ff for ff in filelist if version.lower() in infos[ff].version_name.lower()]
         else:
             filelist = [ff for ff in filelist if version.lower() in os.path.basename(ff).lower()]
     if extension == 'apk':
-        filelist = [ff for ff in filelist if not ApkInfo(ff).native_code or resource.platform in ApkInfo(ff).native_code]
-        filelist = [ff for ff in filelist if resource.uiauto == ('com.arm.wlauto.uiauto' in ApkInfo(ff).package)]
+        filelist = [ff for ff in filelist if not infos[ff].native_code or resource.platform in infos[ff].native_code]
+        filelist = [ff for ff in filelist if resource.uiauto == ('com.arm.wlauto.uiauto' in infos[ff].package)]
     if len(filelist) == 1:
         return filelist[0]
     elif not filelist:
@@ -581,3 +656,9 @@ def get_owner_path(resource):
         return os.path.join(os.path.dirname(__base_filepath), 'common')
     else:
         return os.path.dirname(sys.modules[resource.owner.__module__].__file__)
+
+
+def _get_apk_info(path):
+    if os.path.isfile(path):
+        return get_apk_info(path)  # cached
+    return ApkInfo(path)
@@ -21,8 +21,13 @@ from wlauto import ResultProcessor, Parameter
 from wlauto.core import signal
 from wlauto.exceptions import ConfigError, DeviceError
 from wlauto.instrumentation import instrument_is_installed
-from wlauto.utils.power import report_power_stats
+from wlauto.utils.power import report_power_stats, PowerStatsCollector
+from wlauto.utils.trace_bus import trace_event_bus, get_trace_file
 from wlauto.utils.misc import unique
+from wlauto.utils.lazyimport import lazy_import
+
+
+np = lazy_import('numpy')
 
 
 class CpuStatesProcessor(ResultProcessor):
@@ -36,9 +41,10 @@ class CpuStatesProcessor(ResultProcessor):
 
     .. note:: trace-cmd instrument must be enabled and configured to collect
               at least ``power:cpu_idle`` and ``power:cpu_frequency`` events.
-              Reporting should also be enabled (it is by default) as
-              ``cpustate`` parses the text version of the trace.
-              Finally, the device should have ``cpuidle`` module installed.
+              If reporting is enabled (it is by default), ``cpustate`` parses
+              the text version of the trace; otherwise, the binary ``trace.dat``
+              is decoded directly (which avoids the need for ``trace-cmd`` on the
+              host). Finally, the device should have ``cpuidle`` module installed.
 
     This generates two reports for the run:
 
@@ -75,6 +81,9 @@ class CpuStatesProcessor(ResultProcessor):
 
     '''
 
+    thread_safe = True
+    queries_device = True
+
     parameters = [
         Parameter('first_cluster_state', kind=int, default=2,
                   description="""
@@ -135,7 +144,13 @@ class CpuStatesProcessor(ResultProcessor):
                   If this parameter is set to ``True``, the processor will assuming that cores are
                   running prior to the begining of the issue, and they will leave unknown state on
                   the first frequency transition.
-                  """)
+                  """),
+        Parameter('columnar_parsing', kind=bool, default=False,
+                  description="""
+                  Parse the trace in large blocks into per-event-type columns, instead of
+                  creating an object for every event in the trace. This is considerably
+                  faster for large traces, but requires ``numpy`` to be installed on the host.
+                  """),
     ]
 
     def validate(self):
@@ -146,6 +161,8 @@ class CpuStatesProcessor(ResultProcessor):
             execution.
             '''
             raise ConfigError(message.format(self.name).strip())
+        if self.columnar_parsing and np is None:
+            raise ConfigError('columnar_parsing requires numpy Python package to be installed.')
 
     def initialize(self, context):
         # pylint: disable=attribute-defined-outside-init
@@ -163,9 +180,18 @@ class CpuStatesProcessor(ResultProcessor):
         self.idle_state_names = [idle_states[i] for i in sorted(idle_states.keys())]
         self.num_idle_states = len(self.idle_state_names)
         self.iteration_reports = OrderedDict()
-        self.max_freq_list = []
+        # iteration output directory --> max frequency of each core at the start
+        # of that iteration
+        self.max_freq_lists = {}
+        self.collector = None
         # priority -19: just higher than the slow_start of instrumentation
         signal.connect(self.set_initial_state, signal.BEFORE_WORKLOAD_EXECUTION, priority=-19)
+        if not self.columnar_parsing:
+            # Power events are obtained from the shared trace event bus, so that the
+            # trace is only parsed once for all processors that need it.
+            trace_event_bus.subscribe(self.update_power_stats,
+                                      names=['cpu_idle', 'cpu_frequency', 'print'],
+                                      on_start=self.start_power_stats)
 
     def set_initial_state(self, context):
         # TODO: this does not play well with hotplug but leaving as-is, as this will be changed with
@@ -178,7 +204,7 @@ class CpuStatesProcessor(ResultProcessor):
         device = context.device
         cluster_freqs = {}
         cluster_max_freqs = {}
-        self.max_freq_list = []
+        max_freq_list = []
         for c in unique(device.core_clusters):
             try:
                 cluster_freqs[c] = device.get_cluster_cur_frequency(c)
@@ -187,10 +213,14 @@ class CpuStatesProcessor(ResultProcessor):
                 cluster_freqs[c] = None
                 cluster_max_freqs[c] = None
         for i, c in enumerate(device.core_clusters):
-            self.max_freq_list.append(cluster_max_freqs[c])
+            max_freq_list.append(cluster_max_freqs[c])
             entry = 'CPU {} FREQUENCY: {} kHZ'.format(i, cluster_freqs[c])
             device.set_sysfile_value('/sys/kernel/debug/tracing/trace_marker',
                                      entry, verify=False)
+        # Recorded per iteration, as runtime parameters may change frequencies
+        # between specs, and previous iterations' results may still be waiting
+        # to be processed (see parallel_result_processing).
+        self.max_freq_lists[os.path.abspath(context.output_directory)] = max_freq_list
 
         # Nudge each cpu to force idle state transitions in the trace
         self.logger.debug('Nudging all cores awake...')
@@ -201,36 +231,36 @@ class CpuStatesProcessor(ResultProcessor):
             except DeviceError:
                 self.logger.warning("Failed to nudge CPU %s, has it been hot plugged out?", i)
 
+    def start_power_stats(self, trace_file):
+        # The trace is located in the iteration's output directory.
+        options = self._get_power_stats_options(os.path.dirname(trace_file))
+        self.collector = PowerStatsCollector(**options)
+
+    def update_power_stats(self, event):
+        self.collector.update(event)
+
     def process_iteration_result(self, result, context):
-        trace = context.get_artifact('txttrace')
-        if not trace:
-            self.logger.debug('Text trace does not appear to have been generated; skipping this iteration.')
+        try:
+            self._process_iteration_trace(context)
+        finally:
+            self.max_freq_lists.pop(os.path.abspath(context.output_directory), None)
+
+    def _process_iteration_trace(self, context):
+        trace_file = get_trace_file(context)
+        if not trace_file:
+            self.logger.debug('Trace does not appear to have been generated; skipping this iteration.')
             return
         self.logger.debug('Generating power state reports from trace...')
-        if self.create_timeline:
-            timeline_csv_file = os.path.join(context.output_directory, 'power_states.csv')
+        if self.columnar_parsing:
+            options = self._get_power_stats_options(context.output_directory)
+            reports = report_power_stats(trace_file, columnar=True, **options)
         else:
-            timeline_csv_file = None
-        if self.create_utilization_timeline:
-            cpu_utilisation = os.path.join(context.output_directory, 'cpu_utilisation.csv')
-        else:
-            cpu_utilisation = None
-
-        reports = report_power_stats(  # pylint: disable=unbalanced-tuple-unpacking
-            trace_file=trace.path,
-            idle_state_names=self.idle_state_names,
-            core_names=self.core_names,
-            core_clusters=self.core_clusters,
-            num_idle_states=self.num_idle_states,
-            first_cluster_state=self.first_cluster_state,
-            first_system_state=self.first_system_state,
-            use_ratios=self.use_ratios,
-            timeline_csv_file=timeline_csv_file,
-            cpu_utilisation=cpu_utilisation,
-            max_freq_list=self.max_freq_list,
-            start_marker_handling=self.start_marker_handling,
-            no_idle=self.no_idle,
-        )
+            trace_event_bus.dispatch(trace_file)
+            if self.collector is None:
+                self.logger.debug('No power events were dispatched for this iteration.')
+                return
+            reports = self.collector.report()
+            self.collector = None
         parallel_report = reports.pop(0)
         powerstate_report = reports.pop(0)
         if parallel_report is None:
@@ -247,6 +277,31 @@ class CpuStatesProcessor(ResultProcessor):
             parallel_report.write(os.path.join(context.output_directory, 'parallel.csv'))
             powerstate_report.write(os.path.join(context.output_directory, 'cpustates.csv'))
 
+    def finalize(self, context):
+        trace_event_bus.unsubscribe(self.update_power_stats)
+
+    def _get_power_stats_options(self, output_directory):
+        if self.create_timeline:
+            timeline_csv_file = os.path.join(output_directory, 'power_states.csv')
+        else:
+            timeline_csv_file = None
+        if self.create_utilization_timeline:
+            cpu_utilisation = os.path.join(output_directory, 'cpu_utilisation.csv')
+        else:
+            cpu_utilisation = None
+        return dict(idle_state_names=self.idle_state_names,
+                    core_names=self.core_names,
+                    core_clusters=self.core_clusters,
+                    num_idle_states=self.num_idle_states,
+                    first_cluster_state=self.first_cluster_state,
+                    first_system_state=self.first_system_state,
+                    use_ratios=self.use_ratios,
+                    timeline_csv_file=timeline_csv_file,
+                    cpu_utilisation=cpu_utilisation,
+                    max_freq_list=self.max_freq_lists.get(os.path.abspath(output_directory), []),
+                    start_marker_handling=self.start_marker_handling,
+                    no_idle=self.no_idle)
+
     def process_run_result(self, result, context):  # pylint: disable=too-many-locals
         if not self.iteration_reports:
             self.logger.warning('No power state reports generated.')
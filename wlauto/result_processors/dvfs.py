@@ -15,10 +15,20 @@
 
 import os
 import csv
-import re
+from array import array
 
 from wlauto import ResultProcessor, settings, instrumentation
 from wlauto.exceptions import ConfigError, ResultProcessorError
+from wlauto.utils.power import PowerStateProcessor, stream_cpu_power_transitions, UNKNOWN_FREQUENCY
+from wlauto.utils.trace_bus import trace_event_bus, get_trace_file
+
+
+# Time spent by cores in an unknown state (e.g. before their first power event
+# in the trace) is reported as "OFFLINE".
+OFFLINE_STATE = -1
+# On IKS devices, the core in the inactive cluster is reported as being in
+# this idle state.
+IKS_POWERDOWN_STATE = 2
 
 
 class DVFS(ResultProcessor):
@@ -37,26 +47,27 @@ class DVFS(ResultProcessor):
 
     """
 
+    thread_safe = True
+    queries_device = True
+
     def __init__(self, **kwargs):
         super(DVFS, self).__init__(**kwargs)
         self.device = None
-        self.infile = None
         self.outfile = None
-        self.current_cluster = None
-        self.currentstates_of_clusters = []
-        self.current_frequency_of_clusters = []
-        self.timestamp = []
-        self.state_time_map = {}  # hold state at timestamp
-        self.cpuid_time_map = {}  # hold cpuid at timestamp
-        self.cpu_freq_time_spent = {}
-        self.cpuids_of_clusters = []
-        self.power_state = [0, 1, 2, 3]
-        self.UNKNOWNSTATE = 4294967295
         self.multiply_factor = None
         self.corename_of_clusters = []
         self.numberofcores_in_cluster = []
         self.minimum_frequency_cluster = []
         self.idlestate_description = {}
+        self.cpu_minimum_frequency = []
+        self.num_columns = None
+        # per-trace state
+        self.ps_processor = None
+        self.states = []
+        self.state_index = {}
+        self.residency = None
+        self.current_states = None
+        self.last_timestamp = None
 
     def validate(self):
         if not instrumentation.instrument_is_installed('trace-cmd'):
@@ -115,262 +126,179 @@ class DVFS(ResultProcessor):
                     self.minimum_frequency_cluster.append(offline_value)
                 else:
                     self.minimum_frequency_cluster.append(self.device.iks_switch_frequency)
+        # Until its frequency is known, an active core is assumed to be running
+        # at the minimum frequency of its cluster (on IKS devices, all cores
+        # start off in the first cluster).
+        if self.device.scheduler == 'iks':
+            self.cpu_minimum_frequency = [self.minimum_frequency_cluster[0]] * self.device.number_of_cores
+        else:
+            self.cpu_minimum_frequency = [self.minimum_frequency_cluster[c] for c in self.device.core_clusters]
+        self.num_columns = self.device.number_of_cores * self.multiply_factor
+        trace_event_bus.subscribe(self.record_event, names=['cpu_idle', 'cpu_frequency', 'print'],
+                                  filter_markers=True, on_start=self.reset_trace_data)
 
     def process_iteration_result(self, result, context):
         """
-        Parse the trace.txt for each iteration,  calculate DVFS residency state/frequencies
-        and dump the result in csv and flush the data for next iteration.
+        Obtain the power events for each iteration from the trace event bus
+        (residency is accumulated as they are dispatched) and dump the result
+        in csv.
         """
-        self.infile = os.path.join(context.output_directory, 'trace.txt')
-        if os.path.isfile(self.infile):
-            self.logger.debug('Running result_processor "dvfs"')
-            self.outfile = os.path.join(settings.output_directory, 'dvfs.csv')
-            self.flush_parse_initialize()
-            self.calculate()
-            self.percentage()
-            self.generate_csv(context)
-            self.logger.debug('Completed result_processor "dvfs"')
-        else:
-            self.logger.debug('trace.txt not found.')
+        trace_file = get_trace_file(context)
+        if not trace_file:
+            self.logger.debug('trace not found.')
+            return
+        self.logger.debug('Running result_processor "dvfs"')
+        self.outfile = os.path.join(settings.output_directory, 'dvfs.csv')
+        trace_event_bus.dispatch(trace_file)
+        if self.residency is None:
+            self.logger.debug('No power events were dispatched for this iteration.')
+            return
+        if self.ps_processor.exceptions:
+            self.logger.warning('There were errors while processing trace:')
+            for e in self.ps_processor.exceptions:
+                self.logger.warning(str(e))
+        self.generate_csv(context)
+        self.ps_processor = None
+        self.residency = None
+        self.logger.debug('Completed result_processor "dvfs"')
+
+    def finalize(self, context):
+        trace_event_bus.unsubscribe(self.record_event)
 
-    def flush_parse_initialize(self):
+    def reset_trace_data(self, trace_file):
         """
-        Store state, cpu_id for each timestamp from trace.txt and flush all the values for
-        next iterations.
+        Start tracking power states for a new trace, preallocating per-core
+        residency for the states that are known in advance.
         """
-        self.current_cluster = 0
-        self.current_frequency_of_clusters = []
-        self.timestamp = []
-        self.currentstates_of_clusters = []
-        self.state_time_map = {}
-        self.cpuid_time_map = {}
-        self.cpu_freq_time_spent = {}
-        self.cpuids_of_clusters = []
-        self.parse()  # Parse trace.txt generated from trace-cmd instrumentation
-        # Initialize the states of each core of clusters and frequency of
-        # each clusters with its minimum freq
-        # cpu_id is assigned for each of clusters.
-        # For IKS devices cpuid remains same in other clusters
-        # and for other it will increment by 1
-        count = 0
-        for cluster, cores_number in enumerate(self.numberofcores_in_cluster):
-            self.currentstates_of_clusters.append([-1 for dummy in range(cores_number)])
-            self.current_frequency_of_clusters.append(self.minimum_frequency_cluster[cluster])
-            if self.device.scheduler == 'iks':
-                self.cpuids_of_clusters.append([j for j in range(cores_number)])
-            else:
-                self.cpuids_of_clusters.append(range(count, count + cores_number))
-                count += cores_number
+        self.ps_processor = PowerStateProcessor(self.device.core_clusters,
+                                                num_idle_states=len(self.idlestate_description))
+        self.states = []
+        self.state_index = {}
+        self.residency = [array('d') for _ in xrange(self.num_columns)]
+        known_states = [OFFLINE_STATE] + range(len(self.idlestate_description)) + self.minimum_frequency_cluster
+        for state in known_states:
+            self.get_state_index(state)
+        self.current_states = None
+        self.last_timestamp = None
 
-        # Initialize the time spent in each state/frequency for each core.
-        for i in range(self.device.number_of_cores * self.multiply_factor):
-            self.cpu_freq_time_spent["cpu{}".format(i)] = {}
-            for j in self.unique_freq():
-                self.cpu_freq_time_spent["cpu{}".format(i)][j] = 0
-            # To determine offline -1 state is added
-            offline_value = -1
-            self.cpu_freq_time_spent["cpu{}".format(i)][offline_value] = 0
-            if 0 not in self.unique_freq():
-                self.cpu_freq_time_spent["cpu{}".format(i)][0] = 0
-
-    def update_cluster_freq(self, state, cpu_id):
-        """ Update the cluster frequency and current cluster"""
-        # For IKS devices cluster changes only possible when
-        # freq changes, for other it is determine by cpu_id.
-        if self.device.scheduler != 'iks':
-            self.current_cluster = self.get_cluster(cpu_id, state)
-        if self.get_state_name(state) == "freqstate":
-            self.current_cluster = self.get_cluster(cpu_id, state)
-            self.current_frequency_of_clusters[self.current_cluster] = state
-
-    def get_cluster(self, cpu_id, state):
-        # For IKS if current state is greater than switch
-        # freq then it is in cluster2 else cluster1
-        # For other, Look the current cpu_id and check this id
-        # belong to which cluster.
-        if self.device.scheduler == 'iks':
-            return 1 if state >= self.device.iks_switch_frequency else 0
-        else:
-            for cluster, cpuids_list in enumerate(self.cpuids_of_clusters):
-                if cpu_id in cpuids_list:
-                    return cluster
-
-    def get_cluster_freq(self):
-        return self.current_frequency_of_clusters[self.current_cluster]
-
-    def update_state(self, state, cpu_id):  # pylint: disable=R0912
+    def record_event(self, event):
         """
-        Update state of each cores in every cluster.
-        This is done for each timestamp.
+        Update the power states of the cores from an event inside the marked
+        region of the trace.
         """
-        POWERDOWN = 2
-        offline_value = -1
-        # if state is in unknowstate, then change state of current cpu_id
-        # with cluster freq of current cluster.
-        # if state is in powerstate then change state with that power state.
-        if self.get_state_name(state) in ["unknownstate", "powerstate"]:
-            for i in range(len(self.cpuids_of_clusters[self.current_cluster])):
-                if cpu_id == self.cpuids_of_clusters[self.current_cluster][i]:
-                    if self.get_state_name(state) == "unknownstate":
-                        self.currentstates_of_clusters[self.current_cluster][i] = self.current_frequency_of_clusters[self.current_cluster]
-                    elif self.get_state_name(state) == "powerstate":
-                        self.currentstates_of_clusters[self.current_cluster][i] = state
-        # If state is in freqstate then update the state with current state.
-        # For IKS, if all cores is in power down and current state is freqstate
-        # then update the all the cores in current cluster to current state
-        # and other state cluster changed to Power down.
-        if self.get_state_name(state) == "freqstate":
-            for i, j in enumerate(self.currentstates_of_clusters[self.current_cluster]):
-                if j != offline_value:
-                    self.currentstates_of_clusters[self.current_cluster][i] = state
-                if cpu_id == self.cpuids_of_clusters[self.current_cluster][i]:
-                    self.currentstates_of_clusters[self.current_cluster][i] = state
-            if self.device.scheduler == 'iks':
-                check = False  # All core in cluster is power down
-                for i in range(len(self.currentstates_of_clusters[self.current_cluster])):
-                    if self.currentstates_of_clusters[self.current_cluster][i] != POWERDOWN:
-                        check = True
-                        break
-                if not check:
-                    for i in range(len(self.currentstates_of_clusters[self.current_cluster])):
-                        self.currentstates_of_clusters[self.current_cluster][i] = self.current_frequency_of_clusters[self.current_cluster]
-                for cluster, state_list in enumerate(self.currentstates_of_clusters):
-                    if cluster != self.current_cluster:
-                        for j in range(len(state_list)):
-                            self.currentstates_of_clusters[i][j] = POWERDOWN
+        ps_processor = self.ps_processor
+        for transition in stream_cpu_power_transitions([event]):
+            try:
+                power_state = ps_processor.update_power_state(transition)
+            except Exception as e:  # pylint: disable=broad-except
+                ps_processor.exceptions.append(e)
+                continue
+            if power_state.timestamp is not None:
+                self.update_residency(power_state.timestamp, power_state.cpus)
 
-    def unique_freq(self):
-        """ Determine the unique Frequency and state"""
-        unique_freq = []
-        for i in self.timestamp:
-            if self.state_time_map[i] not in unique_freq and self.state_time_map[i] != self.UNKNOWNSTATE:
-                unique_freq.append(self.state_time_map[i])
-        for i in self.minimum_frequency_cluster:
-            if i not in unique_freq:
-                unique_freq.append(i)
-        return unique_freq
-
-    def parse(self):
+    def update_residency(self, timestamp, cpu_states):
         """
-        Parse the trace.txt ::
-
-            store timestamp, state, cpu_id
-            ---------------------------------------------------------------------------------
-                                |timestamp|                       |state|        |cpu_id|
-            <idle>-0     [001]   294.554380: cpu_idle:             state=4294967295 cpu_id=1
-            <idle>-0     [001]   294.554454: power_start:          type=1 state=0 cpu_id=1
-            <idle>-0     [001]   294.554458: cpu_idle:             state=0 cpu_id=1
-            <idle>-0     [001]   294.554464: power_end:            cpu_id=1
-            <idle>-0     [001]   294.554471: cpu_idle:             state=4294967295 cpu_id=1
-            <idle>-0     [001]   294.554590: power_start:          type=1 state=0 cpu_id=1
-            <idle>-0     [001]   294.554593: cpu_idle:             state=0 cpu_id=1
-            <idle>-0     [001]   294.554636: power_end:            cpu_id=1
-            <idle>-0     [001]   294.554639: cpu_idle:             state=4294967295 cpu_id=1
-            <idle>-0     [001]   294.554669: power_start:          type=1 state=0 cpu_id=1
-
-
+        Add the time since the previous update to the states each core has
+        been in, and record the states the cores are in from now on.
         """
-        pattern = re.compile(r'\s+(?P<time>\S+)\S+\s*(?P<desc>(cpu_idle:|cpu_frequency:))\s*state=(?P<state>\d+)\s*cpu_id=(?P<cpu_id>\d+)')
-        start_trace = False
-        stop_trace = False
-        with open(self.infile, 'r') as f:
-            for line in f:
-                #Start collecting data from label "TRACE_MARKER_START" and
-                #stop with label "TRACE_MARKER_STOP"
-                if line.find("TRACE_MARKER_START") != -1:
-                    start_trace = True
-                if line.find("TRACE_MARKER_STOP") != -1:
-                    stop_trace = True
-                if start_trace and not stop_trace:
-                    match = pattern.search(line)
-                    if match:
-                        self.timestamp.append(float(match.group('time')))
-                        self.state_time_map[float(match.group('time'))] = int(match.group('state'))
-                        self.cpuid_time_map[float(match.group('time'))] = int(match.group('cpu_id'))
+        if self.last_timestamp is not None:
+            delta = timestamp - self.last_timestamp
+            residency = self.residency
+            for column, index in enumerate(self.current_states):
+                residency[column][index] += delta
+        self.last_timestamp = timestamp
+        self.current_states = self.get_column_states(cpu_states)
 
-    def get_state_name(self, state):
-        if state in self.power_state:
-            return "powerstate"
-        elif state == self.UNKNOWNSTATE:
-            return "unknownstate"
+    def get_column_states(self, cpu_states):
+        """
+        Returns the index of the state for each of the cores (as they appear in the
+        ``dvfs.csv`` columns) based on the ``CpuPowerState``s of the cores in the trace.
+        """
+        iks = self.device.scheduler == 'iks'
+        if iks:
+            column_states = [self.get_state_index(IKS_POWERDOWN_STATE)] * self.num_columns
         else:
-            return "freqstate"
+            column_states = [None] * self.num_columns
+        for cpu, cpu_state in enumerate(cpu_states):
+            if cpu_state.idle_state is None:
+                state = OFFLINE_STATE
+            elif cpu_state.idle_state >= 0:
+                state = cpu_state.idle_state
+            elif cpu_state.frequency is None or cpu_state.frequency == UNKNOWN_FREQUENCY:
+                state = self.cpu_minimum_frequency[cpu]
+            else:
+                state = cpu_state.frequency
+            column = cpu
+            # For IKS, the cluster is determined by the frequency, and cores in
+            # the second cluster are reported after those in the first.
+            if iks and cpu_state.frequency >= self.device.iks_switch_frequency:
+                column += self.numberofcores_in_cluster[0]
+            column_states[column] = self.get_state_index(state)
+        return column_states
 
-    def populate(self, time1, time2):
-        diff = time2 - time1
-        for cluster, states_list in enumerate(self.currentstates_of_clusters):
-            for k, j in enumerate(states_list):
-                if self.device.scheduler == 'iks' and cluster == 1:
-                    self.cpu_freq_time_spent["cpu{}".format(self.cpuids_of_clusters[cluster][k] + len(self.currentstates_of_clusters[0]))][j] += diff
-                else:
-                    self.cpu_freq_time_spent["cpu{}".format(self.cpuids_of_clusters[cluster][k])][j] += diff
+    def get_state_index(self, state):
+        index = self.state_index.get(state)
+        if index is None:
+            index = len(self.states)
+            self.states.append(state)
+            self.state_index[state] = index
+            for column in self.residency:
+                column.append(0.0)
+        return index
 
-    def calculate(self):
-        for i in range(len(self.timestamp) - 1):
-            self.update_cluster_freq(self.state_time_map[self.timestamp[i]], self.cpuid_time_map[self.timestamp[i]])
-            self.update_state(self.state_time_map[self.timestamp[i]], self.cpuid_time_map[self.timestamp[i]])
-            self.populate(self.timestamp[i], self.timestamp[i + 1])
+    def get_state_name(self, state):
+        ghz_conversion = 1000000
+        mhz_conversion = 1000
+        if "state{}".format(state) in self.idlestate_description:
+            return self.idlestate_description["state{}".format(state)]
+        state_value = float(state)
+        if state_value / ghz_conversion >= 1:
+            return "{} Ghz".format(state_value / ghz_conversion)
+        else:
+            return "{} Mhz".format(state_value / mhz_conversion)
 
     def percentage(self):
         """Normalize the result with total execution time."""
-        temp = self.cpu_freq_time_spent.copy()
-        for i in self.cpu_freq_time_spent:
-            total = 0
-            for j in self.cpu_freq_time_spent[i]:
-                total += self.cpu_freq_time_spent[i][j]
-            for j in self.cpu_freq_time_spent[i]:
-                if total != 0:
-                    temp[i][j] = self.cpu_freq_time_spent[i][j] * 100 / total
-                else:
-                    temp[i][j] = 0
-        return temp
+        percentages = []
+        for column in self.residency:
+            total = sum(column)
+            if total != 0:
+                percentages.append([value * 100 / total for value in column])
+            else:
+                percentages.append([0] * len(column))
+        return percentages
 
-    def generate_csv(self, context):  # pylint: disable=R0912,R0914
-        """ generate the '''dvfs.csv''' with the state, frequency and cores """
-        temp = self.percentage()
-        total_state = self.unique_freq()
-        offline_value = -1
-        ghz_conversion = 1000000
-        mhz_conversion = 1000
-        with open(self.outfile, 'a+') as f:
+    def generate_csv(self, context):
+        """ generate the ``dvfs.csv`` with the state, frequency and cores """
+        percentages = self.percentage()
+        write_header = not os.path.isfile(self.outfile) or not os.path.getsize(self.outfile)
+        with open(self.outfile, 'a') as f:
             writer = csv.writer(f, delimiter=',')
-            reader = csv.reader(f)
             # Create the header in the format below
             # workload name, iteration, state, A7 CPU0,A7 CPU1,A7 CPU2,A7 CPU3,A15 CPU4,A15 CPU5
-            if sum(1 for row in reader) == 0:
+            if write_header:
                 header_row = ['workload', 'iteration', 'state']
                 count = 0
-                for cluster, states_list in enumerate(self.currentstates_of_clusters):
-                    for dummy_index in range(len(states_list)):
+                for cluster, cores_number in enumerate(self.numberofcores_in_cluster):
+                    for dummy_index in range(cores_number):
                         header_row.append("{} CPU{}".format(self.corename_of_clusters[cluster], count))
                         count += 1
                 writer.writerow(header_row)
-            if offline_value in total_state:
-                total_state.remove(offline_value)  # remove the offline state
-            for i in sorted(total_state):
-                temprow = []
-                temprow.extend([context.result.spec.label, context.result.iteration])
-                if "state{}".format(i) in self.idlestate_description:
-                    temprow.append(self.idlestate_description["state{}".format(i)])
-                else:
-                    state_value = float(i)
-                    if state_value / ghz_conversion >= 1:
-                        temprow.append("{} Ghz".format(state_value / ghz_conversion))
-                    else:
-                        temprow.append("{} Mhz".format(state_value / mhz_conversion))
-                for j in range(self.device.number_of_cores * self.multiply_factor):
-                    temprow.append("{0:.3f}".format(temp["cpu{}".format(j)][i]))
+            # Report the states the cores have spent time in, along with the
+            # minimum frequencies of the clusters.
+            for state in sorted(self.states):
+                if state == OFFLINE_STATE:
+                    continue
+                index = self.state_index[state]
+                if state not in self.minimum_frequency_cluster and not any(c[index] for c in self.residency):
+                    continue
+                temprow = [context.result.spec.label, context.result.iteration, self.get_state_name(state)]
+                temprow.extend("{0:.3f}".format(p[index]) for p in percentages)
                 writer.writerow(temprow)
-            check_off = True  # Checking whether core is OFFLINE
-            for i in range(self.device.number_of_cores * self.multiply_factor):
-                temp_val = "{0:.3f}".format(temp["cpu{}".format(i)][offline_value])
-                if float(temp_val) > 1:
-                    check_off = False
-                    break
-            if check_off is False:
-                temprow = []
-                temprow.extend([context.result.spec.label, context.result.iteration])
-                temprow.append("OFFLINE")
-                for i in range(self.device.number_of_cores * self.multiply_factor):
-                    temprow.append("{0:.3f}".format(temp["cpu{}".format(i)][offline_value]))
+            # Only report OFFLINE if any core spent a significant portion of
+            # time in it.
+            offline = ["{0:.3f}".format(p[self.state_index[OFFLINE_STATE]]) for p in percentages]
+            if any(float(value) > 1 for value in offline):
+                temprow = [context.result.spec.label, context.result.iteration, "OFFLINE"]
+                temprow.extend(offline)
                 writer.writerow(temprow)
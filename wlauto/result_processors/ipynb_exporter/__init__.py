@@ -20,17 +20,15 @@ import os
 import shutil
 import webbrowser
 
-try:
-    import jinja2
-except ImportError:
-    jinja2 = None
-
 from wlauto import File, Parameter, ResultProcessor
 from wlauto.exceptions import ConfigError, ResultProcessorError
-import wlauto.utils.ipython as ipython
+from wlauto.utils.lazyimport import lazy_import
 from wlauto.utils.misc import open_file
 from wlauto.utils.types import file_path
 
+jinja2 = lazy_import('jinja2')
+# wlauto.utils.ipython imports IPython itself, so that is deferred until used as well.
+ipython = lazy_import('wlauto.utils.ipython')
 
 DEFAULT_NOTEBOOK_TEMPLATE = 'template.ipynb'
 
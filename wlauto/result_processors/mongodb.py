@@ -16,20 +16,18 @@
 
 #pylint: disable=E1101,W0201
 import os
-import re
 import string
 import tarfile
-
-try:
-    import pymongo
-    from bson.objectid import ObjectId
-    from gridfs import GridFS
-except ImportError:
-    pymongo = None
+from multiprocessing.pool import ThreadPool
 
 from wlauto import ResultProcessor, Parameter, Artifact
 from wlauto.exceptions import ResultProcessorError
 from wlauto.utils.misc import as_relative
+from wlauto.utils.lazyimport import lazy_import
+
+pymongo = lazy_import('pymongo')
+bson = lazy_import('bson')
+gridfs = lazy_import('gridfs')
 
 
 __bad_chars = '$.'
@@ -45,6 +43,12 @@ class MongodbUploader(ResultProcessor):
 
     MongoDB is a popular document-based data store (NoSQL database).
 
+    Artifacts are uploaded to GridFS in the background, so that uploading large
+    files does not hold up execution; iteration results are written in batches.
+    Everything will have been uploaded by the time the processor is finalized.
+
+    .. note:: This requires pymongo 3.0 or later.
+
     """
 
     parameters = [
@@ -63,6 +67,13 @@ class MongodbUploader(ResultProcessor):
         Parameter('authentication', kind=dict, default={},
                   description='''If specified, this will be passed to db.authenticate() upon connection;
                                  please pymongo documentaion authentication examples for detail.'''),
+        Parameter('upload_threads', kind=int, default=4,
+                  description='''The maximum number of artifacts that will be uploaded to GridFS
+                                 concurrently.'''),
+        Parameter('batch_size', kind=int, default=20,
+                  description='''The number of iteration results that will be accumulated before
+                                 they are written to the database in a single bulk operation. Any
+                                 remaining results are written at the end of the run.'''),
     ]
 
     def initialize(self, context):
@@ -71,14 +82,17 @@ class MongodbUploader(ResultProcessor):
         try:
             self.client = pymongo.MongoClient(self.host, self.port, **self.extra_params)
         except pymongo.errors.PyMongoError, e:
-            raise ResultProcessorError('Error connecting to mongod: {}'.fromat(e))
+            raise ResultProcessorError('Error connecting to mongod: {}'.format(e))
+        self.start_run(context)
+
+    def start_run(self, context):
         self.dbc = self.client[self.db]
-        self.fs = GridFS(self.dbc)
+        self.fs = gridfs.GridFS(self.dbc)
         if self.authentication:
             if not self.dbc.authenticate(**self.authentication):
                 raise ResultProcessorError('Authentication to database {} failed.'.format(self.db))
 
-        self.run_result_dbid = ObjectId()
+        self.run_result_dbid = bson.ObjectId()
         run_doc = context.run_info.to_dict()
 
         wa_adapter = run_doc['device']
@@ -95,17 +109,11 @@ class MongodbUploader(ResultProcessor):
             workload['name'] = workload['workload_name']
             del workload['workload_name']
             workload['results'] = []
-        self.run_dbid = self.dbc.runs.insert(run_doc)
+        self.run_dbid = self.dbc.runs.insert_one(run_doc).inserted_id
 
         prefix = context.run_info.project if context.run_info.project else '[NOPROJECT]'
         run_part = context.run_info.run_name or context.run_info.uuid.hex
-        self.gridfs_dir = os.path.join(prefix, run_part)
-        i = 0
-        while self.gridfs_directory_exists(self.gridfs_dir):
-            if self.gridfs_dir.endswith('-{}'.format(i)):
-                self.gridfs_dir = self.gridfs_dir[:-2]
-            i += 1
-            self.gridfs_dir += '-{}'.format(i)
+        self.gridfs_dir = self.get_unused_gridfs_directory(os.path.join(prefix, run_part))
 
         # Keep track of all generated artefacts, so that we know what to
         # include in the tarball. The tarball will contains raw artificats
@@ -113,6 +121,11 @@ class MongodbUploader(ResultProcessor):
         # new data) and all files in the results dir that have not been marked
         # as artificats.
         self.artifacts = []
+        # Updates for iteration results that have not been written yet, and
+        # uploads that are still in progress.
+        self.pending_updates = []
+        self.uploads = []
+        self.upload_pool = ThreadPool(max(1, self.upload_threads))
 
     def export_iteration_result(self, result, context):
         r = {}
@@ -126,8 +139,10 @@ class MongodbUploader(ResultProcessor):
             r['metrics'].append(md)
         iteration_artefacts = [self.upload_artifact(context, a) for a in context.iteration_artifacts]
         r['artifacts'] = [e for e in iteration_artefacts if e is not None]
-        self.dbc.runs.update({'_id': self.run_dbid, 'workloads.id': context.spec.id},
-                             {'$push': {'workloads.$.results': r}})
+        query = {'_id': self.run_dbid, 'workloads': {'$elemMatch': {'id': context.spec.id}}}
+        self.pending_updates.append(pymongo.UpdateOne(query, {'$push': {'workloads.$.results': r}}))
+        if len(self.pending_updates) >= self.batch_size:
+            self.write_pending_updates()
 
     def export_run_result(self, result, context):
         run_artifacts = [self.upload_artifact(context, a) for a in context.run_artifacts]
@@ -144,10 +159,37 @@ class MongodbUploader(ResultProcessor):
             'duration': context.run_info.duration.total_seconds(),
             'artifacts': [e for e in run_artifacts if e is not None],
         }
-        self.dbc.runs.update({'_id': self.run_dbid}, {'$set': run_stats})
+        self.write_pending_updates()
+        self.dbc.runs.update_one({'_id': self.run_dbid}, {'$set': run_stats})
 
     def finalize(self, context):
-        self.client.close()
+        try:
+            self.finish_run()
+        finally:
+            self.client.close()
+
+    def finish_run(self):
+        """Write any pending iteration results and wait for all uploads to complete."""
+        self.write_pending_updates()
+        self.upload_pool.close()
+        self.upload_pool.join()
+        failed = []
+        for artifact_path, upload in self.uploads:
+            try:
+                upload.get()
+            except Exception, e:  # pylint: disable=broad-except
+                self.logger.error('Could not upload {}: {}'.format(artifact_path, e))
+                failed.append(artifact_path)
+        self.uploads = []
+        if failed:
+            raise ResultProcessorError('{} artifact(s) could not be uploaded.'.format(len(failed)))
+
+    def write_pending_updates(self):
+        if self.pending_updates:
+            # Updates must be applied in order, so that iteration results
+            # appear in the order they were generated.
+            self.dbc.runs.bulk_write(self.pending_updates, ordered=True)
+            self.pending_updates = []
 
     def validate(self):
         if self.uri:
@@ -188,15 +230,34 @@ class MongodbUploader(ResultProcessor):
                                                                    context.spec.label,
                                                                    context.current_iteration),
                                                  as_relative(path))
-            with open(artifact_path, 'rb') as fh:
-                fsid = self.fs.put(fh, **entry)
-                entry['gridfs_id'] = fsid
-
+            # The ID is allocated up front, so that the entry can be recorded
+            # before the upload completes.
+            fsid = bson.ObjectId()
+            upload = self.upload_pool.apply_async(self._put_file, (artifact_path, fsid, dict(entry)))
+            self.uploads.append((artifact_path, upload))
+            entry['gridfs_id'] = fsid
             return entry
 
-    def gridfs_directory_exists(self, path):
-        regex = re.compile('^{}'.format(path))
-        return self.fs.exists({'filename': regex})
+    def get_unused_gridfs_directory(self, path):
+        """
+        Returns ``path`` if no files have been uploaded under it, otherwise
+        the first of ``path-1``, ``path-2``, etc. that is unused.
+
+        """
+        # This is a range query on the filename, rather than a regex, so that it
+        # can always use the (filename, uploadDate) index (which is the one
+        # GridFS would create on the first upload).
+        self.dbc.fs.files.create_index([('filename', pymongo.ASCENDING), ('uploadDate', pymongo.ASCENDING)])
+        query = {'filename': {'$gte': path, '$lt': path[:-1] + unichr(ord(path[-1]) + 1)}}
+        used = set()
+        for doc in self.dbc.fs.files.find(query, {'filename': True}):
+            used.add(doc['filename'][len(path):].split('/')[0])
+        if '' not in used:
+            return path
+        i = 1
+        while '-{}'.format(i) in used:
+            i += 1
+        return '{}-{}'.format(path, i)
 
     def generate_bundle(self, context):  # pylint: disable=R0914
         """
@@ -233,3 +294,7 @@ class MongodbUploader(ResultProcessor):
                     tf.add(fpath, arcpath)
             return Artifact('mongo_bundle', BUNDLE_NAME, 'data',
                             description='bundle to be uploaded to mongodb.')
+
+    def _put_file(self, artifact_path, fsid, entry):
+        with open(artifact_path, 'rb') as fh:
+            self.fs.put(fh, _id=fsid, **entry)
@@ -16,10 +16,13 @@
 # pylint: disable=attribute-defined-outside-init
 
 import os
+import re
+import csv
 import sqlite3
 import json
 import uuid
 from datetime import datetime, timedelta
+from collections import defaultdict
 from contextlib import contextmanager
 
 from wlauto import ResultProcessor, settings, Parameter
@@ -27,8 +30,70 @@ from wlauto.exceptions import ResultProcessorError
 from wlauto.utils.types import boolean
 
 
-# IMPORTANT: when updating this schema, make sure to bump the version!
-SCHEMA_VERSION = '0.0.2'
+# IMPORTANT: when updating this schema, make sure to bump the version (and add
+#            a migration from the previous version to MIGRATIONS below)!
+SCHEMA_VERSION = '0.0.3'
+
+RESULTS_VIEW = '''CREATE VIEW results AS
+       SELECT uuid as run_uuid, spec_id, label as workload, iteration, metric, value, value_text,
+              units, lower_is_better
+       FROM metrics AS m INNER JOIN (
+            SELECT ws.OID as spec_oid, ws.id as spec_id, uuid, label
+            FROM workload_specs AS ws INNER JOIN runs AS r ON ws.run_oid = r.OID
+       ) AS wsr ON wsr.spec_oid = m.spec_oid
+    '''
+
+METRICS_TABLE = '''CREATE TABLE  metrics (
+        spec_oid int,
+        iteration integer,
+        metric text,
+        value real,
+        value_text text,
+        units text,
+        lower_is_better integer
+    )'''
+
+# The metrics index covers the common "values of this metric for these specs"
+# queries, so that these do not need to touch the metrics table itself.
+INDEXES = [
+    'CREATE INDEX metrics_spec_metric ON metrics (spec_oid, metric, iteration, value)',
+    'CREATE INDEX runs_uuid ON runs (uuid)',
+    'CREATE INDEX workload_specs_run ON workload_specs (run_oid, id)',
+]
+
+# Tables populated from the reports generated by trace-derived result
+# processors (cpustate and dvfs), so that these can be queried across runs.
+TRACE_TABLES = [
+    '''CREATE TABLE  parallel (
+        spec_oid int,
+        iteration integer,
+        cluster text,
+        number_of_cores integer,
+        total_time real,
+        time_pc real,
+        running_time_pc real
+    )''',
+    '''CREATE TABLE  cpustates (
+        spec_oid int,
+        iteration integer,
+        state text,
+        cpu integer,
+        core text,
+        value real
+    )''',
+    '''CREATE TABLE  dvfs (
+        spec_oid int,
+        iteration integer,
+        state text,
+        cpu integer,
+        core text,
+        value real
+    )''',
+    'CREATE INDEX parallel_spec ON parallel (spec_oid, iteration)',
+    'CREATE INDEX cpustates_spec ON cpustates (spec_oid, iteration)',
+    'CREATE INDEX dvfs_spec ON dvfs (spec_oid, iteration)',
+]
+
 SCHEMA = [
     '''CREATE TABLE  runs (
         uuid text,
@@ -46,27 +111,40 @@ SCHEMA = [
         runtime_parameters text,
         workload_parameters text
     )''',
-    '''CREATE TABLE  metrics (
-        spec_oid int,
-        iteration integer,
-        metric text,
-        value text,
-        units text,
-        lower_is_better integer
-    )''',
-    '''CREATE VIEW results AS
-       SELECT uuid as run_uuid, spec_id, label as workload, iteration, metric, value, units, lower_is_better
-       FROM metrics AS m INNER JOIN (
-            SELECT ws.OID as spec_oid, ws.id as spec_id, uuid, label
-            FROM workload_specs AS ws INNER JOIN runs AS r ON ws.run_oid = r.OID
-       ) AS wsr ON wsr.spec_oid = m.spec_oid
-    ''',
+    METRICS_TABLE,
+    RESULTS_VIEW,
     '''CREATE TABLE  __meta (
         schema_version text
     )''',
     '''INSERT INTO __meta VALUES ("{}")'''.format(SCHEMA_VERSION),
+] + INDEXES + TRACE_TABLES
+
+# Maps a schema version to the commands that will upgrade a database to the
+# following version.
+MIGRATIONS = {
+    '0.0.2': [
+        'ALTER TABLE metrics RENAME TO metrics_0_0_2',
+        METRICS_TABLE,
+        '''INSERT INTO metrics
+           SELECT spec_oid, iteration, metric, wa_real(value), wa_text(value), units, lower_is_better
+           FROM metrics_0_0_2''',
+        'DROP TABLE metrics_0_0_2',
+        'DROP VIEW results',
+        RESULTS_VIEW,
+        'UPDATE __meta SET schema_version = "0.0.3"',
+    ] + INDEXES + TRACE_TABLES,
+}
+
+# Trace-derived reports (generated at the top level of the output directory) and
+# the tables they are ingested into.
+TRACE_REPORTS = [
+    ('parallel.csv', 'parallel'),
+    ('cpustate.csv', 'cpustates'),
+    ('dvfs.csv', 'dvfs'),
 ]
 
+CORE_COLUMN_REGEX = re.compile(r'(?P<core>.*) CPU(?P<cpu>\d+)$')
+
 
 sqlite3.register_adapter(datetime, lambda x: x.isoformat())
 sqlite3.register_adapter(timedelta, lambda x: x.total_seconds())
@@ -81,6 +159,16 @@ class SqliteResultProcessor(ResultProcessor):
 
     This may be used accumulate results of multiple runs in a single file.
 
+    Numeric metric values are stored as ``real`` values in the ``value`` column;
+    values that cannot be represented as such (e.g. strings, or integers too
+    large to be represented exactly) are stored as text in the ``value_text``
+    column. If ``cpustate`` and/or ``dvfs`` result processors are enabled, the
+    reports they generate are also stored in ``parallel``, ``cpustates``
+    and ``dvfs`` tables, with one row per state per core.
+
+    Databases created with the previous schema version (0.0.2) are upgraded
+    when they are first used.
+
     """
 
     name = 'sqlite'
@@ -103,82 +191,214 @@ class SqliteResultProcessor(ResultProcessor):
                   description="""If ``True``, this will overwrite the database file
                                  if it already exists. If ``False`` (the default) data
                                  will be added to the existing file (provided schema
-                                 versions match -- otherwise an error will be raised).
+                                 versions match, or the existing database can be
+                                 upgraded -- otherwise an error will be raised).
                               """),
 
     ]
 
     def initialize(self, context):
-        self._last_spec = None
-        self._run_oid = None
-        self._spec_oid = None
-        if not os.path.exists(self.database):
-            self._initdb()
-        elif self.overwrite:  # pylint: disable=no-member
-            os.remove(self.database)
-            self._initdb()
-        else:
-            self._validate_schema_version()
-        self._update_run(context.run_info.uuid)
+        self._open_database(context.run_info.uuid)
 
     def process_iteration_result(self, result, context):
-        if self._last_spec != context.spec:
-            self._update_spec(context.spec)
-        metrics = [(self._spec_oid, context.current_iteration, m.name, str(m.value), m.units, int(m.lower_is_better))
-                   for m in result.metrics]
-        with self._open_connecton() as conn:
-            conn.executemany('INSERT INTO metrics VALUES (?,?,?,?,?,?)', metrics)
+        with self._transaction() as conn:
+            spec_oid = self._get_spec_oid(context.spec)
+            metrics = [(spec_oid, context.current_iteration, m.name, _to_real(m.value), _to_text(m.value),
+                        m.units, int(m.lower_is_better))
+                       for m in result.metrics]
+            conn.executemany('INSERT INTO metrics VALUES (?,?,?,?,?,?,?)', metrics)
 
     def process_run_result(self, result, context):
         info = context.run_info
-        with self._open_connecton() as conn:
+        with self._transaction() as conn:
             conn.execute('''UPDATE runs SET start_time=?, end_time=?, duration=?
                             WHERE OID=?''', (info.start_time, info.end_time, info.duration, self._run_oid))
 
+    def export_run_result(self, result, context):
+        # Trace-derived reports are generated by other processors'
+        # process_run_result(), so they can only be picked up at this stage.
+        specs = context.config.workload_specs
+        with self._transaction() as conn:
+            for filename, table in TRACE_REPORTS:
+                filepath = os.path.join(context.run_output_directory, filename)
+                if os.path.isfile(filepath):
+                    self.logger.debug('Ingesting {} into "{}"'.format(filename, table))
+                    rows = list(self._read_trace_report(filepath, table, specs, result))
+                    if rows:
+                        placeholders = ','.join('?' * len(rows[0]))
+                        conn.executemany('INSERT INTO {} VALUES ({})'.format(table, placeholders), rows)
+
+    def finalize(self, context):
+        self._close_database()
+
     def validate(self):
         if not self.database:  # pylint: disable=access-member-before-definition
             self.database = os.path.join(settings.output_directory, 'results.sqlite')
         self.database = os.path.expandvars(os.path.expanduser(self.database))
 
+    def _open_database(self, run_uuid):
+        self._run_oid = None
+        self._spec_oids = {}
+        if os.path.exists(self.database) and self.overwrite:  # pylint: disable=no-member
+            os.remove(self.database)
+        is_new = not os.path.exists(self.database)
+        self._connect()
+        if is_new:
+            self._initdb()
+        else:
+            self._validate_schema_version()
+        self._update_run(run_uuid)
+
+    def _close_database(self):
+        if getattr(self, '_conn', None) is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self):
+        # Transactions are managed explicitly (see _transaction()), as otherwise
+        # the sqlite3 module implicitly commits before each schema change.
+        self._conn = sqlite3.connect(self.database, isolation_level=None)
+        self._conn.create_function('wa_real', 1, _to_real)
+        self._conn.create_function('wa_text', 1, _to_text)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, this only syncs at checkpoints, and is still safe against
+        # corruption.
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute('BEGIN')
+        try:
+            yield self._conn
+        except:  # pylint: disable=bare-except
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
     def _initdb(self):
-        with self._open_connecton() as conn:
+        with self._transaction() as conn:
             for command in SCHEMA:
                 conn.execute(command)
 
     def _validate_schema_version(self):
-        with self._open_connecton() as conn:
-            try:
-                c = conn.execute('SELECT schema_version FROM __meta')
-                found_version = c.fetchone()[0]
-            except sqlite3.OperationalError:
-                message = '{} does not appear to be a valid WA results database.'.format(self.database)
-                raise ResultProcessorError(message)
-            if found_version != SCHEMA_VERSION:
+        try:
+            c = self._conn.execute('SELECT schema_version FROM __meta')
+            found_version = c.fetchone()[0]
+        except sqlite3.OperationalError:
+            message = '{} does not appear to be a valid WA results database.'.format(self.database)
+            raise ResultProcessorError(message)
+        while found_version != SCHEMA_VERSION:
+            if found_version not in MIGRATIONS:
                 message = 'Schema version in {} ({}) does not match current version ({}).'
                 raise ResultProcessorError(message.format(self.database, found_version, SCHEMA_VERSION))
+            self.logger.info('Upgrading {} from schema version {}'.format(self.database, found_version))
+            with self._transaction() as conn:
+                for command in MIGRATIONS[found_version]:
+                    conn.execute(command)
+                found_version = conn.execute('SELECT schema_version FROM __meta').fetchone()[0]
 
     def _update_run(self, run_uuid):
-        with self._open_connecton() as conn:
-            conn.execute('INSERT INTO runs (uuid) VALUES (?)', (run_uuid,))
-            conn.commit()
-            c = conn.execute('SELECT OID FROM runs WHERE uuid=?', (run_uuid,))
-            self._run_oid = c.fetchone()[0]
-
-    def _update_spec(self, spec):
-        self._last_spec = spec
-        spec_tuple = (spec.id, self._run_oid, spec.number_of_iterations, spec.label, spec.workload_name,
-                      json.dumps(spec.boot_parameters), json.dumps(spec.runtime_parameters),
-                      json.dumps(spec.workload_parameters))
-        with self._open_connecton() as conn:
-            conn.execute('INSERT INTO workload_specs VALUES (?,?,?,?,?,?,?,?)', spec_tuple)
-            conn.commit()
-            c = conn.execute('SELECT OID FROM workload_specs WHERE run_oid=? AND id=?', (self._run_oid, spec.id))
-            self._spec_oid = c.fetchone()[0]
+        with self._transaction() as conn:
+            c = conn.execute('INSERT INTO runs (uuid) VALUES (?)', (run_uuid,))
+            self._run_oid = c.lastrowid
 
-    @contextmanager
-    def _open_connecton(self):
-        conn = sqlite3.connect(self.database)
+    def _get_spec_oid(self, spec):
+        # Specs are added the first time they are seen, as (depending on the
+        # execution order) iterations of a spec may not be consecutive.
+        if spec.id not in self._spec_oids:
+            spec_tuple = (spec.id, self._run_oid, spec.number_of_iterations, spec.label, spec.workload_name,
+                          json.dumps(spec.boot_parameters), json.dumps(spec.runtime_parameters),
+                          json.dumps(spec.workload_parameters))
+            c = self._conn.execute('INSERT INTO workload_specs VALUES (?,?,?,?,?,?,?,?)', spec_tuple)
+            self._spec_oids[spec.id] = c.lastrowid
+        return self._spec_oids[spec.id]
+
+    def _read_trace_report(self, filepath, table, specs, result):
+        with open(filepath) as fh:
+            reader = csv.reader(fh)
+            header = reader.next()
+            if header[0] == 'id':
+                specs_by_id = {s.id: s for s in specs}
+                get_spec = lambda key, _: specs_by_id.get(key)
+                first = 2
+            else:  # dvfs.csv only identifies the workload by its label
+                get_spec = _LabelResolver(specs, result, table, self.logger).get_spec
+                first = 1
+            cores = [CORE_COLUMN_REGEX.match(c) for c in header[first + 2:]]
+            for row in reader:
+                iteration = int(row[first])
+                spec = get_spec(row[0], iteration)
+                if spec is None:
+                    self.logger.debug('Ignoring {} entry for unknown or ambiguous workload {}'.format(table, row[0]))
+                    continue
+                spec_oid = self._get_spec_oid(spec)
+                if table == 'parallel':
+                    cluster, number_of_cores, total_time, time_pc, running_time_pc = row[first + 1:]
+                    yield (spec_oid, iteration, cluster, int(number_of_cores),
+                           float(total_time), float(time_pc), float(running_time_pc))
+                else:
+                    state = row[first + 1]
+                    for match, value in zip(cores, row[first + 2:]):
+                        yield (spec_oid, iteration, state, int(match.group('cpu')),
+                               match.group('core'), float(value))
+
+
+class _LabelResolver(object):
+    """
+    Resolves the spec a report entry belongs to from its workload label and
+    iteration. Where several specs share a label, only those that actually ran
+    that iteration (according to the run result) are considered; entries that
+    still cannot be attributed to a single spec are ignored with a warning.
+
+    """
+
+    def __init__(self, specs, result, table, logger):
+        self.table = table
+        self.logger = logger
+        self.specs_by_label = defaultdict(list)
+        for spec in specs:
+            self.specs_by_label[spec.label].append(spec)
+        self.ran = None
+        if result is not None:
+            self.ran = set((r.id, r.iteration) for r in result.iteration_results)
+        self.warned = set()
+
+    def get_spec(self, label, iteration):
+        candidates = self.specs_by_label.get(label, [])
+        if len(candidates) > 1:
+            if self.ran is not None:
+                candidates = [s for s in candidates if (s.id, iteration) in self.ran]
+            else:
+                candidates = [s for s in candidates if s.number_of_iterations >= iteration]
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates and (label, iteration) not in self.warned:
+            self.warned.add((label, iteration))
+            message = 'Ignoring {} entries for iteration {} of "{}", as specs {} share that label.'
+            self.logger.warning(message.format(self.table, iteration, label,
+                                               ', '.join(s.id for s in candidates)))
+        return None
+
+
+def _to_real(value):
+    if isinstance(value, basestring):
         try:
-            yield conn
-        finally:
-            conn.commit()
+            return float(value)
+        except ValueError:
+            return None
+    if isinstance(value, (int, long, float)):
+        return float(value)
+    return None
+
+
+def _to_text(value):
+    # Text is only stored for values that cannot be stored as a real without
+    # losing information.
+    if value is None:
+        return None
+    real = _to_real(value)
+    if real is None:
+        return value if isinstance(value, basestring) else str(value)
+    if not isinstance(value, basestring) and real != value:
+        return str(value)
+    return None
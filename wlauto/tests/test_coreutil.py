@@ -0,0 +1,121 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201
+import os
+import csv
+import shutil
+import tempfile
+from unittest import TestCase
+
+from nose.tools import assert_equal, raises
+
+from wlauto.exceptions import InstrumentError
+from wlauto.instrumentation import coreutil
+from wlauto.instrumentation.coreutil import Calculator, CoreUtilization
+
+
+# (user, idle) times for two cores in each sample.
+SAMPLES = [
+    [(100, 100), (100, 100)],
+    [(180, 120), (110, 190)],
+    [(260, 140), (200, 200)],
+    [(270, 230), (290, 210)],
+    [(350, 250), (290, 310)],
+]
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class MockDevice(object):
+
+    busybox = 'busybox'
+
+    def __init__(self):
+        self.commands = []
+
+    def execute(self, command):
+        self.commands.append(command)
+
+    def file_exists(self, filepath):  # pylint: disable=unused-argument
+        return False
+
+
+def write_proc_txt(path, samples):
+    with open(path, 'w') as wfh:
+        for i, sample in enumerate(samples):
+            wfh.write('cpu  {} 0 0 {} 0 0 0 0 0 0\n'.format(sum(u for u, _ in sample),
+                                                           sum(i for _, i in sample)))
+            for cpu, (user, idle) in enumerate(sample):
+                wfh.write('cpu{} {} 0 0 {} 0 0 0 0 0 0\n'.format(cpu, user, idle))
+        # incomplete last record
+        wfh.write('cpu  0 0 0 0 0 0 0 0 0 0\n')
+        wfh.write('cpu0 400 0 0 300 0 0 0 0 0 0\n')
+
+
+class TestCalculator(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        write_proc_txt(os.path.join(self.tempdir, 'proc.txt'), SAMPLES)
+        result = MockObject(workload=MockObject(name='test'), iteration=1)
+        self.context = MockObject(run_output_directory=self.tempdir,
+                                  output_directory=self.tempdir,
+                                  result=result)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_calculate(self):
+        calc = Calculator(2, 50, self.context)
+        calc.calculate()
+        # utilization: cpu0 -- 80, 80, 10, 80; cpu1 -- 10, 90, 90, 0
+        assert_equal(calc.cpu_util, [[80.0, 80.0, 10.0, 80.0], [10.0, 90.0, 90.0, 0.0]])
+        with open(os.path.join(self.tempdir, 'coreutil.csv')) as fh:
+            rows = list(csv.reader(fh))
+        assert_equal(rows, [['workload', 'iteration', '<threshold', '1core', '2core'],
+                            ['test', '1', '0.0', '75.0', '25.0']])
+
+    def test_calculate_without_numpy(self):
+        np = coreutil.np
+        coreutil.np = None
+        try:
+            calc = Calculator(2, 50, self.context)
+            calc.calculate()
+        finally:
+            coreutil.np = np
+        assert_equal(calc.cpu_util, [[80.0, 80.0, 10.0, 80.0], [10.0, 90.0, 90.0, 0.0]])
+        assert_equal(calc.output, [0, 75.0, 25.0])
+
+
+class TestCoreUtilization(TestCase):
+
+    @raises(InstrumentError)
+    def test_sampler_not_done(self):
+        instrument = _instantiate(CoreUtilization, MockDevice())
+        instrument.sampler = 'procstat.sh'
+        instrument.on_device_done_file = 'procstat.done'
+        instrument.update_result(None)
+
+
+def _instantiate(cls, *args, **kwargs):
+    # Needed to get around Extension's __init__ checks
+    return cls(*args, **kwargs)
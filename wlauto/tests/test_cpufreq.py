@@ -0,0 +1,118 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201,protected-access
+from unittest import TestCase
+
+from nose.tools import assert_equal, raises
+
+from wlauto.exceptions import ConfigError, DeviceError
+from wlauto.modules.cpufreq import CpufreqModule
+
+
+class MockDevice(object):
+
+    core_names = ['a7', 'a7', 'a15', 'a15']
+    core_clusters = [0, 0, 1, 1]
+
+    @property
+    def online_cpus(self):
+        self.reads.append('online')
+        return [0, 1, 2, 3]
+
+    def __init__(self):
+        self.reads = []
+        self.files = {}
+        for cpu in xrange(4):
+            root = '/sys/devices/system/cpu/cpu{}/cpufreq/'.format(cpu)
+            self.files[root + 'scaling_available_governors'] = 'userspace performance'
+            self.files[root + 'scaling_governor'] = 'performance'
+            self.files[root + 'scaling_available_frequencies'] = '500000 1000000 '
+
+    def get_sysfile_value(self, sysfile):
+        self.reads.append(sysfile)
+        return self.files[sysfile]
+
+    def get_sysfile_values(self, sysfiles):
+        self.reads.append(sorted(sysfiles))
+        try:
+            return {sysfile: self.files[sysfile] for sysfile in sysfiles}
+        except KeyError as e:
+            raise DeviceError('Could not read {}'.format(e))
+
+    def set_sysfile_value(self, sysfile, value, verify=True):  # pylint: disable=unused-argument
+        self.files[sysfile] = str(value)
+
+    def execute(self, command):
+        self.reads.append(command)
+        try:
+            return self.files[command.split()[-1]]
+        except KeyError as e:
+            raise DeviceError('No such file: {}'.format(e))
+
+    def listdir(self, path):
+        raise DeviceError('No such directory: {}'.format(path))
+
+
+class TestCpufreqCache(TestCase):
+
+    def setUp(self):
+        self.device = MockDevice()
+        self.module = _instantiate(CpufreqModule, self.device)
+        # initialize() only runs once per execution, so reset its state here.
+        self.module.initialize(None)
+        CpufreqModule.device = self.device
+        for cache in ['_available_governors', '_available_governor_tunables', '_available_frequencies']:
+            getattr(CpufreqModule, cache).clear()
+        self.module.invalidate_cpufreq_cache()
+
+    def test_probe_once(self):
+        self.module._on_device_init(None)
+        assert_equal(len(self.device.reads), 3)  # online cpus, governors, frequencies
+        del self.device.reads[:]
+
+        self.module.set_cpu_governor('cpu2', 'userspace')
+        for freq in [500000, 1000000]:
+            self.module.set_cluster_cur_frequency(1, freq)
+            self.module.set_cluster_min_frequency(0, freq)
+        assert_equal(self.device.reads, [])
+        assert_equal(self.device.files['/sys/devices/system/cpu/cpu2/cpufreq/scaling_setspeed'], '1000000')
+
+    @raises(ConfigError)
+    def test_unsupported_frequency(self):
+        self.module._on_device_init(None)
+        self.module.set_cpu_min_frequency('cpu0', 700000)
+
+    def test_missing_available_frequencies(self):
+        del self.device.files['/sys/devices/system/cpu/cpu3/cpufreq/scaling_available_frequencies']
+        self.device.files['/sys/devices/system/cpu/cpu3/cpufreq/stats/time_in_state'] = '1000000 5\n500000 10\n'
+        self.module._on_device_init(None)
+        assert_equal(self.module.get_cpu_governor('cpu3'), 'performance')
+        assert_equal(self.module.list_available_cpu_frequencies('cpu3'), [500000, 1000000])
+
+    def test_invalidate(self):
+        self.module._on_device_init(None)
+        del self.device.reads[:]
+        self.module.invalidate_cpufreq_cache()
+        self.module.get_cluster_governor(0)
+        self.module.list_available_cpu_frequencies('cpu0')
+        assert_equal(self.device.reads, ['online', '/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor'])
+
+
+def _instantiate(cls, *args, **kwargs):
+    # Needed to get around Extension's __init__ checks
+    return cls(*args, **kwargs)
@@ -0,0 +1,103 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201,W0201
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from nose.tools import assert_equal
+
+from wlauto.result_processors.cpustate import CpuStatesProcessor
+
+
+class MockDevice(object):
+
+    busybox = 'busybox'
+    core_names = ['a7', 'a7', 'a15']
+    core_clusters = [0, 0, 1]
+
+    def __init__(self, max_frequencies):
+        self.max_frequencies = max_frequencies
+        self.trace_markers = []
+
+    def get_cluster_cur_frequency(self, cluster):
+        return self.max_frequencies[cluster] // 2
+
+    def get_cluster_max_frequency(self, cluster):
+        return self.max_frequencies[cluster]
+
+    def set_sysfile_value(self, sysfile, value, verify=True):  # pylint: disable=unused-argument
+        self.trace_markers.append(value)
+
+    def execute(self, command):
+        pass
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def get_artifact(self, name):  # pylint: disable=unused-argument
+        return None
+
+
+class TestCpuStatesProcessor(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        processor = _instantiate(CpuStatesProcessor, create_timeline=False,
+                                 create_utilization_timeline=False)
+        processor.core_names = MockDevice.core_names
+        processor.core_clusters = MockDevice.core_clusters
+        processor.idle_state_names = ['WFI', 'cluster-sleep']
+        processor.num_idle_states = 2
+        processor.max_freq_lists = {}
+        processor.collector = None
+        self.processor = processor
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_max_frequencies_per_iteration(self):
+        processor = self.processor
+        first = MockObject(device=MockDevice({0: 1000000, 1: 2000000}),
+                           output_directory=os.path.join(self.tempdir, 'a_1'))
+        second = MockObject(device=MockDevice({0: 800000, 1: 1600000}),
+                            output_directory=os.path.join(self.tempdir, 'b_1'))
+
+        # The second iteration starts before the first one's results are
+        # processed (as with parallel_result_processing).
+        processor.set_initial_state(first)
+        processor.set_initial_state(second)
+        assert_equal(second.device.trace_markers[-1], 'CPU 2 FREQUENCY: 800000 kHZ')
+
+        processor.start_power_stats(os.path.join(first.output_directory, 'trace.txt'))
+        assert_equal(processor.collector.max_freq_list, [1000000, 1000000, 2000000])
+        processor.process_iteration_result(None, first)
+
+        processor.start_power_stats(os.path.join(second.output_directory, 'trace.txt'))
+        assert_equal(processor.collector.max_freq_list, [800000, 800000, 1600000])
+        processor.process_iteration_result(None, second)
+        assert_equal(processor.max_freq_lists, {})
+
+
+def _instantiate(cls, *args, **kwargs):
+    # Needed to get around Extension's __init__ checks
+    return cls(*args, **kwargs)
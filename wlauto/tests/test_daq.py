@@ -0,0 +1,145 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201,protected-access
+import os
+import csv
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from nose.tools import assert_equal, assert_almost_equal, assert_true
+from nose.plugins.skip import SkipTest
+
+from wlauto.instrumentation import daq
+
+
+def write_port_file(path, rows):
+    with open(path, 'wb') as wfh:
+        writer = csv.writer(wfh)
+        writer.writerow(['power', 'voltage'])
+        writer.writerows(rows)
+
+
+def read_port_file(path):
+    with open(path) as fh:
+        reader = csv.reader(fh)
+        reader.next()
+        return [map(float, row) for row in reader]
+
+
+class TestStreamingAggregation(TestCase):
+
+    def setUp(self):
+        if daq.np is None:
+            raise SkipTest('numpy is not installed')
+        self.tempdir = tempfile.mkdtemp()
+        rng = random.Random(42)
+        self.rows = [[rng.uniform(-0.1, 2.0), rng.uniform(0.9, 1.1)] for _ in xrange(10000)]
+        self.path = os.path.join(self.tempdir, 'PORT_0.csv')
+        write_port_file(self.path, self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_stats(self):
+        stats = daq.SampleStats(2, percentile_column=0, summary_size=64)
+        with open(self.path) as fh:
+            fh.next()
+            for chunk in daq._read_chunks(fh, 2, chunk_size=1000):
+                stats.update(daq._apply_negative_samples_policy(chunk, 'zero'))
+
+        powers = sorted(max(r[0], 0) for r in self.rows)
+        assert_equal(stats.count, len(self.rows))
+        assert_almost_equal(stats.means[0], sum(powers) / len(powers))
+        assert_almost_equal(stats.means[1], sum(r[1] for r in self.rows) / len(self.rows))
+        assert_equal(stats.mins[0], 0)
+        assert_equal(stats.maxs[0], powers[-1])
+        for q in [10, 50, 90]:
+            expected = powers[int(q / 100.0 * len(powers))]
+            assert_true(abs(stats.percentile(q) - expected) < 0.05)
+
+    def test_merge(self):
+        other_rows = [[r[0] / 2, r[1]] for r in reversed(self.rows)]
+        other_path = os.path.join(self.tempdir, 'PORT_1.csv')
+        write_port_file(other_path, other_rows)
+        output_path = os.path.join(self.tempdir, 'merged.csv')
+
+        daq._merge_port_files([self.path, other_path], output_path, 'drop')
+
+        expected = [[a[0] + b[0], a[1] + b[1]] for a, b in zip(self.rows, other_rows)
+                    if min(a + b) >= 0]
+        merged = read_port_file(output_path)
+        assert_equal(len(merged), len(expected))
+        for row, expected_row in zip(merged, expected):
+            assert_almost_equal(row[0], expected_row[0])
+            assert_almost_equal(row[1], expected_row[1])
+
+
+class TestBinaryPortFiles(TestCase):
+
+    def setUp(self):
+        if daq.np is None:
+            raise SkipTest('numpy is not installed')
+        self.tempdir = tempfile.mkdtemp()
+        rng = random.Random(42)
+        self.rows = [[rng.uniform(-0.1, 2.0), rng.uniform(0.9, 1.1)] for _ in xrange(1000)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_binary_port_file(self, label, rows):
+        path = os.path.join(self.tempdir, daq.get_port_file_name(label, 'binary'))
+        writer = daq.BinaryPortWriter(path, label, 10000)
+        writer.write(rows[0])
+        writer.write_rows(daq.np.array(rows[1:]))
+        writer.close()
+        return path
+
+    def test_round_trip(self):
+        path = self.write_binary_port_file('PORT_0', self.rows)
+        assert_true(daq.is_binary_port_file(path))
+        # a partially transferred final record is ignored
+        with open(path, 'ab') as wfh:
+            wfh.write('\0\0')
+
+        header, samples = daq.read_binary_port_file(path)
+        assert_equal(header.label, 'PORT_0')
+        assert_equal(header.sampling_rate, 10000)
+        assert_equal(header.columns, ['power', 'voltage'])
+        assert_equal(samples.shape, (len(self.rows), 2))
+        for row, expected_row in zip(samples.tolist(), self.rows):
+            assert_almost_equal(row[0], expected_row[0], places=6)
+            assert_almost_equal(row[1], expected_row[1], places=6)
+
+    def test_merge(self):
+        other_rows = [[r[0] / 2, r[1]] for r in reversed(self.rows)]
+        paths = [self.write_binary_port_file('PORT_0', self.rows),
+                 self.write_binary_port_file('PORT_1', other_rows)]
+        output_path = os.path.join(self.tempdir, 'merged.bin')
+
+        daq._merge_binary_port_files('merged', paths, output_path, 'drop')
+
+        expected = [[a[0] + b[0], a[1] + b[1]] for a, b in zip(self.rows, other_rows)
+                    if min(a + b) >= 0]
+        header, merged = daq.read_binary_port_file(output_path)
+        assert_equal(header.label, 'merged')
+        assert_equal(len(merged), len(expected))
+        for row, expected_row in zip(merged.tolist(), expected):
+            assert_almost_equal(row[0], expected_row[0], places=5)
+            assert_almost_equal(row[1], expected_row[1], places=5)
@@ -15,13 +15,28 @@
 
 
 # pylint: disable=abstract-method,no-self-use,no-name-in-module
+import os
+import re
+import logging
+import shutil
+import tempfile
+import subprocess
 from collections import defaultdict, OrderedDict
 from unittest import TestCase
 
-from nose.tools import raises, assert_equal
+from nose.tools import raises, assert_equal, assert_true
 
 from wlauto import Device, Parameter, RuntimeParameter, CoreParameter
-from wlauto.exceptions import ConfigError
+from wlauto.common.android.device import AndroidDevice, _LogcatStreamer
+from wlauto.common.linux.device import BaseLinuxDevice
+from wlauto.exceptions import ConfigError, DeviceError
+from wlauto.utils import android
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
 
 
 class TestDevice(Device):
@@ -93,6 +108,321 @@ class RuntimeParametersTest(TestCase):
         assert_equal(device.value, 5)
 
 
+class LocalShellDevice(BaseLinuxDevice):
+    """Runs commands in a shell on the host."""
+
+    name = 'local-shell-device'
+    is_rooted = True
+
+    parameters = [
+        Parameter('core_names', default=['a7'], override=True),
+        Parameter('core_clusters', default=[0], override=True),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super(LocalShellDevice, self).__init__(*args, **kwargs)
+        self.busybox = ''
+        self.commands = []
+
+    def execute(self, command, check_exit_code=True, **kwargs):
+        self.commands.append(command)
+        process = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = process.communicate()
+        if check_exit_code and process.returncode:
+            raise DeviceError(output)
+        return output
+
+
+class SysfileBatchTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.device = _instantiate(LocalShellDevice)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _path(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def test_set_and_get_values(self):
+        params = OrderedDict([
+            (self._path('a'), 1),
+            (self._path('b') + '!', 'unverified'),
+            ('^' + self._path('c'), '\\x00\\x01binary'),
+        ])
+        self.device.set_sysfile_values(params)
+        assert_equal(len(self.device.commands), 1)
+        expected = {
+            self._path('a'): '1',
+            self._path('b'): 'unverified',
+            self._path('c'): '\x00\x01binary',
+        }
+        assert_equal(self.device.get_sysfile_values(), expected)
+        assert_equal(len(self.device.commands), 2)
+        assert_equal(self.device.get_sysfile_values([self._path('a')]), {self._path('a'): '1'})
+
+    def test_split_batches(self):
+        self.device.max_batch_command_length = 200
+        params = OrderedDict((self._path(str(i)), i) for i in xrange(10))
+        self.device.set_sysfile_values(params)
+        assert_equal(self.device.get_sysfile_values(params.keys()),
+                     {path: str(value) for path, value in params.iteritems()})
+        assert_true(len(self.device.commands) > 2)
+
+    def test_verification_failure(self):
+        params = OrderedDict([(self._path('missing/file'), 1), (self._path('a'), 2)])
+        try:
+            self.device.set_sysfile_values(params)
+        except DeviceError:
+            pass
+        else:
+            raise AssertionError('DeviceError was not raised')
+        # only the sysfile that was successfully written is recorded
+        assert_equal(self.device.get_sysfile_values(), {self._path('a'): '2'})
+
+    @raises(DeviceError)
+    def test_read_failure(self):
+        self.device.get_sysfile_values([self._path('missing')])
+
+    def test_governor_write_invalidates_cpufreq_cache(self):
+        invalidations = []
+        self.device.capabilities = ['cpufreq']
+        self.device.invalidate_cpufreq_cache = lambda: invalidations.append(True)
+        self.device.set_sysfile_values({self._path('a'): 1})
+        assert_equal(invalidations, [])
+        os.makedirs(self._path('cpufreq'))
+        self.device.set_sysfile_values({self._path('cpufreq/scaling_governor'): 'performance'})
+        self.device.set_sysfile_value(self._path('cpufreq/scaling_governor'), 'userspace')
+        assert_equal(len(invalidations), 2)
+
+
+class CommandBatchTest(TestCase):
+
+    def setUp(self):
+        self.device = _instantiate(LocalShellDevice)
+
+    def test_batch(self):
+        with self.device.batch() as batch:
+            first = batch.execute('echo first')
+            second = batch.execute('printf "two\\nlines"; echo error >&2')
+            failed = batch.execute('false', check_exit_code=False)
+        assert_equal(len(self.device.commands), 1)
+        assert_equal(first.output, 'first\n')
+        assert_equal(first.exit_code, 0)
+        assert_equal(second.output, 'two\nlineserror\n')
+        assert_equal(failed.exit_code, 1)
+
+    def test_split_batch(self):
+        self.device.max_batch_command_length = 100
+        with self.device.batch() as batch:
+            results = [batch.execute('echo {}'.format(i)) for i in xrange(10)]
+        assert_true(len(self.device.commands) > 1)
+        assert_equal([r.output.strip() for r in results], map(str, xrange(10)))
+
+    def test_failure(self):
+        batch = self.device.batch()
+        batch.execute('exit_code() { return $1; }; exit_code 3')
+        last = batch.execute('echo last')
+        try:
+            batch.flush()
+        except DeviceError as e:
+            assert_true('exit code 3' in str(e))
+        else:
+            raise AssertionError('DeviceError was not raised')
+        assert_equal(last.output, 'last\n')
+
+    @raises(RuntimeError)
+    def test_output_before_execution(self):
+        try:
+            with self.device.batch() as batch:
+                result = batch.execute('echo test')
+                raise ValueError()
+        except ValueError:
+            pass
+        assert_equal(self.device.commands, [])
+        result.output  # pylint: disable=pointless-statement
+
+
+FAKE_ADB = '''#!/bin/sh
+# Stands in for "adb [-s <device>] shell <command>", running the command locally.
+if [ "$1" = "-s" ]; then shift 2; fi
+shift
+exec sh -c "$*"
+'''
+
+
+class AdbShellDevice(LocalShellDevice):
+    """Runs commands through ``adb_shell()``, with ``adb`` replaced by a local shell."""
+
+    name = 'adb-shell-device'
+
+    def execute(self, command, check_exit_code=True, **kwargs):
+        self.commands.append(command)
+        return android.adb_shell(None, command, check_exit_code=check_exit_code)
+
+
+class AdbShellTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        adb_path = os.path.join(self.tempdir, 'adb')
+        with open(adb_path, 'w') as wfh:
+            wfh.write(FAKE_ADB)
+        os.chmod(adb_path, 0755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.pathsep.join([self.tempdir, self.path])
+        self.android_home = android.android_home
+        android.android_home = self.tempdir  # skip looking for the Android SDK
+        self.device = _instantiate(AdbShellDevice)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        android.android_home = self.android_home
+        shutil.rmtree(self.tempdir)
+
+    def test_batch(self):
+        with self.device.batch() as batch:
+            first = batch.execute('echo first')
+            failed = batch.execute('echo "$HOME" > /dev/null; false', check_exit_code=False)
+        assert_equal(len(self.device.commands), 1)
+        assert_equal(first.output.strip(), 'first')
+        assert_equal(first.exit_code, 0)
+        assert_equal(failed.exit_code, 1)
+
+    def test_sysfile_values(self):
+        path = os.path.join(self.tempdir, 'value')
+        self.device.set_sysfile_values({path: 1})
+        assert_equal(self.device.get_sysfile_values(), {path: '1'})
+
+
+class LogcatStreamerTest(TestCase):
+
+    def setUp(self):
+        device = MockObject(adb_name=None, logger=logging.getLogger('test'))
+        self.streamer = _LogcatStreamer(device, buffer_size=100)
+        self.outfile = tempfile.mktemp()
+
+    def tearDown(self):
+        self.streamer.close()
+        if os.path.isfile(self.outfile):
+            os.remove(self.outfile)
+
+    def _append_lines(self, start, end):
+        for i in xrange(start, end):
+            self.streamer._append('line {:02}\n'.format(i))
+
+    def _read_lines(self):
+        with open(self.outfile) as fh:
+            return [int(line.split()[1]) for line in fh]
+
+    def test_slices(self):
+        self._append_lines(0, 5)
+        since = self.streamer.mark()
+        self._append_lines(5, 8)
+        until = self.streamer.mark()
+        self._append_lines(8, 10)
+
+        self.streamer.write_log(self.outfile, since=since, until=until)
+        assert_equal(self._read_lines(), [5, 6, 7])
+        self.streamer.write_log(self.outfile)
+        assert_equal(self._read_lines(), range(10))
+        self.streamer.clear_buffer()
+        self._append_lines(10, 12)
+        self.streamer.write_log(self.outfile)
+        assert_equal(self._read_lines(), [10, 11])
+
+    def test_sync_markers_dropped(self):
+        streamer = self.streamer
+        self._append_lines(0, 2)
+        streamer._sync_token = '{}_2'.format(streamer.sync_tag)
+        # a late marker from a sync that timed out, followed by the current one
+        streamer._append('I/{0}_1( 1234): {0}_1\n'.format(streamer.sync_tag))
+        assert_equal(streamer._sync_token, '{}_2'.format(streamer.sync_tag))
+        streamer._append('I/{0}_2( 1234): {0}_2\n'.format(streamer.sync_tag))
+        assert_equal(streamer._sync_token, None)
+        self._append_lines(2, 4)
+        streamer.write_log(self.outfile)
+        assert_equal(self._read_lines(), range(4))
+
+    def test_rotation(self):
+        self._append_lines(0, 50)
+        self.streamer.write_log(self.outfile)
+        lines = self._read_lines()
+        # at least buffer_size bytes are retained, plus up to two (4-line) segments.
+        assert_true(100 <= len(lines) * 8 <= 100 + 2 * 32)
+        assert_true(len(lines) < 50)
+        assert_equal(lines, range(50 - len(lines), 50))
+        assert_equal(len(os.listdir(self.streamer.buffer_directory)), len(self.streamer.segments))
+
+
+class FingerprintTestDevice(AndroidDevice):
+    """Runs commands in a shell on the host, with ``dumpsys`` output read from a file."""
+
+    name = 'fingerprint-test-device'
+
+    parameters = [
+        Parameter('core_names', default=['a7'], override=True),
+        Parameter('core_clusters', default=[0], override=True),
+    ]
+
+    def __init__(self, dumpsys_file, **kwargs):
+        super(FingerprintTestDevice, self).__init__(**kwargs)
+        self.dumpsys_file = dumpsys_file
+        self.commands = []
+
+    def execute(self, command, check_exit_code=True, **kwargs):
+        self.commands.append(command)
+        command = re.sub(r'dumpsys package \S+', 'cat ' + self.dumpsys_file, command)
+        process = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = process.communicate()
+        if check_exit_code and process.returncode:
+            raise DeviceError(output)
+        return output
+
+
+class ApkFingerprintTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dumpsys_file = os.path.join(self.tempdir, 'dumpsys.txt')
+        self.write_dumpsys('2017-01-01 10:00:00')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_dumpsys(self, last_update_time):
+        with open(self.dumpsys_file, 'w') as wfh:
+            wfh.write('Packages:\n')
+            wfh.write('  Package [com.example.app] (1234abc):\n')
+            wfh.write('    primaryCpuAbi=arm64-v8a\n')
+            wfh.write('    versionCode=42 minSdk=21 targetSdk=25\n')
+            wfh.write("    versionName=1.2.3 'beta'\n")
+            wfh.write('    lastUpdateTime={}\n'.format(last_update_time))
+
+    def get_device(self):
+        return _instantiate(FingerprintTestDevice, self.dumpsys_file, working_directory=self.tempdir)
+
+    def test_fingerprint(self):
+        device = self.get_device()
+        assert_equal(device.get_apk_fingerprint('com.example.app'), None)
+        device.set_apk_fingerprint('com.example.app', 'abc123')
+
+        # fingerprints persist on the device, and are only validated once
+        device = self.get_device()
+        fingerprint = device.get_apk_fingerprint('com.example.app')
+        assert_equal(fingerprint, {'sha256': 'abc123', 'version_name': "1.2.3 'beta'", 'version_code': '42',
+                                   'abi': 'arm64', 'last_update_time': '2017-01-01 10:00:00'})
+        assert_equal(len(device.commands), 1)
+        device.get_apk_fingerprint('com.example.app')
+        assert_equal(len(device.commands), 1)
+
+    def test_reinstalled(self):
+        self.get_device().set_apk_fingerprint('com.example.app', 'abc123')
+        self.write_dumpsys('2017-01-02 10:00:00')
+        assert_equal(self.get_device().get_apk_fingerprint('com.example.app'), None)
+
+
 def _instantiate(cls, *args, **kwargs):
     # Needed to get around Extension's __init__ checks
     return cls(*args, **kwargs)
@@ -0,0 +1,95 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201,W0201
+import os
+import csv
+import shutil
+import tempfile
+from unittest import TestCase
+
+from nose.tools import assert_equal
+
+from wlauto.result_processors.dvfs import DVFS
+from wlauto.utils.trace_cmd import TraceCmdTrace
+
+
+TRACE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'trace.txt')
+
+
+class MockDevice(object):
+
+    scheduler = 'hmp'
+    number_of_cores = 2
+    core_clusters = [0, 0]
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class TestDvfsResidency(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.processor = _instantiate(DVFS)
+        self.processor.device = MockDevice()
+        self.processor.multiply_factor = 1
+        self.processor.corename_of_clusters = ['a7']
+        self.processor.numberofcores_in_cluster = [2]
+        self.processor.minimum_frequency_cluster = [500000]
+        self.processor.idlestate_description = {'state0': 'WFI', 'state1': 'cluster-sleep'}
+        self.processor.cpu_minimum_frequency = [500000, 500000]
+        self.processor.num_columns = 2
+        self.processor.outfile = os.path.join(self.tempdir, 'dvfs.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_residency(self):
+        processor = self.processor
+        processor.reset_trace_data(TRACE_FILE)
+        trace = TraceCmdTrace(TRACE_FILE, names=['cpu_idle', 'cpu_frequency', 'print'])
+        for event in trace.parse():
+            processor.record_event(event)
+
+        spec = MockObject(label='test')
+        context = MockObject(result=MockObject(spec=spec, iteration=1))
+        processor.generate_csv(context)
+        processor.generate_csv(context)
+
+        with open(processor.outfile) as fh:
+            rows = list(csv.reader(fh))
+        # Events sharing a timestamp are all accounted for; CPU1's state is
+        # unknown after dropped events until it exits idle.
+        assert_equal(rows[:6], [
+            ['workload', 'iteration', 'state', 'a7 CPU0', 'a7 CPU1'],
+            ['test', '1', 'WFI', '81.818', '0.000'],
+            ['test', '1', 'cluster-sleep', '0.000', '81.818'],
+            ['test', '1', '500.0 Mhz', '0.000', '0.000'],
+            ['test', '1', '1.0 Ghz', '18.182', '0.000'],
+            ['test', '1', 'OFFLINE', '0.000', '18.182'],
+        ])
+        # header is only written once
+        assert_equal(len(rows), 11)
+
+
+def _instantiate(cls):
+    # Needed to get around Extension's __init__ checks
+    return cls()
@@ -20,18 +20,29 @@
 # pylint: disable=abstract-method
 # pylint: disable=attribute-defined-outside-init
 # pylint: disable=no-member
+import os
+import getpass
+import shutil
+import subprocess
+import tempfile
+import threading
+import multiprocessing
 from unittest import TestCase
 from nose.tools import assert_equal, assert_raises, raises
+from nose.plugins.skip import SkipTest
 
-from wlauto.core.execution import BySpecRunner, ByIterationRunner
-from wlauto.exceptions import DeviceError
+from wlauto import settings
+from wlauto.core.execution import (BySpecRunner, ByIterationRunner, Executor, ExecutionContext,
+                                   PoolJobQueue, SharedIterationCounts)
+from wlauto.exceptions import DeviceError, ConfigError
 from wlauto.core.configuration import WorkloadRunSpec, RebootPolicy
 from wlauto.core.instrumentation import Instrument
 from wlauto.core.device import Device, DeviceMeta
 from wlauto.core import instrumentation, signal
 from wlauto.core.workload import Workload
-from wlauto.core.result import IterationResult
+from wlauto.core.result import IterationResult, ResultManager
 from wlauto.core.signal import Signal
+from wlauto.core.extension_loader import ExtensionLoader
 
 
 class SignalCatcher(Instrument):
@@ -1064,6 +1075,341 @@ class RunnerTest(TestCase):
         assert_raises(DeviceError, self.bad_device('get_properties'))
 
 
+class PreparedWorkload(object):
+
+    def __init__(self, name, events, fail_prepare=False):
+        self.name = name
+        self.events = events
+        self.fail_prepare = fail_prepare
+
+    def prepare(self, context):
+        self.events.append((self.name, 'prepare', threading.current_thread().name))
+        if self.fail_prepare:
+            raise ValueError('Preparation failed')
+
+    def setup(self, context):
+        self.events.append((self.name, 'setup', threading.current_thread().name))
+
+    def __getattr__(self, name):
+        return Mock()
+
+
+class PreparationTest(TestCase):
+
+    def run_specs(self, runner_class, fail_prepare=False):
+        events = []
+        specs = [WorkloadRunSpec(id=spec_id, number_of_iterations=2, instrumentation=[])
+                 for spec_id in ['1', '2']]
+        for spec in specs:
+            spec._workload = PreparedWorkload(spec.id, events, fail_prepare)
+        context = Mock()
+        context.reboot_policy = RebootPolicy('never')
+        context.config.workload_specs = specs
+        context.config.retry_on_status = []
+        runner = runner_class(Mock(), context, Mock())
+        runner.init_queue(specs)
+        runner.run()
+        return runner, events
+
+    def test_next_spec_prepared(self):
+        runner, events = self.run_specs(BySpecRunner)
+        main = threading.current_thread().name
+        # The next spec is prepared in the background once, before it is set up.
+        assert_equal(events, [('1', 'setup', main), ('1', 'setup', main),
+                              ('2', 'prepare', 'job-preparation'),
+                              ('2', 'setup', main), ('2', 'setup', main)])
+        assert_equal(set(j.result.status for j in runner.completed_jobs), set([IterationResult.OK]))
+
+    def test_prepared_on_each_spec_change(self):
+        _, events = self.run_specs(ByIterationRunner)
+        assert_equal([(name, event) for name, event, _ in events],
+                     [('1', 'setup'), ('2', 'prepare'), ('2', 'setup'), ('1', 'prepare'),
+                      ('1', 'setup'), ('2', 'prepare'), ('2', 'setup')])
+
+    def test_preparation_errors_ignored(self):
+        runner, events = self.run_specs(BySpecRunner, fail_prepare=True)
+        assert_equal(len(events), 5)
+        assert_equal(set(j.result.status for j in runner.completed_jobs), set([IterationResult.OK]))
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class LocalDevice(object):
+    """A stand-in for a device in a device pool that runs workloads in-process."""
+
+    name = 'local'
+    platform = 'linux'
+
+    def __init__(self, label):
+        self.label = label
+
+    def validate(self):
+        pass
+
+    def connect(self):
+        pass
+
+    def initialize(self, context):
+        pass
+
+    def get_properties(self, context):
+        return {'label': self.label}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_runtime_parameters(self, params):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def ping(self):
+        return True
+
+    def can(self, capability):
+        return False
+
+
+class LocalWorkload(object):
+
+    def __init__(self, name, device):
+        self.name = name
+        self.device = device
+        self.artifacts = []
+
+    def init_resources(self, context):
+        pass
+
+    def validate(self):
+        pass
+
+    def initialize(self, context):
+        pass
+
+    def setup(self, context):
+        pass
+
+    def run(self, context):
+        pass
+
+    def update_result(self, context):
+        context.result.add_metric('device_index', int(self.device.label[len('local'):]))
+
+    def teardown(self, context):
+        pass
+
+    def finalize(self, context):
+        pass
+
+
+class LocalExtensionLoader(object):
+
+    def get_device(self, name, **params):
+        return LocalDevice(**params)
+
+    def get_workload(self, name, device, **params):
+        return LocalWorkload(name, device)
+
+
+class RecordingResultManager(object):
+
+    def __init__(self):
+        self.iterations = []
+        self.run_result = None
+
+    def initialize(self, context):
+        pass
+
+    def add_result(self, result, context):
+        self.iterations.append((result.classifiers['device'], result.id, result.iteration,
+                                context.current_iteration, context.output_directory))
+
+    def process_run_result(self, result, context):
+        self.run_result = result
+
+    def finalize(self, context):
+        pass
+
+
+def claim_jobs(specs, next_index, claimed):
+    queue = PoolJobQueue(specs, next_index)
+    while queue:
+        claimed.put(queue.pop(0).spec.id)
+    claimed.put(None)
+
+
+def count_iterations(counts, spec_id, iterations):
+    for _ in xrange(10):
+        iterations.put(counts.increment(spec_id))
+
+
+class DevicePoolTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.output_directory = settings.output_directory
+        settings.output_directory = self.tempdir
+        self.specs = []
+        for spec_id in ['a', 'b', 'c']:
+            spec = WorkloadRunSpec(id=spec_id, number_of_iterations=3, workload_name=spec_id)
+            spec._workload = Mock()
+            self.specs.append(spec)
+
+    def tearDown(self):
+        settings.output_directory = self.output_directory
+        shutil.rmtree(self.tempdir)
+
+    def test_job_queue(self):
+        next_index = multiprocessing.Value('i', 0)
+        claimed = multiprocessing.Queue()
+        specs = [s for s in self.specs for _ in xrange(s.number_of_iterations)]
+        workers = [multiprocessing.Process(target=claim_jobs, args=(specs, next_index, claimed))
+                   for _ in xrange(3)]
+        for worker in workers:
+            worker.start()
+        claimed_ids = []
+        finished = 0
+        while finished < len(workers):
+            spec_id = claimed.get(timeout=10)
+            if spec_id is None:
+                finished += 1
+            else:
+                claimed_ids.append(spec_id)
+        for worker in workers:
+            worker.join()
+        assert_equal(sorted(claimed_ids), sorted(s.id for s in specs))
+
+    def test_job_queue_lookahead(self):
+        next_index = multiprocessing.Value('i', 0)
+        context = MockObject(aborted=False)
+        queue = PoolJobQueue(self.specs, next_index, context)
+        assert_equal(queue[0].spec.id, 'a')
+        assert_equal(next_index.value, 1)
+        assert_equal(len(queue), 2)  # only claims the job after the current one
+        assert_equal(next_index.value, 2)
+        queue.pop(0)
+        context.aborted = True
+        assert_equal(queue.pop(0).spec.id, 'b')
+        assert_equal(len(queue), 0)  # the remaining jobs are left for other devices
+        assert_equal(next_index.value, 2)
+
+    def test_shared_iteration_counts(self):
+        counts = SharedIterationCounts(['a', 'b'])
+        iterations = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=count_iterations, args=(counts, 'a', iterations))
+                   for _ in xrange(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert_equal(sorted(iterations.get(timeout=10) for _ in xrange(30)), range(1, 31))
+        assert_equal(counts['a'], 30)
+        assert_equal(counts['b'], 0)
+
+    def test_execute_on_device_pool(self):
+        config = MockObject(device='local', device_config={}, project=None, project_stage=None,
+                            run_name='pool_test', device_pool=[{'label': 'local0'}, {'label': 'local1'}],
+                            execution_order='by_spec', reboot_policy=RebootPolicy('never'),
+                            retry_on_status=[], max_retries=0, instrumentation={},
+                            flashing_config={}, clean_up=False, workload_specs=self.specs)
+        executor = Executor()
+        executor.config = config
+        executor.ext_loader = LocalExtensionLoader()
+        for spec in self.specs:
+            spec.load(None, executor.ext_loader)
+        executor.context = ExecutionContext(None, config)
+        executor.context.initialize()
+        result_manager = RecordingResultManager()
+
+        executor.execute_on_device_pool(result_manager)
+
+        run_result = result_manager.run_result
+        assert_equal(sorted((r.id, r.iteration) for r in run_result.iteration_results),
+                     [(s, i) for s in ['a', 'b', 'c'] for i in [1, 2, 3]])
+        assert_equal(set(r.status for r in run_result.iteration_results), set([IterationResult.OK]))
+        for result in run_result.iteration_results:
+            assert_equal('local{}'.format(result['device_index'].value), result.classifiers['device'])
+        assert_equal(dict(executor.context.job_iteration_counts), {'a': 3, 'b': 3, 'c': 3})
+        assert_equal(run_result.info.device_properties.keys(), ['label'])
+
+        assert_equal(len(result_manager.iterations), 9)
+        for device in ['local0', 'local1']:
+            order = [(spec_id, iteration) for d, spec_id, iteration, _, _ in result_manager.iterations
+                     if d == device]
+            # each device runs its share of the jobs in the by_spec order
+            assert_equal(order, sorted(order))
+        for _, spec_id, iteration, current_iteration, output_directory in result_manager.iterations:
+            assert_equal(current_iteration, iteration)
+            assert_equal(output_directory.split('/')[-1], '{}_{}_{}'.format(spec_id, spec_id, iteration))
+
+    def test_pool_result_processors(self):
+        executor = Executor()
+        result_manager = ResultManager()
+        loader = ExtensionLoader()
+        result_manager.install(loader.get_result_processor('status'))
+        executor._validate_pool_result_processors(result_manager)
+        result_manager.install(loader.get_result_processor('dvfs'))
+        assert_raises(ConfigError, executor._validate_pool_result_processors, result_manager)
+
+    def test_generic_linux_pool_device_config(self):
+        device_config = {'username': 'root', 'core_names': ['a7', 'a7'], 'core_clusters': [0, 0]}
+        config = MockObject(device='generic_linux', device_config=device_config,
+                            device_pool=[{'host': '10.0.0.1'},
+                                         {'host': '10.0.0.2', 'port': 2222, 'username': 'wa',
+                                          'core_names': ['a15'], 'core_clusters': [1]}])
+        executor = Executor()
+        executor.config = config
+        loader = ExtensionLoader()
+        devices = [loader.get_device(config.device, **executor._get_pool_device_config(i))
+                   for i in xrange(len(config.device_pool))]
+        for device in devices:
+            device.validate()
+
+        assert_equal([(d.host, d.port, d.username) for d in devices],
+                     [('10.0.0.1', 22, 'root'), ('10.0.0.2', 2222, 'wa')])
+        # pool entries replace lists from device_config rather than extending them
+        assert_equal([(d.core_names, d.core_clusters) for d in devices],
+                     [(['a7', 'a7'], [0, 0]), (['a15'], [1])])
+        assert_equal([d.working_directory for d in devices], ['/root/wa', '/home/wa/wa'])
+        assert_equal(config.device_config,
+                     {'username': 'root', 'core_names': ['a7', 'a7'], 'core_clusters': [0, 0]})
+
+    def test_generic_linux_pool_devices_connect(self):
+        if not _local_ssh_available():
+            raise SkipTest('passwordless ssh to localhost is not available')
+        config = MockObject(device='generic_linux', device_config={'username': getpass.getuser()},
+                            device_pool=[{'host': 'localhost'}, {'host': '127.0.0.1'}])
+        executor = Executor()
+        executor.config = config
+        loader = ExtensionLoader()
+        for index in xrange(len(config.device_pool)):
+            device = loader.get_device(config.device, **executor._get_pool_device_config(index))
+            device.validate()
+            device.connect()
+            try:
+                assert_equal(device.execute('echo {}'.format(index)).strip(), str(index))
+            finally:
+                device.disconnect()
+
+
+def _local_ssh_available():
+    command = ['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5',
+               '-o', 'StrictHostKeyChecking=no', 'localhost', 'true']
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(command, stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
 def _instantiate(cls, *args, **kwargs):
     # Needed to get around Extension's __init__ checks
     return cls(*args, **kwargs)
@@ -16,11 +16,14 @@
 
 # pylint: disable=E0611,R0201
 import os
+import sys
+import shutil
+import tempfile
 from unittest import TestCase
 
-from nose.tools import assert_equal, assert_greater
+from nose.tools import assert_equal, assert_greater, assert_true, assert_false
 
-from wlauto.core.extension_loader import ExtensionLoader
+from wlauto.core.extension_loader import ExtensionLoader, MODNAME_TRANS
 
 
 EXTDIR = os.path.join(os.path.dirname(__file__), 'data', 'extensions')
@@ -48,3 +51,73 @@ class ExtensionLoaderTest(TestCase):
         assert_equal(len(devices), 1)
         assert_equal(devices[0].name, 'test-device')
         assert_equal(len(loader.list_extensions()), 1)
+
+
+class ExtensionManifestTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.extdir = os.path.join(self.tempdir, 'extensions')
+        shutil.copytree(EXTDIR, self.extdir, ignore=shutil.ignore_patterns('*.pyc'))
+        self.filepath = os.path.join(self.extdir, 'devices', 'test_device.py')
+        self.modname = os.path.splitext(self.filepath[1:])[0].translate(MODNAME_TRANS)
+        ExtensionLoader.manifest_path = os.path.join(self.tempdir, 'manifest.json')
+
+    def tearDown(self):
+        ExtensionLoader.manifest_path = None
+        sys.modules.pop(self.modname, None)
+        shutil.rmtree(self.tempdir)
+
+    def test_lazy_loading(self):
+        ExtensionLoader(paths=[self.extdir], load_defaults=False)
+        assert_true(os.path.isfile(ExtensionLoader.manifest_path))
+        sys.modules.pop(self.modname)
+
+        loader = ExtensionLoader(paths=[self.extdir], load_defaults=False)
+        devices = loader.list_devices()
+        assert_equal([d.name for d in devices], ['test-device'])
+        assert_true(loader.has_device('test-device'))
+        assert_false(self.modname in sys.modules)
+
+        cls = loader.get_extension_class('test-device')
+        assert_true(self.modname in sys.modules)
+        assert_equal(cls.__name__, 'TestDevice')
+        assert_equal(cls.kind, 'device')
+        assert_equal(loader.get_device('test-device').name, 'test-device')
+
+    def test_modified_module(self):
+        ExtensionLoader(paths=[self.extdir], load_defaults=False)
+        sys.modules.pop(self.modname)
+        with open(self.filepath, 'a') as wfh:
+            wfh.write('\n\nclass OtherDevice(TestDevice):\n\n    name = \'other-device\'\n')
+
+        loader = ExtensionLoader(paths=[self.extdir], load_defaults=False)
+        assert_equal(sorted(d.name for d in loader.list_devices()), ['other-device', 'test-device'])
+        assert_true(self.modname in sys.modules)
+
+    def test_modified_base_class(self):
+        basedir = os.path.join(self.tempdir, 'base')
+        os.makedirs(basedir)
+        base_path = os.path.join(basedir, 'manifest_test_base.py')
+        base_source = ('from wlauto import Device, Parameter\n\n\n'
+                       'class BaseTestDevice(Device):\n\n'
+                       '    parameters = [Parameter(\'foo\', global_alias=\'{}\')]\n')
+        with open(base_path, 'w') as wfh:
+            wfh.write(base_source.format('old_alias'))
+        with open(self.filepath, 'w') as wfh:
+            wfh.write('from manifest_test_base import BaseTestDevice\n\n\n'
+                      'class TestDevice(BaseTestDevice):\n\n    name = \'test-device\'\n')
+        sys.path.insert(0, basedir)
+        try:
+            loader = ExtensionLoader(paths=[self.extdir], load_defaults=False)
+            assert_equal(loader.global_param_aliases.keys(), ['old_alias'])
+            sys.modules.pop(self.modname)
+            sys.modules.pop('manifest_test_base')
+
+            with open(base_path, 'w') as wfh:
+                wfh.write(base_source.format('new_alias_for_foo'))
+            loader = ExtensionLoader(paths=[self.extdir], load_defaults=False)
+            assert_equal(loader.global_param_aliases.keys(), ['new_alias_for_foo'])
+        finally:
+            sys.path.remove(basedir)
+            sys.modules.pop('manifest_test_base', None)
@@ -0,0 +1,112 @@
+#    Copyright 2017 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201
+import os
+import uuid
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+
+from wlauto import Artifact
+from wlauto.core.result import Metric
+from wlauto.result_processors import mongodb
+from wlauto.result_processors.mongodb import MongodbUploader
+from wlauto.utils.lazyimport import lazy_import
+
+mongomock = lazy_import('mongomock')
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class MockRunInfo(object):
+
+    project = None
+    run_name = 'test'
+
+    def __init__(self):
+        self.uuid = uuid.uuid4()
+        self.end_time = datetime.now()
+        self.duration = timedelta(seconds=10)
+
+    def to_dict(self):
+        return {'uuid': self.uuid.hex, 'device': 'generic_android', 'device_properties': {'ro.build.id': 'X'}}
+
+
+class MongodbUploaderTest(TestCase):
+
+    def setUp(self):
+        if mongomock is None or mongodb.pymongo is None:
+            raise SkipTest('mongomock and pymongo must be installed')
+        from mongomock.gridfs import enable_gridfs_integration
+        enable_gridfs_integration()
+        self.tempdir = tempfile.mkdtemp()
+        config = MockObject(to_dict=lambda: {'workload_specs': [{'id': '1', 'workload_name': 'foo'}]})
+        self.context = MockObject(run_info=MockRunInfo(), config=config, output_directory=self.tempdir,
+                                  spec=MockObject(id='1', label='foo'), workload=MockObject(summary_metrics=[]),
+                                  run_artifacts=[])
+        self.processor = _instantiate(MongodbUploader, batch_size=2, upload_threads=2)
+        self.processor.client = mongomock.MongoClient()
+
+    def tearDown(self):
+        if hasattr(self, 'tempdir'):
+            shutil.rmtree(self.tempdir)
+
+    def get_run_doc(self):
+        return self.processor.dbc.runs.find_one({'_id': self.processor.run_dbid})
+
+    def add_iteration(self, iteration):
+        filename = 'log-{}.txt'.format(iteration)
+        with open(os.path.join(self.tempdir, filename), 'w') as wfh:
+            wfh.write('iteration {}\n'.format(iteration) * 1000)
+        self.context.current_iteration = iteration
+        self.context.iteration_artifacts = [Artifact('log', filename, 'log', Artifact.ITERATION)]
+        result = MockObject(status='OK', events=[], metrics=[Metric('score', iteration)])
+        self.processor.export_iteration_result(result, self.context)
+
+    def test_upload(self):
+        fs = mongodb.gridfs.GridFS(self.processor.client.wa)
+        fs.put('', filename='[NOPROJECT]/test/existing.txt')
+        fs.put('', filename='[NOPROJECT]/testing/other.txt')
+        self.processor.start_run(self.context)
+        assert_equal(self.processor.gridfs_dir, '[NOPROJECT]/test-1')
+
+        for iteration in [1, 2, 3]:
+            self.add_iteration(iteration)
+        # iteration results are written in batches
+        assert_equal(len(self.get_run_doc()['workloads'][0]['results']), 2)
+
+        self.processor.finish_run()
+        results = self.get_run_doc()['workloads'][0]['results']
+        assert_equal([r['iteration'] for r in results], [1, 2, 3])
+        for r in results:
+            artifact = r['artifacts'][0]
+            assert_equal(artifact['filename'], '[NOPROJECT]/test-1/1-foo-{0}/log-{0}.txt'.format(r['iteration']))
+            assert_equal(self.processor.fs.get(artifact['gridfs_id']).read(),
+                         'iteration {}\n'.format(r['iteration']) * 1000)
+
+
+def _instantiate(cls, *args, **kwargs):
+    return cls(*args, **kwargs)
@@ -0,0 +1,187 @@
+#    Copyright 2017 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201
+import os
+import shutil
+import hashlib
+import httplib
+import tempfile
+import threading
+from unittest import TestCase
+
+import requests
+from nose.tools import assert_equal, raises
+
+from wlauto import settings
+from wlauto.common.android.resources import ApkFile
+from wlauto.core.resolver import ResourceResolver
+from wlauto.exceptions import ResourceError
+from wlauto.resource_getters.standard import HttpGetter
+from wlauto.utils.misc import FileHashIndex, sha256
+
+
+class MockOwner(object):
+
+    name = 'owner'
+
+
+class MockGetter(object):
+
+    name = 'mock_getter'
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def get(self, resource, **kwargs):
+        self.calls.append((resource.platform, kwargs))
+        return self.results.get(resource.platform)
+
+
+class ResolverCacheTest(TestCase):
+
+    def setUp(self):
+        self.owner = MockOwner()
+        self.getter = MockGetter({'arm64': 'arm64.apk'})
+        self.resolver = ResourceResolver(None)
+        self.resolver.register(self.getter, 'apk')
+
+    def test_cached(self):
+        for _ in xrange(3):
+            assert_equal(self.resolver.get(ApkFile(self.owner, 'arm64'), version='1.0'), 'arm64.apk')
+            assert_equal(self.resolver.get(ApkFile(self.owner, 'armeabi'), version='1.0', strict=False), None)
+        assert_equal(len(self.getter.calls), 2)
+
+        assert_equal(self.resolver.get(ApkFile(self.owner, 'arm64'), version='2.0'), 'arm64.apk')
+        assert_equal(self.resolver.get(ApkFile(MockOwner(), 'arm64'), version='1.0'), 'arm64.apk')
+        assert_equal(len(self.getter.calls), 4)
+
+    def test_register_clears_cache(self):
+        self.resolver.get(ApkFile(self.owner, 'arm64'))
+        self.resolver.register(MockGetter({}), 'apk', priority=-1)
+        self.resolver.get(ApkFile(self.owner, 'arm64'))
+        assert_equal(len(self.getter.calls), 2)
+
+    @raises(ResourceError)
+    def test_cached_miss_is_strict(self):
+        self.resolver.get(ApkFile(self.owner, 'armeabi'), strict=False)
+        self.resolver.get(ApkFile(self.owner, 'armeabi'))
+
+
+class FileHashIndexTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'asset.bin')
+        with open(self.path, 'wb') as wfh:
+            wfh.write('\0' * 4096)
+        self.index_path = os.path.join(self.tempdir, 'index', 'sha256.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_persistent(self):
+        assert_equal(FileHashIndex(self.index_path).sha256(self.path), sha256(self.path))
+        # a new index reads the recorded value rather than re-hashing the file
+        FileHashIndex(self.index_path).update(self.path, 'recorded')
+        assert_equal(FileHashIndex(self.index_path).sha256(self.path), 'recorded')
+
+    def test_modified_file(self):
+        index = FileHashIndex(self.index_path)
+        index.update(self.path, 'recorded')
+        with open(self.path, 'ab') as wfh:
+            wfh.write('more')
+        assert_equal(index.sha256(self.path), sha256(self.path))
+
+
+class MockResponse(object):
+
+    def __init__(self, content):
+        self.status_code = httplib.OK
+        self.content = content
+
+    def iter_content(self, chunk_size):
+        for i in xrange(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class MockHttpGetter(HttpGetter):
+
+    def __init__(self, assets, **kwargs):
+        super(MockHttpGetter, self).__init__(None, url='http://example.com', **kwargs)
+        self.assets = assets
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def geturl(self, url, stream=False):
+        with self.lock:
+            self.requested.append(url)
+        path = url[len('http://example.com/'):]
+        if path not in self.assets:
+            response = MockResponse('')
+            response.status_code = httplib.NOT_FOUND
+            response.reason = 'Not Found'
+            return response
+        return MockResponse(self.assets[path])
+
+
+class HttpGetterPrefetchTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dependencies_directory = settings.dependencies_directory
+        settings.dependencies_directory = self.tempdir
+        contents = {'foo/a.apk': 'a' * 1000, 'foo/sub/b.file': 'b' * 10, 'bar/c.file': 'c'}
+        self.getter = _instantiate(MockHttpGetter, contents, chunk_size=64)
+        self.getter.index = {
+            'foo': [{'path': 'a.apk', 'sha256': hashlib.sha256(contents['foo/a.apk']).hexdigest()},
+                    {'path': 'sub/b.file', 'sha256': hashlib.sha256(contents['foo/sub/b.file']).hexdigest()},
+                    {'path': 'missing.file', 'sha256': ''}],
+            'bar': [{'path': 'c.file', 'sha256': hashlib.sha256(contents['bar/c.file']).hexdigest()}],
+        }
+
+    def tearDown(self):
+        settings.dependencies_directory = self.dependencies_directory
+        shutil.rmtree(self.tempdir)
+
+    def test_prefetch(self):
+        results = self.getter.prefetch(['foo', 'baz'], jobs=4)
+        assert_equal(sorted(results), [('foo', 'a.apk'), ('foo', 'missing.file'), ('foo', 'sub/b.file')])
+        assert_equal(results[('foo', 'missing.file')], None)
+        with open(results[('foo', 'a.apk')]) as fh:
+            assert_equal(fh.read(), 'a' * 1000)
+        # no partial downloads are left behind
+        assert_equal(sorted(os.listdir(os.path.dirname(results[('foo', 'a.apk')]))), ['a.apk', 'sub'])
+
+        # assets that have already been fetched are not downloaded again
+        del self.getter.requested[:]
+        self.getter.prefetch(['foo'], jobs=2)
+        assert_equal(self.getter.requested, ['http://example.com/foo/missing.file'])
+
+    def test_prefetch_without_network(self):
+        def geturl(url, stream=False):
+            raise requests.ConnectionError('network is down')
+
+        self.getter.index = None
+        self.getter.geturl = geturl
+        assert_equal(self.getter.prefetch(['foo'], jobs=2), {})
+        assert_equal(self.getter.index, None)
+
+
+def _instantiate(cls, *args, **kwargs):
+    return cls(*args, **kwargs)
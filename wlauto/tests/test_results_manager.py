@@ -15,11 +15,14 @@
 
 
 # pylint: disable=W0231,W0613,E0611,W0603,R0201
+import pickle
+import threading
 from unittest import TestCase
 
-from nose.tools import assert_equal, assert_true, assert_false, assert_raises
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises, assert_is
 
-from wlauto.core.result import ResultProcessor, ResultManager
+from wlauto.core.configuration import WorkloadRunSpec
+from wlauto.core.result import ResultProcessor, ResultManager, IterationResult, Metric, MetricStore
 from wlauto.exceptions import WAError
 
 
@@ -71,6 +74,25 @@ class MockResultProcessor4(ResultProcessor):
         self.is_invoked = True
 
 
+class MockResultProcessor5(ResultProcessor):
+
+    name = 'thread_safe_result_processor'
+    thread_safe = True
+
+    def __init__(self):
+        super(MockResultProcessor5, self).__init__()
+        self.results = []
+        self.threads = set()
+        self.results_at_run_end = None
+
+    def process_iteration_result(self, result, context):
+        self.threads.add(threading.current_thread())
+        self.results.append(result)
+
+    def process_run_result(self, result, context):
+        self.results_at_run_end = list(self.results)
+
+
 class ResultManagerTest(TestCase):
 
     def test_keyboard_interrupt(self):
@@ -124,6 +146,85 @@ class ResultManagerTest(TestCase):
 
         assert_true(processor.is_invoked)
 
+    def test_parallel_result_processing(self):
+        processor = _instantiate(MockResultProcessor4)
+        thread_safe_processor = _instantiate(MockResultProcessor5)
+        processor_generic_exception = _instantiate(MockResultProcessor1)
+        processor_generic_exception.thread_safe = True
+
+        manager = ResultManager(parallel=True)
+        manager.install(processor)
+        manager.install(thread_safe_processor)
+        manager.install(processor_generic_exception)
+
+        for i in xrange(10):
+            manager.add_result(i, None)
+        assert_true(processor.is_invoked)
+
+        manager.process_run_result(None, None)
+        assert_equal(thread_safe_processor.results_at_run_end, range(10))
+        assert_equal(len(thread_safe_processor.threads), 1)
+        assert_false(threading.current_thread() in thread_safe_processor.threads)
+        assert_false(processor_generic_exception in manager.processors)
+
+
+class MetricStoreTest(TestCase):
+
+    def setUp(self):
+        spec = WorkloadRunSpec(id='1', number_of_iterations=1, classifiers={'device': 'a'})
+        spec._workload = object()  # pylint: disable=protected-access
+        self.result = IterationResult(spec)
+
+    def test_metrics(self):
+        self.result.add_metric('int', '3', 'ms')
+        self.result.add_metric('float', 2.5, lower_is_better=True)
+        self.result.add_metric('big', 2 ** 70)
+        self.result.add_metric('flag', True)
+        self.result.add_metric('int', 4, classifiers={'run': 2})
+
+        metrics = list(self.result.metrics)
+        assert_equal([m.to_dict() for m in metrics], [
+            {'name': 'int', 'value': 3, 'units': 'ms', 'lower_is_better': False,
+             'classifiers': {'device': 'a'}},
+            {'name': 'float', 'value': 2.5, 'units': None, 'lower_is_better': True,
+             'classifiers': {'device': 'a'}},
+            {'name': 'big', 'value': 2 ** 70, 'units': None, 'lower_is_better': False,
+             'classifiers': {'device': 'a'}},
+            {'name': 'flag', 'value': True, 'units': None, 'lower_is_better': False,
+             'classifiers': {'device': 'a'}},
+            {'name': 'int', 'value': 4, 'units': None, 'lower_is_better': False,
+             'classifiers': {'device': 'a', 'run': 2}},
+        ])
+        assert_equal([type(m.value) for m in metrics], [int, float, long, bool, int])
+        assert_equal(len(self.result.metrics), 5)
+        assert_equal(self.result.metrics[-1].value, 4)
+        assert_equal([m.name for m in self.result.metrics[1:3]], ['float', 'big'])
+
+    def test_lookup(self):
+        for i in xrange(100):
+            self.result.add_metric('metric{}'.format(i % 10), i)
+        assert_true(self.result.has_metric('metric3'))
+        assert_false(self.result.has_metric('metric10'))
+        # the first metric with the name is returned, as before
+        assert_equal(self.result['metric3'].value, 3)
+        assert_raises(KeyError, self.result.__getitem__, 'metric10')
+
+    def test_shared_classifiers(self):
+        for i in xrange(10):
+            self.result.add_metric('metric', i)
+        # later changes to the iteration's classifiers only affect new metrics
+        self.result.classifiers['device'] = 'b'
+        self.result.add_metric('metric', 10)
+        metrics = list(self.result.metrics)
+        assert_is(metrics[0].classifiers, metrics[9].classifiers)
+        assert_equal(metrics[0].classifiers, {'device': 'a'})
+        assert_equal(metrics[10].classifiers, {'device': 'b'})
+
+    def test_pickle(self):
+        store = MetricStore([Metric('a', 1, 'ms'), Metric('b', 0.5, classifiers={'x': [1]})])
+        copied = pickle.loads(pickle.dumps(store))
+        assert_equal([m.to_dict() for m in copied], [m.to_dict() for m in store])
+
 
 def _instantiate(cls):
     # Needed to get around Extension's __init__ checks
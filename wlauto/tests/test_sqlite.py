@@ -0,0 +1,200 @@
+#    Copyright 2017 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201,protected-access
+import os
+import csv
+import uuid
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from nose.tools import assert_equal, raises
+
+from wlauto.core.result import IterationResult
+from wlauto.exceptions import ResultProcessorError
+from wlauto.result_processors.sqlite import SqliteResultProcessor, SCHEMA_VERSION
+
+
+OLD_SCHEMA = [
+    'CREATE TABLE runs (uuid text, start_time datetime, end_time datetime, duration integer)',
+    '''CREATE TABLE workload_specs (id text, run_oid text, number_of_iterations integer, label text,
+                                    workload_name text, boot_parameters text, runtime_parameters text,
+                                    workload_parameters text)''',
+    '''CREATE TABLE metrics (spec_oid int, iteration integer, metric text, value text, units text,
+                             lower_is_better integer)''',
+    '''CREATE VIEW results AS
+       SELECT uuid as run_uuid, spec_id, label as workload, iteration, metric, value, units, lower_is_better
+       FROM metrics AS m INNER JOIN (
+            SELECT ws.OID as spec_oid, ws.id as spec_id, uuid, label
+            FROM workload_specs AS ws INNER JOIN runs AS r ON ws.run_oid = r.OID
+       ) AS wsr ON wsr.spec_oid = m.spec_oid''',
+    'CREATE TABLE __meta (schema_version text)',
+    'INSERT INTO __meta VALUES ("0.0.2")',
+    'INSERT INTO runs (uuid) VALUES ("old-run")',
+    'INSERT INTO workload_specs (id, run_oid, label) VALUES ("1", 1, "old")',
+    'INSERT INTO metrics VALUES (1, 1, "score", "42.5", NULL, 0)',
+    'INSERT INTO metrics VALUES (1, 1, "status", "OK", NULL, 0)',
+]
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def mock_spec(spec_id, label):
+    return MockObject(id=spec_id, label=label, workload_name=label, number_of_iterations=2,
+                      boot_parameters={}, runtime_parameters={}, workload_parameters={},
+                      classifiers={}, workload=None)
+
+
+def write_csv(path, rows):
+    with open(path, 'wb') as wfh:
+        csv.writer(wfh).writerows(rows)
+
+
+class SqliteResultProcessorTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tempdir, 'results.sqlite')
+        # specs "1" and "3" share a label
+        self.specs = [mock_spec('1', 'foo'), mock_spec('2', 'bar'), mock_spec('3', 'foo')]
+        start_time = datetime.now()
+        run_info = MockObject(uuid=uuid.uuid4(), start_time=start_time,
+                              end_time=start_time + timedelta(seconds=10), duration=timedelta(seconds=10))
+        self.context = MockObject(run_info=run_info, run_output_directory=self.tempdir,
+                                  config=MockObject(workload_specs=self.specs))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_processor(self):
+        processor = _instantiate(SqliteResultProcessor, database=self.database)
+        processor.validate()
+        # initialize() and finalize() are only invoked once for each extension
+        # class, so the database is opened and closed directly.
+        processor._open_database(self.context.run_info.uuid)
+        return processor
+
+    def add_result(self, processor, spec, iteration, **metrics):
+        result = IterationResult(spec)
+        for name, value in sorted(metrics.iteritems()):
+            result.add_metric(name, value)
+        self.context.spec = spec
+        self.context.current_iteration = iteration
+        processor.process_iteration_result(result, self.context)
+
+    def query(self, sql, *args):
+        conn = sqlite3.connect(self.database)
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+
+    def test_results(self):
+        processor = self.create_processor()
+        # iterations of a spec are not necessarily consecutive
+        for iteration in [1, 2]:
+            for spec in self.specs[:2]:
+                self.add_result(processor, spec, iteration, score=iteration * 10, big=2 ** 60 + 1)
+        processor.process_run_result(None, self.context)
+        processor._close_database()
+
+        assert_equal(self.query('PRAGMA journal_mode'), [('wal',)])
+        assert_equal(self.query('SELECT id, label FROM workload_specs ORDER BY id'), [('1', 'foo'), ('2', 'bar')])
+        assert_equal(self.query('''SELECT workload, iteration, value, value_text FROM results
+                                   WHERE metric="score" ORDER BY workload, iteration'''),
+                     [('bar', 1, 10.0, None), ('bar', 2, 20.0, None), ('foo', 1, 10.0, None), ('foo', 2, 20.0, None)])
+        # integers that would lose precision as reals are also kept as text
+        assert_equal(set(self.query('SELECT value_text FROM metrics WHERE metric="big"')), {(str(2 ** 60 + 1),)})
+        assert_equal(self.query('SELECT duration FROM runs'), [(10,)])
+
+    def test_migration(self):
+        conn = sqlite3.connect(self.database)
+        for command in OLD_SCHEMA:
+            conn.execute(command)
+        conn.commit()
+        conn.close()
+
+        processor = self.create_processor()
+        self.add_result(processor, self.specs[0], 1, score=1)
+        processor._close_database()
+
+        assert_equal(self.query('SELECT schema_version FROM __meta'), [(SCHEMA_VERSION,)])
+        assert_equal(sorted(self.query('SELECT run_uuid, metric, value, value_text FROM results')),
+                     sorted([('old-run', 'score', 42.5, None), ('old-run', 'status', None, 'OK'),
+                             (str(self.context.run_info.uuid), 'score', 1.0, None)]))
+
+    @raises(ResultProcessorError)
+    def test_unknown_version(self):
+        conn = sqlite3.connect(self.database)
+        conn.execute('CREATE TABLE __meta (schema_version text)')
+        conn.execute('INSERT INTO __meta VALUES ("0.0.1")')
+        conn.commit()
+        conn.close()
+        self.create_processor()
+
+    def test_trace_reports(self):
+        write_csv(os.path.join(self.tempdir, 'parallel.csv'),
+                  [['id', 'workload', 'iteration', 'cluster', 'number_of_cores', 'total_time', '%time',
+                    '%running_time'],
+                   ['1', 'foo', '1', 'all', '2', '1.500', '75.000', '100.000'],
+                   ['4', 'unknown', '1', 'all', '2', '1.500', '75.000', '100.000']])
+        write_csv(os.path.join(self.tempdir, 'cpustate.csv'),
+                  [['id', 'workload', 'iteration', 'state', 'A53 CPU0', 'A72 CPU1'],
+                   ['2', 'bar', '1', '1000000KHz', '25.000', '50.000']])
+        # dvfs.csv only has labels; spec "3" did not run a second iteration, so
+        # "foo" iteration 2 can only be spec "1", while iteration 1 is ambiguous.
+        write_csv(os.path.join(self.tempdir, 'dvfs.csv'),
+                  [['workload', 'iteration', 'state', 'A53 CPU0', 'A72 CPU1'],
+                   ['foo', '2', 'idle', '10.000', '20.000'],
+                   ['foo', '1', 'idle', '50.000', '50.000'],
+                   ['bar', '1', 'idle', '30.000', '40.000']])
+        iteration_results = []
+        for spec, iteration in [('1', 1), ('2', 1), ('3', 1), ('1', 2), ('2', 2)]:
+            iteration_results.append(MockObject(id=spec, iteration=iteration))
+        run_result = MockObject(iteration_results=iteration_results)
+
+        processor = self.create_processor()
+        self.add_result(processor, self.specs[0], 1, score=1)
+        processor.process_run_result(run_result, self.context)
+        processor.export_run_result(run_result, self.context)
+        processor._close_database()
+
+        assert_equal(self.query('''SELECT ws.id, iteration, cluster, number_of_cores, total_time, time_pc
+                                   FROM parallel AS p INNER JOIN workload_specs AS ws ON p.spec_oid = ws.OID'''),
+                     [('1', 1, 'all', 2, 1.5, 75.0)])
+        assert_equal(self.query('''SELECT ws.id, iteration, state, cpu, core, value
+                                   FROM cpustates AS c INNER JOIN workload_specs AS ws ON c.spec_oid = ws.OID
+                                   ORDER BY cpu'''),
+                     [('2', 1, '1000000KHz', 0, 'A53', 25.0), ('2', 1, '1000000KHz', 1, 'A72', 50.0)])
+        assert_equal(self.query('''SELECT ws.id, iteration, state, cpu, core, value
+                                   FROM dvfs AS d INNER JOIN workload_specs AS ws ON d.spec_oid = ws.OID
+                                   ORDER BY ws.id, cpu'''),
+                     [('1', 2, 'idle', 0, 'A53', 10.0), ('1', 2, 'idle', 1, 'A72', 20.0),
+                      ('2', 1, 'idle', 0, 'A53', 30.0), ('2', 1, 'idle', 1, 'A72', 40.0)])
+        # spec "1" was only added once, when its metrics were processed
+        assert_equal(self.query('SELECT count(*) FROM workload_specs'), [(2,)])
+
+
+def _instantiate(cls, *args, **kwargs):
+    return cls(*args, **kwargs)
@@ -0,0 +1,301 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201
+import os
+import struct
+import tempfile
+from unittest import TestCase
+
+from nose.tools import assert_equal, assert_true, assert_raises
+from nose.plugins.skip import SkipTest
+
+from wlauto.utils.trace_cmd import TraceCmdTrace, text_trace_has_dropped_events, _thread_pid
+from wlauto.utils.trace_dat import TraceDatTrace, is_trace_dat
+from wlauto.utils.trace_bus import TraceEventBus
+from wlauto.utils.power import (stream_cpu_power_transitions,
+                                stream_cpu_power_transitions_from_columns)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+TRACE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'trace.txt')
+
+# Events in formats that are, and are not, handled in bulk when parsing into
+# columns.
+IRREGULAR_TRACE = """\
+version = 6
+      foo-bar-12x  [000]   1.000001: ev:      a=1 b=2
+        a: b-7 [001]  1.1: ev: a=+5 b=hello world
+             t [001] 1.2: ev: a=007 b=1.5
+           t-1 [000] 1.3: ev: b=1  a=2
+           t-1 [000] 1.4: two words: a=1
+           t-1 [000] 1.5: text: no key value pairs here
+CPU:0 [5 EVENTS DROPPED]
+           t-1 [000] 1.6: ev: a=1 b= \t
+           t-1 [000] 1.7: sched_wakeup: comm=sh pid=2316 prio=120 success=1 CPU:001
+           t-1 [000] 1.8: kv: x=1 y=foo
+             t [001] 1.9: kv: x=-2 y=3
+"""
+
+
+class TestTraceCmdParsing(TestCase):
+
+    def test_parse(self):
+        trace = TraceCmdTrace(TRACE_FILE)
+        events = list(trace.parse())
+        assert_equal([e.name for e in events],
+                     ['sched_switch', 'cpu_idle', 'cpu_idle', 'cpu_frequency',
+                      'cpu_frequency', 'cpu_idle', 'DROPPED EVENTS DETECTED', 'cpu_idle'])
+        assert_equal(events[0].next_comm, 'swapper/0')
+        assert_equal(events[1].state, 0)
+        assert_equal(events[6].cpu_id, 1)
+        assert_true(trace.has_start_marker)
+
+    def test_dropped_events_scan(self):
+        assert_true(text_trace_has_dropped_events(TRACE_FILE))
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as wfh:
+                with open(TRACE_FILE) as fh:
+                    wfh.writelines(line for line in fh if 'EVENTS DROPPED' not in line)
+            assert_true(not text_trace_has_dropped_events(path))
+        finally:
+            os.remove(path)
+
+    def test_parse_columns(self):
+        if np is None:
+            raise SkipTest('numpy is not installed')
+        trace = TraceCmdTrace(TRACE_FILE)
+        columns = trace.parse_columns(block_size=128)
+        assert_equal(columns.keys(), ['sched_switch', 'cpu_idle', 'cpu_frequency',
+                                      'DROPPED EVENTS DETECTED'])
+        idle = columns['cpu_idle']
+        assert_equal(len(idle), 4)
+        assert_equal(idle.state.tolist(), [0, 1, 4294967295, 4294967295])
+        assert_equal(idle.cpu_id.tolist(), [0, 1, 0, 1])
+        assert_equal(idle.pid.tolist(), [0, 0, 0, 0])
+        assert_equal(columns['cpu_frequency'].timestamp.tolist(), [920.491, 920.491])
+        assert_equal(columns['sched_switch'].fields['next_comm'].tolist(), ['swapper/0'])
+        assert_equal(columns['DROPPED EVENTS DETECTED'].cpu.tolist(), [1])
+
+    def test_parse_columns_matches_parse(self):
+        if np is None:
+            raise SkipTest('numpy is not installed')
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as wfh:
+                wfh.write(IRREGULAR_TRACE)
+            trace = TraceCmdTrace(path, filter_markers=False)
+            events = list(trace.parse())
+            for block_size in [1, 64, 1024 * 1024]:
+                columns = trace.parse_columns(block_size=block_size)
+                actual = []
+                for name, cols in columns.iteritems():
+                    for i, index in enumerate(cols.index.tolist()):
+                        # events without a field have None or NaN for it
+                        fields = {k: v[i] for k, v in cols.fields.iteritems()
+                                  if v[i] is not None and not (isinstance(v[i], float) and np.isnan(v[i]))}
+                        actual.append((index, name, cols.cpu[i], cols.pid[i], fields))
+                # dropped events have their CPU in the cpu column, rather than a field
+                expected = [(i, e.name, e.reporting_cpu_id, _thread_pid(e.thread), e.fields)
+                            if e.timestamp is not None else (i, e.name, e.cpu_id, -1, {})
+                            for i, e in enumerate(events)]
+                assert_equal(sorted(actual), expected)
+        finally:
+            os.remove(path)
+
+    def test_columnar_transitions(self):
+        if np is None:
+            raise SkipTest('numpy is not installed')
+        names = ['cpu_idle', 'cpu_frequency', 'print']
+        trace = TraceCmdTrace(TRACE_FILE, names=names, filter_markers=False)
+        expected = list(stream_cpu_power_transitions(trace.parse()))
+        actual = list(stream_cpu_power_transitions_from_columns(trace.parse_columns()))
+        assert_equal(map(str, actual), map(str, expected))
+
+
+class TestTraceEventBus(TestCase):
+
+    def test_dispatch(self):
+        bus = TraceEventBus()
+        idle, marked, starts = [], [], []
+        bus.subscribe(idle.append, names=['cpu_idle'], on_start=starts.append)
+        bus.subscribe(marked.append, names=['cpu_.*'], filter_markers=True)
+        bus.dispatch(TRACE_FILE)
+        bus.dispatch(TRACE_FILE)  # already dispatched -- should do nothing
+
+        assert_equal(starts, [TRACE_FILE])
+        assert_equal([e.name for e in idle],
+                     ['cpu_idle'] * 5 + ['DROPPED EVENTS DETECTED'] + ['cpu_idle'] * 2)
+        assert_equal([e.name for e in marked],
+                     ['cpu_idle', 'cpu_idle', 'cpu_frequency', 'cpu_frequency',
+                      'cpu_idle', 'DROPPED EVENTS DETECTED', 'cpu_idle'])
+
+        bus.unsubscribe(idle.append)
+        assert_equal(len(bus.subscribers), 1)
+
+    def test_failing_subscriber(self):
+        bus = TraceEventBus()
+        events, unstarted, ends = [], [], []
+
+        def fail_on_dropped(event):
+            if event.name == 'DROPPED EVENTS DETECTED':
+                raise ValueError(event)
+
+        def fail_on_start(trace_file):
+            raise ValueError(trace_file)
+
+        bus.subscribe(fail_on_dropped, names=['cpu_idle'], on_end=ends.append)
+        bus.subscribe(unstarted.append, names=['cpu_idle'], on_start=fail_on_start)
+        bus.subscribe(events.append, names=['cpu_idle'], on_end=ends.append)
+        bus.dispatch(TRACE_FILE)
+
+        # failing subscribers do not prevent the others from getting all events
+        assert_equal([e.name for e in events],
+                     ['cpu_idle'] * 5 + ['DROPPED EVENTS DETECTED'] + ['cpu_idle'] * 2)
+        assert_equal(unstarted, [])
+        assert_equal(ends, [TRACE_FILE])
+        assert_equal([s.callback for s in bus.subscribers], [events.append])
+
+    def test_parse_error(self):
+        bus = TraceEventBus()
+        bus.subscribe(lambda event: None)
+        missing = os.path.join(os.path.dirname(__file__), 'data', 'missing-trace.txt')
+        # every consumer that requests the trace sees the error
+        assert_raises(IOError, bus.dispatch, missing)
+        assert_raises(IOError, bus.dispatch, missing)
+        bus.dispatch(TRACE_FILE)
+
+
+PAGE_SIZE = 4096
+
+HEADER_PAGE = """\tfield: u64 timestamp;\toffset:0;\tsize:8;\tsigned:0;
+\tfield: local_t commit;\toffset:8;\tsize:8;\tsigned:1;
+\tfield: int overwrite;\toffset:8;\tsize:1;\tsigned:1;
+\tfield: char data;\toffset:16;\tsize:4080;\tsigned:1;
+"""
+
+COMMON_FIELDS = """\tfield:unsigned short common_type;\toffset:0;\tsize:2;\tsigned:0;
+\tfield:unsigned char common_flags;\toffset:2;\tsize:1;\tsigned:0;
+\tfield:unsigned char common_preempt_count;\toffset:3;\tsize:1;\tsigned:0;
+\tfield:int common_pid;\toffset:4;\tsize:4;\tsigned:1;
+"""
+
+PRINT_FORMAT = """name: print
+ID: 5
+format:
+""" + COMMON_FIELDS + """
+\tfield:unsigned long ip;\toffset:8;\tsize:8;\tsigned:0;
+\tfield:char buf[];\toffset:16;\tsize:0;\tsigned:1;
+
+print fmt: "%ps: %s", (void *)REC->ip, REC->buf
+"""
+
+CPU_IDLE_FORMAT = """name: cpu_idle
+ID: 380
+format:
+""" + COMMON_FIELDS + """
+\tfield:u32 state;\toffset:8;\tsize:4;\tsigned:0;
+\tfield:u32 cpu_id;\toffset:12;\tsize:4;\tsigned:0;
+
+print fmt: "state=%lu cpu_id=%lu", (unsigned long)REC->state, (unsigned long)REC->cpu_id
+"""
+
+
+def _record(delta, payload):
+    payload += '\0' * (-len(payload) % 4)
+    return struct.pack('<I', (delta << 5) | (len(payload) // 4)) + payload
+
+
+def _print_record(delta, pid, text):
+    return _record(delta, struct.pack('<HBBiQ', 5, 0, 0, pid, 0) + text + '\n\0')
+
+
+def _idle_record(delta, pid, state, cpu):
+    return _record(delta, struct.pack('<HBBiII', 380, 0, 0, pid, state, cpu))
+
+
+def _page(timestamp, records, missed=False):
+    data = ''.join(records)
+    commit = len(data) | ((1 << 31) if missed else 0)
+    page = struct.pack('<QQ', timestamp, commit) + data
+    return page + '\0' * (PAGE_SIZE - len(page))
+
+
+def write_trace_dat(path, cpu_pages):
+    header = '\x17\x08\x44tracing' + '6\0' + '\0' + '\x08' + struct.pack('<I', PAGE_SIZE)
+    header += 'header_page\0' + struct.pack('<Q', len(HEADER_PAGE)) + HEADER_PAGE
+    header += 'header_event\0' + struct.pack('<Q', 0)
+    header += struct.pack('<I', 1) + struct.pack('<Q', len(PRINT_FORMAT)) + PRINT_FORMAT
+    header += struct.pack('<I', 1) + 'power\0' + struct.pack('<I', 1)
+    header += struct.pack('<Q', len(CPU_IDLE_FORMAT)) + CPU_IDLE_FORMAT
+    header += struct.pack('<I', 0) + struct.pack('<I', 0)
+    cmdlines = '42 sh\n'
+    header += struct.pack('<Q', len(cmdlines)) + cmdlines
+    header += struct.pack('<I', len(cpu_pages))
+    header += 'options  \0' + struct.pack('<H', 0)
+    header += 'flyrecord\0'
+    offset = len(header) + 16 * len(cpu_pages)
+    offset += -offset % PAGE_SIZE
+    sections = []
+    data = ''
+    for pages in cpu_pages:
+        sections.append(struct.pack('<QQ', offset + len(data), len(pages) * PAGE_SIZE))
+        data += ''.join(pages)
+    header += ''.join(sections)
+    with open(path, 'wb') as wfh:
+        wfh.write(header + '\0' * (-len(header) % PAGE_SIZE) + data)
+
+
+class TestTraceDatParsing(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.dat')
+        write_trace_dat(self.path, [
+            [_page(1000000000, [_print_record(0, 42, 'TRACE_MARKER_START'),
+                                _idle_record(500, 0, 0, 0),
+                                _idle_record(1000, 0, 4294967295, 0)]),
+             _page(1000002000, [_print_record(100, 42, 'TRACE_MARKER_STOP')], missed=True)],
+            [_page(1000000200, [_idle_record(0, 0, 1, 1)])],
+        ])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parse(self):
+        assert_true(is_trace_dat(self.path))
+        assert_true(not is_trace_dat(TRACE_FILE))
+        trace = TraceDatTrace(self.path, filter_markers=False)
+        events = list(trace.parse())
+        assert_equal([e.name for e in events],
+                     ['print', 'cpu_idle', 'cpu_idle', 'cpu_idle',
+                      'DROPPED EVENTS DETECTED', 'print'])
+        assert_equal(events[0].thread, 'sh-42')
+        assert_equal(events[0].text, 'TRACE_MARKER_START')
+        assert_equal([e.reporting_cpu_id for e in events[1:4]], [1, 0, 0])
+        assert_equal(events[2].timestamp, 1.0000005)
+        assert_equal(events[3].state, 4294967295)
+        assert_equal(events[4].cpu_id, 0)
+        assert_true(trace.has_start_marker)
+
+    def test_filter_markers(self):
+        trace = TraceDatTrace(self.path, names=['cpu_idle'])
+        assert_equal(len(list(trace.parse())), 4)
@@ -15,12 +15,17 @@
 
 
 # pylint: disable=R0201
+import sys
 from unittest import TestCase
 
 from nose.tools import raises, assert_equal, assert_not_equal, assert_true  # pylint: disable=E0611
+from pexpect import spawn
 
-from wlauto.utils.android import check_output
+from wlauto.exceptions import DeviceError
+from wlauto.utils.android import check_output, AdbShell
+from wlauto.utils.lazyimport import lazy_import, profile_imports, LazyModule
 from wlauto.utils.misc import merge_dicts, merge_lists, TimeoutError
+from wlauto.utils.statedetect import search_scales, select_state
 from wlauto.utils.types import (list_or_integer, list_or_bool, caseless_string, arguments,
                                 ParameterDict)
 
@@ -35,6 +40,110 @@ class TestCheckOutput(TestCase):
         check_output("python -c 'import time; time.sleep(1)'", timeout=0.5, shell=True)
 
 
+class TestAdbShell(TestCase):
+
+    def setUp(self):
+        # Use a local interactive shell in place of the one on the device.
+        self.shell = AdbShell(None, timeout=5)
+        self.shell.conn = spawn('sh')
+
+    def tearDown(self):
+        self.shell.close()
+
+    def test_execute(self):
+        assert_equal(self.shell.execute('echo hello; echo world'), 'hello\nworld\n')
+        assert_equal(self.shell.execute('true'), '')
+        assert_equal(self.shell.execute('echo error >&2; false'), 'error\n')
+        assert_equal(self.shell.execute('test -t 1 && echo terminal || echo pipe'), 'pipe\n')
+
+    @raises(DeviceError)
+    def test_exit_code(self):
+        self.shell.execute('echo oops; exit 3', check_exit_code=True)
+
+    @raises(TimeoutError)
+    def test_timeout(self):
+        self.shell.execute('sleep 5', timeout=0.5)
+
+
+class TestLazyImport(TestCase):
+
+    def test_lazy_import(self):
+        sys.modules.pop('telnetlib', None)
+        calls = []
+        telnetlib = lazy_import('telnetlib', pre_import=lambda: calls.append('pre_import'))
+        assert_true(isinstance(telnetlib, LazyModule))
+        assert_true('telnetlib' not in sys.modules)
+        assert_equal(telnetlib.TELNET_PORT, 23)
+        assert_true('telnetlib' in sys.modules)
+        assert_equal(calls, ['pre_import'])
+
+    def test_imported_or_missing(self):
+        assert_true(lazy_import('os') is sys.modules['os'])
+        assert_equal(lazy_import('no_such_module_for_wa'), None)
+        assert_equal(lazy_import('no_such_module_for_wa.submodule'), None)
+
+    def test_profile_imports(self):
+        times = profile_imports(['telnetlib'])
+        names = [t.name for t in times]
+        assert_true('telnetlib' in names)
+        for t in times:
+            assert_true(0 <= t.self_time <= t.cumulative_time)
+
+    def test_trace_modules_defer_numpy(self):
+        modules = ['wlauto.utils.trace_cmd', 'wlauto.utils.power', 'wlauto.result_processors.cpustate',
+                   'wlauto.instrumentation.coreutil']
+        names = [t.name for t in profile_imports(modules)]
+        assert_true('wlauto.utils.trace_cmd' in names)
+        assert_true('numpy' not in names)
+
+
+class TestStateDetection(TestCase):
+
+    def test_coarse_match(self):
+        evaluated = []
+
+        def score(i):
+            evaluated.append(i)
+            return 0.9 if i == 10 else 0.1
+
+        assert_true(search_scales(61, score, threshold=0.4, step=5))
+        assert_equal(evaluated, [0, 5, 10])
+
+    def test_refined_match(self):
+        evaluated = []
+
+        def score(i):
+            evaluated.append(i)
+            return 0.4 - 0.02 * abs(i - 12)
+
+        assert_true(search_scales(61, score, threshold=0.4, step=5))
+        assert_equal(len(evaluated), len(set(evaluated)))
+        assert_true(len(evaluated) < 61)
+
+    def test_template_too_large(self):
+        evaluated = []
+
+        def score(i):
+            evaluated.append(i)
+            return 0.1 if i < 20 else None
+
+        assert_true(not search_scales(61, score, threshold=0.4, step=5))
+        assert_true(max(evaluated) <= 20)
+        assert_true(not search_scales(61, score, threshold=0.4, step=1))
+        assert_equal(sorted(set(evaluated)), range(21))
+
+    def test_select_state(self):
+        definitions = {'workload_states': [
+            {'state_name': 'menu', 'templates': ['logo', 'play'], 'matches': 1},
+            {'state_name': 'game', 'templates': ['logo', 'score'], 'matches': 2},
+        ]}
+        assert_equal(select_state(definitions, set(['play'])), 'menu')
+        # when several states match, the first one defined wins
+        assert_equal(select_state(definitions, set(['logo', 'play', 'score'])), 'menu')
+        assert_equal(select_state(definitions, set(['logo', 'score'])), 'menu')
+        assert_equal(select_state(definitions, set(['score'])), 'none')
+
+
 class TestMerge(TestCase):
 
     def test_dict_merge(self):
@@ -0,0 +1,149 @@
+#    Copyright 2017 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+# pylint: disable=E0611
+# pylint: disable=R0201,protected-access
+import os
+import shutil
+import tarfile
+import tempfile
+import posixpath
+import subprocess
+from unittest import TestCase
+
+from nose.tools import assert_equal, assert_true
+
+from wlauto import settings
+from wlauto.common.android.workload import GameWorkload, get_tarball_manifest
+from wlauto.exceptions import DeviceError
+
+
+class MockObject(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class LocalDevice(object):
+    """Runs commands in a shell on the host, with its storage under a local directory."""
+
+    name = 'local-device'
+    platform = 'android'
+    path = posixpath
+    busybox = ''
+
+    def __init__(self, root):
+        self.resource_cache = os.path.join(root, 'cache')
+        self.external_storage_directory = os.path.join(root, 'sdcard')
+        os.makedirs(os.path.join(self.external_storage_directory, 'Android', 'data'))
+        self.commands = []
+        self.pushed = []
+
+    def execute(self, command, check_exit_code=True, **kwargs):  # pylint: disable=unused-argument
+        self.commands.append(command)
+        process = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = process.communicate()
+        if check_exit_code and process.returncode:
+            raise DeviceError(output)
+        return output
+
+    def file_exists(self, filepath):
+        return os.path.exists(filepath)
+
+    def push_file(self, source, dest, timeout=None):  # pylint: disable=unused-argument
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copy(source, dest)
+        self.pushed.append(dest)
+
+
+class TestGame(GameWorkload):
+
+    name = 'test_game'
+    package = 'com.example.game'
+    asset_file = 'test-assets.tar.gz'
+
+
+class DeployAssetsTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.environment_root = settings.environment_root
+        settings.environment_root = os.path.join(self.tempdir, 'wa')
+        self.tarball = os.path.join(self.tempdir, 'test-assets.tar.gz')
+        self.write_tarball({'com.example.game/a.dat': 'a' * 100, 'com.example.game/sub/b.dat': 'b' * 10})
+        self.device = LocalDevice(os.path.join(self.tempdir, 'device'))
+        self.workload = _instantiate(TestGame, self.device)
+        self.context = MockObject(resolver=MockObject(get=lambda resource, strict=True: self.tarball))
+        self.data_directory = os.path.join(self.device.external_storage_directory, 'Android', 'data')
+
+    def tearDown(self):
+        settings.environment_root = self.environment_root
+        shutil.rmtree(self.tempdir)
+
+    def write_tarball(self, contents):
+        source = os.path.join(self.tempdir, 'source')
+        shutil.rmtree(source, ignore_errors=True)
+        for path, data in contents.iteritems():
+            filepath = os.path.join(source, path)
+            if not os.path.isdir(os.path.dirname(filepath)):
+                os.makedirs(os.path.dirname(filepath))
+            with open(filepath, 'w') as wfh:
+                wfh.write(data)
+        with tarfile.open(self.tarball, 'w:gz') as tar:
+            tar.add(os.path.join(source, 'com.example.game'), 'com.example.game')
+
+    def deploy(self):
+        del self.device.commands[:]
+        self.workload._deploy_assets(self.context)
+        return [c for c in self.device.commands if 'tar -xzf' in c]
+
+    def test_manifest(self):
+        manifest = get_tarball_manifest(self.tarball)
+        assert_equal(manifest.files, {'com.example.game/a.dat': ('com.example.game/a.dat', 100),
+                                      'com.example.game/sub/b.dat': ('com.example.game/sub/b.dat', 10)})
+
+    def test_skip_deployed(self):
+        assert_equal(len(self.deploy()), 1)
+        assert_true(os.path.isfile(os.path.join(self.data_directory, 'com.example.game', 'sub', 'b.dat')))
+
+        # nothing has changed, so nothing is extracted
+        assert_equal(self.deploy(), [])
+
+        # only the missing file is re-extracted
+        os.remove(os.path.join(self.data_directory, 'com.example.game', 'a.dat'))
+        extract_commands = self.deploy()
+        assert_equal(len(extract_commands), 1)
+        assert_true("'com.example.game/a.dat'" in extract_commands[0])
+        assert_true('b.dat' not in extract_commands[0])
+        with open(os.path.join(self.data_directory, 'com.example.game', 'a.dat')) as fh:
+            assert_equal(fh.read(), 'a' * 100)
+
+    def test_updated_tarball(self):
+        self.deploy()
+        self.write_tarball({'com.example.game/a.dat': 'c' * 100, 'com.example.game/sub/b.dat': 'b' * 10})
+        extract_commands = self.deploy()
+        # the new tarball is pushed and extracted in full
+        assert_equal(len(self.device.pushed), 2)
+        assert_equal(len(extract_commands), 1)
+        assert_true('a.dat' not in extract_commands[0])
+        with open(os.path.join(self.data_directory, 'com.example.game', 'a.dat')) as fh:
+            assert_equal(fh.read(), 'c' * 100)
+
+
+def _instantiate(cls, *args, **kwargs):
+    # Needed to get around Extension's __init__ checks
+    return cls(*args, **kwargs)
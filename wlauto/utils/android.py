@@ -24,11 +24,17 @@ import time
 import subprocess
 import logging
 import re
+import json
+import threading
 
-from wlauto.exceptions import DeviceError, ConfigError, HostError, WAError
+from pexpect import EOF, TIMEOUT, spawn
+
+from wlauto.core.bootstrap import settings
+from wlauto.exceptions import DeviceError, ConfigError, HostError, WAError, TimeoutError
 from wlauto.utils.misc import (check_output, escape_single_quotes,
                                escape_double_quotes, get_null,
-                               CalledProcessErrorWithStderr, ABI_MAP)
+                               CalledProcessErrorWithStderr, ABI_MAP,
+                               FileHashIndex, ensure_file_directory_exists)
 
 
 MAX_TRIES = 5
@@ -178,6 +184,17 @@ class ApkInfo(object):
     version_regex = re.compile(r"name='(?P<name>[^']+)' versionCode='(?P<vcode>[^']+)' versionName='(?P<vname>[^']+)'")
     name_regex = re.compile(r"name='(?P<name>[^']+)'")
 
+    pod_attributes = ['package', 'activity', 'label', 'version_name', 'version_code', 'native_code']
+
+    @staticmethod
+    def from_pod(pod, path=None):
+        info = ApkInfo()
+        info.path = path
+        for attr in ApkInfo.pod_attributes:
+            setattr(info, attr, pod.get(attr))
+        info.native_code = info.native_code or []
+        return info
+
     def __init__(self, path=None):
         self.path = path
         self.package = None
@@ -186,7 +203,12 @@ class ApkInfo(object):
         self.version_name = None
         self.version_code = None
         self.native_code = []
-        self.parse(path)
+        self.sha256 = None  # only set by ApkInfoCache
+        if path:
+            self.parse(path)
+
+    def to_pod(self):
+        return {attr: getattr(self, attr) for attr in self.pod_attributes}
 
     def parse(self, apk_path):
         _check_env()
@@ -222,6 +244,70 @@ class ApkInfo(object):
                 pass  # not interested
 
 
+class ApkInfoCache(object):
+    """
+    A persistent cache of :class:`ApkInfo`\ s, keyed on the SHA256 of the APK, so
+    that ``aapt`` only needs to be run once for each APK.
+
+    """
+
+    def __init__(self, cache_directory):
+        self.hash_index = FileHashIndex(os.path.join(cache_directory, 'sha256.json'))
+        self.index_path = os.path.join(cache_directory, 'apk_info.json')
+        self._index = None
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the :class:`ApkInfo` for the APK at the specified path."""
+        digest = self.hash_index.sha256(path)
+        with self.lock:
+            index = self._get_index()
+            if digest in index:
+                info = ApkInfo.from_pod(index[digest], path)
+            else:
+                info = ApkInfo(path)
+                index[digest] = info.to_pod()
+                self._save()
+        info.sha256 = digest
+        return info
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = {}
+            if os.path.isfile(self.index_path):
+                try:
+                    with open(self.index_path) as fh:
+                        self._index = json.load(fh)
+                except (IOError, ValueError):
+                    pass  # the index will be rebuilt
+        return self._index
+
+    def _save(self):
+        try:
+            ensure_file_directory_exists(self.index_path)
+            temp_path = '{}.{}'.format(self.index_path, os.getpid())
+            with open(temp_path, 'w') as wfh:
+                json.dump(self._index, wfh)
+            os.rename(temp_path, self.index_path)
+        except (IOError, OSError):
+            pass  # APKs will simply be parsed again next time
+
+
+_apk_info_cache = None
+
+
+def get_apk_info(path):
+    """
+    Returns the :class:`ApkInfo` for the APK at the specified path, using an
+    :class:`ApkInfoCache` kept under WA's environment root.
+
+    """
+    global _apk_info_cache  # pylint: disable=global-statement
+    if _apk_info_cache is None:
+        _apk_info_cache = ApkInfoCache(os.path.join(settings.environment_root, 'apk_info'))
+    return _apk_info_cache.get(path)
+
+
 def fastboot_command(command, timeout=None):
     _check_env()
     full_command = "fastboot {}".format(command)
@@ -372,8 +458,11 @@ def adb_shell(device, command, timeout=None, check_exit_code=False, as_root=Fals
                           '-----ERROR:\n-----\n{}\n-----'
                 raise DeviceError(message.format(raw_output, error))
     else:  # do not check exit code
+        # As above, the command is passed as an argument to adb, rather than via
+        # a shell on the host, so that e.g. "$?" is expanded on the device.
+        actual_command = ['adb'] + device_part + ['shell', command]
         try:
-            output, error = check_output(full_command, timeout, shell=True)
+            output, error = check_output(actual_command, timeout, shell=False)
             if output is None:
                 output = error
             elif error is not None:
@@ -386,6 +475,95 @@ def adb_shell(device, command, timeout=None, check_exit_code=False, as_root=Fals
     return output
 
 
+class AdbShell(object):
+    """
+    A long-lived ``adb shell`` session that commands are executed over, avoiding
+    the cost of starting a new ``adb`` process (and the associated handshake with
+    the device) for every command.
+
+    The output and exit code of each command are delimited by markers that are
+    generated by the shell on the device (so that they are not matched in the
+    echo of the command itself). If the session is lost (e.g. because the device
+    has been rebooted), a new one is started for the next command.
+
+    """
+
+    # Commands are written to a terminal on the device, which limits the length
+    # of lines; longer commands are executed using a separate adb process.
+    max_command_length = 4000
+
+    def __init__(self, device, timeout=30):
+        self.device = device
+        self.timeout = timeout
+        self.conn = None
+        self.lock = threading.Lock()
+        self._command_count = 0
+
+    def connect(self):
+        _check_env()
+        device_string = ' -s {}'.format(self.device) if self.device else ''
+        command = 'adb{} shell'.format(device_string)
+        logger.debug(command)
+        self.conn = spawn(command, timeout=self.timeout)
+        # Make sure the shell is up and accepting commands.
+        self._execute('true', self.timeout)
+
+    def execute(self, command, timeout=None, check_exit_code=False, as_root=False):
+        if as_root:
+            command = 'echo \'{}\' | su'.format(escape_single_quotes(command))
+        if len(command) > self.max_command_length or '\n' in command:
+            return adb_shell(self.device, command, timeout, check_exit_code)
+        logger.debug(command)
+        with self.lock:
+            if not self.conn or not self.conn.isalive():
+                logger.debug('Starting a new adb shell session...')
+                self.connect()
+            exit_code, output = self._execute(command, timeout)
+        if check_exit_code:
+            if exit_code:
+                message = 'Got exit code {}\nfrom: {}\nOUTPUT: {}'
+                raise DeviceError(message.format(exit_code, command, output))
+            elif am_start_error.findall(output):
+                message = 'Could not start activity; got the following:'
+                message += '\n{}'.format(am_start_error.findall(output)[0])
+                raise DeviceError(message)
+        return output
+
+    def close(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close(force=True)
+                self.conn = None
+
+    def _execute(self, command, timeout):
+        self._command_count += 1
+        marker = 'WA_{}_{}'.format(os.getpid(), self._command_count)
+        # The quotes are removed by the shell on the device, so the markers
+        # only appear as below in the output of the echo commands.
+        start_marker = marker.replace('_', "_''", 1) + '_START'
+        end_marker = marker.replace('_', "_''", 1) + '_END'
+        # Output is piped through cat so that commands do not see a terminal
+        # (which would, e.g., change the format of ls output).
+        self.conn.sendline('echo {}; (({}) </dev/null 2>&1; echo {}_$?) | cat'.format(start_marker, command,
+                                                                                      end_marker))
+        timeout = timeout or None
+        try:
+            self.conn.expect(r'{}_START\r?\n'.format(marker), timeout=timeout)
+            self.conn.expect(r'{}_END_(\d+)\r?\n'.format(marker), timeout=timeout)
+        except TIMEOUT:
+            output = self.conn.before
+            # The command may still be running, so start a new session for the
+            # next command.
+            self.conn.close(force=True)
+            self.conn = None
+            raise TimeoutError(command, output)
+        except EOF:
+            self.conn = None
+            raise DeviceError('adb shell session was terminated while executing "{}"'.format(command))
+        output = self.conn.before.replace('\r\n', '\n')
+        return int(self.conn.match.group(1)), output
+
+
 def adb_background_shell(device, command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, as_root=False):
     """Runs the sepcified command in a subprocess, returning the the Popen object."""
     _check_env()
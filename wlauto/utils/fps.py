@@ -14,10 +14,9 @@
 #
 import collections
 
-try:
-    import pandas as pd
-except ImportError:
-    pd = None
+from wlauto.utils.lazyimport import lazy_import
+
+pd = lazy_import('pandas')
 
 SurfaceFlingerFrame = collections.namedtuple('SurfaceFlingerFrame', 'desired_present_time actual_present_time frame_ready_time')
 GfxInfoFrame = collections.namedtuple('GfxInfoFrame', 'Flags IntendedVsync Vsync OldestInputEvent NewestInputEvent HandleInputStart AnimationStart PerformTraversalsStart DrawStart SyncQueued SyncStart IssueDrawCommandsStart SwapBuffers FrameCompleted')
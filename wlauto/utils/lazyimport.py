@@ -0,0 +1,210 @@
+#    Copyright 2017 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Utilities for deferring the import of (typically large, optional) modules until
+they are actually used. This is intended to replace the ::
+
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+idiom, which pays the cost of importing ``pandas`` whenever the module containing
+it is imported, with ::
+
+    pd = lazy_import('pandas')
+
+which only imports ``pandas`` when an attribute of ``pd`` is first accessed. As with
+the original idiom, ``pd`` will be ``None`` if ``pandas`` is not installed.
+
+"""
+from __future__ import absolute_import
+
+import os
+import imp
+import sys
+import json
+import types
+import shutil
+import tempfile
+import importlib
+import threading
+import subprocess
+from collections import namedtuple
+
+
+class LazyModule(types.ModuleType):
+    """
+    A proxy for a module that imports the module the first time one of its
+    attributes is accessed.
+
+    """
+
+    def __init__(self, name, pre_import=None):
+        super(LazyModule, self).__init__(name)
+        # Attributes are set via __dict__, as the proxy's own __setattr__ is
+        # forwarded to the module.
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_pre_import'] = pre_import
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with self.__dict__['_lazy_lock']:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    pre_import = self.__dict__['_lazy_pre_import']
+                    if pre_import:
+                        pre_import()
+                    module = importlib.import_module(self.__dict__['_lazy_name'])
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] else 'not loaded'
+        return '<lazy module {} ({})>'.format(self.__dict__['_lazy_name'], state)
+
+
+def is_importable(name):
+    """
+    Returns ``True`` if the module with the specified name can be found, without
+    importing it. For submodules, only the top-level package is checked.
+
+    """
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    top_level = name.split('.')[0]
+    if top_level in sys.modules:
+        return sys.modules[top_level] is not None
+    try:
+        fh, _, _ = imp.find_module(top_level)
+    except ImportError:
+        return False
+    if fh:
+        fh.close()
+    return True
+
+
+def lazy_import(name, pre_import=None):
+    """
+    Returns a :class:`LazyModule` for the specified module, or ``None`` if it is not
+    installed. If the module has already been imported, it is returned directly.
+
+    :param name: The full (dot-delimited) name of the module.
+    :param pre_import: A callable that is invoked immediately before the module gets
+                       imported (e.g. to select a matplotlib backend before
+                       ``matplotlib.pyplot`` is imported).
+
+    """
+    if sys.modules.get(name) is not None:
+        return sys.modules[name]
+    if not is_importable(name):
+        return None
+    return LazyModule(name, pre_import)
+
+
+ImportTime = namedtuple('ImportTime', 'name self_time cumulative_time')
+
+# Run in a fresh interpreter by profile_imports(), so that the reported times are
+# not affected by what has already been imported by the current process.
+_PROFILE_SCRIPT = '''
+import __builtin__, imp, json, sys, time
+
+records = []
+stack = []
+original_import = __builtin__.__import__
+
+
+def timed(name, func, *args, **kwargs):
+    stack.append(0.0)
+    known = len(sys.modules)
+    start = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        children = stack.pop()
+        # Only record imports that actually loaded something; the (small) cost
+        # of looking up modules that have already been imported is attributed
+        # to the importer.
+        if len(sys.modules) != known:
+            if stack:
+                stack[-1] += elapsed
+            records.append((name, elapsed - children, elapsed))
+
+
+def timed_import(name, *args, **kwargs):
+    return timed(name, original_import, name, *args, **kwargs)
+
+
+__builtin__.__import__ = timed_import
+with open(sys.argv[1]) as fh:
+    targets = json.load(fh)
+for modname, filepath in targets:
+    try:
+        if filepath:
+            timed(modname, imp.load_source, str(modname), str(filepath))
+        else:
+            __import__(str(modname))
+    except Exception as e:  # pylint: disable=broad-except
+        sys.stderr.write('Could not import {}: {}\\n'.format(modname, e))
+__builtin__.__import__ = original_import
+with open(sys.argv[2], 'w') as wfh:
+    json.dump(records, wfh)
+'''
+
+
+def profile_imports(modules, python=None):
+    """
+    Imports the specified modules in a new Python interpreter and returns a list of
+    :class:`ImportTime`\\ s, in the order the imports completed, for every module that
+    got imported as a result. Times are in seconds; the self time of an import
+    excludes the time taken by the imports it triggered, while the cumulative time
+    includes it.
+
+    :param modules: A list of module names, or ``(name, file path)`` tuples for modules
+                    that are not on the Python path.
+    :param python: The Python interpreter to use; defaults to the current one.
+
+    """
+    targets = [m if isinstance(m, tuple) else (m, None) for m in modules]
+    tempdir = tempfile.mkdtemp()
+    try:
+        targets_file = os.path.join(tempdir, 'targets.json')
+        results_file = os.path.join(tempdir, 'results.json')
+        with open(targets_file, 'w') as wfh:
+            json.dump(targets, wfh)
+        command = [python or sys.executable, '-c', _PROFILE_SCRIPT, targets_file, results_file]
+        # Make sure the modules can be found in the same places as in this process.
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, stdout=devnull, env=env)
+        with open(results_file) as fh:
+            return [ImportTime(str(name), self_time, cumulative_time)
+                    for name, self_time, cumulative_time in json.load(fh)]
+    finally:
+        shutil.rmtree(tempdir)
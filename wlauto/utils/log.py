@@ -69,6 +69,36 @@ def add_log_file(filepath, level=logging.DEBUG):
     root_logger.addHandler(file_handler)
 
 
+def add_log_prefix(prefix):
+    """
+    Prefix all messages subsequently logged in this process with ``prefix``
+    (e.g. to tell apart the output of several processes writing to the same
+    console and log file).
+
+    """
+    log_filter = PrefixFilter(prefix)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(log_filter)
+
+
+class PrefixFilter(logging.Filter):
+
+    def __init__(self, prefix):
+        super(PrefixFilter, self).__init__()
+        self.prefix = prefix
+
+    def filter(self, record):
+        # The same record is passed through the filters of each handler, so
+        # make sure the prefix only gets added once.
+        if not getattr(record, 'prefixed', False):
+            if isinstance(record.msg, unicode):
+                record.msg = u'[{}] {}'.format(self.prefix, record.msg)
+            else:
+                record.msg = '[{}] {}'.format(self.prefix, record.msg)
+            record.prefixed = True
+        return True
+
+
 class ErrorSignalHandler(logging.Handler):
     """
     Emits signals for ERROR and WARNING level traces.
@@ -20,6 +20,7 @@ Miscellaneous functions that don't fit anywhere else.
 """
 from __future__ import division
 import os
+import errno
 import sys
 import re
 import math
@@ -30,6 +31,7 @@ import signal
 import pkgutil
 import traceback
 import logging
+import json
 import random
 import hashlib
 import subprocess
@@ -160,7 +162,12 @@ def walk_modules(path):
 def ensure_directory_exists(dirpath):
     """A filter for directory paths to ensure they exist."""
     if not os.path.isdir(dirpath):
-        os.makedirs(dirpath)
+        try:
+            os.makedirs(dirpath)
+        except OSError as e:
+            # The directory may have been created concurrently by another thread.
+            if e.errno != errno.EEXIST or not os.path.isdir(dirpath):
+                raise
     return dirpath
 
 
@@ -828,6 +835,65 @@ def sha256(path, chunk=2048):
     return h.hexdigest()
 
 
+class FileHashIndex(object):
+    """
+    A persistent index of SHA256 hexdigests of files, so that large files only need
+    to be hashed once. Entries are keyed on the file's path, and are only used if
+    the file's size and modification time have not changed since it was hashed.
+
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._index = None
+        self.lock = threading.RLock()
+
+    def sha256(self, path):
+        """Returns the SHA256 hexdigest of the file at the specified path."""
+        path = os.path.abspath(path)
+        with self.lock:
+            stat = os.stat(path)
+            entry = self._get_index().get(path)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                return entry['sha256']
+            digest = sha256(path)
+            self.update(path, digest, stat)
+            return digest
+
+    def update(self, path, digest, stat=None):
+        """
+        Records the hexdigest of a file whose contents are already known (e.g. because
+        it has just been written).
+
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            stat = stat or os.stat(path)
+            self._get_index()[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest}
+            self._save()
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = {}
+            if os.path.isfile(self.index_path):
+                try:
+                    with open(self.index_path) as fh:
+                        self._index = json.load(fh)
+                except (IOError, ValueError):
+                    pass  # the index will be rebuilt
+        return self._index
+
+    def _save(self):
+        try:
+            ensure_file_directory_exists(self.index_path)
+            temp_path = '{}.{}'.format(self.index_path, os.getpid())
+            with open(temp_path, 'w') as wfh:
+                json.dump(self._index, wfh)
+            os.rename(temp_path, self.index_path)
+        except (IOError, OSError):
+            pass  # the file will simply be re-hashed next time
+
+
 def urljoin(*parts):
     return '/'.join(p.rstrip('/') for p in parts)
 
@@ -24,7 +24,12 @@ from collections import defaultdict
 import argparse
 
 from wlauto.utils.trace_cmd import TraceCmdTrace, TRACE_MARKER_START, TRACE_MARKER_STOP
+from wlauto.utils.trace_dat import TraceDatTrace, is_trace_dat
 from wlauto.exceptions import DeviceError
+from wlauto.utils.lazyimport import lazy_import
+
+
+np = lazy_import('numpy')
 
 
 logger = logging.getLogger('power')
@@ -316,6 +321,65 @@ def stream_cpu_power_transitions(events):
                                                    frequency=int(match.group('freq')))
 
 
+def stream_cpu_power_transitions_from_columns(columns):
+    """
+    Equivalent to :func:`stream_cpu_power_transitions`, but operates on the
+    per-event-type columns produced by ``TraceCmdTrace.parse_columns()``. The
+    columns for the relevant events are merged back into trace order using
+    their indexes, and values are converted in bulk rather than per event.
+
+    """
+    kinds = ['cpu_idle', 'cpu_frequency', 'DROPPED EVENTS DETECTED', 'print']
+    present = [(k, columns[name]) for k, name in enumerate(kinds)
+               if name in columns and len(columns[name])]
+    if not present:
+        return
+
+    index = np.concatenate([cols.index for _, cols in present])
+    kind = np.concatenate([np.full(len(cols), k, dtype=np.int8) for k, cols in present])
+    position = np.concatenate([np.arange(len(cols)) for _, cols in present])
+    order = np.argsort(index, kind='mergesort')
+
+    values = {}
+    for k, cols in present:
+        if k == 2:  # dropped events
+            values[k] = (None, cols.cpu.tolist(), None)
+        elif k == 3:  # print
+            values[k] = (cols.timestamp.tolist(), None, cols.text)
+        else:
+            state = cols.fields['state']
+            if k == 0:
+                # idle state is reported as an unsigned value, with -1 (i.e.
+                # 4294967295) used to indicate idle exit.
+                state = state.astype(np.uint32).astype(np.int32)
+            values[k] = (cols.timestamp.tolist(), cols.fields['cpu_id'].tolist(),
+                         state.tolist())
+
+    for k, i in zip(kind[order].tolist(), position[order].tolist()):
+        timestamps, cpus, extra = values[k]
+        if k == 0:
+            yield CorePowerTransitionEvent(timestamps[i], cpus[i], idle_state=extra[i])
+        elif k == 1:
+            yield CorePowerTransitionEvent(timestamps[i], cpus[i], frequency=extra[i])
+        elif k == 2:
+            yield CorePowerDroppedEvents(cpus[i])
+        else:
+            text = extra[i]
+            if TRACE_MARKER_START in text:
+                yield TraceMarkerEvent('START')
+            elif TRACE_MARKER_STOP in text:
+                yield TraceMarkerEvent('STOP')
+            else:
+                if 'cpu_frequency' in text:
+                    match = DEVLIB_CPU_FREQ_REGEX.search(text)
+                else:
+                    match = INIT_CPU_FREQ_REGEX.search(text)
+                if match:
+                    yield CorePowerTransitionEvent(timestamps[i],
+                                                   int(match.group('cpu')),
+                                                   frequency=int(match.group('freq')))
+
+
 def gather_core_states(system_state_stream, freq_dependent_idle_states=None):  # NOQA
     if freq_dependent_idle_states is None:
         freq_dependent_idle_states = [0]
@@ -646,72 +710,143 @@ def build_idle_domains(core_clusters,   # NOQA
     return idle_state_domains
 
 
+class PowerStatsCollector(object):
+    """
+    Generates power state reports from trace events that are pushed into it one
+    at a time via :meth:`update` (or as already-extracted power transitions via
+    :meth:`update_transitions`), so that it may consume events from a trace that
+    is being parsed for other purposes as well. Once all events have been
+    pushed, :meth:`report` returns the reports in the same format as
+    :func:`report_power_stats`.
+
+    With ``'try'`` start marker handling, states are reported from the
+    beginning of the trace until the START marker is encountered, at which
+    point reporting restarts; this avoids having to scan the trace for the
+    marker beforehand.
+
+    """
+
+    def __init__(self, idle_state_names, core_names, core_clusters,
+                 num_idle_states, first_cluster_state=sys.maxint,
+                 first_system_state=sys.maxint, use_ratios=False,
+                 timeline_csv_file=None, cpu_utilisation=None,
+                 max_freq_list=None, start_marker_handling='error',
+                 transitions_csv_file=None, no_idle=False):
+        self.idle_state_names = idle_state_names
+        self.core_names = core_names
+        self.core_clusters = core_clusters
+        self.use_ratios = use_ratios
+        self.timeline_csv_file = timeline_csv_file
+        self.cpu_utilisation = cpu_utilisation
+        self.max_freq_list = max_freq_list
+        self.start_marker_handling = start_marker_handling
+        self.ps_processor = PowerStateProcessor(core_clusters,
+                                                num_idle_states=num_idle_states,
+                                                first_cluster_state=first_cluster_state,
+                                                first_system_state=first_system_state,
+                                                wait_for_start_marker=start_marker_handling == 'error',
+                                                no_idle=no_idle)
+        if self.cpu_utilisation and not self.max_freq_list:
+            logger.warning('Maximum frequencies not found. Cannot normalise. Skipping CPU Utilisation Timeline')
+        self.reporters = self._create_reporters()
+        self.transitions_reporter = None
+        if transitions_csv_file:
+            self.transitions_reporter = PowerStateTransitions(transitions_csv_file)
+        self._done = False
+
+    def update(self, event):
+        self.update_transitions(stream_cpu_power_transitions([event]))
+
+    def update_transitions(self, transitions):
+        ps_processor = self.ps_processor
+        for transition in transitions:
+            if self._done:
+                break
+            if self.transitions_reporter and transition.kind == 'transition':
+                self.transitions_reporter.record_transition(transition)
+            try:
+                power_state = ps_processor.update_power_state(transition)
+            except Exception as e:  # pylint: disable=broad-except
+                ps_processor.exceptions.append(e)
+                continue
+            if transition.kind == 'marker':
+                if transition.name == 'START' and self.start_marker_handling == 'try':
+                    # discard anything reported before the START marker
+                    for reporter in self.reporters:
+                        reporter.report()
+                    self.reporters = self._create_reporters()
+                self._done = ps_processor._saw_stop_marker  # pylint: disable=protected-access
+            if ps_processor._saw_start_marker or not ps_processor.wait_for_start_marker:  # pylint: disable=protected-access
+                for timestamp, states in gather_core_states([power_state]):
+                    for reporter in self.reporters:
+                        reporter.update(timestamp, states)
+
+    def report(self):
+        # pylint: disable=protected-access
+        saw_start_marker = self.ps_processor._saw_start_marker
+        if self.start_marker_handling == 'error' and not saw_start_marker:
+            raise DeviceError("Start marker was not found in the trace")
+        elif self.start_marker_handling == 'try' and not saw_start_marker:
+            logger.warning("Did not see a START marker in the trace, "
+                           "state residency and parallelism statistics may be inaccurate.")
+        if saw_start_marker and not self.ps_processor._saw_stop_marker:
+            logger.warning("Did not see a STOP marker in the trace")
+
+        if self.ps_processor.exceptions:
+            logger.warning('There were errors while processing trace:')
+            for e in self.ps_processor.exceptions:
+                logger.warning(str(e))
+
+        reports = []
+        for reporter in self.reporters:
+            reports.append(reporter.report())
+        if self.transitions_reporter:
+            reports.append(self.transitions_reporter.report())
+        return reports
+
+    def _create_reporters(self):
+        reporters = [
+            ParallelStats(self.core_clusters, self.use_ratios),
+            PowerStateStats(self.core_names, self.idle_state_names, self.use_ratios)
+        ]
+        if self.timeline_csv_file:
+            reporters.append(PowerStateTimeline(self.timeline_csv_file,
+                                                self.core_names, self.idle_state_names))
+        if self.cpu_utilisation and self.max_freq_list:
+            reporters.append(CpuUtilisationTimeline(self.cpu_utilisation, self.core_names,
+                                                    self.max_freq_list))
+        return reporters
+
+
 def report_power_stats(trace_file, idle_state_names, core_names, core_clusters,
                        num_idle_states, first_cluster_state=sys.maxint,
                        first_system_state=sys.maxint, use_ratios=False,
                        timeline_csv_file=None, cpu_utilisation=None,
                        max_freq_list=None, start_marker_handling='error',
-                       transitions_csv_file=None, no_idle=False):
-    # pylint: disable=too-many-locals,too-many-branches
-    trace = TraceCmdTrace(trace_file,
-                          filter_markers=False,
-                          names=['cpu_idle', 'cpu_frequency', 'print'])
-
-    wait_for_start_marker = True
-    if start_marker_handling == "error" and not trace.has_start_marker:
-        raise DeviceError("Start marker was not found in the trace")
-    elif start_marker_handling == "try":
-        wait_for_start_marker = trace.has_start_marker
-        if not wait_for_start_marker:
-            logger.warning("Did not see a START marker in the trace, "
-                           "state residency and parallelism statistics may be inaccurate.")
-    elif start_marker_handling == "ignore":
-        wait_for_start_marker = False
-
-    ps_processor = PowerStateProcessor(core_clusters,
-                                       num_idle_states=num_idle_states,
-                                       first_cluster_state=first_cluster_state,
-                                       first_system_state=first_system_state,
-                                       wait_for_start_marker=wait_for_start_marker,
-                                       no_idle=no_idle)
-    reporters = [
-        ParallelStats(core_clusters, use_ratios),
-        PowerStateStats(core_names, idle_state_names, use_ratios)
-    ]
-    if timeline_csv_file:
-        reporters.append(PowerStateTimeline(timeline_csv_file,
-                                            core_names, idle_state_names))
-    if cpu_utilisation:
-        if max_freq_list:
-            reporters.append(CpuUtilisationTimeline(cpu_utilisation, core_names, max_freq_list))
-        else:
-            logger.warning('Maximum frequencies not found. Cannot normalise. Skipping CPU Utilisation Timeline')
-
-    event_stream = trace.parse()
-    transition_stream = stream_cpu_power_transitions(event_stream)
-    if transitions_csv_file:
-        trans_reporter = PowerStateTransitions(transitions_csv_file)
-        reporters.append(trans_reporter)
-        recorded_trans_stream = record_state_transitions(trans_reporter, transition_stream)
-        power_state_stream = ps_processor.process(recorded_trans_stream)
+                       transitions_csv_file=None, no_idle=False, columnar=False):
+    # Binary trace.dat files are decoded natively, without the need for a text
+    # report to be generated first.
+    trace_class = TraceDatTrace if is_trace_dat(trace_file) else TraceCmdTrace
+    trace = trace_class(trace_file,
+                        filter_markers=False,
+                        names=['cpu_idle', 'cpu_frequency', 'print'])
+
+    collector = PowerStatsCollector(idle_state_names, core_names, core_clusters,
+                                    num_idle_states,
+                                    first_cluster_state=first_cluster_state,
+                                    first_system_state=first_system_state,
+                                    use_ratios=use_ratios,
+                                    timeline_csv_file=timeline_csv_file,
+                                    cpu_utilisation=cpu_utilisation,
+                                    max_freq_list=max_freq_list,
+                                    start_marker_handling=start_marker_handling,
+                                    transitions_csv_file=transitions_csv_file,
+                                    no_idle=no_idle)
+    if columnar:
+        collector.update_transitions(stream_cpu_power_transitions_from_columns(trace.parse_columns()))
     else:
-        power_state_stream = ps_processor.process(transition_stream)
-    core_state_stream = gather_core_states(power_state_stream)
-
-    for timestamp, states in core_state_stream:
-        for reporter in reporters:
-            reporter.update(timestamp, states)
-
-    if ps_processor.exceptions:
-        logger.warning('There were errors while processing trace:')
-        for e in ps_processor.exceptions:
-            logger.warning(str(e))
-
-    reports = []
-    for reporter in reporters:
-        report = reporter.report()
-        reports.append(report)
-    return reports
+        collector.update_transitions(stream_cpu_power_transitions(trace.parse()))
+    return collector.report()
 
 
 def main():
@@ -734,6 +869,7 @@ def main():
         start_marker_handling=args.start_marker_handling,
         transitions_csv_file=args.transitions_file,
         no_idle=args.no_idle,
+        columnar=args.columnar,
     )
 
     parallel_report = reports.pop(0)
@@ -760,8 +896,8 @@ def parse_arguments():  # NOQA
                                      power trace.
                                      """)
     parser.add_argument('infile', metavar='TRACEFILE', help='''
-                        Path to the trace file to parse. This must be in the format generated
-                        by "trace-cmd report" command.
+                        Path to the trace file to parse. This must either be a binary trace.dat
+                        file, or in the format generated by "trace-cmd report" command.
                         ''')
     parser.add_argument('-d', '--output-directory', default='.',
                         help='''
@@ -843,6 +979,12 @@ def parse_arguments():  # NOQA
                         the processor assumes the cores are in an unknown state until it sees the first idle
                         transition, which will never come if cpuidle is absent.
                         ''')
+    parser.add_argument('-P', '--columnar', action='store_true',
+                        help='''
+                        Parse the trace in blocks into per-event columns (requires numpy), rather
+                        than creating an object for each event. This is significantly faster for
+                        large traces.
+                        ''')
 
     args = parser.parse_args()
 
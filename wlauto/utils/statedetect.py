@@ -21,27 +21,37 @@ Requires a 'statedetection' directory in the workload directory that includes th
 and the 'templates' folder with PNGs of all templates mentioned in the yaml file.
 
 Requires the following Python libraries:
-numpy, pyyaml (yaml), imutils and opencv-python
+numpy, pyyaml (yaml) and opencv-python
+
+Templates are edge-detected once when the state definitions are loaded, and the loaded
+definitions are cached (per directory) for as long as the files do not change. When
+matching, a template is first compared against the screenshot at a subset of the scales
+(see ``COARSE_STEP``); the remaining scales are only tried around the ones that
+produced the best matches, and the search stops as soon as a match is found.
 
 """
 
 import os
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import yaml
-try:
-    import numpy as np
-except ImportError:
-    np = None
-try:
-    import cv2
-except ImportError:
-    cv2 = None
-try:
-    import imutils
-except ImportError:
-    imutils = None
-
 from wlauto.exceptions import HostError
+from wlauto.utils.lazyimport import lazy_import
+
+np = lazy_import('numpy')
+cv2 = lazy_import('cv2')
+
+
+# Scales of the screenshot (relative to its original size) at which templates are
+# matched, from largest to smallest.
+SCALES = [1.4 - i * 0.8 / 60 for i in xrange(61)]
+MATCH_THRESHOLD = 0.4
+# Only every COARSE_STEP-th scale is tried initially; the scales around the
+# REFINE_CANDIDATES best matching of those are tried afterwards.
+COARSE_STEP = 5
+REFINE_CANDIDATES = 2
 
 
 class StateDefinitionError(RuntimeError):
@@ -62,90 +72,216 @@ def auto_canny(image, sigma=0.33):
 
 
 def check_match_state_dependencies():
-    if np is None or cv2 is None or imutils is None:
-        raise HostError("State detection requires numpy, opencv (cv2) and imutils.")
+    if np is None or cv2 is None:
+        raise HostError("State detection requires numpy and opencv (cv2).")
+
+
+class ScreenshotPyramid(object):
+    """
+    The edge map of a screenshot, resized to each of ``SCALES``. Each level is only
+    computed the first time it is needed, and is then shared between all templates.
+
+    """
+
+    def __init__(self, screenshot_file):
+        if not os.path.isfile(screenshot_file):
+            raise StateDefinitionError("Screenshot file not found")
+        img_rgb = cv2.imread(screenshot_file)
+        img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
+        self.edge = auto_canny(img_gray)
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, index):
+        level = self._levels.get(index)
+        if level is None:
+            level = _resize(self.edge, int(self.edge.shape[1] * SCALES[index]))
+            with self._lock:
+                level = self._levels.setdefault(index, level)
+        return level
+
+    def __len__(self):
+        return len(SCALES)
+
+
+class StateDetector(object):
+    """
+    Matches screenshots against the states defined in a state definitions
+    directory. The template PNGs are loaded and edge-detected on creation.
+
+    """
+
+    def __init__(self, defpath, state_definitions):
+        self.defpath = defpath
+        self.state_definitions = state_definitions
+        self.templates = {}
+        for state in state_definitions["workload_states"]:
+            for template_png in state["templates"]:
+                if template_png not in self.templates:
+                    self.templates[template_png] = _load_template(defpath, template_png)
+
+    def get_expected_state(self, workload_phase):
+        expected_state = None
+        for phase in self.state_definitions["workload_phases"]:
+            if phase["phase_name"] == workload_phase:
+                expected_state = phase["expected_state"]
+        if expected_state is None:
+            raise StateDefinitionError("Phase not defined")
+        return expected_state
+
+    def match(self, screenshot_file, jobs=None):
+        """
+        Returns the name of the first state whose templates match the screenshot
+        (see :func:`select_state`), or ``"none"``. Templates are matched using up to
+        ``jobs`` threads (by default, one per CPU).
+
+        """
+        pyramid = ScreenshotPyramid(screenshot_file)
+        names = sorted(self.templates)
+        jobs = min(jobs or cpu_count(), len(names))
+
+        def match_one(name):
+            return _match_template(self.templates[name], pyramid)
+
+        if jobs > 1:
+            pool = ThreadPool(jobs)
+            try:
+                matches = pool.map(match_one, names)
+            finally:
+                pool.terminate()
+        else:
+            matches = map(match_one, names)
+        matched_templates = set(name for name, matched in zip(names, matches) if matched)
+        return select_state(self.state_definitions, matched_templates)
+
+    def verify(self, screenshot_file, workload_phase, jobs=None):
+        expected_state = self.get_expected_state(workload_phase)
+        return self.match(screenshot_file, jobs) == expected_state
+
+
+def select_state(state_definitions, matched_templates):
+    """
+    Returns the name of the state that has enough of its templates in
+    ``matched_templates``, or ``"none"``. If several states match, the one
+    defined first is returned.
+
+    """
+    for state in state_definitions["workload_states"]:
+        match_count = len([t for t in state["templates"] if t in matched_templates])
+        if match_count >= state["matches"]:
+            return state["state_name"]
+    return "none"
 
 
-def match_state(screenshot_file, defpath, state_definitions):  # pylint: disable=too-many-locals
-    # check dependencies
-    check_match_state_dependencies()
+_detectors = {}
+_detectors_lock = threading.Lock()
 
-    # check if file exists, then load screenshot into opencv and create edge map
-    if not os.path.isfile(screenshot_file):
-        raise StateDefinitionError("Screenshot file not found")
-    img_rgb = cv2.imread(screenshot_file)
-    img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
-    img_edge = auto_canny(img_gray)
 
-    # make a list of all templates defined in the state definitions
-    template_list = []
-    for state in state_definitions["workload_states"]:
-        template_list.extend(state["templates"])
-
-    # check all template PNGs exist
-    for template_png in template_list:
-        if not os.path.isfile(os.path.join(defpath, 'templates', template_png + '.png')):
-            raise StateDefinitionError("Missing template PNG file: " + template_png + ".png")
-
-    # try to match each PNG
-    matched_templates = []
-    for template_png in template_list:
-        template = cv2.imread(os.path.join(defpath, 'templates', template_png + '.png'), 0)
-        template_edge = auto_canny(template)
-        template_height, template_width = template_edge.shape[:2]
-
-        # loop over the scales of the image
-        for scale in np.linspace(1.4, 0.6, 61):
-            resized = imutils.resize(img_edge, width=int(img_edge.shape[1] * scale))
-
-            # skip if the resized image is smaller than the template
-            if resized.shape[0] < template_height or resized.shape[1] < template_width:
-                break
-
-            res = cv2.matchTemplate(resized, template_edge, cv2.TM_CCOEFF_NORMED)
-            threshold = 0.4
-            loc = np.where(res >= threshold)
-            zipped = zip(*loc[::-1])
-
-            if len(zipped) > 0:
-                matched_templates.append(template_png)
-                break
-
-    # determine the state according to the matched templates
-    matched_state = "none"
-    for state in state_definitions["workload_states"]:
-        # look in the matched templates list for each template of this state
-        match_count = 0
-        for template in state["templates"]:
-            if template in matched_templates:
-                match_count += 1
+def get_state_detector(defpath):
+    """
+    Returns a :class:`StateDetector` for the state definitions in the specified
+    directory. This is cached until the definitions file or any of the templates
+    are modified.
 
-        if match_count >= state["matches"]:
-            # we have a match
-            matched_state = state["state_name"]
+    """
+    statedefs_file = os.path.join(defpath, 'definition.yaml')
+    if not os.path.isfile(statedefs_file):
+        raise StateDefinitionError("Missing state definitions yaml file: " + statedefs_file)
+    key = os.path.abspath(defpath)
+    with _detectors_lock:
+        cached = _detectors.get(key)
+        if cached and cached[0] == _get_signature(defpath):
+            return cached[1]
+        with open(statedefs_file) as fh:
+            state_definitions = yaml.load(fh)
+        detector = StateDetector(defpath, state_definitions)
+        _detectors[key] = (_get_signature(defpath), detector)
+        return detector
+
+
+def match_state(screenshot_file, defpath, state_definitions, jobs=None):
+    check_match_state_dependencies()
+    detector = get_state_detector(defpath)
+    if detector.state_definitions != state_definitions:
+        detector = StateDetector(defpath, state_definitions)
+    return detector.match(screenshot_file, jobs)
+
+
+def verify_state(screenshot_file, state_defs_path, workload_phase, jobs=None):
+    check_match_state_dependencies()
+    return get_state_detector(state_defs_path).verify(screenshot_file, workload_phase, jobs)
+
+
+def search_scales(num_scales, score, threshold=MATCH_THRESHOLD, step=COARSE_STEP):
+    """
+    Returns ``True`` if ``score(i)`` is at least ``threshold`` for a scale index ``i``
+    in ``range(num_scales)``, evaluating as few scales as possible. ``score`` should
+    return ``None`` for scales at which the template does not fit within the image
+    (which is then assumed for all subsequent, smaller, scales).
+
+    Scales are first evaluated ``step`` apart; if none of those match, the scales in
+    between are evaluated around the best ``REFINE_CANDIDATES`` of them. A ``step``
+    of ``1`` evaluates every scale.
+
+    """
+    scores = {}
+
+    def evaluate(i):
+        if i not in scores:
+            scores[i] = score(i)
+        return scores[i]
+
+    coarse = range(0, num_scales, step)
+    if coarse[-1] != num_scales - 1:
+        coarse.append(num_scales - 1)
+    for i in coarse:
+        value = evaluate(i)
+        if value is None:
             break
+        if value >= threshold:
+            return True
 
-    return matched_state
+    candidates = sorted(((v, i) for i, v in scores.iteritems() if v is not None), reverse=True)
+    for _, centre in candidates[:REFINE_CANDIDATES]:
+        for i in xrange(max(0, centre - step + 1), min(num_scales, centre + step)):
+            value = evaluate(i)
+            if value is not None and value >= threshold:
+                return True
+    return False
 
 
-def verify_state(screenshot_file, state_defs_path, workload_phase):
-    # load and parse state definition file
-    statedefs_file = os.path.join(state_defs_path, 'definition.yaml')
-    if not os.path.isfile(statedefs_file):
-        raise StateDefinitionError("Missing state definitions yaml file: " + statedefs_file)
-    with open(statedefs_file) as fh:
-        state_definitions = yaml.load(fh)
+def _match_template(template_edge, pyramid):
+    template_height, template_width = template_edge.shape[:2]
+
+    def score(index):
+        resized = pyramid[index]
+        # the template cannot be matched if the resized image is smaller than it
+        if resized.shape[0] < template_height or resized.shape[1] < template_width:
+            return None
+        return cv2.matchTemplate(resized, template_edge, cv2.TM_CCOEFF_NORMED).max()
+
+    return search_scales(len(pyramid), score)
+
+
+def _load_template(defpath, template_png):
+    path = os.path.join(defpath, 'templates', template_png + '.png')
+    if not os.path.isfile(path):
+        raise StateDefinitionError("Missing template PNG file: " + template_png + ".png")
+    return auto_canny(cv2.imread(path, 0))
 
-    # find what the expected state is for the given workload phase
-    expected_state = None
-    for phase in state_definitions["workload_phases"]:
-        if phase["phase_name"] == workload_phase:
-            expected_state = phase["expected_state"]
 
-    if expected_state is None:
-        raise StateDefinitionError("Phase not defined")
+def _resize(image, width):
+    # Equivalent to imutils.resize(image, width=width)
+    height, original_width = image.shape[:2]
+    dim = (width, int(height * (width / float(original_width))))
+    return cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
 
-    # run a match on the screenshot
-    matched_state = match_state(screenshot_file, state_defs_path, state_definitions)
 
-    return expected_state == matched_state
+def _get_signature(defpath):
+    signature = []
+    for dirpath, _, filenames in os.walk(defpath):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime))
+    return sorted(signature)
@@ -0,0 +1,200 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Single-pass dispatch of trace events to multiple consumers. Rather than each
+instrument/result processor that is interested in the trace parsing it
+independently, consumers subscribe to the events they need on the
+``trace_event_bus``, and the trace for an iteration is parsed once, the first
+time any of them calls ``dispatch()`` for it.
+
+"""
+
+import os
+import re
+import logging
+import threading
+
+from wlauto.utils.trace_cmd import (TraceCmdTrace, DroppedEventsEvent,
+                                    TRACE_MARKER_START, TRACE_MARKER_STOP)
+from wlauto.utils.trace_dat import TraceDatTrace, is_trace_dat
+from wlauto.utils.misc import get_traceback
+
+
+logger = logging.getLogger('trace-bus')
+
+
+class TraceEventSubscriber(object):
+
+    def __init__(self, callback, names=None, filter_markers=False, on_start=None, on_end=None):
+        self.callback = callback
+        self.names = names or []
+        self.filter_markers = filter_markers
+        self.on_start = on_start
+        self.on_end = on_end
+        self.filters = [re.compile('^{}$'.format(n)) for n in self.names]
+
+    def matches(self, name):
+        if not self.filters:
+            return True
+        for f in self.filters:
+            if f.search(name):
+                return True
+        return False
+
+
+class TraceEventBus(object):
+    """
+    Parses a trace once, and dispatches its events to all subscribers.
+
+    A subscriber is a callable that will be invoked with each event (a
+    ``TraceCmdEvent``) whose name matches one of the names (which may be regular
+    expressions) it has subscribed to; if no names are specified, all events
+    will be passed to it. Dropped events markers are passed to all subscribers.
+    If ``filter_markers`` is set, only events inside the marked region of the
+    trace (excluding the markers themselves) will be passed to the subscriber.
+
+    ``on_start`` and ``on_end`` callbacks may optionally be provided. These will
+    be invoked with the path to the trace before the first, and after the last,
+    event of each trace is dispatched; this may be used to (re)initialize and
+    finalize any per-trace state.
+
+    Dispatching is serialized, so that the bus may be used by result processors
+    running on a background thread (see ``parallel_result_processing``).
+
+    A subscriber whose callbacks raise an exception is logged and unsubscribed,
+    so that it does not prevent events from reaching the others. Errors parsing
+    the trace, on the other hand, are raised to every consumer that requests the
+    trace to be dispatched.
+
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.last_dispatched = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, names=None, filter_markers=False, on_start=None, on_end=None):
+        self.subscribers.append(TraceEventSubscriber(callback, names, filter_markers,
+                                                     on_start, on_end))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [s for s in self.subscribers if s.callback != callback]
+
+    def dispatch(self, trace_file):
+        """
+        Parse the specified trace (either a text report or binary ``trace.dat``)
+        and dispatch its events to subscribers. Subsequent calls for the same
+        trace will do nothing (or re-raise the error that parsing it failed
+        with), so this may be invoked by every consumer that requires events for
+        the trace.
+
+        """
+        trace_file = os.path.abspath(trace_file)
+        with self._lock:
+            if trace_file == self.last_dispatched:
+                if self.last_error is not None:
+                    raise self.last_error
+                return
+            try:
+                if self.subscribers:
+                    self._dispatch(trace_file)
+            except Exception as e:
+                self.last_error = e
+                raise
+            else:
+                self.last_error = None
+            finally:
+                self.last_dispatched = trace_file
+
+    def _dispatch(self, trace_file):
+        subscribers = list(self.subscribers)
+        names = None
+        if all(s.names for s in subscribers):
+            names = sorted(set(n for s in subscribers for n in s.names) | set(['print']))
+
+        trace_class = TraceDatTrace if is_trace_dat(trace_file) else TraceCmdTrace
+        trace = trace_class(trace_file, names=names, filter_markers=False)
+
+        logger.debug('Dispatching events from {} to {} subscribers'.format(trace_file, len(subscribers)))
+        for subscriber in list(subscribers):
+            if subscriber.on_start:
+                self._call(subscriber, subscribers, subscriber.on_start, trace_file)
+
+        # event name --> subscribers for events outside/inside the marked region
+        routes = {}
+        inside_marked_region = False
+        seen_stop_marker = False
+        for event in trace.parse():
+            is_marker = False
+            if event.name == 'print':
+                if TRACE_MARKER_START in event.text and not seen_stop_marker:
+                    inside_marked_region = True
+                    is_marker = True
+                elif TRACE_MARKER_STOP in event.text:
+                    inside_marked_region = False
+                    seen_stop_marker = True
+                    is_marker = True
+
+            route = routes.get(event.name)
+            if route is None:
+                is_dropped = isinstance(event, DroppedEventsEvent)
+                matching = [s for s in subscribers if is_dropped or s.matches(event.name)]
+                route = ([s for s in matching if not s.filter_markers], matching)
+                routes[event.name] = route
+
+            for subscriber in route[1] if inside_marked_region and not is_marker else route[0]:
+                try:
+                    subscriber.callback(event)
+                except Exception as e:  # pylint: disable=broad-except
+                    self._drop(subscriber, subscribers, e)
+                    routes = {}
+
+        for subscriber in list(subscribers):
+            if subscriber.on_end:
+                self._call(subscriber, subscribers, subscriber.on_end, trace_file)
+
+    def _call(self, subscriber, subscribers, func, *args):
+        try:
+            func(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            self._drop(subscriber, subscribers, e)
+
+    def _drop(self, subscriber, subscribers, error):
+        if subscriber not in subscribers:  # already dropped
+            return
+        logger.error('Unsubscribing {} from trace events after {}("{}")'.format(
+            getattr(subscriber.callback, '__name__', subscriber.callback), error.__class__.__name__, error))
+        logger.debug(get_traceback())
+        subscribers.remove(subscriber)
+        self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+
+def get_trace_file(context):
+    """
+    Returns the path to the trace collected by the trace-cmd instrument for the
+    current iteration (the text report, if one has been generated, otherwise
+    the binary trace), or ``None`` if there is no trace.
+
+    """
+    artifact = context.get_artifact('txttrace') or context.get_artifact('bintrace')
+    if artifact and os.path.isfile(artifact.path):
+        return artifact.path
+    return None
+
+
+# Global bus used by trace-cmd instrument and trace result processors.
+trace_event_bus = TraceEventBus()
@@ -15,10 +15,18 @@
 
 import re
 import logging
+from array import array
+from collections import OrderedDict
 from itertools import chain
+from operator import itemgetter
 
+from wlauto.exceptions import HostError
 from wlauto.utils.misc import isiterable, memoized
 from wlauto.utils.types import numeric
+from wlauto.utils.lazyimport import lazy_import
+
+
+np = lazy_import('numpy')
 
 
 logger = logging.getLogger('trace-cmd')
@@ -29,6 +37,10 @@ logger = logging.getLogger('trace-cmd')
 TRACE_MARKER_START = 'TRACE_MARKER_START'
 TRACE_MARKER_STOP = 'TRACE_MARKER_STOP'
 
+# Size hint (in bytes) for the blocks of lines read at a time when parsing the
+# trace into columns.
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+
 
 class TraceCmdEvent(object):
     """
@@ -238,6 +250,20 @@ DROPPED_EVENTS_REGEX = re.compile(r'CPU:(?P<cpu_id>\d+) \[\d*\s*EVENTS DROPPED\]
 
 EMPTY_CPU_REGEX = re.compile(r'CPU \d+ is empty')
 
+# Matches each line of a text trace. Lines in the usual event format are split
+# into the PID of the thread, the CPU, the timestamp, and the event name and
+# body; any other line is captured whole as "other".
+EVENT_LINE_REGEX = re.compile(r'^(?:[^\S\n]*(?:[^\[\n]*-(?P<pid>\d+)|[^\[\n]*?)[^\S\n]* \[(?P<cpu>\d+)\] [^\S\n]*'
+                              r'(?P<ts>\d+(?:\.\d+)?)[^\S\n]*: [^\S\n]*(?P<name>[^\s:]+)[^\S\n]*: '
+                              r'[^\S\n]*(?P<body>(?:[^\n]*\S)?)[^\S\n]*|(?P<other>[^\n]*))$', re.M)
+
+# Matches a space-separated list of integers that fit into 64 bits.
+INTEGER_LIST_REGEX = re.compile(r'[-+]?\d{1,18}(?: [-+]?\d{1,18})*\Z')
+
+# Regexes for matching the bodies of events in the default "key=value" format,
+# keyed by the tuple of keys.
+_DEFAULT_BODY_REGEXES = {}
+
 
 def split_trace_event_line(line):
     """
@@ -261,6 +287,291 @@ def split_trace_event_line(line):
     return (preamble, event_name, ': '.join(parts))
 
 
+class TraceEventColumns(object):
+    """
+    Columnar representation of all occurrences of a single event type within a
+    trace. Rather than creating an object per event, the values are held in
+    NumPy arrays, with an entry for each occurrence of the event:
+
+        :index: the position of the event within the trace. This may be used to
+                merge the columns of several event types back into trace order.
+        :timestamp: timestamp of the event (``NaN`` for dropped events markers).
+        :cpu: the reporting CPU.
+        :pid: the PID of the thread that generated the event (``-1`` if it could
+              not be determined).
+        :fields: a dict mapping field names onto arrays of their values. Integer
+                 fields are stored as ``int64`` and other numeric fields as
+                 ``float64`` (with ``NaN`` for events that did not have the
+                 field); fields with non-numeric values are stored as ``object``
+                 arrays.
+        :text: a list with the body text of each event, if bodies were retained
+               for this event type, otherwise ``None``.
+
+    """
+
+    def __init__(self, name, index, timestamp, cpu, pid, fields, text=None):
+        self.name = name
+        self.index = index
+        self.timestamp = timestamp
+        self.cpu = cpu
+        self.pid = pid
+        self.fields = fields
+        self.text = text
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['fields'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __str__(self):
+        return 'TEC({} x{})'.format(self.name, len(self))
+
+    __repr__ = __str__
+
+
+class _FieldsHolder(object):
+    # Stand-in for TraceCmdEvent passed to body parsers when parsing into
+    # columns, so that the same parsers may be used for both.
+
+    __slots__ = ['_fields']
+
+    def __init__(self):
+        self._fields = {}
+
+
+class _ColumnsBuilder(object):
+    """
+    Accumulates the columns for an event type, either an event at a time (``add()``),
+    or in chunks of events that have already been converted into arrays
+    (``add_columns()``).
+
+    """
+
+    def __init__(self, name, keep_text=False):
+        self.name = name
+        self.keep_text = keep_text
+        self.chunks = []
+        self.field_names = OrderedDict()
+        self._reset_pending()
+
+    def add(self, index, timestamp, cpu, pid, fields, text=None):
+        count = len(self.index)
+        self.index.append(index)
+        self.timestamp.append(timestamp)
+        self.cpu.append(cpu)
+        self.pid.append(pid)
+        for key, value in fields.iteritems():
+            values = self.fields.get(key)
+            if values is None:
+                values = self.fields[key] = [None] * count
+            values.append(value)
+        for values in self.fields.itervalues():
+            if len(values) == count:
+                values.append(None)
+        if self.text is not None:
+            self.text.append(text)
+
+    def add_columns(self, index, timestamp, cpu, pid, fields, text):
+        """
+        Add a chunk of events. ``fields`` maps field names onto either lists of
+        values (``None`` for events without the field), or ``int64`` arrays.
+
+        """
+        self._flush_pending()
+        self._add_chunk(index, timestamp, cpu, pid, fields, text)
+
+    def build(self):
+        self._flush_pending()
+        if not self.chunks:
+            return TraceEventColumns(self.name,
+                                     np.array([], dtype=np.int64),
+                                     np.array([], dtype=np.float64),
+                                     np.array([], dtype=np.int64),
+                                     np.array([], dtype=np.int64),
+                                     OrderedDict(), [] if self.keep_text else None)
+        index = np.concatenate([chunk[0] for chunk in self.chunks])
+        timestamp = np.concatenate([chunk[1] for chunk in self.chunks])
+        cpu = np.concatenate([chunk[2] for chunk in self.chunks])
+        pid = np.concatenate([chunk[3] for chunk in self.chunks])
+        fields = OrderedDict()
+        for key in self.field_names:
+            fields[key] = _merge_field_chunks([(len(chunk[0]), chunk[4].get(key)) for chunk in self.chunks])
+        text = list(chain.from_iterable(chunk[5] for chunk in self.chunks)) if self.keep_text else None
+
+        # Events that were not in the usual format are added as they are
+        # encountered, so may be out of order within their block.
+        if (np.diff(index) < 0).any():
+            order = np.argsort(index, kind='mergesort')
+            index, timestamp, cpu, pid = index[order], timestamp[order], cpu[order], pid[order]
+            for key, values in fields.iteritems():
+                fields[key] = values[order]
+            if text is not None:
+                text = [text[i] for i in order.tolist()]
+        return TraceEventColumns(self.name, index, timestamp, cpu, pid, fields, text)
+
+    def _add_chunk(self, index, timestamp, cpu, pid, fields, text):
+        for key in fields:
+            self.field_names[key] = True
+        self.chunks.append((index, timestamp, cpu, pid, fields, text if self.keep_text else None))
+
+    def _flush_pending(self):
+        if self.index:
+            self._add_chunk(_array_to_column(self.index),
+                            _array_to_column(self.timestamp),
+                            _array_to_column(self.cpu),
+                            _array_to_column(self.pid),
+                            self.fields, self.text)
+            self._reset_pending()
+
+    def _reset_pending(self):
+        self.index = array('l')
+        self.timestamp = array('d')
+        self.cpu = array('l')
+        self.pid = array('l')
+        self.fields = OrderedDict()
+        self.text = [] if self.keep_text else None
+
+
+def _array_to_column(values):
+    if not values:
+        return np.array([], dtype=values.typecode)
+    return np.frombuffer(values, dtype=values.typecode).copy()
+
+
+def _to_column(values):
+    if all(isinstance(v, (int, long)) for v in values):
+        return np.array(values, dtype=np.int64)
+    try:
+        return np.array([v if v is not None else np.nan for v in values],
+                        dtype=np.float64)
+    except (ValueError, TypeError):
+        return np.array(values, dtype=object)
+
+
+def _merge_field_chunks(chunks):
+    # chunks is a list of (size, values) pairs, where values may be None if
+    # none of the events in the chunk had the field.
+    if all(isinstance(values, np.ndarray) for _, values in chunks):
+        return np.concatenate([values for _, values in chunks])
+    merged = []
+    for size, values in chunks:
+        if values is None:
+            merged.extend([None] * size)
+        elif isinstance(values, np.ndarray):
+            merged.extend(values.tolist())
+        else:
+            merged.extend(values)
+    return _to_column(merged)
+
+
+def _thread_pid(thread):
+    try:
+        return int(thread.rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+def _read_blocks(fh, block_size):
+    # Blocks of (approximately) block_size bytes, each made up of whole lines.
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        if not block.endswith('\n'):
+            block += fh.readline()
+        yield block
+
+
+def _parse_event_fields(parser, body):
+    holder = _FieldsHolder()
+    try:
+        parser(holder, body)
+    except Exception:  # pylint: disable=broad-except
+        # Same as for TraceCmdEvent -- unparsable bodies simply produce no
+        # fields.
+        pass
+    return holder._fields  # pylint: disable=protected-access
+
+
+def _parse_body_columns(event_name, bodies):
+    """
+    Returns a dict mapping the names of the fields in the specified event bodies
+    onto their values. Bodies in the ``key=value`` format handled by
+    ``default_body_parser`` are matched and converted in bulk when they all
+    have the same keys; otherwise, each body is parsed individually.
+
+    """
+    if event_name not in EVENT_PARSER_MAP:
+        fields = _match_default_body_columns(bodies)
+        if fields is not None:
+            return fields
+    parser = _get_body_parser(event_name)
+    fields = OrderedDict()
+    for i, body in enumerate(bodies):
+        for key, value in _parse_event_fields(parser, body).iteritems():
+            values = fields.get(key)
+            if values is None:
+                values = fields[key] = [None] * len(bodies)
+            values[i] = value
+    return fields
+
+
+def _match_default_body_columns(bodies):
+    # Keys are found as default_body_parser would find them in the first body;
+    # the rest are matched against the same keys with a single regex pass.
+    keys = tuple(part.rsplit(' ', 1)[-1].strip() for part in bodies[0].split('=')[:-1])
+    if not keys or '' in keys or len(set(keys)) != len(keys):
+        return None
+    matches = _get_default_body_regex(keys).findall('\n'.join(bodies))
+    if len(matches) != len(bodies):
+        return None
+    fields = OrderedDict()
+    for key, values in zip(keys, zip(*matches) if len(keys) > 1 else [matches]):
+        column = _to_int_column(values)
+        fields[key] = column if column is not None else map(_int_or_text, values)
+    return fields
+
+
+def _get_default_body_regex(keys):
+    regex = _DEFAULT_BODY_REGEXES.get(keys)
+    if regex is None:
+        pattern = ' '.join(r'{}=([^\s=]*)'.format(re.escape(key)) for key in keys)
+        regex = _DEFAULT_BODY_REGEXES[keys] = re.compile('^{}$'.format(pattern), re.M)
+    return regex
+
+
+def _select(values, positions):
+    if len(positions) == 1:
+        return (values[positions[0]],)
+    return itemgetter(*positions.tolist())(values)
+
+
+def _to_int_column(values):
+    """Returns an int64 array of the values (strings), or None if they are not all integers."""
+    text = ' '.join(values)
+    if not INTEGER_LIST_REGEX.match(text):
+        return None
+    return np.fromstring(text, dtype=np.int64, sep=' ')
+
+
+def _int_column(values):
+    column = _to_int_column(values)
+    if column is None:
+        column = np.array(map(int, values), dtype=np.int64)
+    return column
+
+
+def _int_or_text(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
 class TraceCmdTrace(object):
 
     @property
@@ -277,75 +588,231 @@ class TraceCmdTrace(object):
         self.file_path = file_path
         self.names = names or []
 
-    def parse(self):  # pylint: disable=too-many-branches,too-many-locals
+    def parse(self):
         """
         This is a generator for the trace event stream.
 
         """
-        inside_marked_region = False
-        filters = [re.compile('^{}$'.format(n)) for n in self.names or []]
         with open(self.file_path) as fh:
-            for line in fh:
-                # if processing trace markers, skip marker lines as well as all
-                # lines outside marked region
-                if self.filter_markers:
-                    if not inside_marked_region:
-                        if TRACE_MARKER_START in line:
-                            inside_marked_region = True
-                        continue
-                    elif TRACE_MARKER_STOP in line:
-                        break
-
-                if 'EVENTS DROPPED' in line:
-                    match = DROPPED_EVENTS_REGEX.search(line)
-                    if match:
-                        yield DroppedEventsEvent(match.group('cpu_id'))
-                        continue
-
-                if line.startswith('version') or line.startswith('cpus') or\
-                        line.startswith('CPU:'):
-                    matched = False
-                    for rx in [HEADER_REGEX, EMPTY_CPU_REGEX]:
-                        match = rx.search(line)
-                        if match:
-                            logger.debug(line.strip())
-                            matched = True
-                            break
-                    if matched:
-                        continue
-
-                # <thread/cpu/timestamp>: <event name>: <event body>
-                parts = split_trace_event_line(line)
-                if len(parts) != 3:
+            for raw in self._iter_raw_events(fh):
+                if isinstance(raw, DroppedEventsEvent):
+                    yield raw
                     continue
-
-                event_name = parts[1].strip()
-
-                if filters:
-                    found = False
-                    for f in filters:
-                        if f.search(event_name):
-                            found = True
-                            break
-                    if not found:
-                        continue
-
-                thread_string, rest = parts[0].rsplit(' [', 1)
-                cpu_id, ts_string = rest.split('] ')
-                body = parts[2].strip()
-
-                body_parser = EVENT_PARSER_MAP.get(event_name, default_body_parser)
-                if isinstance(body_parser, basestring) or isinstance(body_parser, re._pattern_type):  # pylint: disable=protected-access
-                    body_parser = regex_body_parser(body_parser)
-
+                thread, cpu_id, ts_string, event_name, body = raw
                 yield TraceCmdEvent(
-                    thread=thread_string.strip(),
+                    thread=thread,
                     cpu_id=cpu_id,
-                    ts=ts_string.strip(),
+                    ts=ts_string,
                     name=event_name,
                     body=body,
-                    parser=body_parser,
+                    parser=_get_body_parser(event_name),
                 )
+
+    def parse_columns(self, block_size=DEFAULT_BLOCK_SIZE, text_events=None):
+        """
+        Parse the trace into per-event-type columns. The trace is read in blocks
+        of (approximately) ``block_size`` bytes. Each block is split into events
+        with a single regex pass, and the events are grouped by type and
+        converted into compact arrays in bulk, rather than creating an event
+        object for each line.
+
+        Returns an ``OrderedDict`` mapping event names onto
+        :class:`TraceEventColumns` (in order of first appearance in the trace).
+        Dropped events are reported under ``'DROPPED EVENTS DETECTED'``, with the
+        affected CPU in the ``cpu`` column. Bodies of events whose names are in
+        ``text_events`` (``'print'`` events by default) will be retained in the
+        ``text`` attribute of their columns.
+
+        This requires NumPy to be installed.
+
+        """
+        if np is None:
+            raise HostError('numpy must be installed to parse trace into columns.')
+        if text_events is None:
+            text_events = ['print']
+        builders = OrderedDict()
+        filters = [re.compile('^{}$'.format(n)) for n in self.names]
+        index = 0
+        with open(self.file_path) as fh:
+            for block in self._iter_marked_blocks(fh, block_size):
+                index = self._parse_block_columns(block, filters, text_events, builders, index)
+        return OrderedDict((name, builder.build()) for name, builder in builders.iteritems())
+
+    def _iter_marked_blocks(self, fh, block_size):
+        """
+        Generates the blocks of the trace, trimmed to the marked region if
+        markers are being filtered.
+
+        """
+        inside_marked_region = not self.filter_markers
+        for block in _read_blocks(fh, block_size):
+            if not inside_marked_region:
+                start = block.find(TRACE_MARKER_START)
+                if start == -1:
+                    continue
+                inside_marked_region = True
+                end = block.find('\n', start)
+                block = block[end + 1:] if end != -1 else ''
+            if self.filter_markers:
+                stop = block.find(TRACE_MARKER_STOP)
+                if stop != -1:
+                    yield block[:block.rfind('\n', 0, stop) + 1]
+                    return
+            yield block
+        if self.filter_markers and inside_marked_region:
+            logger.warning('Did not encounter a stop marker in trace')
+
+    def _parse_block_columns(self, block, filters, text_events, builders, base_index):  # pylint: disable=too-many-locals
+        """
+        Adds the events in the block to the column builders, and returns the
+        index of the event following the last one in the block.
+
+        """
+        matches = EVENT_LINE_REGEX.findall(block)
+        if block.endswith('\n'):
+            matches.pop()  # empty match following the final new line
+        if not matches:
+            return base_index
+        pids, cpus, timestamps, names, bodies, others = zip(*matches)
+
+        is_event = np.array(timestamps) != ''
+        unique_names, first_seen, inverse = np.unique(np.array(names), return_index=True, return_inverse=True)
+        unique_names = unique_names.tolist()
+        wanted = np.array([not filters or any(f.search(n) for f in filters) for n in unique_names], dtype=bool)
+        kept_events = is_event & wanted[inverse]
+
+        # Lines that are not in the usual format (dropped events, headers, etc)
+        # are rare, so are handled one at a time.
+        other_events = []
+        for i in np.flatnonzero(~is_event).tolist():
+            if others[i]:
+                raw = self._parse_raw_line(others[i], filters)
+                if raw is not None:
+                    other_events.append((i, raw))
+
+        kept = kept_events.copy()
+        for i, _ in other_events:
+            kept[i] = True
+        index = base_index + np.cumsum(kept) - 1
+
+        appearances = [(first_seen[k], unique_names[k])
+                       for k in np.flatnonzero(np.bincount(inverse[kept_events], minlength=len(unique_names)))]
+        appearances.extend((i, raw.name if isinstance(raw, DroppedEventsEvent) else raw[3])
+                           for i, raw in other_events)
+        for _, name in sorted(appearances):
+            if name not in builders:
+                builders[name] = _ColumnsBuilder(name, keep_text=name in text_events)
+
+        positions = np.flatnonzero(kept_events)
+        if len(positions):
+            # Group the events by type, keeping them in trace order within each group.
+            positions = positions[np.argsort(inverse[positions], kind='mergesort')]
+            for group in np.split(positions, np.flatnonzero(np.diff(inverse[positions])) + 1):
+                name = unique_names[inverse[group[0]]]
+                group_bodies = _select(bodies, group)
+                group_pids = _select(pids, group)
+                if '' in group_pids:
+                    group_pids = [p or '-1' for p in group_pids]
+                builders[name].add_columns(index[group],
+                                           np.array(_select(timestamps, group), dtype=np.float64),
+                                           _int_column(_select(cpus, group)),
+                                           _int_column(group_pids),
+                                           _parse_body_columns(name, group_bodies),
+                                           group_bodies)
+
+        for i, raw in other_events:
+            if isinstance(raw, DroppedEventsEvent):
+                builders[raw.name].add(int(index[i]), float('nan'), raw.cpu_id, -1, {})
             else:
-                if self.filter_markers and inside_marked_region:
-                    logger.warning('Did not encounter a stop marker in trace')
+                thread, cpu_id, ts_string, event_name, body = raw
+                builders[event_name].add(int(index[i]), float(ts_string), int(cpu_id), _thread_pid(thread),
+                                         _parse_event_fields(_get_body_parser(event_name), body), body)
+        return base_index + int(kept.sum())
+
+    def _iter_raw_events(self, lines):
+        """
+        Generate ``(thread, cpu_id, timestamp, name, body)`` string tuples for the
+        events in the specified lines, applying marker and event name filtering.
+        A ``DroppedEventsEvent`` is generated where dropped events are reported.
+
+        """
+        inside_marked_region = False
+        filters = [re.compile('^{}$'.format(n)) for n in self.names or []]
+        for line in lines:
+            # if processing trace markers, skip marker lines as well as all
+            # lines outside marked region
+            if self.filter_markers:
+                if not inside_marked_region:
+                    if TRACE_MARKER_START in line:
+                        inside_marked_region = True
+                    continue
+                elif TRACE_MARKER_STOP in line:
+                    break
+
+            raw = self._parse_raw_line(line, filters)
+            if raw is not None:
+                yield raw
+        else:
+            if self.filter_markers and inside_marked_region:
+                logger.warning('Did not encounter a stop marker in trace')
+
+    def _parse_raw_line(self, line, filters):  # pylint: disable=no-self-use
+        """
+        Returns the ``(thread, cpu_id, timestamp, name, body)`` tuple, or the
+        ``DroppedEventsEvent``, for the line, or ``None`` if it does not
+        describe an event, or the event is filtered out.
+
+        """
+        if 'EVENTS DROPPED' in line:
+            match = DROPPED_EVENTS_REGEX.search(line)
+            if match:
+                return DroppedEventsEvent(match.group('cpu_id'))
+
+        if line.startswith('version') or line.startswith('cpus') or\
+                line.startswith('CPU:'):
+            for rx in [HEADER_REGEX, EMPTY_CPU_REGEX]:
+                match = rx.search(line)
+                if match:
+                    logger.debug(line.strip())
+                    return None
+
+        # <thread/cpu/timestamp>: <event name>: <event body>
+        parts = split_trace_event_line(line)
+        if len(parts) != 3:
+            return None
+
+        event_name = parts[1].strip()
+
+        if filters:
+            found = False
+            for f in filters:
+                if f.search(event_name):
+                    found = True
+                    break
+            if not found:
+                return None
+
+        thread_string, rest = parts[0].rsplit(' [', 1)
+        cpu_id, ts_string = rest.split('] ')
+        return (thread_string.strip(), cpu_id, ts_string.strip(),
+                event_name, parts[2].strip())
+
+
+def text_trace_has_dropped_events(filepath):
+    """
+    Returns ``True`` if the text trace at the specified path reports dropped events.
+    This only scans for the markers, which is much cheaper than parsing the trace.
+
+    """
+    with open(filepath) as fh:
+        for line in fh:
+            if 'EVENTS DROPPED' in line:
+                return True
+    return False
+
+
+def _get_body_parser(event_name):
+    body_parser = EVENT_PARSER_MAP.get(event_name, default_body_parser)
+    if isinstance(body_parser, basestring) or isinstance(body_parser, re._pattern_type):  # pylint: disable=protected-access
+        body_parser = regex_body_parser(body_parser)
+    return body_parser
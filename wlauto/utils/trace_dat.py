@@ -0,0 +1,424 @@
+#    Copyright 2015 ARM Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Native reader for the binary ``trace.dat`` files produced by trace-cmd. This
+decodes the per-CPU ring buffer pages directly using the event format
+descriptors stored in the file header, so that events can be obtained without
+first generating a text report with ``trace-cmd report``.
+
+Only the version 6 file format (the one generated by trace-cmd v2.x) is
+supported; only the top-level buffer is read (instance buffers are ignored).
+
+"""
+
+import re
+import heapq
+import mmap
+import struct
+import logging
+from collections import OrderedDict
+
+from wlauto.exceptions import HostError
+from wlauto.utils.misc import memoized
+from wlauto.utils.trace_cmd import (TraceCmdEvent, DroppedEventsEvent,
+                                    TRACE_MARKER_START, TRACE_MARKER_STOP,
+                                    _ColumnsBuilder, np)
+
+
+logger = logging.getLogger('trace-dat')
+
+TRACE_DAT_MAGIC = '\x17\x08\x44tracing'
+
+# Ring buffer event types (see include/linux/ring_buffer.h in the kernel)
+RINGBUF_TYPE_DATA_TYPE_LEN_MAX = 28
+RINGBUF_TYPE_PADDING = 29
+RINGBUF_TYPE_TIME_EXTEND = 30
+RINGBUF_TYPE_TIME_STAMP = 31
+TS_SHIFT = 27
+
+COMMIT_MASK = (1 << 27) - 1
+MISSED_EVENTS_FLAG = 1 << 31
+
+# trace-cmd file options that carry a timestamp offset
+OPTION_DATE = 1
+OPTION_OFFSET = 7
+
+FORMAT_FIELD_REGEX = re.compile(r'field:(?P<decl>[^;]+);\s*offset:(?P<offset>\d+);'
+                                r'\s*size:(?P<size>\d+);(?:\s*signed:(?P<signed>\d+);)?')
+FORMAT_NAME_REGEX = re.compile(r'^name:\s*(?P<name>\S+)', re.MULTILINE)
+FORMAT_ID_REGEX = re.compile(r'^ID:\s*(?P<id>\d+)', re.MULTILINE)
+
+INT_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+
+def is_trace_dat(filepath):
+    """Returns ``True`` if the specified file is a binary trace-cmd trace."""
+    with open(filepath, 'rb') as fh:
+        return fh.read(len(TRACE_DAT_MAGIC)) == TRACE_DAT_MAGIC
+
+
+class EventField(object):
+
+    __slots__ = ['name', 'offset', 'size', 'is_string', 'is_data_loc',
+                 'array_length', 'unpacker']
+
+    def __init__(self, declaration, offset, size, signed, endian):
+        self.offset = offset
+        self.size = size
+        self.is_data_loc = '__data_loc' in declaration
+        self.array_length = None
+
+        name = declaration.split()[-1]
+        if '[' in name:
+            name, length = name.split('[', 1)
+            length = length.rstrip(']')
+            self.array_length = int(length) if length.isdigit() else 0
+        elif declaration.rstrip().endswith('[]'):
+            # "__data_loc char[] name" style declaration
+            self.array_length = 0
+        self.name = name
+        self.is_string = 'char' in declaration and self.array_length is not None
+
+        if self.is_data_loc:
+            self.unpacker = struct.Struct(endian + 'I')
+        elif self.array_length is None and size in INT_FORMATS:
+            fmt = INT_FORMATS[size]
+            self.unpacker = struct.Struct(endian + (fmt if signed else fmt.upper()))
+        elif self.array_length and not self.is_string and size % self.array_length == 0 \
+                and size // self.array_length in INT_FORMATS:
+            fmt = INT_FORMATS[size // self.array_length]
+            fmt = '{}{}'.format(self.array_length, fmt if signed else fmt.upper())
+            self.unpacker = struct.Struct(endian + fmt)
+        else:
+            self.unpacker = None
+
+    def decode(self, data, base):
+        if self.is_data_loc:
+            loc = self.unpacker.unpack_from(data, base + self.offset)[0]
+            start = base + (loc & 0xffff)
+            value = data[start:start + (loc >> 16)]
+            return value.split('\0', 1)[0] if self.is_string else value
+        if self.is_string:
+            start = base + self.offset
+            end = start + self.size if self.size else len(data)
+            return data[start:end].split('\0', 1)[0]
+        if self.unpacker is None:
+            return data[base + self.offset:base + self.offset + self.size]
+        values = self.unpacker.unpack_from(data, base + self.offset)
+        return values[0] if self.array_length is None else list(values)
+
+
+class EventFormat(object):
+
+    def __init__(self, system, text, endian):
+        self.system = system
+        self.name = FORMAT_NAME_REGEX.search(text).group('name')
+        self.id = int(FORMAT_ID_REGEX.search(text).group('id'))
+        self.common_fields = OrderedDict()
+        self.fields = OrderedDict()
+        for match in FORMAT_FIELD_REGEX.finditer(text):
+            signed = match.group('signed')
+            field = EventField(match.group('decl').strip(),
+                               int(match.group('offset')),
+                               int(match.group('size')),
+                               int(signed) if signed is not None else 0,
+                               endian)
+            if field.name.startswith('common_'):
+                self.common_fields[field.name] = field
+            else:
+                self.fields[field.name] = field
+
+    def decode(self, data, base, length):
+        record = data[base:base + length]
+        return OrderedDict((n, f.decode(record, 0)) for n, f in self.fields.iteritems())
+
+
+class TraceDatTrace(object):
+    """
+    Reader for binary trace-cmd ``trace.dat`` files that exposes the same
+    interface as :class:`wlauto.utils.trace_cmd.TraceCmdTrace`. Events are
+    generated as :class:`TraceCmdEvent` instances, with their fields already
+    decoded from the binary record, in the same order as they would appear in
+    the output of ``trace-cmd report``.
+
+    """
+
+    @property
+    @memoized
+    def has_start_marker(self):
+        for event in self._iter_events():
+            if event.name == 'print' and TRACE_MARKER_START in event.text:
+                return True
+        return False
+
+    def __init__(self, file_path, names=None, filter_markers=True):
+        self.filter_markers = filter_markers
+        self.file_path = file_path
+        self.names = names or []
+        self.endian = '<'
+        self.long_size = None
+        self.page_size = None
+        self.formats = {}
+        self.cmdlines = {}
+        self.cpu_sections = []
+        self.timestamp_offset = 0
+        self._page_header = None
+        self._fh = None
+
+    def parse(self):
+        """
+        This is a generator for the trace event stream.
+
+        """
+        filters = [re.compile('^{}$'.format(n)) for n in self.names]
+        inside_marked_region = False
+        for event in self._iter_events():
+            if self.filter_markers and event.name == 'print':
+                if not inside_marked_region:
+                    if TRACE_MARKER_START in event.text:
+                        inside_marked_region = True
+                    continue
+                elif TRACE_MARKER_STOP in event.text:
+                    break
+            elif self.filter_markers and not inside_marked_region:
+                continue
+
+            if filters and not isinstance(event, DroppedEventsEvent):
+                if not any(f.search(event.name) for f in filters):
+                    continue
+            yield event
+        else:
+            if self.filter_markers and inside_marked_region:
+                logger.warning('Did not encounter a stop marker in trace')
+
+    def parse_columns(self, text_events=None):
+        """
+        Same as ``TraceCmdTrace.parse_columns()``; event fields are taken
+        directly from the binary records. This requires NumPy to be installed.
+
+        """
+        if np is None:
+            raise HostError('numpy must be installed to parse trace into columns.')
+        if text_events is None:
+            text_events = ['print']
+        builders = OrderedDict()
+        for index, event in enumerate(self.parse()):
+            builder = builders.get(event.name)
+            if builder is None:
+                builder = _ColumnsBuilder(event.name, keep_text=event.name in text_events)
+                builders[event.name] = builder
+            if isinstance(event, DroppedEventsEvent):
+                builder.add(index, float('nan'), event.cpu_id, -1, {})
+            else:
+                pid = int(event.thread.rsplit('-', 1)[1])
+                builder.add(index, event.timestamp, event.reporting_cpu_id, pid,
+                            event.fields, event.text)
+        return OrderedDict((name, builder.build()) for name, builder in builders.iteritems())
+
+    def _iter_events(self):
+        with open(self.file_path, 'rb') as fh:
+            self._fh = fh
+            try:
+                self._read_headers()
+            finally:
+                self._fh = None
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                streams = [self._iter_cpu_events(data, cpu, offset, size)
+                           for cpu, (offset, size) in enumerate(self.cpu_sections)
+                           if size]
+                for _, _, _, event in heapq.merge(*streams):
+                    yield event
+            finally:
+                data.close()
+
+    # file header
+
+    def _read(self, n):
+        data = self._fh.read(n)
+        if len(data) != n:
+            raise HostError('Unexpected end of file while reading {}'.format(self.file_path))
+        return data
+
+    def _read_int(self, fmt):
+        s = struct.Struct(self.endian + fmt)
+        return s.unpack(self._read(s.size))[0]
+
+    def _read_string(self):
+        chars = []
+        while True:
+            c = self._read(1)
+            if c == '\0':
+                return ''.join(chars)
+            chars.append(c)
+
+    def _read_headers(self):  # pylint: disable=too-many-locals
+        if self._read(len(TRACE_DAT_MAGIC)) != TRACE_DAT_MAGIC:
+            raise HostError('{} is not a trace-cmd trace.dat file'.format(self.file_path))
+        version = self._read_string()
+        if version != '6':
+            raise HostError('Unsupported trace.dat version: {}'.format(version))
+        self.endian = '>' if ord(self._read(1)) else '<'
+        self.long_size = ord(self._read(1))
+        self.page_size = self._read_int('I')
+
+        label = self._read(len('header_page') + 1)
+        if label != 'header_page\0':
+            raise HostError('Malformed trace.dat header (expected header_page)')
+        header_page = self._read(self._read_int('Q'))
+        self._page_header = self._parse_page_header(header_page)
+        label = self._read(len('header_event') + 1)
+        if label != 'header_event\0':
+            raise HostError('Malformed trace.dat header (expected header_event)')
+        self._read(self._read_int('Q'))
+
+        self.formats = {}
+        for _ in xrange(self._read_int('I')):
+            fmt = EventFormat('ftrace', self._read(self._read_int('Q')), self.endian)
+            self.formats[fmt.id] = fmt
+        for _ in xrange(self._read_int('I')):
+            system = self._read_string()
+            for _ in xrange(self._read_int('I')):
+                fmt = EventFormat(system, self._read(self._read_int('Q')), self.endian)
+                self.formats[fmt.id] = fmt
+
+        self._read(self._read_int('I'))  # kallsyms
+        self._read(self._read_int('I'))  # ftrace_printk formats
+        self.cmdlines = {0: '<idle>'}
+        for line in self._read(self._read_int('Q')).split('\n'):
+            if line.strip():
+                pid, comm = line.strip().split(' ', 1)
+                self.cmdlines[int(pid)] = comm
+
+        num_cpus = self._read_int('I')
+        label = self._read(10)
+        if label == 'options  \0':
+            self._read_options()
+            label = self._read(10)
+        if label != 'flyrecord\0':
+            raise HostError('Unsupported trace.dat data section: {}'.format(label.rstrip('\0 ')))
+        self.cpu_sections = [(self._read_int('Q'), self._read_int('Q')) for _ in xrange(num_cpus)]
+
+    def _read_options(self):
+        while True:
+            option = self._read_int('H')
+            if not option:
+                break
+            data = self._read(self._read_int('I'))
+            if option in (OPTION_DATE, OPTION_OFFSET):
+                try:
+                    self.timestamp_offset = int(data.rstrip('\0').strip(), 0)
+                except ValueError:
+                    logger.debug('Could not parse timestamp offset option: {}'.format(data))
+
+    def _parse_page_header(self, text):
+        fields = {}
+        for match in FORMAT_FIELD_REGEX.finditer(text):
+            name = match.group('decl').split()[-1]
+            fields[name] = (int(match.group('offset')), int(match.group('size')))
+        ts_offset, _ = fields.get('timestamp', (0, 8))
+        commit_offset, commit_size = fields.get('commit', (8, self.long_size))
+        data_offset, _ = fields.get('data', (commit_offset + commit_size, 0))
+        commit_fmt = 'Q' if commit_size == 8 else 'I'
+        return (struct.Struct(self.endian + 'Q'), ts_offset,
+                struct.Struct(self.endian + commit_fmt), commit_offset,
+                data_offset)
+
+    # ring buffer pages
+
+    def _iter_cpu_events(self, data, cpu, offset, size):
+        # Generates (timestamp, cpu, sequence, event) tuples so that per-CPU
+        # streams may be merged in timestamp order. Dropped events markers do
+        # not have a timestamp, so they are ordered by the preceding event.
+        seq = 0
+        timestamp = 0
+        for page_offset in xrange(offset, offset + size, self.page_size):
+            for event in self._iter_page_events(data, cpu, page_offset):
+                if event.timestamp is not None:
+                    timestamp = event.timestamp
+                yield (timestamp, cpu, seq, event)
+                seq += 1
+
+    def _iter_page_events(self, data, cpu, page_offset):  # pylint: disable=too-many-locals
+        ts_struct, ts_offset, commit_struct, commit_offset, data_offset = self._page_header
+        u32 = struct.Struct(self.endian + 'I')
+        u16 = struct.Struct(self.endian + 'H')
+        i32 = struct.Struct(self.endian + 'i')
+
+        timestamp = ts_struct.unpack_from(data, page_offset + ts_offset)[0]
+        commit = commit_struct.unpack_from(data, page_offset + commit_offset)[0]
+        if commit & MISSED_EVENTS_FLAG:
+            yield DroppedEventsEvent(cpu)
+        start = page_offset + data_offset
+        end = start + (commit & COMMIT_MASK)
+
+        pos = start
+        while pos < end:
+            header = u32.unpack_from(data, pos)[0]
+            pos += 4
+            if self.endian == '<':
+                type_len, delta = header & 0x1f, header >> 5
+            else:
+                type_len, delta = header >> 27, header & ((1 << 27) - 1)
+
+            if type_len == RINGBUF_TYPE_PADDING:
+                if not delta:
+                    break  # the rest of the page is padding
+                pos += u32.unpack_from(data, pos)[0]
+                continue
+            elif type_len == RINGBUF_TYPE_TIME_EXTEND:
+                timestamp += (u32.unpack_from(data, pos)[0] << TS_SHIFT) + delta
+                pos += 4
+                continue
+            elif type_len == RINGBUF_TYPE_TIME_STAMP:
+                timestamp = (u32.unpack_from(data, pos)[0] << TS_SHIFT) + delta
+                pos += 4
+                continue
+            elif type_len == 0:
+                length = u32.unpack_from(data, pos)[0] - 4
+                length = (length + 3) & ~3
+                pos += 4
+            else:
+                length = type_len * 4
+
+            timestamp += delta
+            event = self._decode_event(data, pos, length, cpu, timestamp,
+                                       u16, i32)
+            if event is not None:
+                yield event
+            pos += length
+
+    def _decode_event(self, data, pos, length, cpu, timestamp, u16, i32):  # pylint: disable=too-many-arguments
+        event_id = u16.unpack_from(data, pos)[0]
+        fmt = self.formats.get(event_id)
+        if fmt is None:
+            logger.debug('Unknown event ID {} on CPU{}'.format(event_id, cpu))
+            return None
+        pid_field = fmt.common_fields.get('common_pid')
+        pid = i32.unpack_from(data, pos + pid_field.offset)[0] if pid_field else -1
+        fields = fmt.decode(data, pos, length)
+
+        if fmt.name == 'print' and 'buf' in fields:
+            text = fields['buf'].rstrip('\n')
+        else:
+            text = ' '.join('{}={}'.format(k, v) for k, v in fields.iteritems())
+
+        thread = '{}-{}'.format(self.cmdlines.get(pid, '<...>'), pid)
+        ts = (timestamp + self.timestamp_offset) / 1e9
+        event = TraceCmdEvent(thread, cpu, ts, fmt.name, text)
+        event._fields = dict(fields)  # pylint: disable=protected-access
+        return event
+
@@ -4,11 +4,9 @@ import logging
 from collections import defaultdict
 
 from wlauto.utils.fps import FpsProcessor, SurfaceFlingerFrame, GfxInfoFrame, VSYNC_INTERVAL
+from wlauto.utils.lazyimport import lazy_import
 
-try:
-    import pandas as pd
-except ImportError:
-    pd = None
+pd = lazy_import('pandas')
 
 
 class UxPerfParser(object):